@@ -12,7 +12,7 @@ def cleanup_extracted(confirm=False):
         confirm: Если False, требует подтверждение пользователя
     """
     extracted_dir = DOWNLOAD_DIR / "extracted"
-    zips_dir = DOWNLOAD_DIR / "zips"
+    objects_dir = DOWNLOAD_DIR / "objects"
     
     if not extracted_dir.exists():
         print(f"Папка {extracted_dir} не существует. Нечего удалять.")
@@ -40,7 +40,7 @@ def cleanup_extracted(confirm=False):
         print(f"Размер: {size_mb:.2f} MB")
     print()
     print("ВНИМАНИЕ: Эта папка больше не используется системой.")
-    print("ZIP архивы сохраняются в downloads/zips/ и обрабатываются напрямую.")
+    print("ZIP архивы сохраняются в downloads/objects/ и обрабатываются напрямую.")
     print()
     
     if not confirm:
@@ -58,12 +58,12 @@ def cleanup_extracted(confirm=False):
         print(f"✗ Ошибка при удалении: {e}")
         sys.exit(1)
     
-    # Проверяем, что папка zips на месте
-    if zips_dir.exists():
-        zip_count = len(list(zips_dir.glob('*.zip')))
-        print(f"\n✓ Папка downloads/zips/ сохранена ({zip_count} ZIP файлов)")
+    # Проверяем, что хранилище архивов на месте
+    if objects_dir.exists():
+        zip_count = len(list(objects_dir.glob('*/*.zip')))
+        print(f"\n✓ Папка downloads/objects/ сохранена ({zip_count} ZIP файлов)")
     else:
-        print("\n⚠ Папка downloads/zips/ не найдена")
+        print("\n⚠ Папка downloads/objects/ не найдена")
 
 
 if __name__ == '__main__':
@@ -0,0 +1,9 @@
+"""Модуль бенчмарков и инструментов измерения производительности"""
+
+
+
+
+
+
+
+
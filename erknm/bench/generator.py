@@ -0,0 +1,304 @@
+"""Генератор синтетических данных ЕРКНМ для бенчмарков
+
+Запуск:
+    python -m erknm.bench.generator /tmp/catalog --datasets 4 --versions 2 --records 5000
+    python -m erknm.bench.generator /tmp/catalog --variant default_ns --base-url http://127.0.0.1:8765
+
+Создает каталог в формате портала открытых данных:
+    list.xml                  - список наборов (item identifier/title/link/format)
+    meta/<identifier>.xml     - мета-XML набора с версиями данных (dataversion/source)
+    zips/<имя>.zip            - архивы с документами PLAN/INSPECTION
+    manifest.json             - описание сгенерированных файлов
+
+Ссылки в list.xml и мета-XML строятся от base_url, так что каталог можно
+раздать локальным HTTP-сервером (erknm.bench.mock_portal) и указать его как SOURCE_URL.
+"""
+import argparse
+import json
+import random
+import sys
+import zipfile
+from datetime import date, timedelta
+from pathlib import Path
+from typing import Dict, List
+from xml.sax.saxutils import escape, quoteattr
+
+# Варианты оформления документа: регистр тегов и namespace
+VARIANTS = ('plain', 'lower', 'default_ns', 'prefixed')
+
+NAMESPACE = 'urn:erknm:opendata'
+
+DEFAULT_BASE_URL = 'http://127.0.0.1:8765'
+
+ORGANIZATIONS = [
+    'ООО "Ромашка"', 'АО "Северный завод"', 'ИП Иванов Иван Иванович',
+    'МУП "Водоканал"', 'ПАО "Энергосбыт"', 'ГБУЗ "Городская больница N 1"',
+]
+REGIONS = ['Москва', 'Санкт-Петербург', 'Новосибирская область', 'Свердловская область', 'Республика Татарстан']
+AUTHORITIES = ['Роспотребнадзор', 'Ростехнадзор', 'МЧС России', 'Росприроднадзор', 'Роструд']
+STATUSES = ['Утвержден', 'Завершено', 'Ожидает проведения', 'Проводится']
+
+
+class _Tags:
+    """Оформление тегов для варианта документа"""
+
+    def __init__(self, variant: str):
+        if variant not in VARIANTS:
+            raise ValueError(f"Неизвестный вариант документа: {variant}")
+        self.variant = variant
+
+    def __call__(self, name: str) -> str:
+        if self.variant == 'lower':
+            return name.lower()
+        if self.variant == 'prefixed':
+            return f'erk:{name}'
+        return name
+
+    def root_attrs(self) -> str:
+        if self.variant == 'default_ns':
+            return f' xmlns="{NAMESPACE}"'
+        if self.variant == 'prefixed':
+            return f' xmlns:erk="{NAMESPACE}"'
+        return ''
+
+
+def _field(t: _Tags, name: str, value, indent: str) -> str:
+    return f'{indent}<{t(name)}>{escape(str(value))}</{t(name)}>\n'
+
+
+def _inspection(t: _Tags, rnd: random.Random, number: int, indent: str) -> str:
+    start = date(2024, 1, 1) + timedelta(days=rnd.randrange(365))
+    parts = [
+        f'{indent}<{t("INSPECTION")}>\n',
+        _field(t, 'GUID', f'{rnd.getrandbits(128):032x}', indent + '  '),
+        _field(t, 'Number', f'77{number:012d}', indent + '  '),
+        _field(t, 'Date', start.isoformat(), indent + '  '),
+        _field(t, 'Type', rnd.choice(['Плановая', 'Внеплановая']), indent + '  '),
+        _field(t, 'Status', rnd.choice(STATUSES), indent + '  '),
+        _field(t, 'Organization', rnd.choice(ORGANIZATIONS), indent + '  '),
+        _field(t, 'INN', f'{rnd.randrange(10 ** 9, 10 ** 10)}', indent + '  '),
+        _field(t, 'OGRN', f'{rnd.randrange(10 ** 12, 10 ** 13)}', indent + '  '),
+        _field(t, 'Region', rnd.choice(REGIONS), indent + '  '),
+        _field(t, 'Address', f'г. {rnd.choice(REGIONS)}, ул. Ленина, д. {rnd.randrange(1, 200)}', indent + '  '),
+        _field(t, 'StartDate', start.isoformat(), indent + '  '),
+        _field(t, 'EndDate', (start + timedelta(days=rnd.randrange(1, 20))).isoformat(), indent + '  '),
+        _field(t, 'Inspector', rnd.choice(AUTHORITIES), indent + '  '),
+        _field(t, 'Result', 'Нарушения не выявлены' if rnd.random() < 0.6 else 'Выявлены нарушения', indent + '  '),
+        _field(t, 'ViolationsCount', rnd.randrange(0, 5), indent + '  '),
+        f'{indent}</{t("INSPECTION")}>\n',
+    ]
+    return ''.join(parts)
+
+
+def _plan(t: _Tags, rnd: random.Random, number: int, indent: str) -> str:
+    parts = [
+        f'{indent}<{t("PLAN")}>\n',
+        _field(t, 'GUID', f'{rnd.getrandbits(128):032x}', indent + '  '),
+        _field(t, 'Number', f'2024{number:08d}', indent + '  '),
+        _field(t, 'Date', (date(2023, 10, 1) + timedelta(days=rnd.randrange(90))).strftime('%d.%m.%Y'), indent + '  '),
+        _field(t, 'Name', f'План проведения плановых проверок на 2024 год N {number}', indent + '  '),
+        _field(t, 'Status', rnd.choice(STATUSES), indent + '  '),
+        _field(t, 'Organization', rnd.choice(AUTHORITIES), indent + '  '),
+    ]
+    # В плане проверки вложены - загрузчик не должен считать их отдельными записями
+    for i in range(rnd.randrange(1, 4)):
+        parts.append(_inspection(t, rnd, number * 10 + i, indent + '  '))
+    parts.append(f'{indent}</{t("PLAN")}>\n')
+    return ''.join(parts)
+
+
+def write_document(out, data_type: str, records: int, variant: str = 'plain', seed: int = 0) -> int:
+    """
+    Записать XML документ с записями PLAN или INSPECTION в бинарный поток
+
+    Returns:
+        Количество записанных байт
+    """
+    if data_type not in ('plan', 'inspection'):
+        raise ValueError("Тип данных должен быть 'plan' или 'inspection'")
+    t = _Tags(variant)
+    rnd = random.Random(seed)
+    record = _plan if data_type == 'plan' else _inspection
+    root = t('PLANS' if data_type == 'plan' else 'INSPECTIONS')
+
+    written = 0
+    head = (
+        '<?xml version="1.0" encoding="UTF-8"?>\n'
+        f'<{root}{t.root_attrs()}>\n'
+        f'  <{t("Header")}><{t("Created")}>{date.today().isoformat()}</{t("Created")}></{t("Header")}>\n'
+    )
+    written += out.write(head.encode('utf-8'))
+    batch = []
+    for number in range(1, records + 1):
+        batch.append(record(t, rnd, number, '  '))
+        if len(batch) >= 500:
+            written += out.write(''.join(batch).encode('utf-8'))
+            batch = []
+    if batch:
+        written += out.write(''.join(batch).encode('utf-8'))
+    written += out.write(f'</{root}>\n'.encode('utf-8'))
+    return written
+
+
+def generate_xml(path: Path, data_type: str, records: int, variant: str = 'plain', seed: int = 0) -> Path:
+    """Создать XML файл с записями"""
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, 'wb') as out:
+        write_document(out, data_type, records, variant=variant, seed=seed)
+    return path
+
+
+def generate_zip(path: Path, data_type: str, records: int, variant: str = 'plain',
+                 seed: int = 0, extra_members: bool = True) -> Dict:
+    """
+    Создать ZIP архив с XML документом
+
+    Кроме основного документа в архив кладутся небольшой XML со структурой
+    и readme, как в реальных выгрузках (загрузчик выбирает самый крупный XML).
+
+    Returns:
+        Словарь: path, xml_name, xml_size, records
+    """
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    xml_name = f'data-{data_type}.xml'
+    with zipfile.ZipFile(path, 'w', compression=zipfile.ZIP_DEFLATED) as zf:
+        with zf.open(xml_name, 'w', force_zip64=True) as member:
+            xml_size = write_document(member, data_type, records, variant=variant, seed=seed)
+        if extra_members:
+            zf.writestr('structure.xml', '<?xml version="1.0" encoding="UTF-8"?>\n'
+                                         '<structure><field name="GUID"/><field name="Number"/></structure>\n')
+            zf.writestr('readme.txt', 'Синтетические данные для бенчмарков erknm\n')
+    return {'path': str(path), 'xml_name': xml_name, 'xml_size': xml_size, 'records': records}
+
+
+def generate_meta_xml(path: Path, identifier: str, title: str, versions: List[Dict]) -> Path:
+    """
+    Создать мета-XML набора данных
+
+    Args:
+        versions: список словарей с ключами source, created
+    """
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    dataversions = ''.join(
+        '    <dataversion>\n'
+        f'      <source>{escape(v["source"])}</source>\n'
+        f'      <created>{escape(v["created"])}</created>\n'
+        '      <provenance>Синтетическая версия</provenance>\n'
+        '      <structure>20190101</structure>\n'
+        '    </dataversion>\n'
+        for v in versions
+    )
+    path.write_text(
+        '<?xml version="1.0" encoding="UTF-8"?>\n'
+        '<meta>\n'
+        '  <standardversion>http://opendata.gosmonitor.ru/standard/3.0</standardversion>\n'
+        f'  <identifier>{escape(identifier)}</identifier>\n'
+        f'  <title>{escape(title)}</title>\n'
+        '  <description>Синтетический набор данных для бенчмарков</description>\n'
+        '  <creator>Генеральная прокуратура Российской Федерации</creator>\n'
+        '  <subject>проверки</subject>\n'
+        '  <format>xml</format>\n'
+        '  <dataversions>\n'
+        f'{dataversions}'
+        '  </dataversions>\n'
+        '</meta>\n',
+        encoding='utf-8'
+    )
+    return path
+
+
+def generate_list_xml(path: Path, datasets: List[Dict]) -> Path:
+    """
+    Создать list.xml
+
+    Args:
+        datasets: список словарей с ключами identifier, title, link
+    """
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    items = ''.join(
+        f'    <item identifier={quoteattr(ds["identifier"])} title={quoteattr(ds["title"])} '
+        f'link={quoteattr(ds["link"])} format="xml"/>\n'
+        for ds in datasets
+    )
+    path.write_text(
+        '<?xml version="1.0" encoding="UTF-8"?>\n'
+        '<list>\n'
+        '  <standardversion>\n'
+        f'{items}'
+        '  </standardversion>\n'
+        '</list>\n',
+        encoding='utf-8'
+    )
+    return path
+
+
+def generate_catalog(out_dir: Path, datasets: int = 4, versions: int = 2, records: int = 1000,
+                     variant: str = 'plain', base_url: str = DEFAULT_BASE_URL, seed: int = 0) -> Dict:
+    """
+    Создать каталог портала: list.xml, мета-XML и ZIP архивы
+
+    Наборы чередуются: планы и проверки. Каждая версия набора - отдельный архив.
+
+    Returns:
+        Манифест (также сохраняется в manifest.json)
+    """
+    out_dir = Path(out_dir)
+    base_url = base_url.rstrip('/')
+    manifest = {'base_url': base_url, 'variant': variant, 'datasets': []}
+    list_items = []
+
+    for ds_index in range(datasets):
+        data_type = 'plan' if ds_index % 2 == 0 else 'inspection'
+        identifier = f'7710146102-{data_type}-bench-{ds_index:03d}'
+        title = ('План проверок' if data_type == 'plan' else 'Проверки') + f' (синтетический набор {ds_index})'
+        link = f'{base_url}/meta/{identifier}.xml'
+
+        version_entries = []
+        for v_index in range(versions):
+            created = (date(2024, 1, 1) + timedelta(days=30 * v_index)).strftime('%Y%m%d')
+            zip_name = f'data-{created}-{identifier}.zip'
+            info = generate_zip(out_dir / 'zips' / zip_name, data_type, records, variant=variant,
+                                seed=seed + ds_index * 1000 + v_index)
+            info['source'] = f'{base_url}/zips/{zip_name}'
+            info['created'] = created
+            version_entries.append(info)
+
+        generate_meta_xml(out_dir / 'meta' / f'{identifier}.xml', identifier, title, version_entries)
+        list_items.append({'identifier': identifier, 'title': title, 'link': link})
+        manifest['datasets'].append({
+            'identifier': identifier, 'title': title, 'data_type': data_type,
+            'link': link, 'versions': version_entries,
+        })
+
+    generate_list_xml(out_dir / 'list.xml', list_items)
+    (out_dir / 'manifest.json').write_text(json.dumps(manifest, ensure_ascii=False, indent=2), encoding='utf-8')
+    return manifest
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Генератор синтетических данных ЕРКНМ")
+    parser.add_argument('out_dir', help="Каталог для сгенерированных файлов")
+    parser.add_argument('--datasets', type=int, default=4, help="Количество наборов данных")
+    parser.add_argument('--versions', type=int, default=2, help="Версий (архивов) на набор")
+    parser.add_argument('--records', type=int, default=1000, help="Записей в документе")
+    parser.add_argument('--variant', choices=VARIANTS, default='plain', help="Регистр тегов и namespace")
+    parser.add_argument('--base-url', default=DEFAULT_BASE_URL, help="Адрес, от которого строятся ссылки")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+
+    manifest = generate_catalog(Path(args.out_dir), datasets=args.datasets, versions=args.versions,
+                                records=args.records, variant=args.variant,
+                                base_url=args.base_url, seed=args.seed)
+    total_zips = sum(len(ds['versions']) for ds in manifest['datasets'])
+    total_xml = sum(v['xml_size'] for ds in manifest['datasets'] for v in ds['versions'])
+    print(f"Наборов: {len(manifest['datasets'])}, архивов: {total_zips}, "
+          f"XML: {total_xml / (1024 * 1024):.1f} МБ -> {args.out_dir}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,121 @@
+"""Бенчмарк времени запуска CLI/веб на основе python -X importtime
+
+Запуск:
+    python -m erknm.bench.import_time
+    python -m erknm.bench.import_time erknm.cli --repeat 5
+
+Для каждого модуля замеряется кумулятивное время импорта (медиана по нескольким
+запускам в чистом интерпретаторе) и проверяется бюджет: предел времени и список
+тяжелых модулей, которые не должны импортироваться на старте.
+Код возврата 1, если хотя бы один бюджет превышен.
+"""
+import argparse
+import statistics
+import subprocess
+import sys
+from typing import Dict, List, Optional, Tuple
+
+# Модули, которые подтягивают браузер, XML-парсер или полную цепочку синхронизации
+HEAVY_MODULES = ['playwright', 'lxml', 'requests', 'erknm.sync.synchronizer']
+
+# Бюджеты старта: модуль -> (максимум мс, запрещенные при импорте модули)
+BUDGETS = {
+    # CLI: show-logs/show-runs не должны платить за Playwright, lxml и БД-настройки
+    'erknm.cli': (250.0, HEAVY_MODULES),
+    # Конфигурация не должна подключаться к БД при импорте
+    'erknm.config': (100.0, HEAVY_MODULES + ['psycopg2', 'erknm.db.models']),
+    # Веб-интерфейс: Flask допустим, синхронизатор импортируется при старте задачи
+    'erknm.web.app': (800.0, HEAVY_MODULES),
+}
+
+
+def measure_import(module: str) -> Tuple[float, List[str]]:
+    """
+    Импортировать модуль в отдельном интерпретаторе с -X importtime
+    
+    Returns:
+        Tuple (кумулятивное время импорта модуля в мс, список импортированных модулей)
+    """
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        capture_output=True, text=True
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"Не удалось импортировать {module}: {result.stderr.strip().splitlines()[-1:]}")
+    
+    cumulative_us = None
+    imported = []
+    for line in result.stderr.splitlines():
+        # Формат: "import time: self [us] | cumulative | imported package"
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        parts = line[len('import time:'):].split('|')
+        if len(parts) != 3:
+            continue
+        name = parts[2].strip()
+        imported.append(name)
+        if name == module:
+            cumulative_us = int(parts[1].strip())
+    
+    if cumulative_us is None:
+        # Модуль уже был импортирован интерпретатором (например, через site)
+        cumulative_us = 0
+    return cumulative_us / 1000.0, imported
+
+
+def check_budget(module: str, repeat: int = 3,
+                 max_ms: Optional[float] = None, forbidden: Optional[List[str]] = None) -> Dict:
+    """Замерить импорт модуля и сравнить с бюджетом"""
+    default_ms, default_forbidden = BUDGETS.get(module, (None, HEAVY_MODULES))
+    max_ms = max_ms if max_ms is not None else default_ms
+    forbidden = forbidden if forbidden is not None else default_forbidden
+    
+    timings = []
+    imported = []
+    for _ in range(repeat):
+        elapsed_ms, imported = measure_import(module)
+        timings.append(elapsed_ms)
+    
+    median_ms = statistics.median(timings)
+    leaked = sorted({
+        name for name in imported
+        for heavy in forbidden
+        if name == heavy or name.startswith(heavy + '.')
+    })
+    # Оставляем только верхний уровень пакетов, чтобы отчет был коротким
+    leaked = [name for name in leaked if not any(name.startswith(other + '.') for other in leaked)]
+    
+    return {
+        'module': module,
+        'median_ms': median_ms,
+        'max_ms': max_ms,
+        'leaked': leaked,
+        'ok': (max_ms is None or median_ms <= max_ms) and not leaked,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Бюджет времени импорта модулей erknm")
+    parser.add_argument('modules', nargs='*', help="Модули для проверки (по умолчанию все из BUDGETS)")
+    parser.add_argument('--repeat', type=int, default=3, help="Количество замеров на модуль")
+    args = parser.parse_args(argv)
+    
+    modules = args.modules or list(BUDGETS)
+    failed = False
+    
+    print(f"{'Модуль':<20} {'Медиана, мс':>12} {'Бюджет, мс':>11}  Результат")
+    print("-" * 70)
+    for module in modules:
+        report = check_budget(module, repeat=args.repeat)
+        budget = f"{report['max_ms']:.0f}" if report['max_ms'] is not None else '-'
+        status = 'OK' if report['ok'] else 'ПРЕВЫШЕН'
+        if report['leaked']:
+            status += f" (импортированы: {', '.join(report['leaked'])})"
+        print(f"{module:<20} {report['median_ms']:>12.1f} {budget:>11}  {status}")
+        failed = failed or not report['ok']
+    
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
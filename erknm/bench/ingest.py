@@ -0,0 +1,238 @@
+"""Сквозной бенчмарк загрузки ZIP/XML в PostgreSQL
+
+Запуск (нужна настроенная БД из .env, схема создается через init):
+    python -m erknm.bench.ingest
+    python -m erknm.bench.ingest --records 50000 --variant default_ns
+    python -m erknm.bench.ingest --update-baseline
+
+Сценарии:
+    zip-<тип>     - process_zip_archive: архив уже лежит в DOWNLOAD_DIR/zips
+                    (без сети), проверка дубликатов, перенос в хранилище
+                    объектов с SHA-256, разбор, запись
+    stream-<тип>  - stream_parse_xml_from_zip: только разбор и запись
+
+Каждый сценарий выполняется в отдельном процессе (чистый пиковый RSS) с
+собственным запуском синхронизации, после замера данные удаляются из БД.
+Результаты сравниваются с базовыми значениями из baselines.json: падение
+скорости, рост пиковой памяти или числа обращений к БД на запись сверх
+допуска - регрессия, код возврата 1.
+
+Базовые значения скорости зависят от машины; после смены оборудования их
+нужно перезаписать с --update-baseline. Обращения к БД на запись от машины
+не зависят.
+"""
+import argparse
+import json
+import subprocess
+import sys
+import time
+import uuid
+from pathlib import Path
+from typing import Dict, List, Optional
+
+BASELINES_PATH = Path(__file__).with_name('baselines.json')
+
+SCENARIOS = ['zip-plan', 'zip-inspection', 'stream-plan', 'stream-inspection']
+
+# Допуски относительно базовых значений
+TOLERANCES = {
+    'records_per_s': 0.25,           # скорость может упасть не более чем на 25%
+    'peak_rss_mb': 0.25,             # пиковая память может вырасти не более чем на 25%
+    'roundtrips_per_record': 0.10,   # обращения к БД на запись - не более чем на 10%
+}
+
+# Абсолютный запас по памяти (шум аллокатора на маленьких прогонах)
+RSS_SLACK_MB = 16.0
+
+
+def _cleanup(archive_id: Optional[int], run_id: Optional[int]):
+    """Удалить данные замера из БД"""
+    from erknm.db.connection import get_connection
+    from erknm.db.models import SyncRun
+
+    conn = get_connection()
+    cur = conn.cursor()
+    try:
+        if archive_id:
+            cur.execute("DELETE FROM parsed_records WHERE zip_archive_id = %s", (archive_id,))
+            for table in ('plans_raw', 'inspections_raw'):
+                cur.execute(f"""
+                    DELETE FROM {table} WHERE xml_fragment_id IN
+                    (SELECT id FROM xml_fragments WHERE zip_archive_id = %s)
+                """, (archive_id,))
+            cur.execute("DELETE FROM xml_fragments WHERE zip_archive_id = %s", (archive_id,))
+            cur.execute("DELETE FROM zip_archives WHERE id = %s", (archive_id,))
+        conn.commit()
+    finally:
+        cur.close()
+        conn.close()
+    if run_id:
+        SyncRun.delete_run(run_id)
+
+
+def run_scenario(scenario: str, records: int, variant: str = 'plain') -> Dict:
+    """
+    Выполнить сценарий в текущем процессе
+
+    Returns:
+        Словарь с результатами замера
+    """
+    import resource
+    from erknm.bench.generator import generate_zip
+    from erknm.config import get_download_dir
+    from erknm.db.connection import get_db_stats, reset_db_stats
+    from erknm.db.models import SyncRun, ZipArchive
+    from erknm.loader import object_store
+    from erknm.loader.zip_loader import (calculate_sha256, process_zip_archive, select_xml_from_zip,
+                                         stream_parse_xml_from_zip)
+
+    mode, data_type = scenario.split('-', 1)
+    if mode not in ('zip', 'stream') or data_type not in ('plan', 'inspection'):
+        raise ValueError(f"Неизвестный сценарий: {scenario}")
+
+    zip_name = f'bench-{scenario}-{uuid.uuid4().hex[:12]}.zip'
+    zip_path = get_download_dir() / 'zips' / zip_name
+    info = generate_zip(zip_path, data_type, records, variant=variant)
+    url = f'bench://local/{zip_name}'
+    # process_zip_archive переносит архив в хранилище объектов
+    stored_path = object_store.object_path(calculate_sha256(zip_path)) if mode == 'zip' else None
+
+    run_id = SyncRun.create(is_manual=True)['id']
+    archive_id = None
+    try:
+        reset_db_stats()
+        started = time.perf_counter()
+        if mode == 'zip':
+            loaded = process_zip_archive(url, sync_run_id=run_id)
+            elapsed = time.perf_counter() - started
+            existing = ZipArchive.exists(url)
+            archive_id = existing['id'] if existing else None
+        else:
+            archive = ZipArchive.create(url, file_path=str(zip_path), status='downloaded', sync_run_id=run_id)
+            archive_id = archive['id']
+            xml_name, zip_info = select_xml_from_zip(zip_path)
+            loaded = stream_parse_xml_from_zip(zip_path, xml_name, zip_info, archive_id, run_id)
+            elapsed = time.perf_counter() - started
+        db_stats = get_db_stats()
+        SyncRun.finish(run_id, status='completed', files_processed=1, records_loaded=loaded)
+    finally:
+        _cleanup(archive_id, run_id)
+        zip_path.unlink(missing_ok=True)
+        if stored_path is not None:
+            stored_path.unlink(missing_ok=True)
+
+    if loaded != records:
+        raise RuntimeError(f"{scenario}: загружено {loaded} записей из {records}")
+
+    peak_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    xml_mb = info['xml_size'] / (1024 * 1024)
+    return {
+        'scenario': scenario,
+        'records': records,
+        'variant': variant,
+        'xml_mb': round(xml_mb, 2),
+        'elapsed_s': round(elapsed, 3),
+        'records_per_s': round(loaded / elapsed, 1),
+        'mb_per_s': round(xml_mb / elapsed, 2),
+        'peak_rss_mb': round(peak_kb / (1024 * 1024) if sys.platform == 'darwin' else peak_kb / 1024, 1),
+        'roundtrips': db_stats['roundtrips'],
+        'connections': db_stats['connections'],
+        'roundtrips_per_record': round(db_stats['roundtrips'] / loaded, 4),
+        'connections_per_record': round(db_stats['connections'] / loaded, 4),
+    }
+
+
+def run_isolated(scenario: str, records: int, variant: str) -> Dict:
+    """Выполнить сценарий в отдельном процессе"""
+    result = subprocess.run(
+        [sys.executable, '-m', 'erknm.bench.ingest', '--run-one', scenario,
+         '--records', str(records), '--variant', variant],
+        capture_output=True, text=True
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"Сценарий {scenario} завершился с ошибкой:\n{result.stderr.strip()}")
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def load_baselines() -> Dict:
+    if BASELINES_PATH.exists():
+        return json.loads(BASELINES_PATH.read_text(encoding='utf-8'))
+    return {}
+
+
+def compare(report: Dict, baseline: Optional[Dict]) -> List[str]:
+    """
+    Сравнить замер с базовым значением
+
+    Returns:
+        Список описаний регрессий (пустой - регрессий нет)
+    """
+    if not baseline:
+        return []
+    if (baseline.get('records'), baseline.get('variant')) != (report['records'], report['variant']):
+        # Базовое значение снято на других параметрах - сравнивать нельзя
+        return []
+
+    regressions = []
+    floor = baseline['records_per_s'] * (1 - TOLERANCES['records_per_s'])
+    if report['records_per_s'] < floor:
+        regressions.append(f"скорость {report['records_per_s']:.0f} зап/с < {floor:.0f}")
+    ceiling = baseline['peak_rss_mb'] * (1 + TOLERANCES['peak_rss_mb']) + RSS_SLACK_MB
+    if report['peak_rss_mb'] > ceiling:
+        regressions.append(f"пиковый RSS {report['peak_rss_mb']:.0f} МБ > {ceiling:.0f}")
+    ceiling = baseline['roundtrips_per_record'] * (1 + TOLERANCES['roundtrips_per_record'])
+    if report['roundtrips_per_record'] > ceiling:
+        regressions.append(f"обращений к БД на запись {report['roundtrips_per_record']:.3f} > {ceiling:.3f}")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Бенчмарк загрузки ZIP/XML в PostgreSQL")
+    parser.add_argument('scenarios', nargs='*', help=f"Сценарии (по умолчанию: {', '.join(SCENARIOS)})")
+    parser.add_argument('--records', type=int, default=20000, help="Записей в документе")
+    parser.add_argument('--variant', default='plain', help="Вариант документа (см. erknm.bench.generator)")
+    parser.add_argument('--update-baseline', action='store_true', help="Сохранить результаты как базовые")
+    parser.add_argument('--json', action='store_true', help="Вывести результаты в JSON")
+    parser.add_argument('--run-one', help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.run_one:
+        print(json.dumps(run_scenario(args.run_one, args.records, args.variant)))
+        return 0
+
+    scenarios = args.scenarios or SCENARIOS
+    baselines = load_baselines()
+    reports = []
+    failed = False
+
+    if not args.json:
+        print(f"{'Сценарий':<18} {'зап/с':>9} {'МБ/с':>7} {'RSS, МБ':>8} {'БД/зап':>7}  Результат")
+        print("-" * 72)
+    for scenario in scenarios:
+        report = run_isolated(scenario, args.records, args.variant)
+        regressions = [] if args.update_baseline else compare(report, baselines.get(scenario))
+        report['regressions'] = regressions
+        reports.append(report)
+        failed = failed or bool(regressions)
+        if not args.json:
+            status = 'OK' if not regressions else 'РЕГРЕССИЯ: ' + '; '.join(regressions)
+            if scenario not in baselines and not args.update_baseline:
+                status += ' (нет базового значения)'
+            print(f"{scenario:<18} {report['records_per_s']:>9.0f} {report['mb_per_s']:>7.1f} "
+                  f"{report['peak_rss_mb']:>8.1f} {report['roundtrips_per_record']:>7.3f}  {status}")
+
+    if args.json:
+        print(json.dumps(reports, ensure_ascii=False, indent=2))
+
+    if args.update_baseline:
+        for report in reports:
+            baselines[report['scenario']] = {k: v for k, v in report.items() if k != 'regressions'}
+        BASELINES_PATH.write_text(json.dumps(baselines, ensure_ascii=False, indent=2) + '\n', encoding='utf-8')
+        print(f"Базовые значения сохранены: {BASELINES_PATH}")
+        return 0
+
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,189 @@
+"""Проверка постоянства памяти при потоковом разборе XML
+
+Запуск:
+    python -m erknm.bench.memory
+    python -m erknm.bench.memory --size-mb 200 --namespace
+
+Документ генерируется на лету (ничего не пишется на диск) и разбирается тем же
+кодом, что и при загрузке в БД (erknm.loader.xml_stream.iter_records), включая
+сериализацию записи и извлечение полей для parsed_records. По ходу разбора
+замеряется RSS процесса; проверка считается пройденной, если прирост RSS после
+прогрева не превышает заданного предела.
+Код возврата 1, если память растет вместе с документом.
+"""
+import argparse
+import resource
+import sys
+import time
+from typing import Dict, Optional
+
+# Размер документа по умолчанию - 5 ГБ
+DEFAULT_SIZE_MB = 5 * 1024
+
+# Допустимый прирост RSS после прогрева
+DEFAULT_MAX_GROWTH_MB = 64
+
+# Объем документа, после которого фиксируется базовый RSS
+WARMUP_MB = 32
+
+RECORD_TEMPLATE = (
+    '  <PLAN>\n'
+    '    <GUID>{guid}</GUID>\n'
+    '    <Number>{number}</Number>\n'
+    '    <Date>2024-01-15</Date>\n'
+    '    <Name>Плановая проверка организации {number}</Name>\n'
+    '    <Status>Утвержден</Status>\n'
+    '    <Organization>ООО Ромашка</Organization>\n'
+    '    <INN>7700000000</INN>\n'
+    '    <INSPECTION>\n'
+    '      <GUID>{guid}-i</GUID>\n'
+    '      <StartDate>2024-03-01</StartDate>\n'
+    '      <Address>г. Москва, ул. Примерная, д. {number}</Address>\n'
+    '    </INSPECTION>\n'
+    '  </PLAN>\n'
+)
+
+
+class SyntheticXmlStream:
+    """
+    Файлоподобный объект с XML документом заданного размера
+
+    Отдает документ порциями по запросу read(), не держа его в памяти целиком:
+    заголовок, записи PLAN с вложенными INSPECTION, закрывающий тег.
+    """
+
+    def __init__(self, size_bytes: int, namespace: Optional[str] = None):
+        self.size_bytes = size_bytes
+        self.records = 0
+        self.bytes_read = 0
+        root_attrs = f' xmlns="{namespace}"' if namespace else ''
+        self._head = (
+            '<?xml version="1.0" encoding="UTF-8"?>\n'
+            f'<PLANS{root_attrs}>\n'
+            '  <Header><Generated>2024-01-01</Generated></Header>\n'
+        ).encode('utf-8')
+        self._tail = b'</PLANS>\n'
+        self._buffer = self._head
+        self._offset = 0
+        self._produced = len(self._head)
+        self._finished = False
+
+    def _next_chunk(self, chunk_size: int = 1024 * 1024) -> bytes:
+        parts = []
+        length = 0
+        while length < chunk_size and self._produced + length < self.size_bytes:
+            self.records += 1
+            part = RECORD_TEMPLATE.format(
+                guid=f'00000000-0000-0000-0000-{self.records:012d}', number=self.records
+            ).encode('utf-8')
+            parts.append(part)
+            length += len(part)
+        self._produced += length
+        return b''.join(parts)
+
+    def read(self, size: int = -1) -> bytes:
+        if size is None or size < 0:
+            size = 1024 * 1024
+        if self._offset >= len(self._buffer) and not self._finished:
+            chunk = self._next_chunk()
+            if not chunk:
+                chunk = self._tail
+                self._finished = True
+            self._buffer, self._offset = chunk, 0
+        data = self._buffer[self._offset:self._offset + size]
+        self._offset += len(data)
+        self.bytes_read += len(data)
+        return data
+
+
+def current_rss_mb() -> float:
+    """Текущий RSS процесса в МБ (Linux /proc, иначе пиковый из getrusage)"""
+    try:
+        with open('/proc/self/statm') as f:
+            pages = int(f.read().split()[1])
+        return pages * resource.getpagesize() / (1024 * 1024)
+    except (OSError, ValueError, IndexError):
+        return peak_rss_mb()
+
+
+def peak_rss_mb() -> float:
+    """Пиковый RSS процесса в МБ"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux отдает КБ, macOS - байты
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def run(size_mb: int = DEFAULT_SIZE_MB, namespace: Optional[str] = None,
+        max_growth_mb: float = DEFAULT_MAX_GROWTH_MB, progress: bool = True) -> Dict:
+    """Разобрать синтетический документ и замерить память"""
+    from lxml import etree
+    from erknm.loader.xml_stream import iter_records, extract_record_fields
+
+    stream = SyntheticXmlStream(size_mb * 1024 * 1024, namespace=namespace)
+    warmup_bytes = min(WARMUP_MB, size_mb // 4) * 1024 * 1024
+    baseline_mb = None
+    max_rss_mb = 0.0
+    records = 0
+    started = time.monotonic()
+    next_report = 0
+
+    for _, elem in iter_records(stream, 'plan'):
+        extract_record_fields(elem)
+        etree.tostring(elem, encoding='unicode')
+        records += 1
+
+        if records % 1000 == 0:
+            rss = current_rss_mb()
+            if baseline_mb is None and stream.bytes_read >= warmup_bytes:
+                baseline_mb = rss
+            max_rss_mb = max(max_rss_mb, rss)
+            if progress and stream.bytes_read >= next_report:
+                print(f"  {stream.bytes_read / (1024 * 1024):>8.0f} МБ  записей: {records:>10}  RSS: {rss:.1f} МБ",
+                      file=sys.stderr)
+                next_report += max(size_mb // 20, 1) * 1024 * 1024
+
+    elapsed = time.monotonic() - started
+    baseline_mb = baseline_mb if baseline_mb is not None else current_rss_mb()
+    growth_mb = max(max_rss_mb - baseline_mb, 0.0)
+
+    return {
+        'size_mb': stream.bytes_read / (1024 * 1024),
+        'records': records,
+        'expected_records': stream.records,
+        'elapsed_s': elapsed,
+        'baseline_rss_mb': baseline_mb,
+        'max_rss_mb': max_rss_mb,
+        'peak_rss_mb': peak_rss_mb(),
+        'growth_mb': growth_mb,
+        'max_growth_mb': max_growth_mb,
+        'ok': growth_mb <= max_growth_mb and records == stream.records,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Постоянство памяти при потоковом разборе XML")
+    parser.add_argument('--size-mb', type=int, default=DEFAULT_SIZE_MB, help="Размер документа в МБ")
+    parser.add_argument('--namespace', nargs='?', const='urn:erknm:plans', default=None,
+                        help="Объявить namespace по умолчанию в корне документа")
+    parser.add_argument('--max-growth-mb', type=float, default=DEFAULT_MAX_GROWTH_MB,
+                        help="Допустимый прирост RSS после прогрева")
+    parser.add_argument('--quiet', action='store_true', help="Не выводить прогресс")
+    args = parser.parse_args(argv)
+
+    report = run(args.size_mb, namespace=args.namespace,
+                 max_growth_mb=args.max_growth_mb, progress=not args.quiet)
+
+    mb_per_s = report['size_mb'] / report['elapsed_s'] if report['elapsed_s'] else 0
+    print(f"Документ:        {report['size_mb']:.0f} МБ, записей {report['records']} "
+          f"из {report['expected_records']}")
+    print(f"Скорость:        {mb_per_s:.1f} МБ/с ({report['elapsed_s']:.1f} с)")
+    print(f"RSS после прогрева: {report['baseline_rss_mb']:.1f} МБ")
+    print(f"RSS максимум:    {report['max_rss_mb']:.1f} МБ (пик процесса {report['peak_rss_mb']:.1f} МБ)")
+    print(f"Прирост:         {report['growth_mb']:.1f} МБ (предел {report['max_growth_mb']:.0f} МБ)")
+    print("Результат:       " + ("OK" if report['ok'] else "ПАМЯТЬ РАСТЕТ"))
+
+    return 0 if report['ok'] else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
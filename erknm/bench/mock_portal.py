@@ -0,0 +1,310 @@
+"""Локальный мок портала открытых данных для офлайн-бенчмарков синхронизации
+
+Запуск:
+    python -m erknm.bench.mock_portal --datasets 4 --versions 2 --records 5000
+    python -m erknm.bench.mock_portal --catalog /tmp/catalog --latency-ms 200 --error-429-rate 0.1
+
+Затем в другом терминале:
+    python -m erknm.cli sync-cmd --source-url http://127.0.0.1:8765
+
+Раздает каталог из erknm.bench.generator (генерирует его сам, если --catalog
+не указан) по тем же путям, что и портал:
+    /                         - страница с разделом "Реестр наборов данных" и кнопкой "Скачать"
+    /list.xml                 - список наборов
+    /meta/<identifier>.xml    - мета-XML набора
+    /zips/<имя>.zip           - архивы
+    /_stats                   - статистика мока (JSON): запросы, статусы, байты, внесенные сбои
+
+Ссылки в XML переписываются на фактический адрес мока. Поведение реального
+источника имитируется настройками: задержка ответа, ограничение полосы,
+ограничение частоты запросов (429 с Retry-After), случайные 429/5xx и ответы,
+обернутые в HTML (как страница-заглушка вместо XML).
+"""
+import argparse
+import json
+import random
+import sys
+import tempfile
+import threading
+import time
+from html import escape as html_escape
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Dict, Optional
+from urllib.parse import unquote, urlparse
+
+DEFAULT_PORT = 8765
+
+INDEX_PAGE = '''<!DOCTYPE html>
+<html lang="ru">
+<head><meta charset="utf-8"><title>Открытые данные (мок)</title></head>
+<body>
+  <section>
+    <h2>Реестр наборов данных</h2>
+    <a href="{list_url}" download="list.xml">Скачать</a>
+  </section>
+</body>
+</html>
+'''
+
+HTML_WRAPPER = '''<!DOCTYPE html>
+<html><head><meta charset="utf-8"><title>{title}</title></head>
+<body><pre>{body}</pre></body></html>
+'''
+
+
+class PortalFaults:
+    """Настройки имитации поведения портала"""
+
+    def __init__(self, latency_ms: float = 0, jitter_ms: float = 0, bandwidth_kbps: float = 0,
+                 max_rps: float = 0, error_429_rate: float = 0, error_5xx_rate: float = 0,
+                 html_rate: float = 0, seed: Optional[int] = None):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.bandwidth_kbps = bandwidth_kbps
+        self.max_rps = max_rps
+        self.error_429_rate = error_429_rate
+        self.error_5xx_rate = error_5xx_rate
+        self.html_rate = html_rate
+        self.random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._tokens = max_rps
+        self._refilled = time.monotonic()
+
+    def chance(self, rate: float) -> bool:
+        if rate <= 0:
+            return False
+        with self._lock:
+            return self.random.random() < rate
+
+    def delay(self) -> float:
+        """Задержка перед ответом в секундах"""
+        if not self.latency_ms and not self.jitter_ms:
+            return 0.0
+        with self._lock:
+            jitter = self.random.uniform(0, self.jitter_ms) if self.jitter_ms else 0
+        return (self.latency_ms + jitter) / 1000.0
+
+    def take_token(self) -> bool:
+        """Ограничение частоты запросов (token bucket); False - запрос сверх лимита"""
+        if self.max_rps <= 0:
+            return True
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.max_rps, self._tokens + (now - self._refilled) * self.max_rps)
+            self._refilled = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return True
+            return False
+
+
+class MockPortal:
+    """HTTP-сервер мока портала, работающий в фоновом потоке"""
+
+    def __init__(self, catalog_dir: Path, host: str = '127.0.0.1', port: int = DEFAULT_PORT,
+                 faults: Optional[PortalFaults] = None):
+        self.catalog_dir = Path(catalog_dir)
+        self.faults = faults or PortalFaults()
+        manifest_path = self.catalog_dir / 'manifest.json'
+        manifest = json.loads(manifest_path.read_text(encoding='utf-8')) if manifest_path.exists() else {}
+        self.catalog_base_url = manifest.get('base_url')
+        self._stats = {'requests': 0, 'bytes_sent': 0, 'by_status': {}, 'by_kind': {}, 'injected': {}}
+        self._stats_lock = threading.Lock()
+        self.server = ThreadingHTTPServer((host, port), self._make_handler())
+        self.server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def start(self) -> 'MockPortal':
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+        if self._thread:
+            self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def stats(self) -> Dict:
+        with self._stats_lock:
+            return json.loads(json.dumps(self._stats))
+
+    def _record(self, kind: str, status: int, sent: int, injected: Optional[str] = None):
+        with self._stats_lock:
+            self._stats['requests'] += 1
+            self._stats['bytes_sent'] += sent
+            self._stats['by_status'][str(status)] = self._stats['by_status'].get(str(status), 0) + 1
+            self._stats['by_kind'][kind] = self._stats['by_kind'].get(kind, 0) + 1
+            if injected:
+                self._stats['injected'][injected] = self._stats['injected'].get(injected, 0) + 1
+
+    def _resolve(self, path: str):
+        """Путь запроса -> (вид ресурса, файл каталога или None)"""
+        path = unquote(urlparse(path).path).rstrip('/')
+        if path in ('', '/index.html'):
+            return 'index', None
+        if path == '/list.xml':
+            return 'list', self.catalog_dir / 'list.xml'
+        parts = path.strip('/').split('/')
+        if len(parts) == 2 and parts[0] in ('meta', 'zips') and '..' not in parts[1]:
+            return parts[0], self.catalog_dir / parts[0] / parts[1]
+        return 'other', None
+
+    def _make_handler(self):
+        portal = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, format, *args):
+                pass
+
+            def _send(self, kind: str, status: int, body: bytes, content_type: str,
+                      headers: Optional[Dict] = None, injected: Optional[str] = None):
+                self.send_response(status)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                sent = 0
+                if self.command != 'HEAD':
+                    sent = self._write_throttled(body)
+                portal._record(kind, status, sent, injected)
+
+            def _write_throttled(self, body: bytes) -> int:
+                bandwidth = portal.faults.bandwidth_kbps * 1024
+                if bandwidth <= 0:
+                    self.wfile.write(body)
+                    return len(body)
+                chunk = 16 * 1024
+                started = time.monotonic()
+                sent = 0
+                try:
+                    for offset in range(0, len(body), chunk):
+                        self.wfile.write(body[offset:offset + chunk])
+                        sent += len(body[offset:offset + chunk])
+                        # Выравниваем скорость отдачи по заданной полосе
+                        ahead = sent / bandwidth - (time.monotonic() - started)
+                        if ahead > 0:
+                            time.sleep(ahead)
+                except (BrokenPipeError, ConnectionResetError):
+                    pass
+                return sent
+
+            def do_HEAD(self):
+                self.do_GET()
+
+            def do_GET(self):
+                faults = portal.faults
+                kind, file_path = portal._resolve(self.path)
+
+                if kind == 'other' and self.path.startswith('/_stats'):
+                    body = json.dumps(portal.stats(), ensure_ascii=False, indent=2).encode('utf-8')
+                    self.send_response(200)
+                    self.send_header('Content-Type', 'application/json; charset=utf-8')
+                    self.send_header('Content-Length', str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+                    return
+
+                delay = faults.delay()
+                if delay:
+                    time.sleep(delay)
+
+                if not faults.take_token():
+                    self._send(kind, 429, b'Too Many Requests', 'text/plain; charset=utf-8',
+                               {'Retry-After': '1'}, injected='rate_limit')
+                    return
+                if faults.chance(faults.error_429_rate):
+                    self._send(kind, 429, b'Too Many Requests', 'text/plain; charset=utf-8',
+                               {'Retry-After': '2'}, injected='429')
+                    return
+                if faults.chance(faults.error_5xx_rate):
+                    status = faults.random.choice([500, 502, 503, 504])
+                    self._send(kind, status, b'Server Error', 'text/plain; charset=utf-8', injected='5xx')
+                    return
+
+                if kind == 'index':
+                    body = INDEX_PAGE.format(list_url=f'{portal.url}/list.xml').encode('utf-8')
+                    self._send(kind, 200, body, 'text/html; charset=utf-8')
+                    return
+                if file_path is None or not file_path.is_file():
+                    self._send(kind, 404, b'Not Found', 'text/plain; charset=utf-8')
+                    return
+
+                body = file_path.read_bytes()
+                if file_path.suffix == '.xml' and portal.catalog_base_url:
+                    body = body.replace(portal.catalog_base_url.encode('utf-8'), portal.url.encode('utf-8'))
+
+                if faults.chance(faults.html_rate):
+                    # Вместо данных - HTML-страница (просмотрщик XML/заглушка защиты от ботов)
+                    preview = body[:4096].decode('utf-8', errors='replace') if file_path.suffix == '.xml' \
+                        else 'Доступ временно ограничен'
+                    wrapped = HTML_WRAPPER.format(title=html_escape(file_path.name), body=html_escape(preview))
+                    self._send(kind, 200, wrapped.encode('utf-8'), 'text/html; charset=utf-8', injected='html')
+                    return
+
+                content_type = 'application/zip' if file_path.suffix == '.zip' else 'application/xml; charset=utf-8'
+                self._send(kind, 200, body, content_type)
+
+        return Handler
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Локальный мок портала открытых данных ЕРКНМ")
+    parser.add_argument('--catalog', help="Каталог из erknm.bench.generator (по умолчанию генерируется)")
+    parser.add_argument('--datasets', type=int, default=4, help="Наборов данных при генерации")
+    parser.add_argument('--versions', type=int, default=2, help="Версий на набор при генерации")
+    parser.add_argument('--records', type=int, default=1000, help="Записей в документе при генерации")
+    parser.add_argument('--variant', default='plain', help="Вариант документа при генерации")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('--latency-ms', type=float, default=0, help="Задержка перед каждым ответом")
+    parser.add_argument('--jitter-ms', type=float, default=0, help="Случайная добавка к задержке")
+    parser.add_argument('--bandwidth-kbps', type=float, default=0, help="Полоса отдачи на ответ, КБ/с")
+    parser.add_argument('--max-rps', type=float, default=0, help="Лимит запросов в секунду (сверх - 429)")
+    parser.add_argument('--error-429-rate', type=float, default=0, help="Доля случайных ответов 429")
+    parser.add_argument('--error-5xx-rate', type=float, default=0, help="Доля случайных ответов 5xx")
+    parser.add_argument('--html-rate', type=float, default=0, help="Доля ответов, обернутых в HTML")
+    parser.add_argument('--seed', type=int, default=None)
+    args = parser.parse_args(argv)
+
+    catalog_dir = args.catalog
+    if not catalog_dir:
+        from erknm.bench.generator import generate_catalog
+        catalog_dir = tempfile.mkdtemp(prefix='erknm-mock-portal-')
+        generate_catalog(Path(catalog_dir), datasets=args.datasets, versions=args.versions,
+                         records=args.records, variant=args.variant)
+
+    faults = PortalFaults(latency_ms=args.latency_ms, jitter_ms=args.jitter_ms,
+                          bandwidth_kbps=args.bandwidth_kbps, max_rps=args.max_rps,
+                          error_429_rate=args.error_429_rate, error_5xx_rate=args.error_5xx_rate,
+                          html_rate=args.html_rate, seed=args.seed)
+    portal = MockPortal(Path(catalog_dir), host=args.host, port=args.port, faults=faults)
+    print(f"Мок портала: {portal.url} (каталог: {catalog_dir})")
+    print(f"Синхронизация: python -m erknm.cli sync-cmd --source-url {portal.url}")
+    try:
+        portal.server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        portal.server.server_close()
+        print(json.dumps(portal.stats(), ensure_ascii=False, indent=2))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
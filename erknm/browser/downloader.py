@@ -3,10 +3,28 @@ from pathlib import Path
 from playwright.sync_api import sync_playwright, TimeoutError as PlaywrightTimeoutError
 import requests
 import time
-from erknm.config import SOURCE_URL, DOWNLOAD_DIR
 from erknm.db.models import OperationLog
 
 
+def _list_xml_urls():
+    """
+    Варианты URL list.xml
+    
+    Запасные адреса реального портала используются только для адреса по умолчанию:
+    при переопределенном SOURCE_URL (например, локальный мок) реальный портал не трогаем.
+    """
+    from erknm.config import SOURCE_URL, DEFAULT_SOURCE_URL
+    
+    urls = [f"{SOURCE_URL.rstrip('/')}/list.xml"]
+    if SOURCE_URL.rstrip('/') == DEFAULT_SOURCE_URL:
+        urls += [
+            "https://proverki.gov.ru/portal/public-open-data/list.xml",
+            "https://proverki.gov.ru/list.xml",
+            "https://proverki.gov.ru/portal/list.xml"
+        ]
+    return urls
+
+
 def download_list_xml(sync_run_id=None, timeout=30000):
     """
     Скачать list.xml через браузерную автоматизацию
@@ -18,6 +36,8 @@ def download_list_xml(sync_run_id=None, timeout=30000):
     Returns:
         Path к скачанному файлу или None при ошибке
     """
+    from erknm.config import SOURCE_URL, DOWNLOAD_DIR
+    
     output_path = DOWNLOAD_DIR / "list.xml"
     
     browser = None
@@ -28,12 +48,7 @@ def download_list_xml(sync_run_id=None, timeout=30000):
             page = context.new_page()
             
             # Сначала пробуем получить list.xml напрямую - пробуем несколько вариантов URL
-            list_xml_urls = [
-                f"{SOURCE_URL.rstrip('/')}/list.xml",
-                "https://proverki.gov.ru/portal/public-open-data/list.xml",
-                "https://proverki.gov.ru/list.xml",
-                "https://proverki.gov.ru/portal/list.xml"
-            ]
+            list_xml_urls = _list_xml_urls()
             
             for list_xml_url in list_xml_urls:
                 if sync_run_id:
@@ -212,12 +227,7 @@ def download_list_xml(sync_run_id=None, timeout=30000):
                 page = context.new_page()
                 
                 # Пробуем все варианты URL для list.xml
-                list_xml_urls = [
-                    f"{SOURCE_URL.rstrip('/')}/list.xml",
-                    "https://proverki.gov.ru/portal/public-open-data/list.xml",
-                    "https://proverki.gov.ru/list.xml",
-                    "https://proverki.gov.ru/portal/list.xml"
-                ]
+                list_xml_urls = _list_xml_urls()
                 
                 for list_xml_url in list_xml_urls:
                     try:
@@ -1,24 +1,31 @@
 """Загрузка мета-XML файлов через браузер"""
 from pathlib import Path
+from typing import Dict, Optional
 from playwright.sync_api import sync_playwright, TimeoutError as PlaywrightTimeoutError
-import time
 import random
+from erknm import metrics
 from erknm.db.models import OperationLog
+from erknm.sync import rate_limiter
 
 
-def download_meta_xml_browser(url: str, output_path: Path, sync_run_id=None, max_retries=5, delay=10.0, timeout=60000):
+def download_meta_xml_browser(url: str, output_path: Path, sync_run_id=None, max_retries=5, delay=10.0, timeout=60000,
+                              session_state: Optional[Dict] = None):
     """
     Скачать мета-XML файл через браузерную автоматизацию с имитацией человеческого поведения
     
-    Проверенная логика из тестов: прямой переход через page.goto() с задержками 10+ секунд
+    Проверенная логика из тестов: прямой переход через page.goto(). Частота
+    переходов ограничивается erknm.sync.rate_limiter (по хосту URL).
     
     Args:
         url: URL мета-XML файла
         output_path: Путь для сохранения файла
         sync_run_id: ID запуска синхронизации для логирования (опционально)
         max_retries: Максимальное количество попыток
-        delay: Базовая задержка между попытками в секундах (10 секунд - проверено в тестах)
+        delay: Базовая задержка между повторными попытками в секундах
         timeout: Таймаут в миллисекундах
+        session_state: словарь, в который после успешного скачивания
+            записываются cookies ('cookies', формат Playwright) и User-Agent
+            ('user_agent') браузера - для передачи HTTP клиенту
     
     Returns:
         Path к скачанному файлу
@@ -36,17 +43,24 @@ def download_meta_xml_browser(url: str, output_path: Path, sync_run_id=None, max
     output_path.parent.mkdir(parents=True, exist_ok=True)
     
     last_error = None
+    # Предыдущая попытка получила ответ-ограничение (429/403/HTML)
+    throttled = False
     
     for attempt in range(max_retries):
+        # Ответ уже учтен ограничителем частоты (чтобы не учитывать ошибку дважды)
+        signalled = False
         try:
             # Задержка между попытками (кроме первой)
             if attempt > 0:
-                # Экспоненциальная задержка с jitter
-                wait_time = delay * (2 ** attempt) + random.uniform(0, 2)
+                # Экспоненциальная задержка с jitter; после ограничения паузу
+                # выдерживает ограничитель частоты
+                wait_time = 0 if throttled else delay * (2 ** attempt) + random.uniform(0, 2)
                 if sync_run_id:
                     OperationLog.log(sync_run_id, "dataset", 
                                    f"Повторная попытка {attempt + 1}/{max_retries} через {wait_time:.1f}с", stage='dataset')
-                time.sleep(wait_time)
+                metrics.inc('retries_total', kind='meta')
+                metrics.sleep(wait_time, 'retry_backoff')
+            throttled = False
             
             if sync_run_id:
                 OperationLog.log(sync_run_id, "dataset", f"Открытие страницы {url} через Playwright (попытка {attempt + 1}/{max_retries})", stage='dataset')
@@ -63,6 +77,8 @@ def download_meta_xml_browser(url: str, output_path: Path, sync_run_id=None, max
                 
                 try:
                     # Прямой переход на URL (проверенный метод)
+                    # Ждем разрешения ограничителя частоты запросов к хосту
+                    rate_limiter.acquire(url, sync_run_id)
                     if sync_run_id:
                         OperationLog.log(sync_run_id, "dataset", f"Переход на URL: {url}", stage='dataset')
                     
@@ -73,14 +89,15 @@ def download_meta_xml_browser(url: str, output_path: Path, sync_run_id=None, max
                     
                     # Проверяем статус ответа
                     if response.status >= 400:
+                        signal = rate_limiter.signal_for_status(response.status)
+                        rate_limiter.feedback(url, signal, rate_limiter.parse_retry_after(response.headers.get('retry-after')))
+                        signalled = True
+                        throttled = signal == rate_limiter.SIGNAL_THROTTLED
                         raise Exception(f"HTTP ошибка {response.status}: {response.status_text}")
                     
                     if sync_run_id:
                         OperationLog.log(sync_run_id, "dataset", f"Получен ответ со статусом {response.status}", stage='dataset')
                     
-                    # Небольшая задержка для имитации человеческого поведения
-                    time.sleep(random.uniform(1.0, 2.5))
-                    
                     # Получаем тело ответа напрямую (проверенный метод)
                     body = response.body()
                     
@@ -92,6 +109,11 @@ def download_meta_xml_browser(url: str, output_path: Path, sync_run_id=None, max
                     
                     # Проверяем, что это действительно XML
                     if not (b'<?xml' in body[:100] or b'<meta' in body[:200] or b'<dataset' in body[:200]):
+                        # HTML вместо XML - заглушка/капча, источник ограничивает запросы
+                        if rate_limiter.is_html(response.headers.get('content-type', ''), body):
+                            rate_limiter.feedback(url, rate_limiter.SIGNAL_THROTTLED)
+                            signalled = True
+                            throttled = True
                         raise Exception("Полученный ответ не является валидным XML")
                     
                     # Сохраняем файл
@@ -105,20 +127,28 @@ def download_meta_xml_browser(url: str, output_path: Path, sync_run_id=None, max
                         OperationLog.log(sync_run_id, "dataset", 
                                        f"Файл {output_path.name} успешно скачан ({output_path.stat().st_size} байт)", stage='dataset')
                     
+                    if session_state is not None:
+                        # Cookies, полученные при прохождении проверки источника
+                        try:
+                            session_state['cookies'] = context.cookies()
+                            session_state['user_agent'] = page.evaluate('navigator.userAgent')
+                        except Exception:
+                            pass  # Файл уже сохранен: без cookies HTTP клиент продолжит как был
+                    
                     browser.close()
                     
-                    # КРИТИЧЕСКИ ВАЖНО: Задержка перед следующим запросом
-                    # Тесты показали, что задержка 10 секунд работает надежно
-                    wait_time = delay + random.uniform(3, 7)  # 10-17 секунд
-                    if sync_run_id:
-                        OperationLog.log(sync_run_id, "dataset", 
-                                       f"Задержка {wait_time:.1f}с перед следующим запросом", stage='dataset')
-                    time.sleep(wait_time)
+                    # Паузу перед следующим запросом выдерживает ограничитель частоты
+                    rate_limiter.feedback(url, rate_limiter.SIGNAL_OK)
+                    metrics.inc('bytes_total', len(body), kind='download')
                     
                     return output_path
                     
+                except StopIteration:
+                    browser.close()
+                    raise
                 except PlaywrightTimeoutError as e:
                     browser.close()
+                    rate_limiter.feedback(url, rate_limiter.SIGNAL_ERROR)
                     last_error = f"Таймаут при загрузке страницы: {str(e)}"
                     if sync_run_id:
                         OperationLog.log(sync_run_id, "dataset", last_error, level="WARNING", stage='dataset')
@@ -135,6 +165,8 @@ def download_meta_xml_browser(url: str, output_path: Path, sync_run_id=None, max
                     ])
                     
                     if is_connection_error:
+                        if not signalled:
+                            rate_limiter.feedback(url, rate_limiter.SIGNAL_ERROR)
                         last_error = f"Ошибка соединения при скачивании: {error_str}"
                     else:
                         last_error = f"Ошибка при скачивании: {error_str}"
@@ -148,12 +180,15 @@ def download_meta_xml_browser(url: str, output_path: Path, sync_run_id=None, max
                         if sync_run_id:
                             OperationLog.log(sync_run_id, "dataset", 
                                            f"Дополнительная задержка {extra_wait:.1f}с из-за ошибки соединения", stage='dataset')
-                        time.sleep(extra_wait)
+                        metrics.sleep(extra_wait, 'retry_backoff')
                     
                     if attempt == max_retries - 1:
                         raise Exception(last_error)
                     continue
                     
+        except StopIteration:
+            # Остановка запрошена - пробрасываем дальше
+            raise
         except Exception as e:
             last_error = str(e)
             if sync_run_id:
@@ -1,7 +1,34 @@
 """Классификатор данных"""
-from typing import Optional
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Optional, Dict
 from pathlib import Path
-from lxml import etree
+
+
+# Локальные имена элементов-записей и соответствующие типы данных
+RECORD_TAGS = {
+    'PLAN': 'plan',
+    'plan': 'plan',
+    'INSPECTION': 'inspection',
+    'inspection': 'inspection',
+}
+
+# Сколько элементов просматривать в поисках первой записи, если тип уже известен по корню
+SNIFF_MAX_ELEMENTS = 10000
+
+# Сколько элементов просматривать, если корень не классифицирован: документ без
+# записей иначе читался бы до конца
+SNIFF_MAX_ELEMENTS_UNKNOWN = 20000
+
+# Объем начала файла, по которому ищется запись кэша (проверяются все прочитанные байты)
+SNIFF_HEAD_BYTES = 64 * 1024
+
+# Кэш результатов разбора начала документа: отпечаток содержимого -> результат
+# (для файлов - вместе с объемом и SHA-256 прочитанных разбором байт)
+SNIFF_CACHE_SIZE = 1024
+_sniff_cache = OrderedDict()
+_sniff_cache_lock = threading.Lock()
 
 
 def classify_dataset(identifier: str, title: str, link: str) -> Optional[str]:
@@ -28,52 +55,194 @@ def classify_dataset(identifier: str, title: str, link: str) -> Optional[str]:
     return None
 
 
-def classify_xml_file(file_path: Path) -> Optional[str]:
+def _local_name(tag) -> str:
+    """Имя тега без namespace"""
+    if not isinstance(tag, str):
+        return ''
+    return tag.rsplit('}', 1)[-1]
+
+
+def _classify_root(root_tag: str, nsmap: Dict) -> Optional[str]:
+    """Определить тип данных по корневому элементу и его namespace"""
+    root_tag_lower = root_tag.lower()
+    
+    if 'plan' in root_tag_lower or 'план' in root_tag_lower:
+        return 'plan'
+    
+    if 'inspection' in root_tag_lower or 'проверк' in root_tag_lower:
+        return 'inspection'
+    
+    for ns in (nsmap or {}).values():
+        if ns and 'plan' in ns.lower():
+            return 'plan'
+        if ns and 'inspection' in ns.lower():
+            return 'inspection'
+    
+    return None
+
+
+def sniff_xml_head(source, max_elements: int = SNIFF_MAX_ELEMENTS,
+                   max_unknown_elements: int = SNIFF_MAX_ELEMENTS_UNKNOWN) -> Dict:
     """
-    Классифицировать XML файл по содержимому
+    Определить тип XML по началу документа без построения полного дерева
+    
+    Разбор идет по событиям start и останавливается на корневом элементе
+    (если его достаточно) и первом элементе-записи PLAN/INSPECTION.
+    Закрытые элементы сразу освобождаются, поэтому память не растет,
+    даже если запись встречается далеко от начала файла.
+    
+    Args:
+        source: путь к файлу или бинарный поток
+        max_elements: сколько элементов просматривать в поисках записи,
+                      если тип уже определен по корню
+        max_unknown_elements: то же, если корень не классифицирован; после
+                      него тип остается None
     
     Returns:
-        'plan' - планы проверок
-        'inspection' - проверки
-        None - неклассифицировано
+        Словарь: data_type ('plan', 'inspection' или None), root_tag,
+        record_tag (полное имя тега первой записи или None)
     """
+    from lxml import etree
+    
+    result = {'data_type': None, 'root_tag': None, 'record_tag': None}
+    context = etree.iterparse(source, events=('start', 'end'), huge_tree=True, recover=True)
+    seen = 0
+    
     try:
-        tree = etree.parse(str(file_path))
-        root = tree.getroot()
-        
-        # Проверяем корневой элемент
-        root_tag = root.tag.lower()
-        
-        if 'plan' in root_tag or 'план' in root_tag:
-            return 'plan'
-        
-        if 'inspection' in root_tag or 'проверк' in root_tag:
-            return 'inspection'
-        
-        # Проверяем namespace или другие признаки
-        if root.nsmap:
-            for ns in root.nsmap.values():
-                if 'plan' in ns.lower():
-                    return 'plan'
-                if 'inspection' in ns.lower() or 'inspection' in ns.lower():
-                    return 'inspection'
-        
-        # Проверяем наличие характерных элементов
-        if root.xpath('.//PLAN') or root.xpath('.//plan'):
-            return 'plan'
-        
-        if root.xpath('.//INSPECTION') or root.xpath('.//inspection'):
-            return 'inspection'
-        
-    except Exception:
+        for event, elem in context:
+            if event == 'end':
+                # Освобождаем уже разобранные элементы
+                elem.clear()
+                while elem.getprevious() is not None:
+                    del elem.getparent()[0]
+                continue
+            
+            if result['root_tag'] is None:
+                result['root_tag'] = elem.tag
+                result['data_type'] = _classify_root(elem.tag, elem.nsmap)
+                continue
+            
+            record_type = RECORD_TAGS.get(_local_name(elem.tag))
+            if record_type:
+                if result['data_type'] is None:
+                    result['data_type'] = record_type
+                if record_type == result['data_type']:
+                    result['record_tag'] = elem.tag
+                    break
+            
+            seen += 1
+            if seen >= (max_elements if result['data_type'] else max_unknown_elements):
+                break
+    except etree.XMLSyntaxError:
+        # Битый документ - возвращаем то, что успели определить
         pass
+    finally:
+        del context
     
-    return None
+    return result
+
 
+def _cache_get(key):
+    with _sniff_cache_lock:
+        result = _sniff_cache.get(key)
+        if result is not None:
+            _sniff_cache.move_to_end(key)
+        return result
 
 
+def _cache_put(key, result):
+    with _sniff_cache_lock:
+        _sniff_cache[key] = result
+        _sniff_cache.move_to_end(key)
+        while len(_sniff_cache) > SNIFF_CACHE_SIZE:
+            _sniff_cache.popitem(last=False)
+
+
+class _HashingReader:
+    """Бинарный поток, считающий SHA-256 и объем прочитанных из него байт"""
+    
+    def __init__(self, stream):
+        self.stream = stream
+        self.hash = hashlib.sha256()
+        self.consumed = 0
+    
+    def read(self, size=-1):
+        data = self.stream.read(size)
+        self.hash.update(data)
+        self.consumed += len(data)
+        return data
 
 
+def _file_fingerprint(file_path: Path) -> str:
+    """Отпечаток для поиска в кэше: размер + SHA-256 первых SNIFF_HEAD_BYTES байт"""
+    file_size = file_path.stat().st_size
+    with open(file_path, 'rb') as f:
+        head_hash = hashlib.sha256(f.read(SNIFF_HEAD_BYTES)).hexdigest()
+    return f"{file_size}:{head_hash}"
 
 
+def _prefix_hash(file_path: Path, length: int) -> str:
+    """SHA-256 первых length байт файла"""
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        while length > 0:
+            chunk = f.read(min(length, SNIFF_HEAD_BYTES))
+            if not chunk:
+                break
+            digest.update(chunk)
+            length -= len(chunk)
+    return digest.hexdigest()
 
+
+def sniff_xml_file(file_path: Path) -> Dict:
+    """
+    Разобрать начало XML файла (результат кэшируется по содержимому)
+    
+    Разбор может прочитать намного больше SNIFF_HEAD_BYTES, поэтому вместе
+    с результатом хранится SHA-256 всех прочитанных разбором байт: запись
+    кэша используется, только если это начало файла не изменилось.
+    """
+    file_path = Path(file_path)
+    key = ('file', _file_fingerprint(file_path))
+    cached = _cache_get(key)
+    if cached is not None:
+        consumed, consumed_hash, result = cached
+        if consumed <= SNIFF_HEAD_BYTES or _prefix_hash(file_path, consumed) == consumed_hash:
+            return dict(result)
+    with open(file_path, 'rb') as f:
+        reader = _HashingReader(f)
+        result = sniff_xml_head(reader)
+    _cache_put(key, (reader.consumed, reader.hash.hexdigest(), result))
+    return dict(result)
+
+
+def sniff_xml_member(zip_ref, xml_name: str, zip_info=None) -> Dict:
+    """
+    Разобрать начало XML файла внутри ZIP без распаковки всего файла
+    
+    Результат кэшируется по CRC-32 и размеру из центрального каталога ZIP,
+    поэтому повторная классификация того же содержимого не читает архив.
+    """
+    zip_info = zip_info or zip_ref.getinfo(xml_name)
+    key = ('zip', zip_info.CRC, zip_info.file_size)
+    result = _cache_get(key)
+    if result is None:
+        with zip_ref.open(xml_name) as member:
+            result = sniff_xml_head(member)
+        _cache_put(key, result)
+    return dict(result)
+
+
+def classify_xml_file(file_path: Path) -> Optional[str]:
+    """
+    Классифицировать XML файл по содержимому (по началу документа)
+    
+    Returns:
+        'plan' - планы проверок
+        'inspection' - проверки
+        None - неклассифицировано
+    """
+    try:
+        return sniff_xml_file(file_path)['data_type']
+    except Exception:
+        return None
@@ -1,8 +1,6 @@
 """CLI интерфейс"""
 import click
 from pathlib import Path
-from erknm.sync.synchronizer import sync, process_manual_file
-from erknm.db.schema import init_schema
 from erknm.db.connection import get_connection, get_cursor
 
 
@@ -15,6 +13,8 @@ def cli():
 @cli.command()
 def init():
     """Инициализировать схему базы данных"""
+    from erknm.db.schema import init_schema
+    
     click.echo("Инициализация схемы базы данных...")
     try:
         init_schema()
@@ -24,13 +24,42 @@ def init():
         raise click.Abort()
 
 
+PROFILE_OPTION_HELP = ('Профилировать запуск: sampling (по умолчанию) или cprofile; off - выключить. '
+                       'Без опции используется настройка profile_mode. Профиль сохраняется в DOWNLOAD_DIR/profiles/run-<id>/')
+
+
+def _profile_option(func):
+    return click.option('--profile', type=click.Choice(['sampling', 'cprofile', 'off']),
+                        is_flag=False, flag_value='sampling', default=None,
+                        help=PROFILE_OPTION_HELP)(func)
+
+
+def _echo_profile_dir(profile):
+    if profile and profile != 'off':
+        from erknm.config import get_download_dir
+        click.echo(f"Профиль запуска: {get_download_dir() / 'profiles'}")
+
+
 @cli.command()
-def sync_cmd():
+@click.option('--source-url', default=None,
+              help='Адрес портала вместо SOURCE_URL (например, локальный мок: python -m erknm.bench.mock_portal)')
+@click.option('--resume', is_flag=True,
+              help='Продолжить последнюю прерванную синхронизацию с ее контрольной точки')
+@_profile_option
+def sync_cmd(source_url, resume, profile):
     """Запустить автоматическую синхронизацию"""
+    from erknm.sync.synchronizer import sync
+    
+    if source_url:
+        from erknm import config
+        config.set_source_url(source_url)
+        click.echo(f"Источник данных: {config.SOURCE_URL}")
+    
     click.echo("Запуск синхронизации...")
     try:
-        sync(is_manual=False)
+        sync(is_manual=False, profile=profile, resume=resume)
         click.echo("✓ Синхронизация завершена успешно")
+        _echo_profile_dir(profile)
     except Exception as e:
         click.echo(f"✗ Ошибка синхронизации: {e}", err=True)
         raise click.Abort()
@@ -39,13 +68,17 @@ def sync_cmd():
 @cli.command()
 @click.argument('file_path', type=click.Path(exists=True))
 @click.option('--zip/--xml', default=None, help='Тип файла (определяется автоматически, если не указан)')
-def load_file(file_path, zip):
+@_profile_option
+def load_file(file_path, zip, profile):
     """Загрузить файл вручную"""
+    from erknm.sync.synchronizer import process_manual_file
+    
     click.echo(f"Загрузка файла: {file_path}")
     try:
         is_zip = zip if zip is not None else None
-        process_manual_file(Path(file_path), is_zip=is_zip)
+        process_manual_file(Path(file_path), is_zip=is_zip, profile=profile)
         click.echo("✓ Файл успешно загружен")
+        _echo_profile_dir(profile)
     except Exception as e:
         click.echo(f"✗ Ошибка загрузки: {e}", err=True)
         raise click.Abort()
@@ -140,6 +173,55 @@ def show_runs(limit):
         conn.close()
 
 
+@cli.command()
+@click.argument('run_id', type=int)
+def run_metrics(run_id):
+    """Показать сводку метрик этапов запуска"""
+    from erknm.metrics.registry import STAGE_TITLES
+    
+    conn = get_connection()
+    cur = get_cursor(conn)
+    
+    try:
+        cur.execute("SELECT id, status, metrics FROM sync_runs WHERE id = %s", (run_id,))
+        run = cur.fetchone()
+    finally:
+        cur.close()
+        conn.close()
+    
+    if not run:
+        click.echo(f"Запуск {run_id} не найден")
+        return
+    summary = run['metrics']
+    if not summary:
+        click.echo(f"Для запуска {run_id} метрики не сохранены")
+        return
+    
+    elapsed = summary.get('elapsed_seconds') or 0
+    click.echo(f"\nЗапуск {run_id} ({run['status']}), длительность {elapsed:.1f} с\n")
+    click.echo(f"{'Этап':<34} {'Вызовов':>10} {'Время, с':>10} {'Доля':>7} {'Макс, с':>9}")
+    click.echo("-" * 75)
+    stages = sorted(summary.get('stages', {}).items(), key=lambda item: -item[1]['seconds'])
+    for stage, data in stages:
+        share = data['seconds'] / elapsed * 100 if elapsed else 0
+        title = STAGE_TITLES.get(stage, stage)
+        click.echo(f"{title:<34} {data['calls']:>10} {data['seconds']:>10.2f} {share:>6.1f}% {data['max_seconds']:>9.3f}")
+    
+    counters = summary.get('counters', {})
+    if counters:
+        click.echo("\nСчетчики:")
+        for name in sorted(counters):
+            values = ', '.join(f"{label}: {value}" for label, value in sorted(counters[name].items()))
+            click.echo(f"  {name}: {values}")
+    
+    gauges = summary.get('gauges', {})
+    if gauges:
+        click.echo("\nПоказатели на конец запуска:")
+        for name in sorted(gauges):
+            values = ', '.join(f"{label}: {value}" for label, value in sorted(gauges[name].items()))
+            click.echo(f"  {name}: {values}")
+
+
 @cli.command()
 @click.argument('dataset_id', type=int)
 @click.argument('data_type', type=click.Choice(['plan', 'inspection']))
@@ -184,6 +266,132 @@ def reclassify_fragment_cmd(fragment_id, data_type):
         raise click.Abort()
 
 
+@cli.command()
+@click.option('--fragment', 'fragment_id', type=int, default=None, help='ID XML-фрагмента')
+@click.option('--limit', default=50, help='Количество записей для отображения')
+def quarantine(fragment_id, limit):
+    """Показать записи, отклоненные БД при загрузке"""
+    from erknm.loader.quarantine import list_records
+    
+    records = list_records(fragment_id, limit)
+    if not records:
+        click.echo("Карантин пуст")
+        return
+    
+    click.echo(f"\nЗаписи в карантине ({len(records)}):\n")
+    click.echo(f"{'ID':<7} {'Фрагмент':<10} {'Позиция':<9} {'Тип':<11} {'Попыток':<8} {'Причина'}")
+    click.echo("-" * 100)
+    for record in records:
+        reason = (record['reason'] or '').splitlines()[0] if record['reason'] else ''
+        reason = reason[:50] + '...' if len(reason) > 50 else reason
+        click.echo(f"{record['id']:<7} {record['xml_fragment_id'] or '-':<10} {record['record_offset']:<9} "
+                   f"{record['record_type']:<11} {record['attempts']:<8} {reason}")
+
+
+@cli.command()
+@click.option('--fragment', 'fragment_id', type=int, default=None, help='Только записи XML-фрагмента')
+@click.option('--id', 'record_ids', type=int, multiple=True, help='ID записи карантина (можно указать несколько раз)')
+def quarantine_replay(fragment_id, record_ids):
+    """Повторно загрузить записи из карантина"""
+    from erknm.loader.quarantine import replay
+    
+    result = replay(list(record_ids) or None, fragment_id)
+    click.echo(f"✓ Загружено записей: {result['replayed']}, осталось в карантине: {result['failed']}")
+
+
+@cli.command()
+@click.option('--source-url', default=None, help='Адрес портала вместо SOURCE_URL')
+@click.option('--resume', is_flag=True,
+              help='Продолжить последнюю прерванную синхронизацию с ее контрольной точки')
+@click.option('--force', is_flag=True,
+              help='Загружать, даже если таблицы записей не пусты (индексы перестроятся по всем строкам)')
+@click.option('--concurrently', is_flag=True,
+              help='Строить индексы CONCURRENTLY (не блокировать запись, если БД используется)')
+@click.option('--jobs', default=2, help='Количество индексов, строящихся одновременно')
+@click.option('--finish-only', is_flag=True,
+              help='Только построить индексы и восстановить внешние ключи (после прерванного backfill)')
+def backfill(source_url, resume, force, concurrently, jobs, finish_only):
+    """Первичная загрузка всей истории: без индексов во время загрузки, COPY, построение индексов в конце"""
+    from erknm.sync import backfill as backfill_mode
+    
+    if finish_only:
+        backfill_mode.finish(concurrently=concurrently, jobs=jobs, progress=click.echo)
+        click.echo("✓ Индексы и внешние ключи восстановлены")
+        return
+    
+    if source_url:
+        from erknm import config
+        config.set_source_url(source_url)
+        click.echo(f"Источник данных: {config.SOURCE_URL}")
+    
+    click.echo("Первичная загрузка...")
+    try:
+        backfill_mode.run(resume=resume, force=force, concurrently=concurrently, jobs=jobs,
+                          progress=click.echo)
+        click.echo("✓ Первичная загрузка завершена")
+    except Exception as e:
+        click.echo(f"✗ Ошибка первичной загрузки: {e}", err=True)
+        click.echo("Если индексы не восстановлены: python -m erknm.cli backfill --finish-only", err=True)
+        raise click.Abort()
+
+
+@cli.command()
+@click.option('--table', type=click.Choice(['plans_raw', 'inspections_raw', 'all']), default='all',
+              help='Таблица сырого XML')
+@click.option('--batch-size', default=1000, help='Строк в одной транзакции')
+def compress_raw(table, batch_size):
+    """Перевести сохраненный сырой XML в сжатый формат (raw_storage = compressed)"""
+    from erknm.loader import raw_storage
+    
+    tables = ['plans_raw', 'inspections_raw'] if table == 'all' else [table]
+    click.echo(f"Кодек: {raw_storage.CODEC}")
+    try:
+        for name in tables:
+            converted = raw_storage.migrate(name, batch_size=batch_size, progress=click.echo)
+            click.echo(f"✓ {name}: переведено строк: {converted}")
+    except Exception as e:
+        click.echo(f"✗ Ошибка: {e}", err=True)
+        raise click.Abort()
+    click.echo("Место освобождается после VACUUM (VACUUM FULL - чтобы вернуть его ОС)")
+
+
+@cli.command()
+def migrate_objects():
+    """Перенести архивы из DOWNLOAD_DIR/zips в хранилище объектов по SHA-256"""
+    from erknm.loader import object_store
+    
+    try:
+        result = object_store.migrate(progress=click.echo)
+    except Exception as e:
+        click.echo(f"✗ Ошибка: {e}", err=True)
+        raise click.Abort()
+    click.echo(f"✓ Перенесено архивов: {result['files']}, совпавших с существующими объектами: "
+               f"{result['duplicates']} (освобождено {result['freed'] / (1024 * 1024):.1f} МБ)")
+
+
+@cli.command()
+@click.option('--enforce', is_flag=True, help='Удалить давно не использовавшиеся файлы сверх лимита')
+@click.option('--limit-mb', type=int, default=None, help='Лимит, МБ (вместо настройки storage_limit_mb)')
+def storage(enforce, limit_mb):
+    """Объем скачанных архивов и мета-XML, ограничение по лимиту storage_limit_mb"""
+    from erknm.sync import retention
+    
+    mb = 1024 * 1024
+    if enforce:
+        result = retention.enforce(limit=limit_mb * mb if limit_mb is not None else None)
+        if result['skipped']:
+            click.echo("Выполняется синхронизация - файлы не удалялись", err=True)
+            raise click.Abort()
+        click.echo(f"✓ Удалено файлов: {result['evicted_files']} ({result['evicted_bytes'] / mb:.1f} МБ), "
+                   f"закреплено: {result['pinned_bytes'] / mb:.1f} МБ")
+    
+    status = retention.status()
+    limit_text = f"{status['limit_bytes'] / mb:.0f} МБ" if status['limit_bytes'] else "без ограничения"
+    click.echo(f"Занято: {status['used_bytes'] / mb:.1f} МБ (архивы {status['zip_bytes'] / mb:.1f} МБ, "
+               f"мета-XML {status['meta_bytes'] / mb:.1f} МБ, файлов {status['files']}), лимит: {limit_text}")
+    click.echo(f"Удалено всего: {status['evicted_files']} файлов ({status['evicted_bytes'] / mb:.1f} МБ)")
+
+
 if __name__ == '__main__':
     cli()
 
@@ -1,4 +1,9 @@
-"""Конфигурация приложения"""
+"""Конфигурация приложения
+
+Импорт модуля не обращается к БД и не создает каталогов: DOWNLOAD_DIR и
+настройки, хранящиеся в robot_settings (SCHEDULE_*, ON_ERROR, RETRY_* и т.д.),
+разрешаются лениво при первом обращении к атрибуту модуля (PEP 562).
+"""
 import os
 from pathlib import Path
 from dotenv import load_dotenv
@@ -30,12 +35,12 @@ else:
     DB_USER = os.getenv("DB_USER", "postgres")
     DB_PASSWORD = os.getenv("DB_PASSWORD", "postgres")
 
-# Source URL
-SOURCE_URL = os.getenv("SOURCE_URL", "https://proverki.gov.ru/portal/public-open-data")
+# Source URL (переопределяется через SOURCE_URL или --source-url, например для локального мока портала)
+DEFAULT_SOURCE_URL = "https://proverki.gov.ru/portal/public-open-data"
+SOURCE_URL = os.getenv("SOURCE_URL", DEFAULT_SOURCE_URL)
 
-# Download directory
-DOWNLOAD_DIR = Path(os.getenv("DOWNLOAD_DIR", "./downloads"))
-DOWNLOAD_DIR.mkdir(parents=True, exist_ok=True)
+# Download directory (создается при первом обращении к config.DOWNLOAD_DIR)
+_download_dir = None
 
 # Log level
 LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
@@ -46,41 +51,55 @@ EXTRACT_ZIPS = os.getenv("EXTRACT_ZIPS", "false").lower() == "true"
 
 
 def get_setting(key, default=None):
-    """Получить настройку из БД или дефолтное значение"""
+    """Получить настройку из БД (через процессный снимок) или дефолтное значение"""
     try:
         from erknm.db.models import Settings
-        Settings.set_defaults()  # Инициализируем если нужно
-        value = Settings.get(key, default)
-        # Преобразуем строковые значения в нужные типы
-        if value is None:
-            return default
-        value_str = str(value).lower()
-        if value_str in ('true', 'false'):
-            return value_str == 'true'
-        try:
-            # Пробуем преобразовать в число
-            if '.' in str(value):
-                return float(value)
-            return int(value)
-        except:
-            return value
+        Settings.set_defaults()  # Инициализируем если нужно (один раз на процесс)
+        return Settings.get_typed(key, default)
     except Exception:
         # Если БД еще не инициализирована или другие ошибки - используем дефолт
         return default
 
 
-# Настройки из БД с дефолтами из переменных окружения
-SCHEDULE_ENABLED = get_setting('schedule_enabled', os.getenv("SCHEDULE_ENABLED", "false").lower() == "true")
-SCHEDULE_MODE = get_setting('schedule_mode', os.getenv("SCHEDULE_MODE", "daily"))
-SCHEDULE_TIME = get_setting('schedule_time', os.getenv("SCHEDULE_TIME", "02:00"))
-SCHEDULE_DAY_OF_WEEK = get_setting('schedule_day_of_week', int(os.getenv("SCHEDULE_DAY_OF_WEEK", "1")))
-SCHEDULE_DAY_OF_MONTH = get_setting('schedule_day_of_month', int(os.getenv("SCHEDULE_DAY_OF_MONTH", "1")))
-ON_ERROR = get_setting('on_error', os.getenv("ON_ERROR", "pause"))
-RETRY_POLICY = get_setting('retry_policy', os.getenv("RETRY_POLICY", "fixed"))
-RETRY_COUNT = get_setting('retry_count', int(os.getenv("RETRY_COUNT", "3")))
-RETRY_DELAY_SECONDS = get_setting('retry_delay_seconds', int(os.getenv("RETRY_DELAY_SECONDS", "60")))
-THROTTLE_SECONDS = get_setting('throttle_seconds', float(os.getenv("THROTTLE_SECONDS", "10.0")))
-PROCESS_ONLY_ZIP = get_setting('process_only_zip', os.getenv("PROCESS_ONLY_ZIP", "true").lower() == "true")
-UNKNOWN_POLICY = get_setting('unknown_policy', os.getenv("UNKNOWN_POLICY", "skip"))
+def get_download_dir() -> Path:
+    """Получить каталог загрузок, создав его при первом обращении"""
+    global _download_dir
+    if _download_dir is None:
+        download_dir = Path(os.getenv("DOWNLOAD_DIR", "./downloads"))
+        download_dir.mkdir(parents=True, exist_ok=True)
+        _download_dir = download_dir
+    return _download_dir
+
+
+# Настройки из БД с дефолтами из переменных окружения:
+# имя атрибута -> (ключ robot_settings, дефолт из окружения)
+_DB_SETTINGS = {
+    'SCHEDULE_ENABLED': ('schedule_enabled', lambda: os.getenv("SCHEDULE_ENABLED", "false").lower() == "true"),
+    'SCHEDULE_MODE': ('schedule_mode', lambda: os.getenv("SCHEDULE_MODE", "daily")),
+    'SCHEDULE_TIME': ('schedule_time', lambda: os.getenv("SCHEDULE_TIME", "02:00")),
+    'SCHEDULE_DAY_OF_WEEK': ('schedule_day_of_week', lambda: int(os.getenv("SCHEDULE_DAY_OF_WEEK", "1"))),
+    'SCHEDULE_DAY_OF_MONTH': ('schedule_day_of_month', lambda: int(os.getenv("SCHEDULE_DAY_OF_MONTH", "1"))),
+    'ON_ERROR': ('on_error', lambda: os.getenv("ON_ERROR", "pause")),
+    'RETRY_POLICY': ('retry_policy', lambda: os.getenv("RETRY_POLICY", "fixed")),
+    'RETRY_COUNT': ('retry_count', lambda: int(os.getenv("RETRY_COUNT", "3"))),
+    'RETRY_DELAY_SECONDS': ('retry_delay_seconds', lambda: int(os.getenv("RETRY_DELAY_SECONDS", "60"))),
+    'THROTTLE_SECONDS': ('throttle_seconds', lambda: float(os.getenv("THROTTLE_SECONDS", "10.0"))),
+    'PROCESS_ONLY_ZIP': ('process_only_zip', lambda: os.getenv("PROCESS_ONLY_ZIP", "true").lower() == "true"),
+    'UNKNOWN_POLICY': ('unknown_policy', lambda: os.getenv("UNKNOWN_POLICY", "skip")),
+}
+
+
+def __getattr__(name):
+    """Ленивое разрешение DOWNLOAD_DIR и настроек из БД"""
+    if name == 'DOWNLOAD_DIR':
+        return get_download_dir()
+    if name in _DB_SETTINGS:
+        key, env_default = _DB_SETTINGS[name]
+        return get_setting(key, env_default())
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
+def set_source_url(url: str):
+    """Переопределить адрес портала для текущего процесса"""
+    global SOURCE_URL
+    SOURCE_URL = url.rstrip('/')
@@ -1,7 +1,83 @@
 """Подключение к PostgreSQL"""
+import threading
 import psycopg2
+from psycopg2.extensions import connection as _PgConnection, cursor as _PgCursor
 from psycopg2.extras import RealDictCursor
 from erknm.config import DB_HOST, DB_PORT, DB_NAME, DB_USER, DB_PASSWORD
+from erknm.metrics.registry import record_db_call
+
+
+# Счетчики обращений к БД в текущем процессе (для бенчмарков и метрик)
+_db_stats = {'connections': 0, 'queries': 0, 'commits': 0, 'rollbacks': 0}
+_db_stats_lock = threading.Lock()
+
+
+def _count(key: str, n: int = 1):
+    with _db_stats_lock:
+        _db_stats[key] += n
+    record_db_call(key, n)
+
+
+def get_db_stats() -> dict:
+    """
+    Снимок счетчиков обращений к БД
+    
+    roundtrips - запросы, commit и rollback (каждый - отдельный обмен с сервером);
+    установка соединения учитывается отдельно в connections.
+    """
+    with _db_stats_lock:
+        stats = dict(_db_stats)
+    stats['roundtrips'] = stats['queries'] + stats['commits'] + stats['rollbacks']
+    return stats
+
+
+def reset_db_stats():
+    """Обнулить счетчики обращений к БД"""
+    with _db_stats_lock:
+        for key in _db_stats:
+            _db_stats[key] = 0
+
+
+class _CountingCursorMixin:
+    """Учет запросов курсора в счетчиках обращений к БД"""
+    
+    def execute(self, query, vars=None):
+        _count('queries')
+        return super().execute(query, vars)
+    
+    def executemany(self, query, vars_list):
+        # psycopg2 выполняет executemany отдельным запросом на каждый набор параметров
+        vars_list = list(vars_list)
+        _count('queries', len(vars_list))
+        return super().executemany(query, vars_list)
+    
+    def callproc(self, procname, vars=None):
+        _count('queries')
+        return super().callproc(procname, vars)
+    
+    def copy_expert(self, sql, file, size=8192):
+        _count('queries')
+        return super().copy_expert(sql, file, size)
+
+
+class CountingCursor(_CountingCursorMixin, _PgCursor):
+    """Обычный курсор с учетом запросов"""
+
+
+class CountingDictCursor(_CountingCursorMixin, RealDictCursor):
+    """RealDictCursor с учетом запросов"""
+
+
+class CountingConnection(_PgConnection):
+    """Подключение с учетом commit/rollback"""
+    
+    def commit(self):
+        _count('commits')
+        return super().commit()
+    
+    def rollback(self):
+        _count('rollbacks')
+        return super().rollback()
 
 
 def get_connection():
@@ -12,8 +88,11 @@ def get_connection():
             port=DB_PORT,
             database=DB_NAME,
             user=DB_USER,
-            password=DB_PASSWORD
+            password=DB_PASSWORD,
+            connection_factory=CountingConnection,
+            cursor_factory=CountingCursor
         )
+        _count('connections')
         # Устанавливаем кодировку UTF-8 явно
         conn.set_client_encoding('UTF8')
         return conn
@@ -27,6 +106,4 @@ def get_connection():
 
 def get_cursor(connection):
     """Получить курсор с RealDictCursor"""
-    return connection.cursor(cursor_factory=RealDictCursor)
-
-
+    return connection.cursor(cursor_factory=CountingDictCursor)
@@ -1,4 +1,7 @@
 """Модели для работы с БД"""
+import json
+import threading
+import time
 from datetime import datetime
 from erknm.db.connection import get_connection, get_cursor
 
@@ -19,6 +22,9 @@ class SyncRun:
             """, (is_manual,))
             result = cur.fetchone()
             conn.commit()
+            # Метрики этапов собираются в потоке, создавшем запуск
+            from erknm import metrics
+            metrics.begin_run(result['id'])
             return dict(result)
         finally:
             cur.close()
@@ -45,6 +51,10 @@ class SyncRun:
                     status = 'stopped'
                     error_message = error_message or 'Остановлено пользователем'
             
+            # Сводка метрик этапов (None, если запуск создан в другом процессе)
+            from erknm import metrics
+            summary = metrics.end_run(run_id)
+            
             cur.execute("""
                 UPDATE sync_runs
                 SET finished_at = CURRENT_TIMESTAMP,
@@ -52,9 +62,11 @@ class SyncRun:
                     error_message = %s,
                     files_processed = %s,
                     records_loaded = %s,
-                    stop_requested = FALSE
+                    stop_requested = FALSE,
+                    metrics = COALESCE(%s::jsonb, metrics)
                 WHERE id = %s
-            """, (status, error_message, files_processed, records_loaded, run_id))
+            """, (status, error_message, files_processed, records_loaded,
+                  json.dumps(summary, ensure_ascii=False) if summary else None, run_id))
             conn.commit()
         finally:
             cur.close()
@@ -151,6 +163,98 @@ class SyncRun:
             cur.close()
             conn.close()
     
+    @staticmethod
+    def save_checkpoint(run_id, checkpoint):
+        """Сохранить контрольную точку запуска (позицию для продолжения)"""
+        conn = get_connection()
+        cur = get_cursor(conn)
+        try:
+            cur.execute("""
+                UPDATE sync_runs
+                SET checkpoint = %s::jsonb
+                WHERE id = %s
+            """, (json.dumps(checkpoint, ensure_ascii=False), run_id))
+            conn.commit()
+        finally:
+            cur.close()
+            conn.close()
+    
+    @staticmethod
+    def get_resumable_checkpoint(run_id=None):
+        """
+        Получить контрольную точку прерванного запуска
+        
+        Args:
+            run_id: ID запуска; None - последний запуск с контрольной точкой
+        
+        Returns:
+            Словарь {'run_id', 'status', 'checkpoint'} или None, если продолжать
+            нечего (запуск завершен полностью или точка не сохранялась)
+        """
+        conn = get_connection()
+        cur = get_cursor(conn)
+        try:
+            if run_id is None:
+                # Продолжаем только последний запуск: если после прерванного был
+                # завершенный, точка прерванного уже неактуальна
+                cur.execute("""
+                    SELECT id, status, checkpoint
+                    FROM sync_runs
+                    WHERE checkpoint IS NOT NULL
+                    ORDER BY id DESC
+                    LIMIT 1
+                """)
+            else:
+                cur.execute("""
+                    SELECT id, status, checkpoint
+                    FROM sync_runs
+                    WHERE id = %s AND checkpoint IS NOT NULL
+                """, (run_id,))
+            return SyncRun.resumable_checkpoint(cur.fetchone())
+        finally:
+            cur.close()
+            conn.close()
+    
+    @staticmethod
+    def resumable_checkpoint(row):
+        """
+        Контрольная точка из строки запуска {'id', 'status', 'checkpoint'}
+        
+        Returns:
+            Словарь {'run_id', 'status', 'checkpoint'} или None, если продолжать нечего
+        """
+        if not row or row['status'] not in ('paused', 'stopped', 'aborted', 'error'):
+            return None
+        if row['checkpoint'].get('completed'):
+            return None
+        return {'run_id': row['id'], 'status': row['status'], 'checkpoint': row['checkpoint']}
+    
+    @staticmethod
+    def get_last_list_hash(exclude_run_id=None):
+        """
+        Хеш list.xml последнего полностью завершенного запуска
+        
+        Returns:
+            Словарь {'run_id', 'list_hash'} или None
+        """
+        conn = get_connection()
+        cur = get_cursor(conn)
+        try:
+            cur.execute("""
+                SELECT id, checkpoint->>'list_hash' AS list_hash
+                FROM sync_runs
+                WHERE status = 'completed'
+                AND (checkpoint->>'completed')::boolean
+                AND id <> %s
+                ORDER BY id DESC
+                LIMIT 1
+            """, (exclude_run_id or 0,))
+            row = cur.fetchone()
+            return {'run_id': row['id'], 'list_hash': row['list_hash']} if row else None
+        finally:
+            cur.close()
+            conn.close()
+    
     @staticmethod
     def reconcile_stale_runs():
         """Исправить зависшие запуски (running/stopping без активного процесса)"""
@@ -249,7 +353,7 @@ class SyncRun:
             cur.execute("""
                 SELECT 
                     id, started_at, finished_at, status, is_manual, error_message,
-                    files_processed, records_loaded
+                    files_processed, records_loaded, metrics
                 FROM sync_runs
                 WHERE id = %s
             """, (run_id,))
@@ -304,7 +408,8 @@ class SyncRun:
                 'duration_seconds': (
                     (run['finished_at'] - run['started_at']).total_seconds() 
                     if run['finished_at'] and run['started_at'] else None
-                )
+                ),
+                'metrics': run['metrics']
             }
         finally:
             cur.close()
@@ -329,7 +434,7 @@ class Dataset:
                     link = EXCLUDED.link,
                     data_type = COALESCE(EXCLUDED.data_type, datasets.data_type),
                     updated_at = CURRENT_TIMESTAMP
-                RETURNING id, identifier, title, link, data_type
+                RETURNING id, identifier, title, link, data_type, versions_fingerprint
             """, (identifier, title, link, data_type))
             result = cur.fetchone()
             conn.commit()
@@ -338,6 +443,73 @@ class Dataset:
             cur.close()
             conn.close()
     
+    @staticmethod
+    def upsert_many(datasets):
+        """
+        Создать или обновить наборы данных одним запросом
+        
+        Args:
+            datasets: кортежи (identifier, title, link, data_type)
+        
+        Returns:
+            identifier -> запись для добавленных и изменившихся наборов
+        """
+        rows = {row[0]: row for row in datasets}
+        if not rows:
+            return {}
+        
+        from psycopg2.extras import execute_values
+        
+        conn = get_connection()
+        cur = get_cursor(conn)
+        try:
+            result = execute_values(cur, """
+                INSERT INTO datasets (identifier, title, link, data_type)
+                VALUES %s
+                ON CONFLICT (identifier) 
+                DO UPDATE SET 
+                    title = EXCLUDED.title,
+                    link = EXCLUDED.link,
+                    data_type = COALESCE(EXCLUDED.data_type, datasets.data_type),
+                    updated_at = CURRENT_TIMESTAMP
+                WHERE (datasets.title, datasets.link, COALESCE(EXCLUDED.data_type, datasets.data_type))
+                    IS DISTINCT FROM (EXCLUDED.title, EXCLUDED.link, datasets.data_type)
+                RETURNING id, identifier, title, link, data_type, versions_fingerprint
+            """, list(rows.values()), page_size=len(rows), fetch=True)
+            conn.commit()
+            return {row['identifier']: dict(row) for row in result}
+        finally:
+            cur.close()
+            conn.close()
+    
+    @staticmethod
+    def load_all():
+        """Все известные наборы данных одним запросом: identifier -> запись"""
+        conn = get_connection()
+        cur = get_cursor(conn)
+        try:
+            cur.execute("SELECT id, identifier, title, link, data_type, versions_fingerprint FROM datasets")
+            return {row['identifier']: dict(row) for row in cur.fetchall()}
+        finally:
+            cur.close()
+            conn.close()
+    
+    @staticmethod
+    def set_versions_fingerprint(dataset_id, fingerprint):
+        """Запомнить отпечаток набора версий, все архивы которого обработаны"""
+        conn = get_connection()
+        cur = get_cursor(conn)
+        try:
+            cur.execute("""
+                UPDATE datasets
+                SET versions_fingerprint = %s
+                WHERE id = %s
+            """, (fingerprint, dataset_id))
+            conn.commit()
+        finally:
+            cur.close()
+            conn.close()
+    
     @staticmethod
     def update_type(dataset_id, data_type):
         """Обновить тип набора данных"""
@@ -358,6 +530,19 @@ class Dataset:
 class DatasetVersion:
     """Модель версии набора данных"""
     
+    # Версия идентифицируется парой (dataset_id, source_url); метаданные версии
+    # обновляются, только если изменились (иначе строка не переписывается)
+    _UPSERT_SQL = """
+        INSERT INTO dataset_versions (dataset_id, source_url, created_date, provenance, structure_version)
+        VALUES %s
+        ON CONFLICT (dataset_id, source_url) DO UPDATE SET
+            created_date = EXCLUDED.created_date,
+            provenance = EXCLUDED.provenance,
+            structure_version = EXCLUDED.structure_version
+        WHERE (dataset_versions.created_date, dataset_versions.provenance, dataset_versions.structure_version)
+            IS DISTINCT FROM (EXCLUDED.created_date, EXCLUDED.provenance, EXCLUDED.structure_version)
+    """
+    
     @staticmethod
     def create(dataset_id, source_url, created_date, provenance, structure_version):
         """Создать версию набора данных"""
@@ -367,7 +552,7 @@ class DatasetVersion:
             cur.execute("""
                 INSERT INTO dataset_versions (dataset_id, source_url, created_date, provenance, structure_version)
                 VALUES (%s, %s, %s, %s, %s)
-                ON CONFLICT DO NOTHING
+                ON CONFLICT (dataset_id, source_url) DO NOTHING
                 RETURNING id
             """, (dataset_id, source_url, created_date, provenance, structure_version))
             result = cur.fetchone()
@@ -376,11 +561,70 @@ class DatasetVersion:
         finally:
             cur.close()
             conn.close()
+    
+    @staticmethod
+    def upsert_many(dataset_id, versions):
+        """
+        Записать все версии мета-XML набора одним запросом (идемпотентно)
+        
+        Args:
+            dataset_id: ID набора данных
+            versions: версии из мета-XML (source, created, provenance, structure)
+        
+        Returns:
+            Количество добавленных или обновленных версий
+        """
+        # Повтор версии в одном INSERT ... ON CONFLICT DO UPDATE недопустим -
+        # оставляем последнее описание каждой ссылки
+        rows = {}
+        for version in versions:
+            rows[version['source']] = (dataset_id, version['source'], version.get('created', ''),
+                                       version.get('provenance', ''), version.get('structure', ''))
+        if not rows:
+            return 0
+        
+        from psycopg2.extras import execute_values
+        
+        conn = get_connection()
+        cur = get_cursor(conn)
+        try:
+            execute_values(cur, DatasetVersion._UPSERT_SQL, list(rows.values()), page_size=len(rows))
+            affected = cur.rowcount
+            conn.commit()
+            return affected
+        finally:
+            cur.close()
+            conn.close()
 
 
 class ZipArchive:
     """Модель ZIP-архива"""
     
+    @staticmethod
+    def load_states():
+        """
+        Состояние всех известных архивов одним запросом
+        
+        Returns:
+            URL -> {'id', 'status', 'sha256_hash', 'error_message'}
+        """
+        conn = get_connection()
+        cur = get_cursor(conn)
+        try:
+            cur.execute("SELECT id, url, status, sha256_hash, error_message FROM zip_archives")
+            return {
+                row['url']: {
+                    'id': row['id'],
+                    'status': row['status'],
+                    'sha256_hash': row['sha256_hash'],
+                    'error_message': row['error_message'],
+                }
+                for row in cur.fetchall()
+            }
+        finally:
+            cur.close()
+            conn.close()
+    
     @staticmethod
     def exists(url, sha256_hash=None):
         """Проверить существование архива"""
@@ -466,16 +710,18 @@ class XmlFragment:
     """Модель XML-фрагмента"""
     
     @staticmethod
-    def create(zip_archive_id, file_name, file_path=None, data_type=None, status='pending'):
+    def create(zip_archive_id, file_name, file_path=None, data_type=None, status='pending',
+               source_fingerprint=None):
         """Создать запись о XML-фрагменте"""
         conn = get_connection()
         cur = get_cursor(conn)
         try:
             cur.execute("""
-                INSERT INTO xml_fragments (zip_archive_id, file_name, file_path, data_type, status)
-                VALUES (%s, %s, %s, %s, %s)
+                INSERT INTO xml_fragments (zip_archive_id, file_name, file_path, data_type, status,
+                                           source_fingerprint)
+                VALUES (%s, %s, %s, %s, %s, %s)
                 RETURNING id
-            """, (zip_archive_id, file_name, file_path, data_type, status))
+            """, (zip_archive_id, file_name, file_path, data_type, status, source_fingerprint))
             result = cur.fetchone()
             conn.commit()
             return dict(result)
@@ -483,6 +729,54 @@ class XmlFragment:
             cur.close()
             conn.close()
     
+    @staticmethod
+    def find_latest(zip_archive_id, file_name):
+        """Последний фрагмент архива с указанным именем XML (None - не найден)"""
+        conn = get_connection()
+        cur = get_cursor(conn)
+        try:
+            cur.execute("""
+                SELECT id, status, data_type, records_count, records_committed, source_fingerprint
+                FROM xml_fragments
+                WHERE zip_archive_id = %s AND file_name = %s
+                ORDER BY id DESC
+                LIMIT 1
+            """, (zip_archive_id, file_name))
+            result = cur.fetchone()
+            return dict(result) if result else None
+        finally:
+            cur.close()
+            conn.close()
+    
+    @staticmethod
+    def reset_progress(fragment_id, source_fingerprint=None):
+        """
+        Удалить загруженные записи фрагмента и обнулить позицию загрузки
+        
+        Записи и позиция сбрасываются одной транзакцией, поэтому позиция
+        никогда не указывает на удаленные записи.
+        """
+        conn = get_connection()
+        cur = get_cursor(conn)
+        try:
+            cur.execute("DELETE FROM plans_raw WHERE xml_fragment_id = %s", (fragment_id,))
+            cur.execute("DELETE FROM inspections_raw WHERE xml_fragment_id = %s", (fragment_id,))
+            cur.execute("DELETE FROM parsed_records WHERE xml_fragment_id = %s", (fragment_id,))
+            cur.execute("DELETE FROM quarantined_records WHERE xml_fragment_id = %s", (fragment_id,))
+            cur.execute("DELETE FROM staging_records WHERE xml_fragment_id = %s", (fragment_id,))
+            cur.execute("""
+                UPDATE xml_fragments
+                SET records_count = 0, records_committed = 0, source_fingerprint = %s
+                WHERE id = %s
+            """, (source_fingerprint, fragment_id))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            cur.close()
+            conn.close()
+    
     @staticmethod
     def update_status(fragment_id, status, records_count=None, error_message=None, data_type=None):
         """Обновить статус фрагмента"""
@@ -504,6 +798,9 @@ class XmlFragment:
             
             if status in ('parsed', 'loaded'):
                 update_fields.append("processed_at = CURRENT_TIMESTAMP")
+                if not error_message:
+                    # Ошибка прерванной загрузки, продолженной с позиции, больше не актуальна
+                    update_fields.append("error_message = NULL")
             
             values.append(fragment_id)
             
@@ -593,89 +890,279 @@ class OperationLog:
 
 
 class Settings:
-    """Модель настроек робота"""
+    """Модель настроек робота
+    
+    Значения читаются из процессного снимка, который загружается одним запросом.
+    Снимок обновляется по уведомлению PostgreSQL (LISTEN/NOTIFY), которое
+    отправляется при каждой записи настроек, а если слушающее соединение
+    недоступно - не реже чем раз в SNAPSHOT_TTL секунд.
+    """
+    
+    # Значения по умолчанию (записываются в БД через set_defaults)
+    DEFAULTS = {
+        'schedule_enabled': 'true',
+        'schedule_mode': 'daily',
+        'schedule_time': '02:00',
+        'schedule_day_of_week': '1',
+        'schedule_day_of_month': '1',
+        'on_error': 'pause',
+        'retry_policy': 'fixed',
+        'retry_count': '3',
+        'retry_delay_seconds': '60',
+        'throttle_seconds': '10',
+        'process_only_zip': 'true',
+        'unknown_policy': 'skip',
+        'operational_log_enabled': 'true',
+        'sync_order': 'old_to_new',  # Порядок обработки: 'old_to_new' или 'new_to_old'
+        'stop_on_repeats_enabled': 'false',  # Остановка на повторах: 'true' или 'false'
+        'stop_on_repeats_count': '3',  # Количество подряд идущих повторов для остановки
+        'profile_mode': 'off',  # Профилирование запусков: 'off', 'sampling' или 'cprofile'
+        'ingest_mode': 'direct',  # Загрузка архивов: 'direct' или 'staging' (см. erknm.loader.staging)
+        'raw_storage': 'xml',  # Хранение сырого XML: 'xml', 'compressed' или 'pointer' (см. erknm.loader.raw_storage)
+        'zip_members': 'largest',  # XML архива: 'largest' (самый крупный) или 'all' (см. erknm.loader.members)
+        'member_workers': '2',  # Потоков разбора XML в режиме zip_members = 'all'
+        'storage_limit_mb': '0',  # Лимит объема скачанных архивов и мета-XML, МБ; 0 - без ограничения (см. erknm.sync.retention)
+        'http2_enabled': 'false',  # HTTP/2 для запросов к источнику, если установлены httpx и h2 (см. erknm.sync.http_client)
+        'meta_http_enabled': 'true',  # Мета-XML сначала по HTTP, браузер - при проверке источника (см. erknm.sync.meta_fetcher)
+        'meta_revalidate_hours': '24',  # Без изменений list.xml и необработанных архивов мета-XML перепроверяется не чаще, ч
+        # Адаптивное ограничение частоты запросов (см. erknm.sync.rate_limiter);
+        # начальная частота - один запрос в throttle_seconds
+        'rate_limit_min_rpm': '1',
+        'rate_limit_max_rpm': '30',
+        'rate_limit_increase_rpm': '1',
+        'rate_limit_decrease_factor': '0.5',
+        'rate_limit_burst': '2',
+        'rate_limit_penalty_seconds': '60'
+    }
+    
+    # Типы значений для типизированного доступа (get_typed)
+    TYPES = {
+        'schedule_enabled': bool,
+        'schedule_mode': str,
+        'schedule_time': str,
+        'schedule_day_of_week': int,
+        'schedule_day_of_month': int,
+        'on_error': str,
+        'retry_policy': str,
+        'retry_count': int,
+        'retry_delay_seconds': int,
+        'throttle_seconds': float,
+        'process_only_zip': bool,
+        'unknown_policy': str,
+        'operational_log_enabled': bool,
+        'sync_order': str,
+        'stop_on_repeats_enabled': bool,
+        'stop_on_repeats_count': int,
+        'profile_mode': str,
+        'ingest_mode': str,
+        'raw_storage': str,
+        'zip_members': str,
+        'member_workers': int,
+        'storage_limit_mb': int,
+        'http2_enabled': bool,
+        'meta_http_enabled': bool,
+        'meta_revalidate_hours': float,
+        'rate_limit_min_rpm': float,
+        'rate_limit_max_rpm': float,
+        'rate_limit_increase_rpm': float,
+        'rate_limit_decrease_factor': float,
+        'rate_limit_burst': int,
+        'rate_limit_penalty_seconds': float,
+    }
+    
+    # Канал уведомлений об изменении настроек
+    NOTIFY_CHANNEL = 'erknm_settings'
+    
+    # Максимальный возраст снимка, если уведомления недоступны (секунды)
+    SNAPSHOT_TTL = 30.0
+    
+    _snapshot = None
+    _snapshot_loaded_at = 0.0
+    _listen_conn = None
+    _defaults_applied = False
+    _lock = threading.RLock()
     
     @staticmethod
-    def get(key, default=None):
-        """Получить значение настройки"""
+    def _listen():
+        """Открыть соединение, подписанное на уведомления об изменении настроек"""
+        try:
+            conn = get_connection()
+            conn.autocommit = True
+            cur = conn.cursor()
+            cur.execute(f"LISTEN {Settings.NOTIFY_CHANNEL}")
+            cur.close()
+            return conn
+        except Exception:
+            return None
+    
+    @staticmethod
+    def _is_stale():
+        """Проверить, нужно ли перечитать снимок (без обращения к БД, если работает LISTEN)"""
+        if Settings._snapshot is None:
+            return True
+        
+        listen_conn = Settings._listen_conn
+        if listen_conn is not None:
+            try:
+                # poll() только читает уже пришедшие в сокет уведомления
+                listen_conn.poll()
+                if listen_conn.notifies:
+                    del listen_conn.notifies[:]
+                    return True
+                return False
+            except Exception:
+                # Соединение потеряно - переходим на TTL и переподключимся при перезагрузке
+                try:
+                    listen_conn.close()
+                except Exception:
+                    pass
+                Settings._listen_conn = None
+                return True
+        
+        return time.monotonic() - Settings._snapshot_loaded_at > Settings.SNAPSHOT_TTL
+    
+    @staticmethod
+    def _reload():
+        """Загрузить снимок всех настроек одним запросом"""
+        # Подписываемся до чтения, чтобы не пропустить изменение между чтением и LISTEN
+        if Settings._listen_conn is None:
+            Settings._listen_conn = Settings._listen()
+        
         conn = get_connection()
         cur = get_cursor(conn)
         try:
-            cur.execute("""
-                SELECT value FROM robot_settings WHERE key = %s
-            """, (key,))
-            result = cur.fetchone()
-            return result['value'] if result and result['value'] else default
+            cur.execute("SELECT key, value FROM robot_settings")
+            Settings._snapshot = {row['key']: row['value'] for row in cur.fetchall()}
+            Settings._snapshot_loaded_at = time.monotonic()
         finally:
             cur.close()
             conn.close()
     
+    @staticmethod
+    def snapshot():
+        """Получить актуальный снимок настроек {key: value}"""
+        with Settings._lock:
+            if Settings._is_stale():
+                Settings._reload()
+            return Settings._snapshot
+    
+    @staticmethod
+    def invalidate():
+        """Сбросить процессный снимок (следующее чтение перезагрузит настройки)"""
+        with Settings._lock:
+            Settings._snapshot = None
+    
+    @staticmethod
+    def get(key, default=None):
+        """Получить значение настройки"""
+        value = Settings.snapshot().get(key)
+        return value if value else default
+    
+    @staticmethod
+    def get_typed(key, default=None):
+        """
+        Получить значение настройки, приведенное к типу из Settings.TYPES
+        
+        Если настройка не задана, возвращается default, а при его отсутствии -
+        значение из Settings.DEFAULTS.
+        """
+        if default is None and key in Settings.DEFAULTS:
+            default = Settings._coerce(Settings.DEFAULTS[key], Settings.TYPES.get(key))
+        value = Settings.get(key)
+        if value is None:
+            return default
+        return Settings._coerce(value, Settings.TYPES.get(key), default)
+    
+    @staticmethod
+    def _coerce(value, value_type=None, default=None):
+        """Привести строковое значение настройки к типу"""
+        value_str = str(value).strip()
+        try:
+            if value_type is bool:
+                return value_str.lower() in ('true', '1', 'yes', 'on')
+            if value_type is int:
+                return int(float(value_str))
+            if value_type is float:
+                return float(value_str)
+            if value_type is str:
+                return value_str
+        except ValueError:
+            return default
+        
+        # Тип неизвестен - определяем по содержимому
+        if value_str.lower() in ('true', 'false'):
+            return value_str.lower() == 'true'
+        try:
+            if '.' in value_str:
+                return float(value_str)
+            return int(value_str)
+        except ValueError:
+            return value
+    
     @staticmethod
     def set(key, value):
         """Установить значение настройки"""
+        Settings.set_many({key: value})
+    
+    @staticmethod
+    def set_many(values):
+        """Установить несколько настроек в одной транзакции и оповестить другие процессы"""
+        if not values:
+            return
+        
+        from psycopg2.extras import execute_values
+        
+        rows = [(key, str(value) if value is not None else None) for key, value in values.items()]
         conn = get_connection()
         cur = get_cursor(conn)
         try:
-            cur.execute("""
+            execute_values(cur, """
                 INSERT INTO robot_settings (key, value, updated_at)
-                VALUES (%s, %s, CURRENT_TIMESTAMP)
+                VALUES %s
                 ON CONFLICT (key) 
                 DO UPDATE SET value = EXCLUDED.value, updated_at = CURRENT_TIMESTAMP
-            """, (key, str(value) if value is not None else None))
+            """, rows, template="(%s, %s, CURRENT_TIMESTAMP)")
+            cur.execute("SELECT pg_notify(%s, %s)", (Settings.NOTIFY_CHANNEL, ','.join(values.keys())))
             conn.commit()
         finally:
             cur.close()
             conn.close()
+        
+        # Локальный снимок обновляем сразу, не дожидаясь собственного уведомления
+        with Settings._lock:
+            if Settings._snapshot is not None:
+                Settings._snapshot = dict(Settings._snapshot)
+                Settings._snapshot.update(rows)
     
     @staticmethod
     def get_all():
         """Получить все настройки"""
-        conn = get_connection()
-        cur = get_cursor(conn)
-        try:
-            cur.execute("""
-                SELECT key, value, updated_at FROM robot_settings ORDER BY key
-            """)
-            results = cur.fetchall()
-            return {row['key']: row['value'] for row in results}
-        finally:
-            cur.close()
-            conn.close()
+        return dict(Settings.snapshot())
     
     @staticmethod
     def set_defaults():
-        """Установить настройки по умолчанию (если их еще нет)"""
-        defaults = {
-            'schedule_enabled': 'true',
-            'schedule_mode': 'daily',
-            'schedule_time': '02:00',
-            'schedule_day_of_week': '1',
-            'schedule_day_of_month': '1',
-            'on_error': 'pause',
-            'retry_policy': 'fixed',
-            'retry_count': '3',
-            'retry_delay_seconds': '60',
-            'throttle_seconds': '10',
-            'process_only_zip': 'true',
-            'unknown_policy': 'skip',
-            'operational_log_enabled': 'true',
-            'sync_order': 'old_to_new',  # Порядок обработки: 'old_to_new' или 'new_to_old'
-            'stop_on_repeats_enabled': 'false',  # Остановка на повторах: 'true' или 'false'
-            'stop_on_repeats_count': '3'  # Количество подряд идущих повторов для остановки
-        }
+        """Установить настройки по умолчанию (если их еще нет), один раз на процесс"""
+        if Settings._defaults_applied:
+            return
+        
+        from psycopg2.extras import execute_values
         
         conn = get_connection()
         cur = get_cursor(conn)
         try:
-            for key, value in defaults.items():
-                cur.execute("""
-                    INSERT INTO robot_settings (key, value, updated_at)
-                    VALUES (%s, %s, CURRENT_TIMESTAMP)
-                    ON CONFLICT (key) DO NOTHING
-                """, (key, value))
+            execute_values(cur, """
+                INSERT INTO robot_settings (key, value, updated_at)
+                VALUES %s
+                ON CONFLICT (key) DO NOTHING
+            """, list(Settings.DEFAULTS.items()), template="(%s, %s, CURRENT_TIMESTAMP)")
+            inserted = cur.rowcount
+            if inserted:
+                cur.execute("SELECT pg_notify(%s, %s)", (Settings.NOTIFY_CHANNEL, 'defaults'))
             conn.commit()
         finally:
             cur.close()
             conn.close()
-
-
+        
+        Settings._defaults_applied = True
+        if inserted:
+            Settings.invalidate()
@@ -2,6 +2,104 @@
 from erknm.db.connection import get_connection, get_cursor
 
 
+def _dedupe_dataset_versions(cur):
+    """
+    Удалить повторы версий (dataset_id, source_url) и запретить их уникальным индексом
+    
+    Оставляется самая ранняя запись каждой версии. На таблице без повторов
+    DELETE ничего не удаляет, поэтому миграцию можно выполнять многократно.
+    
+    Returns:
+        Количество удаленных повторов
+    """
+    cur.execute("""
+        DELETE FROM dataset_versions dv
+        USING dataset_versions earlier
+        WHERE dv.dataset_id = earlier.dataset_id
+        AND dv.source_url = earlier.source_url
+        AND dv.id > earlier.id
+    """)
+    removed = cur.rowcount
+    cur.execute("""
+        CREATE UNIQUE INDEX IF NOT EXISTS uq_dataset_versions_dataset_url
+        ON dataset_versions(dataset_id, source_url)
+    """)
+    return removed
+
+
+def _create_quarantine_table(cur):
+    """Таблица записей, отклоненных БД при загрузке (erknm.loader.quarantine)"""
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS quarantined_records (
+            id SERIAL PRIMARY KEY,
+            xml_fragment_id INTEGER REFERENCES xml_fragments(id) ON DELETE CASCADE,
+            zip_archive_id INTEGER REFERENCES zip_archives(id) ON DELETE CASCADE,
+            record_type VARCHAR(50) NOT NULL, -- 'plan', 'inspection'
+            record_offset INTEGER NOT NULL, -- порядковый номер записи в документе (с 1)
+            record_key TEXT,
+            record_date DATE,
+            payload_json TEXT,
+            xml_content TEXT NOT NULL,
+            reason TEXT,
+            attempts INTEGER NOT NULL DEFAULT 1,
+            created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            last_attempt_at TIMESTAMP
+        )
+    """)
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_quarantined_records_fragment ON quarantined_records(xml_fragment_id)")
+
+
+def _create_staging_table(cur):
+    """
+    Промежуточная таблица загрузки архивов (erknm.loader.staging)
+    
+    UNLOGGED и без индексов: запись не проходит через WAL, после аварийного
+    перезапуска сервера таблица очищается - незавершенная загрузка начнется заново.
+    """
+    cur.execute("""
+        CREATE UNLOGGED TABLE IF NOT EXISTS staging_records (
+            xml_fragment_id INTEGER NOT NULL,
+            zip_archive_id INTEGER,
+            record_type VARCHAR(50) NOT NULL, -- 'plan', 'inspection'
+            record_offset INTEGER NOT NULL, -- порядковый номер записи в документе (с 1)
+            record_key TEXT,
+            record_date DATE,
+            payload_json TEXT,
+            xml_content TEXT,
+            xml_compressed BYTEA,
+            xml_codec VARCHAR(16),
+            xml_length INTEGER,
+            xml_sha256 VARCHAR(64),
+            xml_offset BIGINT
+        )
+    """)
+
+
+def _add_compressed_raw_columns(cur):
+    """Столбцы сжатого хранения сырого XML (raw_storage = 'compressed')"""
+    for table in ('plans_raw', 'inspections_raw', 'staging_records'):
+        cur.execute(f"ALTER TABLE {table} ADD COLUMN IF NOT EXISTS xml_compressed BYTEA")
+        cur.execute(f"ALTER TABLE {table} ADD COLUMN IF NOT EXISTS xml_codec VARCHAR(16)")
+        cur.execute(f"ALTER TABLE {table} ADD COLUMN IF NOT EXISTS xml_length INTEGER")
+        cur.execute(f"ALTER TABLE {table} ADD COLUMN IF NOT EXISTS xml_sha256 VARCHAR(64)")
+        cur.execute(f"ALTER TABLE {table} ALTER COLUMN xml_content DROP NOT NULL")
+
+
+def _add_pointer_raw_columns(cur):
+    """Столбец указателя на запись в ZIP архиве (raw_storage = 'pointer')"""
+    for table in ('plans_raw', 'inspections_raw', 'staging_records'):
+        cur.execute(f"ALTER TABLE {table} ADD COLUMN IF NOT EXISTS xml_offset BIGINT")
+
+
+def _add_pointer_indexes(cur):
+    """Фрагменты с записями pointer: их архивы нельзя удалять (erknm.sync.retention)"""
+    for table in ('plans_raw', 'inspections_raw'):
+        cur.execute(f"""
+            CREATE INDEX IF NOT EXISTS idx_{table}_pointer_fragment ON {table}(xml_fragment_id)
+            WHERE xml_codec = 'pointer'
+        """)
+
+
 def init_schema():
     """Инициализировать схему БД"""
     conn = get_connection()
@@ -112,6 +210,73 @@ def init_schema():
                 # Игнорируем ошибки миграции
                 pass
             
+            # Миграция: сводка метрик этапов запуска и контрольная точка продолжения
+            try:
+                cur.execute("ALTER TABLE sync_runs ADD COLUMN IF NOT EXISTS metrics JSONB")
+                cur.execute("ALTER TABLE sync_runs ADD COLUMN IF NOT EXISTS checkpoint JSONB")
+                conn.commit()
+            except Exception as e:
+                conn.rollback()
+                pass
+            
+            # Миграция: уникальность версий наборов (повторы накапливались при каждой синхронизации)
+            try:
+                _dedupe_dataset_versions(cur)
+                conn.commit()
+            except Exception as e:
+                conn.rollback()
+                pass
+            
+            # Миграция: отпечаток набора версий мета-XML (быстрый путь "ничего не изменилось")
+            try:
+                cur.execute("ALTER TABLE datasets ADD COLUMN IF NOT EXISTS versions_fingerprint VARCHAR(64)")
+                conn.commit()
+            except Exception as e:
+                conn.rollback()
+                pass
+            
+            # Миграция: карантин отклоненных записей
+            try:
+                _create_quarantine_table(cur)
+                conn.commit()
+            except Exception as e:
+                conn.rollback()
+                pass
+            
+            # Миграция: промежуточная таблица загрузки (ingest_mode = 'staging')
+            try:
+                _create_staging_table(cur)
+                conn.commit()
+            except Exception as e:
+                conn.rollback()
+                pass
+            
+            # Миграция: сжатое хранение сырого XML
+            try:
+                _add_compressed_raw_columns(cur)
+                conn.commit()
+            except Exception as e:
+                conn.rollback()
+                pass
+            
+            # Миграция: хранение указателей на записи в ZIP архивах
+            try:
+                _add_pointer_raw_columns(cur)
+                _add_pointer_indexes(cur)
+                conn.commit()
+            except Exception as e:
+                conn.rollback()
+                pass
+            
+            # Миграция: позиция загрузки фрагмента для продолжения с середины XML
+            try:
+                cur.execute("ALTER TABLE xml_fragments ADD COLUMN IF NOT EXISTS records_committed INTEGER NOT NULL DEFAULT 0")
+                cur.execute("ALTER TABLE xml_fragments ADD COLUMN IF NOT EXISTS source_fingerprint VARCHAR(64)")
+                conn.commit()
+            except Exception as e:
+                conn.rollback()
+                pass
+            
             return True
         
         # Выдаем права на схему public (если нужно)
@@ -132,16 +297,24 @@ def init_schema():
                 error_message TEXT,
                 files_processed INTEGER DEFAULT 0,
                 records_loaded INTEGER DEFAULT 0,
-                stop_requested BOOLEAN NOT NULL DEFAULT FALSE
+                stop_requested BOOLEAN NOT NULL DEFAULT FALSE,
+                metrics JSONB, -- сводка метрик этапов (erknm.metrics)
+                checkpoint JSONB -- позиция для продолжения прерванной синхронизации (erknm.sync.checkpoint)
             )
         """)
         
         # Добавляем колонку stop_requested если таблица уже существует
         try:
             cur.execute("ALTER TABLE sync_runs ADD COLUMN IF NOT EXISTS stop_requested BOOLEAN NOT NULL DEFAULT FALSE")
+            cur.execute("ALTER TABLE sync_runs ADD COLUMN IF NOT EXISTS metrics JSONB")
+            cur.execute("ALTER TABLE sync_runs ADD COLUMN IF NOT EXISTS checkpoint JSONB")
         except:
             pass  # Колонка уже существует
         
+        # Фиксируем sync_runs до бэкфила: на пустой БД бэкфил падает (zip_archives
+        # еще нет), и его откат не должен откатывать создание таблицы
+        conn.commit()
+        
         # Миграция: обновляем счетчики для существующих запусков (backfill)
         try:
             # Обновляем files_processed из zip_archives
@@ -181,11 +354,17 @@ def init_schema():
                 title TEXT,
                 link TEXT NOT NULL,
                 data_type VARCHAR(50), -- 'plan', 'inspection', 'unknown'
+                versions_fingerprint VARCHAR(64), -- отпечаток полностью обработанного набора версий (erknm.sync.fingerprint)
                 created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
                 updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
             )
         """)
         
+        try:
+            cur.execute("ALTER TABLE datasets ADD COLUMN IF NOT EXISTS versions_fingerprint VARCHAR(64)")
+        except:
+            pass  # Колонка уже существует
+        
         # Таблица версий наборов данных
         cur.execute("""
             CREATE TABLE IF NOT EXISTS dataset_versions (
@@ -227,17 +406,30 @@ def init_schema():
                 status VARCHAR(50) NOT NULL, -- 'pending', 'parsed', 'loaded', 'error'
                 error_message TEXT,
                 records_count INTEGER DEFAULT 0,
+                records_committed INTEGER NOT NULL DEFAULT 0, -- записей XML до зафиксированной позиции (erknm.loader.xml_stream)
+                source_fingerprint VARCHAR(64), -- CRC и размер XML в архиве, к которым относится позиция
                 created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
                 processed_at TIMESTAMP
             )
         """)
         
+        try:
+            cur.execute("ALTER TABLE xml_fragments ADD COLUMN IF NOT EXISTS records_committed INTEGER NOT NULL DEFAULT 0")
+            cur.execute("ALTER TABLE xml_fragments ADD COLUMN IF NOT EXISTS source_fingerprint VARCHAR(64)")
+        except:
+            pass  # Колонки уже существуют
+        
         # Таблица планов проверок (сырой XML)
         cur.execute("""
             CREATE TABLE IF NOT EXISTS plans_raw (
                 id SERIAL PRIMARY KEY,
                 xml_fragment_id INTEGER REFERENCES xml_fragments(id) ON DELETE CASCADE,
-                xml_content XML NOT NULL,
+                xml_content XML, -- NULL, если XML хранится сжатым
+                xml_compressed BYTEA, -- канонический XML, сжатый xml_codec (erknm.loader.raw_storage)
+                xml_codec VARCHAR(16), -- 'zstd', 'zlib', 'none', 'pointer' (XML читается из ZIP архива)
+                xml_length INTEGER, -- длина несжатого XML, байт
+                xml_sha256 VARCHAR(64), -- SHA-256 несжатого XML
+                xml_offset BIGINT, -- смещение записи в несжатом XML архива (xml_codec = 'pointer')
                 created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
             )
         """)
@@ -247,7 +439,12 @@ def init_schema():
             CREATE TABLE IF NOT EXISTS inspections_raw (
                 id SERIAL PRIMARY KEY,
                 xml_fragment_id INTEGER REFERENCES xml_fragments(id) ON DELETE CASCADE,
-                xml_content XML NOT NULL,
+                xml_content XML, -- NULL, если XML хранится сжатым
+                xml_compressed BYTEA, -- канонический XML, сжатый xml_codec (erknm.loader.raw_storage)
+                xml_codec VARCHAR(16), -- 'zstd', 'zlib', 'none', 'pointer' (XML читается из ZIP архива)
+                xml_length INTEGER, -- длина несжатого XML, байт
+                xml_sha256 VARCHAR(64), -- SHA-256 несжатого XML
+                xml_offset BIGINT, -- смещение записи в несжатом XML архива (xml_codec = 'pointer')
                 created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
             )
         """)
@@ -320,8 +517,15 @@ def init_schema():
             )
         """)
         
+        # Карантин записей, отклоненных при загрузке
+        _create_quarantine_table(cur)
+        
+        # Промежуточная таблица загрузки архивов
+        _create_staging_table(cur)
+        
         # Индексы
         cur.execute("CREATE INDEX IF NOT EXISTS idx_datasets_identifier ON datasets(identifier)")
+        _dedupe_dataset_versions(cur)
         cur.execute("CREATE INDEX IF NOT EXISTS idx_zip_archives_url ON zip_archives(url)")
         cur.execute("CREATE INDEX IF NOT EXISTS idx_zip_archives_hash ON zip_archives(sha256_hash)")
         cur.execute("CREATE INDEX IF NOT EXISTS idx_zip_archives_status ON zip_archives(status)")
@@ -337,6 +541,7 @@ def init_schema():
         cur.execute("CREATE INDEX IF NOT EXISTS idx_parsed_records_type ON parsed_records(record_type)")
         cur.execute("CREATE INDEX IF NOT EXISTS idx_parsed_records_date ON parsed_records(record_date)")
         cur.execute("CREATE INDEX IF NOT EXISTS idx_parsed_records_created ON parsed_records(created_at)")
+        _add_pointer_indexes(cur)
         
         conn.commit()
         return True
@@ -0,0 +1,257 @@
+"""Загрузка всех XML файлов ZIP архива (zip_members = 'all')
+
+По умолчанию из архива загружается один XML - самый крупный
+(select_xml_from_zip). В режиме all загружаются все XML архива, каждый - в
+свой фрагмент xml_fragments со своей позицией загрузки.
+
+XML разбираются одновременно в пуле потоков erknm-members (member_workers
+потоков): каждый поток открывает архив отдельно и передает разобранные
+записи пакетами в ограниченную очередь. В БД пишет один поток - вызвавший
+load_members - через одно соединение и RecordWriter на каждый фрагмент:
+пакеты разных XML не конкурируют за соединения, а позиция фрагмента
+фиксируется в транзакции его пакета, как при загрузке одного XML. Разбор
+идет одновременно с записью; извлечение полей выполняется на Python под
+GIL, поэтому больше двух-трех потоков разбора обычно не ускоряют загрузку.
+
+Ошибка разбора XML отмечает ошибкой только его фрагмент: остальные XML
+загружаются до конца, после чего load_members сообщает об ошибке, и архив
+остается необработанным. При повторной обработке загруженные фрагменты
+пропускаются, прерванные продолжаются с позиции. Ошибка записи в БД
+(отклоненные записи уходят в карантин, это не ошибка) и запрошенная
+остановка прерывают загрузку всех XML архива.
+
+Промежуточная таблица (ingest_mode = 'staging') в этом режиме не
+используется: ее перенос отмечает архив обработанным после одного XML.
+"""
+import contextvars
+import io
+import queue
+import threading
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+from erknm import metrics
+from erknm.db.models import OperationLog, Settings, XmlFragment
+from erknm.logger.messages import get_message
+
+MODES = ('largest', 'all')
+
+# Потоков разбора по умолчанию
+DEFAULT_WORKERS = 2
+
+# Пакетов в очереди на один поток разбора: разбор не уходит далеко вперед записи
+QUEUE_BATCHES_PER_WORKER = 2
+
+# Интервал проверки остановки, пока очередь заполнена, с
+_PUT_TIMEOUT = 0.5
+
+
+def resolve_mode() -> str:
+    """Режим выбора XML архива из настройки zip_members ('largest' по умолчанию)"""
+    try:
+        mode = (Settings.get_typed('zip_members') or '').strip().lower()
+    except Exception:
+        return 'largest'
+    return mode if mode in MODES else 'largest'
+
+
+def resolve_workers() -> int:
+    """Количество потоков разбора из настройки member_workers"""
+    try:
+        workers = Settings.get_typed('member_workers')
+    except Exception:
+        return DEFAULT_WORKERS
+    return max(workers, 1) if workers else DEFAULT_WORKERS
+
+
+class _Member:
+    """XML архива и состояние его загрузки"""
+
+    def __init__(self, name: str, info: zipfile.ZipInfo, fragment_id: int, skip: int, committed: int):
+        self.name = name
+        self.info = info
+        self.fragment_id = fragment_id
+        self.skip = skip
+        self.committed = committed
+        self.writer = None
+        self.finished = False
+
+
+def _put(out: queue.Queue, stop: threading.Event, item) -> bool:
+    """Поместить сообщение в очередь; False - загрузка прервана"""
+    while not stop.is_set():
+        try:
+            out.put(item, timeout=_PUT_TIMEOUT)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def _parse_member(zip_path: Path, member: _Member, out: queue.Queue, stop: threading.Event,
+                  raw_storage: str, sync_run_id=None):
+    """
+    Разобрать XML архива в потоке пула
+
+    В очередь передаются ('batch', XML, тип, значения записей), в конце -
+    ('done', XML, тип, остаток значений) или ('error', XML, тип, (остаток, исключение)).
+    """
+    from erknm.classifier.classifier import sniff_xml_member
+    from erknm.loader.xml_stream import BATCH_SIZE, _report_timings, parse_records
+
+    timings = {'xml_parse': 0.0, 'payload_extract': 0.0}
+    parsed = 0
+    batch = []
+    record_type = None
+    try:
+        with zipfile.ZipFile(zip_path, 'r') as zip_ref:
+            data_type = sniff_xml_member(zip_ref, member.name, member.info)['data_type']
+            with zip_ref.open(member.name) as source:
+                for record_type, values in parse_records(io.BufferedReader(source, buffer_size=64 * 1024),
+                                                         member.name, sync_run_id, data_type,
+                                                         skip=member.skip, raw_storage=raw_storage,
+                                                         timings=timings):
+                    if values is None:
+                        continue
+                    batch.append(values)
+                    parsed += 1
+                    if len(batch) >= BATCH_SIZE:
+                        if not _put(out, stop, ('batch', member, record_type, batch)):
+                            return
+                        batch = []
+        _put(out, stop, ('done', member, record_type, batch))
+    except Exception as e:
+        _put(out, stop, ('error', member, record_type, (batch, e)))
+    finally:
+        _report_timings(timings, parsed)
+
+
+def load_members(zip_path: Path, members: List[Tuple[str, zipfile.ZipInfo]], archive_id: int,
+                 sync_run_id=None, workers: Optional[int] = None) -> int:
+    """
+    Загрузить все XML архива
+
+    Args:
+        zip_path: путь к ZIP архиву
+        members: XML архива (select_xml_members)
+        archive_id: ID архива в БД
+        sync_run_id: ID запуска синхронизации для логирования
+        workers: потоков разбора; None - из настройки member_workers
+
+    Returns:
+        Количество загруженных в этот раз записей
+
+    Raises:
+        Exception: XML архива загружены не все (ошибки отдельных XML)
+    """
+    from erknm.loader.xml_stream import RecordWriter, storage_mode, writer_connection
+    from erknm.loader.zip_loader import prepare_fragment
+
+    workers = workers or resolve_workers()
+    raw_storage = storage_mode(pointers=True)
+    total = len(members)
+
+    pending = []
+    for name, info in members:
+        fragment, skip, committed = prepare_fragment(archive_id, name, info)
+        if skip and fragment.get('status') == 'loaded':
+            # XML загружен при прошлой обработке архива
+            continue
+        if skip and sync_run_id:
+            OperationLog.log(sync_run_id, "dataset",
+                           get_message('fragment_resumed', filename=name, position=skip, count=committed),
+                           stage='dataset')
+        XmlFragment.update_status(fragment['id'], 'parsing')
+        pending.append(_Member(name, info, fragment['id'], skip, committed))
+
+    if sync_run_id:
+        OperationLog.log(sync_run_id, "dataset",
+                       get_message('members_started', count=len(pending), total=total, workers=workers),
+                       stage='dataset')
+    if not pending:
+        return 0
+
+    out = queue.Queue(maxsize=workers * QUEUE_BATCHES_PER_WORKER)
+    stop = threading.Event()
+    conn = writer_connection()
+    pool = ThreadPoolExecutor(max_workers=min(workers, len(pending)), thread_name_prefix='erknm-members')
+    written = 0
+    finished = 0
+    failed = []
+    try:
+        for member in pending:
+            # Каждый поток разбора работает в копии контекста: метрики запуска, массовая загрузка
+            pool.submit(contextvars.copy_context().run, _parse_member,
+                        zip_path, member, out, stop, raw_storage, sync_run_id)
+
+        while finished < len(pending):
+            kind, member, record_type, payload = out.get()
+            batch, error = payload if kind == 'error' else (payload, None)
+            started = time.perf_counter()
+            if batch and member.writer is None:
+                member.writer = RecordWriter(conn, member.fragment_id, archive_id, record_type,
+                                             sync_run_id=sync_run_id, source_name=member.name,
+                                             position=member.skip, raw_storage=raw_storage)
+            for values in batch:
+                member.writer.add(*values)
+            if kind != 'batch' and member.writer is not None:
+                # Записи XML до конца документа или до ошибки разбора
+                member.writer.flush()
+            metrics.add_time('db_insert', time.perf_counter() - started, calls=len(batch))
+            if kind == 'batch':
+                continue
+
+            finished += 1
+            member.finished = True
+            count = member.writer.written if member.writer else 0
+            written += count
+            if kind == 'error':
+                failed.append(member.name)
+                XmlFragment.update_status(member.fragment_id, 'error', error_message=str(error))
+                if sync_run_id:
+                    OperationLog.log(sync_run_id, "dataset",
+                                   get_message('member_failed', filename=member.name, done=finished,
+                                               total=len(pending), error=error),
+                                   level="ERROR", stage='dataset')
+                continue
+
+            metrics.inc('bytes_total', member.info.file_size, kind='xml')
+            if record_type and member.committed + count > 0:
+                XmlFragment.update_status(member.fragment_id, 'loaded', records_count=member.committed + count,
+                                          data_type=record_type)
+                if sync_run_id:
+                    OperationLog.log(sync_run_id, "data",
+                                   get_message('member_loaded', filename=member.name, count=count,
+                                               done=finished, total=len(pending)),
+                                   stage='data')
+            else:
+                XmlFragment.update_status(member.fragment_id, 'error',
+                                         error_message='Неклассифицированные данные или нет записей',
+                                         data_type='unknown')
+                if sync_run_id:
+                    OperationLog.log(sync_run_id, "data",
+                                   get_message('unclassified_file') + f": {member.name}",
+                                   level="WARNING", stage='data')
+    except BaseException as e:
+        conn.rollback()
+        if not isinstance(e, StopIteration):
+            for member in pending:
+                if not member.finished:
+                    XmlFragment.update_status(member.fragment_id, 'error', error_message=str(e))
+        raise
+    finally:
+        # Потоки разбора, ожидающие места в очереди, завершаются по stop
+        stop.set()
+        pool.shutdown(wait=True)
+        for member in pending:
+            if member.writer is not None and member.writer.written:
+                metrics.inc('records_total', member.writer.written, type=member.writer.data_type)
+        conn.close()
+
+    if failed:
+        raise Exception(get_message('members_failed', count=len(failed), total=len(pending),
+                                    names=', '.join(failed[:10])))
+    return written
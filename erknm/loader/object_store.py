@@ -0,0 +1,171 @@
+"""Хранилище скачанных ZIP архивов по содержимому (DOWNLOAD_DIR/objects)
+
+Архив хранится один раз под именем SHA-256 своего содержимого:
+objects/<первые два символа хеша>/<sha256>.zip. Связь URL с объектом - строка
+zip_archives (sha256_hash и file_path): одинаковые архивы, опубликованные по
+разным URL, занимают один файл, а разные архивы с одинаковым именем в URL
+не перезаписывают друг друга.
+
+Архив скачивается во временный файл objects/incoming/, SHA-256 вычисляется
+по мере записи (download_zip), поэтому повторного чтения файла для хеша нет.
+Если объект с этим хешем уже есть, временный файл удаляется, иначе
+переименовывается в объект (в пределах DOWNLOAD_DIR - атомарно).
+
+Архивы, скачанные раньше в DOWNLOAD_DIR/zips/<имя из URL>, переносятся на
+месте жесткой ссылкой (adopt - при обработке архива, migrate - все сразу,
+команда migrate-objects): сначала появляется объект, затем zip_archives
+переводится на него и только после этого удаляется старое имя. Данные не
+копируются, прерванный перенос безопасно повторяется. Если жесткие ссылки не
+поддерживаются, файл перемещается. При обработке архив переносится, только
+если файл записан в строке zip_archives этого URL (legacy_file): архив URL
+без такой строки скачивается заново.
+"""
+import hashlib
+import os
+import shutil
+import zipfile
+from pathlib import Path
+from typing import Callable, Dict, Optional, Tuple
+
+
+def objects_dir() -> Path:
+    from erknm.config import DOWNLOAD_DIR
+    return DOWNLOAD_DIR / "objects"
+
+
+def legacy_dir() -> Path:
+    """Каталог архивов, скачанных до хранилища объектов (имя файла из URL)"""
+    from erknm.config import DOWNLOAD_DIR
+    return DOWNLOAD_DIR / "zips"
+
+
+def object_path(sha256: str) -> Path:
+    """Путь объекта с содержимым sha256"""
+    return objects_dir() / sha256[:2] / f"{sha256}.zip"
+
+
+def incoming_path(url: str) -> Path:
+    """Временный файл для скачивания архива url"""
+    # Хеш URL разделяет одноименные архивы разных URL, имя из URL - для журнала и карантина
+    url_hash = hashlib.sha1(url.encode('utf-8')).hexdigest()[:12]
+    return objects_dir() / "incoming" / f"{url_hash}-{Path(url).name}"
+
+
+def legacy_file(file_path: Optional[str]) -> Optional[Path]:
+    """
+    Архив каталога zips, записанный в zip_archives.file_path архива
+
+    Файл ищется только по пути из строки самого архива: по имени из URL
+    нельзя - одноименный файл мог быть скачан по другому URL.
+
+    Returns:
+        Путь файла или None (путь не в каталоге zips или файла нет)
+    """
+    if not file_path:
+        return None
+    path = Path(file_path)
+    if path.resolve().parent != legacy_dir().resolve() or not path.is_file():
+        return None
+    return path
+
+
+def store(temp_path: Path, sha256: str) -> Tuple[Path, bool]:
+    """
+    Поместить скачанный файл в хранилище
+
+    Returns:
+        (путь объекта, True - объект уже был, временный файл удален)
+    """
+    target = object_path(sha256)
+    if target.is_file():
+        temp_path.unlink()
+        return target, True
+    target.parent.mkdir(parents=True, exist_ok=True)
+    os.replace(temp_path, target)
+    return target, False
+
+
+def _link(source: Path, target: Path):
+    """Создать target на месте source без копирования данных"""
+    target.parent.mkdir(parents=True, exist_ok=True)
+    try:
+        os.link(source, target)
+    except FileExistsError:
+        pass
+    except OSError:
+        # Другая файловая система или ФС без жестких ссылок
+        shutil.copy2(source, target.with_suffix('.part'))
+        os.replace(target.with_suffix('.part'), target)
+
+
+def _relink_rows(source: Path, target: Path, sha256: str) -> int:
+    """Перевести строки zip_archives с файлом source на объект target"""
+    from erknm.db.connection import get_connection, get_cursor
+
+    conn = get_connection()
+    cur = get_cursor(conn)
+    try:
+        # file_path мог быть сохранен и относительным, и абсолютным путем
+        cur.execute("""
+            UPDATE zip_archives SET file_path = %s, sha256_hash = %s
+            WHERE file_path IN (%s, %s)
+        """, (str(target), sha256, str(source), str(source.resolve())))
+        conn.commit()
+        return cur.rowcount
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+        conn.close()
+
+
+def adopt(path: Path) -> Tuple[Path, str, bool]:
+    """
+    Перенести архив из каталога zips в хранилище
+
+    Returns:
+        (путь объекта, SHA-256, True - такой объект уже был)
+    """
+    from erknm.loader.zip_loader import calculate_sha256
+
+    sha256 = calculate_sha256(path)
+    target = object_path(sha256)
+    existed = target.is_file()
+    if not existed:
+        _link(path, target)
+    _relink_rows(path, target, sha256)
+    path.unlink()
+    return target, sha256, existed
+
+
+def migrate(progress: Optional[Callable[[str], None]] = None) -> Dict[str, int]:
+    """
+    Перенести все архивы каталога zips в хранилище
+
+    Returns:
+        {'files': перенесено файлов, 'duplicates': из них совпали с объектом,
+         'freed': освобождено байт за счет совпадений}
+    """
+    result = {'files': 0, 'duplicates': 0, 'freed': 0}
+    source_dir = legacy_dir()
+    if not source_dir.is_dir():
+        return result
+    # Подкаталог quarantine (не ZIP) не переносится
+    for path in sorted(source_dir.glob('*.zip')):
+        if not path.is_file():
+            continue
+        if not zipfile.is_zipfile(path):
+            if progress is not None:
+                progress(f"{path.name}: не ZIP, пропущен")
+            continue
+        size = path.stat().st_size
+        target, sha256, existed = adopt(path)
+        result['files'] += 1
+        if existed:
+            result['duplicates'] += 1
+            result['freed'] += size
+        if progress is not None:
+            state = 'совпадает с объектом' if existed else 'объект'
+            progress(f"{path.name} -> {state} {target.name}")
+    return result
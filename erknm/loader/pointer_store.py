@@ -0,0 +1,366 @@
+"""Хранение указателей на записи в XML внутри ZIP (raw_storage = 'pointer')
+
+Вместо XML записи в БД сохраняется ее положение в несжатом потоке XML
+архива: смещение (xml_offset) и длина (xml_length) в байтах, а также SHA-256
+этих байт (xml_sha256). Архив и имя XML берутся из xml_fragments/zip_archives,
+поэтому режим применим только пока ZIP архивы хранятся в DOWNLOAD_DIR/objects
+(erknm.loader.object_store).
+
+Границы записей при загрузке находит RecordScanner: он получает те же байты,
+что читает iterparse (ScanningReader), и ищет открывающие и закрывающие теги
+записей, пропуская комментарии, CDATA и инструкции обработки. Каждая граница
+сверяется с записью, которую выдал lxml; при расхождении (например, в
+поврежденном документе, который lxml читает в режиме recover) оставшиеся
+записи фрагмента хранятся в сжатом виде.
+
+Для чтения записи строится индекс контрольных точек XML в архиве (как zran
+из zlib): при последовательной распаковке каждые CHECKPOINT_SPAN байт
+сохраняется копия состояния распаковщика (zlib.decompressobj().copy()) и
+позиция в сжатых данных. Запись по смещению распаковывается от ближайшей
+точки - не больше CHECKPOINT_SPAN лишних байт. Python не дает восстановить
+распаковщик с произвольного бита (inflatePrime), поэтому точки хранятся в
+памяти процесса: индекс строится при первом чтении из XML архива, последние
+INDEX_CACHE_SIZE индексов остаются в кэше. XML без сжатия читается по
+смещению напрямую, с другими методами сжатия - через ZipExtFile.seek
+(распаковка с начала XML).
+
+Построение индекса - распаковка всего XML, для XML в несколько гигабайт это
+минуты. Поэтому индекс строится в фоновом потоке (erknm-pointer-index), один
+на XML, сколько бы запросов его ни ждали. Вызывающий код ждет индекс не
+дольше wait секунд: веб-интерфейс передает небольшое время и, если индекс
+еще строится, отвечает 503 - повторный запрос получит запись, когда индекс
+будет готов. Загрузка и перенос промежуточной таблицы ждут без ограничения.
+"""
+import hashlib
+import re
+import struct
+import threading
+import zipfile
+import zlib
+from bisect import bisect_right
+from collections import OrderedDict, deque
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+from xml.sax.saxutils import escape
+
+# Интервал контрольных точек в несжатом потоке, байт
+CHECKPOINT_SPAN = 4 * 1024 * 1024
+
+# Количество индексов XML в кэше процесса
+INDEX_CACHE_SIZE = 8
+
+# Размер блока чтения сжатых данных
+READ_BLOCK = 64 * 1024
+
+# Открывающий/закрывающий тег записи (с любым префиксом namespace) или начало
+# конструкции, внутри которой теги не распознаются
+_TOKEN_RE = re.compile(
+    rb'<(?:(/?)(?:[A-Za-z_][\w.\-]*:)?(PLAN|plan|INSPECTION|inspection)(?=[\s/>])|(!--|!\[CDATA\[|\?))'
+)
+_SKIP_END = {b'!--': b'-->', b'![CDATA[': b']]>', b'?': b'?>'}
+
+# Хвост буфера, который сканируется повторно: тег может быть разрезан блоком чтения
+_TAIL = 64
+
+# Строки, номер которых libxml2 сообщает точно (дальше sourceline смещается)
+_RELIABLE_LINES = 65535
+
+# Локальный заголовок файла в ZIP: сигнатура, версия, флаги, метод, время,
+# дата, CRC, размеры, длины имени и дополнительного поля
+_LOCAL_HEADER = struct.Struct('<4sHHHHHIIIHH')
+
+
+class RecordScanner:
+    """Границы записей в несжатом потоке XML"""
+
+    def __init__(self, record_type: Optional[str] = None):
+        self._buffer = bytearray()
+        # Смещение начала буфера в потоке
+        self._base = 0
+        # Позиция в буфере, с которой продолжается поиск
+        self._scan_from = 0
+        # Номер строки в позиции _line_pos буфера
+        self._line = 1
+        self._line_pos = 0
+        self._open: Dict[str, List[Tuple[int, int]]] = {'plan': [], 'inspection': []}
+        self._spans: Dict[str, deque] = {'plan': deque(), 'inspection': deque()}
+        if record_type is not None:
+            self.restrict(record_type)
+
+    def restrict(self, record_type: str):
+        """Искать только записи типа record_type (записи другого типа загрузка пропускает)"""
+        for other in list(self._open):
+            if other != record_type:
+                del self._open[other]
+                del self._spans[other]
+
+    def _line_at(self, pos: int) -> int:
+        self._line += self._buffer.count(b'\n', self._line_pos, pos)
+        self._line_pos = pos
+        return self._line
+
+    def _emit(self, record_type: str, start: int, end: int, line: int):
+        data = bytes(self._buffer[start - self._base:end - self._base])
+        self._spans[record_type].append((start, len(data), hashlib.sha256(data).hexdigest(), line, data))
+
+    def feed(self, data: bytes):
+        buffer = self._buffer
+        buffer += data
+        pos = self._scan_from
+        while True:
+            match = _TOKEN_RE.search(buffer, pos)
+            if match is None:
+                pos = max(pos, len(buffer) - _TAIL)
+                break
+            skip = match.group(3)
+            if skip is not None:
+                end = buffer.find(_SKIP_END[skip], match.end())
+                if end == -1:
+                    pos = match.start()
+                    break
+                pos = end + len(_SKIP_END[skip])
+                continue
+            end = buffer.find(b'>', match.end())
+            if end == -1:
+                pos = match.start()
+                break
+            record_type = match.group(2).decode('ascii').lower()
+            opened = self._open.get(record_type)
+            if opened is None:
+                # Записи этого типа не загружаются
+                pass
+            elif match.group(1):
+                if opened:
+                    start, line = opened.pop()
+                    self._emit(record_type, start, self._base + end + 1, line)
+            else:
+                # libxml2 относит элемент к строке, где заканчивается открывающий тег
+                line = self._line_at(end)
+                if buffer[end - 1] == ord('/'):
+                    self._emit(record_type, self._base + match.start(), self._base + end + 1, line)
+                else:
+                    opened.append((self._base + match.start(), line))
+            pos = end + 1
+
+        # Байты до начала незакрытых записей и позиции поиска больше не нужны
+        keep = pos
+        for stack in self._open.values():
+            if stack:
+                keep = min(keep, stack[0][0] - self._base)
+        if keep > 0:
+            self._line_at(max(self._line_pos, keep))
+            del buffer[:keep]
+            self._base += keep
+            self._line_pos -= keep
+            pos -= keep
+        self._scan_from = pos
+
+    def pop(self, record_type: str, sourceline: Optional[int] = None,
+            record_key: Optional[str] = None) -> Optional[Tuple[int, int, str, bytes]]:
+        """
+        Границы очередной записи типа record_type
+
+        Args:
+            sourceline, record_key: номер строки и ключ записи по данным lxml
+                для сверки
+
+        Returns:
+            (смещение, длина, SHA-256, байты записи) или None, если границы
+            не совпадают с записью lxml
+        """
+        spans = self._spans.get(record_type)
+        if not spans:
+            return None
+        offset, length, sha256, line, data = spans.popleft()
+        if sourceline is not None and sourceline <= _RELIABLE_LINES and line != sourceline:
+            return None
+        if record_key and record_key.encode('utf-8') not in data \
+                and escape(record_key).encode('utf-8') not in data:
+            return None
+        return offset, length, sha256, data
+
+
+class ScanningReader:
+    """Бинарный поток, байты которого по мере чтения передаются RecordScanner"""
+
+    def __init__(self, raw, scanner: RecordScanner):
+        self.raw = raw
+        self.scanner = scanner
+
+    def read(self, size: int = -1) -> bytes:
+        data = self.raw.read(size)
+        # scanner = None отключает поиск границ до конца потока
+        if data and self.scanner is not None:
+            self.scanner.feed(data)
+        return data
+
+
+def _data_offset(zip_path: Path, info: zipfile.ZipInfo) -> int:
+    """Смещение сжатых данных XML в файле архива"""
+    with open(zip_path, 'rb') as f:
+        f.seek(info.header_offset)
+        header = f.read(_LOCAL_HEADER.size)
+    fields = _LOCAL_HEADER.unpack(header)
+    if fields[0] != b'PK\x03\x04':
+        raise zipfile.BadZipFile(f"Неверный локальный заголовок {info.filename} в {zip_path}")
+    return info.header_offset + _LOCAL_HEADER.size + fields[9] + fields[10]
+
+
+class MemberIndex:
+    """Индекс контрольных точек XML внутри ZIP для чтения по смещению"""
+
+    def __init__(self, zip_path: Path, member: str):
+        self.zip_path = Path(zip_path)
+        self.member = member
+        with zipfile.ZipFile(self.zip_path) as zip_ref:
+            self.info = zip_ref.getinfo(member)
+        self.data_offset = _data_offset(self.zip_path, self.info)
+        # (смещение в несжатом потоке, смещение в сжатых данных, состояние распаковщика)
+        self.checkpoints: List[Tuple[int, int, object]] = []
+        self._outputs: List[int] = []
+        if self.info.compress_type == zipfile.ZIP_DEFLATED:
+            self._build()
+
+    def _build(self):
+        decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+        self.checkpoints.append((0, 0, decompressor.copy()))
+        consumed = 0
+        produced = 0
+        last = 0
+        remaining = self.info.compress_size
+        with open(self.zip_path, 'rb') as f:
+            f.seek(self.data_offset)
+            while remaining > 0:
+                block = f.read(min(READ_BLOCK, remaining))
+                if not block:
+                    break
+                remaining -= len(block)
+                consumed += len(block)
+                # Блок распакован полностью: состояние соответствует (consumed, produced)
+                produced += len(decompressor.decompress(block))
+                if produced - last >= CHECKPOINT_SPAN and remaining > 0:
+                    self.checkpoints.append((produced, consumed, decompressor.copy()))
+                    last = produced
+        self._outputs = [checkpoint[0] for checkpoint in self.checkpoints]
+
+    def read(self, offset: int, length: int) -> bytes:
+        """Байты несжатого потока [offset, offset + length)"""
+        if self.info.compress_type == zipfile.ZIP_STORED:
+            with open(self.zip_path, 'rb') as f:
+                f.seek(self.data_offset + offset)
+                return f.read(length)
+        if self.info.compress_type != zipfile.ZIP_DEFLATED:
+            with zipfile.ZipFile(self.zip_path) as zip_ref, zip_ref.open(self.member) as member:
+                member.seek(offset)
+                return member.read(length)
+
+        produced, consumed, state = self.checkpoints[bisect_right(self._outputs, offset) - 1]
+        decompressor = state.copy()
+        skip = offset - produced
+        chunks = []
+        collected = 0
+        remaining = self.info.compress_size - consumed
+        with open(self.zip_path, 'rb') as f:
+            f.seek(self.data_offset + consumed)
+            while collected < length and remaining > 0:
+                block = f.read(min(READ_BLOCK, remaining))
+                if not block:
+                    break
+                remaining -= len(block)
+                data = decompressor.decompress(block)
+                if skip:
+                    dropped = min(skip, len(data))
+                    data = data[dropped:]
+                    skip -= dropped
+                chunks.append(data)
+                collected += len(data)
+        return b''.join(chunks)[:length]
+
+
+class _IndexBuild:
+    """Построение индекса в фоновом потоке"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.index: Optional[MemberIndex] = None
+        self.error: Optional[BaseException] = None
+
+
+_cache_lock = threading.Lock()
+_cache: 'OrderedDict[Tuple[str, str, float], MemberIndex]' = OrderedDict()
+_building: Dict[Tuple[str, str, float], _IndexBuild] = {}
+
+
+def _build_index(key: Tuple[str, str, float], path: Path, member: str, build: _IndexBuild):
+    try:
+        build.index = MemberIndex(path, member)
+        with _cache_lock:
+            _cache[key] = build.index
+            while len(_cache) > INDEX_CACHE_SIZE:
+                _cache.popitem(last=False)
+    except BaseException as e:
+        build.error = e
+    finally:
+        with _cache_lock:
+            _building.pop(key, None)
+        build.done.set()
+
+
+def get_index(zip_path, member: str, wait: Optional[float] = None) -> MemberIndex:
+    """
+    Индекс XML архива (строится в фоне при первом обращении, хранится в кэше)
+
+    Args:
+        wait: сколько ждать построения индекса, с; None - без ограничения
+
+    Raises:
+        TimeoutError: индекс еще строится (построение продолжается)
+    """
+    path = Path(zip_path)
+    # Время изменения в ключе: замененный архив индексируется заново
+    key = (str(path), member, path.stat().st_mtime)
+    with _cache_lock:
+        index = _cache.get(key)
+        if index is not None:
+            _cache.move_to_end(key)
+            return index
+        build = _building.get(key)
+        if build is None:
+            build = _building[key] = _IndexBuild()
+            threading.Thread(target=_build_index, args=(key, path, member, build),
+                             name='erknm-pointer-index', daemon=True).start()
+    if not build.done.wait(wait):
+        raise TimeoutError(f"Индекс {member} в {path.name} строится, повторите запрос позже")
+    if build.error is not None:
+        raise build.error
+    return build.index
+
+
+def read_record(zip_path, member: str, offset: int, length: int, sha256: Optional[str] = None,
+                wait: Optional[float] = None) -> str:
+    """
+    XML записи по указателю
+
+    Args:
+        wait: сколько ждать построения индекса XML, с; None - без ограничения
+
+    Raises:
+        FileNotFoundError: архив удален с диска
+        TimeoutError: индекс XML еще строится
+        ValueError: архив поврежден или заменен (нет XML, содержимое не
+            совпадает с сохраненным SHA-256)
+    """
+    if not zip_path or not Path(zip_path).is_file():
+        raise FileNotFoundError(f"ZIP архив записи не найден: {zip_path}")
+    try:
+        data = get_index(zip_path, member, wait).read(offset, length)
+    except (zipfile.BadZipFile, KeyError, zlib.error) as e:
+        raise ValueError(f"Запись не читается из {Path(zip_path).name}: {e}") from e
+    if sha256 and hashlib.sha256(data).hexdigest() != sha256:
+        raise ValueError(f"Содержимое записи в {Path(zip_path).name} не совпадает с сохраненным SHA-256")
+    return data.decode('utf-8')
+
+
+def clear_cache():
+    with _cache_lock:
+        _cache.clear()
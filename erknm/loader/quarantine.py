@@ -0,0 +1,157 @@
+"""Карантин записей, отклоненных БД при загрузке
+
+Запись, которую БД не приняла (некорректный XML, недопустимый символ,
+нарушение ограничения), не теряется и не останавливает загрузку: она
+сохраняется в quarantined_records вместе с причиной и позицией в документе
+(record_offset - порядковый номер записи, с 1). После исправления причины
+(схема, домен xml, данные) записи повторно загружаются командой
+quarantine-replay; успешно загруженные удаляются из карантина.
+"""
+from typing import Dict, List, Optional
+
+from erknm.db.connection import get_connection, get_cursor
+from erknm.loader.raw_storage import resolve_mode
+from erknm.loader.xml_stream import RECORD_ERRORS, RecordWriter
+
+# Максимальная длина сохраняемой причины отказа
+REASON_MAX_LENGTH = 2000
+
+
+def _text(value: Optional[str]) -> Optional[str]:
+    # Символ NUL не может храниться в TEXT - из-за него запись часто и отклоняется
+    return value.replace('\x00', '') if isinstance(value, str) else value
+
+
+def quarantine_records(cur, fragment_id: int, archive_id: Optional[int], data_type: str, rejected: List):
+    """
+    Сохранить отклоненные записи пакета (в транзакции вызывающего кода)
+
+    Args:
+        rejected: (запись, причина), запись - кортеж (позиция в документе,
+            строка сырого XML, строка parsed_records) из RecordWriter
+    """
+    if not rejected:
+        return
+
+    from psycopg2.extras import execute_values
+
+    rows = []
+    for (offset, raw_row, parsed_row), reason in rejected:
+        _, _, _, record_key, record_date, payload_json = parsed_row
+        rows.append((fragment_id, archive_id, data_type, offset, _text(record_key), record_date,
+                     _text(payload_json), _text(raw_row[1]), _text(reason)[:REASON_MAX_LENGTH]))
+    execute_values(cur, """
+        INSERT INTO quarantined_records
+        (xml_fragment_id, zip_archive_id, record_type, record_offset, record_key, record_date,
+         payload_json, xml_content, reason)
+        VALUES %s
+    """, rows)
+
+
+def list_records(fragment_id: Optional[int] = None, limit: int = 50) -> List[Dict]:
+    """Записи в карантине (последние первыми)"""
+    conn = get_connection()
+    cur = get_cursor(conn)
+    try:
+        query = """
+            SELECT qr.id, qr.xml_fragment_id, xf.file_name, qr.record_type, qr.record_offset,
+                   qr.record_key, qr.reason, qr.attempts, qr.created_at, qr.last_attempt_at
+            FROM quarantined_records qr
+            LEFT JOIN xml_fragments xf ON qr.xml_fragment_id = xf.id
+        """
+        params = []
+        if fragment_id is not None:
+            query += " WHERE qr.xml_fragment_id = %s"
+            params.append(fragment_id)
+        query += " ORDER BY qr.id DESC LIMIT %s"
+        params.append(limit)
+        cur.execute(query, params)
+        return [dict(row) for row in cur.fetchall()]
+    finally:
+        cur.close()
+        conn.close()
+
+
+def count_records() -> int:
+    conn = get_connection()
+    cur = get_cursor(conn)
+    try:
+        cur.execute("SELECT COUNT(*) AS cnt FROM quarantined_records")
+        return cur.fetchone()['cnt']
+    finally:
+        cur.close()
+        conn.close()
+
+
+def replay(record_ids: Optional[List[int]] = None, fragment_id: Optional[int] = None) -> Dict:
+    """
+    Повторно загрузить записи из карантина
+
+    Каждая запись загружается в своей точке сохранения: загруженная удаляется
+    из карантина (счетчик записей фрагмента увеличивается), отклоненная снова
+    остается в карантине с новой причиной.
+
+    Args:
+        record_ids: ID записей карантина; None - все (или все записи фрагмента)
+        fragment_id: ограничить записями XML-фрагмента
+
+    Returns:
+        {'replayed': загружено, 'failed': осталось в карантине}
+    """
+    conn = get_connection()
+    cur = get_cursor(conn)
+    replayed = 0
+    failed = 0
+    try:
+        query = """
+            SELECT id, xml_fragment_id, zip_archive_id, record_type, record_offset, record_key,
+                   record_date, payload_json, xml_content
+            FROM quarantined_records
+            WHERE TRUE
+        """
+        params = []
+        if record_ids:
+            query += " AND id = ANY(%s)"
+            params.append(list(record_ids))
+        if fragment_id is not None:
+            query += " AND xml_fragment_id = %s"
+            params.append(fragment_id)
+        query += " ORDER BY xml_fragment_id, record_offset"
+        cur.execute(query, params)
+        records = cur.fetchall()
+        raw_storage = resolve_mode()
+
+        for record in records:
+            cur.execute("SAVEPOINT erknm_replay")
+            try:
+                # Запись пишется так же, как при загрузке (в текущем формате хранения XML)
+                writer = RecordWriter(conn, record['xml_fragment_id'], record['zip_archive_id'],
+                                      record['record_type'], raw_storage=raw_storage)
+                writer.insert_record(cur, record['record_offset'], record['xml_content'],
+                                     record_key=record['record_key'], record_date=record['record_date'],
+                                     payload_text=record['payload_json'])
+                cur.execute("""
+                    UPDATE xml_fragments SET records_count = COALESCE(records_count, 0) + 1
+                    WHERE id = %s
+                """, (record['xml_fragment_id'],))
+                cur.execute("DELETE FROM quarantined_records WHERE id = %s", (record['id'],))
+                cur.execute("RELEASE SAVEPOINT erknm_replay")
+                replayed += 1
+            except RECORD_ERRORS as e:
+                cur.execute("ROLLBACK TO SAVEPOINT erknm_replay")
+                cur.execute("""
+                    UPDATE quarantined_records
+                    SET attempts = attempts + 1, reason = %s, last_attempt_at = CURRENT_TIMESTAMP
+                    WHERE id = %s
+                """, (_text(str(e).strip())[:REASON_MAX_LENGTH], record['id']))
+                cur.execute("RELEASE SAVEPOINT erknm_replay")
+                failed += 1
+
+        conn.commit()
+        return {'replayed': replayed, 'failed': failed}
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+        conn.close()
@@ -0,0 +1,234 @@
+"""Формат хранения сырого XML записей (настройка raw_storage)
+
+    xml        - столбец xml_content типа xml (по умолчанию): сервер разбирает
+                 каждую запись при вставке и сериализует при чтении;
+    compressed - канонический XML (inclusive C14N: сохраняются все
+                 объявления пространств имен, видимые в записи, в том числе
+                 префиксы, упомянутые только в значениях, например
+                 xsi:type="ns:T") сжимается в xml_compressed (bytea),
+                 рядом хранятся кодек (xml_codec), длина несжатого XML в
+                 байтах (xml_length) и его SHA-256 (xml_sha256); xml_content
+                 остается пустым;
+    pointer    - XML в БД не хранится: xml_offset и xml_length указывают на
+                 байты записи в несжатом XML ZIP архива, из которого она
+                 загружена (кодек pointer, erknm.loader.pointer_store).
+                 Записи, границы которых не удалось определить, и записи
+                 из XML вне архива хранятся как в compressed.
+
+Сжатие - zstd, если установлен пакет zstandard, иначе zlib; короткие записи,
+которые сжатие не уменьшает, хранятся без сжатия (кодек none). Кодек хранится
+в каждой строке, поэтому строки разных кодеков читаются одинаково. XML
+распаковывается только при чтении одной записи (детальный просмотр, raw);
+списки используют xml_length. Поиск по тексту XML в списке выполняется
+только по строкам формата xml.
+
+Существующие строки переводятся в сжатый формат пакетами (migrate, команда
+compress-raw). Строки pointer читаются, пока архив лежит на диске: при
+удалении архива их XML недоступен.
+"""
+import hashlib
+import zlib
+from typing import Callable, Dict, Optional, Tuple
+
+try:
+    import zstandard
+except ImportError:
+    # Необязательная зависимость: без нее используется zlib
+    zstandard = None
+
+MODES = ('xml', 'compressed', 'pointer')
+
+# Кодек для новых строк
+CODEC = 'zstd' if zstandard is not None else 'zlib'
+
+ZSTD_LEVEL = 3
+# На коротких записях уровни выше 1 почти не уменьшают размер, но заметно медленнее
+ZLIB_LEVEL = 1
+
+# Столбцы сжатого XML (порядок значений encode)
+COMPRESSED_COLUMNS = ['xml_compressed', 'xml_codec', 'xml_length', 'xml_sha256']
+
+# Столбцы сырого XML во всех форматах (порядок значений stored_values)
+STORED_COLUMNS = ['xml_content'] + COMPRESSED_COLUMNS + ['xml_offset']
+
+# Строк в одном пакете миграции
+MIGRATE_BATCH_SIZE = 1000
+
+_compressor = zstandard.ZstdCompressor(level=ZSTD_LEVEL) if zstandard is not None else None
+_decompressor = zstandard.ZstdDecompressor() if zstandard is not None else None
+
+
+def resolve_mode() -> str:
+    """Формат хранения из настройки raw_storage ('xml' по умолчанию)"""
+    from erknm.db.models import Settings
+    try:
+        mode = (Settings.get_typed('raw_storage') or '').strip().lower()
+    except Exception:
+        return 'xml'
+    return mode if mode in MODES else 'xml'
+
+
+def canonicalize(elem) -> str:
+    """Канонический XML элемента (inclusive C14N)"""
+    # lxml не импортируется при импорте модуля: веб-интерфейсу нужно только чтение строк
+    from lxml import etree
+    # exclusive C14N отбросил бы объявления префиксов, используемых только в значениях
+    return etree.tostring(elem, method='c14n').decode('utf-8')
+
+
+def encode(xml_content: str) -> Tuple[bytes, str, int, str]:
+    """
+    Сжать XML
+
+    Returns:
+        (сжатые данные, кодек, длина несжатого XML в байтах, SHA-256 несжатого XML)
+    """
+    data = xml_content.encode('utf-8')
+    if CODEC == 'zstd':
+        compressed = _compressor.compress(data)
+    else:
+        compressed = zlib.compress(data, ZLIB_LEVEL)
+    sha256 = hashlib.sha256(data).hexdigest()
+    if len(compressed) >= len(data):
+        return data, 'none', len(data), sha256
+    return compressed, CODEC, len(data), sha256
+
+
+def stored_values(xml_content: Optional[str], mode: str, pointer: Optional[Tuple] = None) -> Tuple:
+    """
+    Значения столбцов STORED_COLUMNS для записи
+
+    Args:
+        xml_content: XML записи
+        mode: формат хранения
+        pointer: (смещение, длина, SHA-256) записи в XML архива для формата pointer;
+            без него запись хранится сжатой
+    """
+    if mode == 'xml':
+        return (xml_content, None, None, None, None, None)
+    if mode == 'pointer' and pointer is not None:
+        offset, length, sha256 = pointer
+        return (None, None, 'pointer', length, sha256, offset)
+    return (None,) + encode(xml_content) + (None,)
+
+
+def decode(compressed, codec: str) -> str:
+    """Распаковать XML, сжатый encode"""
+    data = bytes(compressed)
+    if codec == 'none':
+        return data.decode('utf-8')
+    if codec == 'zlib':
+        return zlib.decompress(data).decode('utf-8')
+    if codec == 'zstd':
+        if _decompressor is None:
+            raise RuntimeError("XML сжат zstd, а пакет zstandard не установлен (pip install zstandard)")
+        return _decompressor.decompress(data).decode('utf-8')
+    raise ValueError(f"Неизвестный кодек сырого XML: {codec}")
+
+
+def select_columns(alias: str) -> str:
+    """Столбцы запроса, из которых row_text получает XML строки"""
+    # Архив и имя XML нужны только строкам pointer
+    return (f"{alias}.xml_content::text AS xml_content, {alias}.xml_compressed, {alias}.xml_codec, "
+            f"{alias}.xml_offset, {alias}.xml_length, {alias}.xml_sha256, "
+            f"(SELECT z.file_path FROM xml_fragments f JOIN zip_archives z ON z.id = f.zip_archive_id "
+            f"WHERE f.id = {alias}.xml_fragment_id AND {alias}.xml_codec = 'pointer') AS xml_archive_path, "
+            f"(SELECT f.file_name FROM xml_fragments f "
+            f"WHERE f.id = {alias}.xml_fragment_id AND {alias}.xml_codec = 'pointer') AS xml_member")
+
+
+def size_expression(alias: str) -> str:
+    """Размер XML строки в байтах без распаковки"""
+    return f"COALESCE({alias}.xml_length, OCTET_LENGTH({alias}.xml_content::text))"
+
+
+def row_text(row: Dict, wait: Optional[float] = None) -> Optional[str]:
+    """
+    XML строки, выбранной со столбцами select_columns
+
+    Args:
+        wait: для строк pointer - сколько ждать индекс XML архива, с
+            (None - без ограничения, см. erknm.loader.pointer_store)
+
+    Raises:
+        FileNotFoundError, ValueError: XML строки pointer недоступен (архив удален или заменен)
+        TimeoutError: индекс XML архива еще строится
+    """
+    if row.get('xml_codec') == 'pointer':
+        from erknm.loader import pointer_store
+        return pointer_store.read_record(row['xml_archive_path'], row['xml_member'],
+                                         row['xml_offset'], row['xml_length'], row['xml_sha256'], wait)
+    if row.get('xml_compressed') is not None:
+        return decode(row['xml_compressed'], row['xml_codec'])
+    return row.get('xml_content')
+
+
+def migrate(table: str, batch_size: int = MIGRATE_BATCH_SIZE,
+            progress: Optional[Callable[[str], None]] = None) -> int:
+    """
+    Перевести строки таблицы сырого XML в сжатый формат
+
+    Каждый пакет - отдельная транзакция, поэтому миграцию можно прервать и
+    продолжить. XML строки приводится к каноническому виду. Строки, XML
+    которых не разбирается, остаются в формате xml и пропускаются
+    (сообщаются через progress).
+
+    Returns:
+        Количество переведенных строк
+    """
+    from lxml import etree
+    from psycopg2.extras import execute_values
+    from erknm.db.connection import get_connection, get_cursor
+    from erknm.loader.xml_stream import RAW_TABLES
+
+    if table not in RAW_TABLES.values():
+        raise ValueError(f"Неизвестная таблица сырого XML: {table}")
+
+    conn = get_connection()
+    cur = get_cursor(conn)
+    converted = 0
+    skipped = 0
+    last_id = 0
+    try:
+        cur.execute(f"SELECT COUNT(*) AS cnt FROM {table} WHERE xml_content IS NOT NULL")
+        total = cur.fetchone()['cnt']
+        while True:
+            cur.execute(f"""
+                SELECT id, xml_content::text AS xml_content FROM {table}
+                WHERE xml_content IS NOT NULL AND id > %s
+                ORDER BY id LIMIT %s
+            """, (last_id, batch_size))
+            rows = cur.fetchall()
+            if not rows:
+                break
+            values = []
+            for row in rows:
+                try:
+                    xml_content = canonicalize(etree.fromstring(row['xml_content'].encode('utf-8')))
+                except (etree.XMLSyntaxError, etree.C14NError, ValueError) as e:
+                    skipped += 1
+                    if progress is not None:
+                        progress(f"{table}: строка {row['id']} пропущена ({e})")
+                    continue
+                values.append((row['id'],) + encode(xml_content))
+            last_id = rows[-1]['id']
+            if not values:
+                continue
+            execute_values(cur, f"""
+                UPDATE {table} AS t
+                SET xml_compressed = v.xml_compressed, xml_codec = v.xml_codec,
+                    xml_length = v.xml_length, xml_sha256 = v.xml_sha256, xml_content = NULL
+                FROM (VALUES %s) AS v (id, xml_compressed, xml_codec, xml_length, xml_sha256)
+                WHERE t.id = v.id
+            """, values, template="(%s, %s::bytea, %s, %s, %s)", page_size=batch_size)
+            conn.commit()
+            converted += len(values)
+            if progress is not None:
+                progress(f"{table}: {converted} из {total}" + (f", пропущено {skipped}" if skipped else ""))
+        return converted
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+        conn.close()
@@ -0,0 +1,253 @@
+"""Загрузка архивов через промежуточную таблицу (ingest_mode = 'staging')
+
+Записи XML сначала пишутся пакетами в staging_records - UNLOGGED таблицу без
+индексов и внешних ключей (запись не проходит через WAL и не обновляет
+индексы). После разбора всего документа записи переносятся в итоговые таблицы
+(plans_raw/inspections_raw и parsed_records) одним INSERT ... SELECT на
+таблицу; в той же транзакции фрагмент отмечается загруженным, архив -
+обработанным, а записи фрагмента удаляются из staging_records. Итоговые
+таблицы никогда не содержат части архива.
+
+Позиция загрузки в этом режиме - наибольший record_offset фрагмента в
+staging_records: пакеты пишутся в отдельных транзакциях, поэтому прерванный
+разбор продолжается с места остановки. После аварийного перезапуска сервера
+PostgreSQL очищает UNLOGGED таблицы - позиция становится нулевой, и документ
+разбирается заново.
+
+Если БД отклоняет перенос из-за отдельных записей (например, некорректный XML
+для ::xml), записи переносятся пакетами с делением в точках сохранения,
+отклоненные - в карантин (erknm.loader.quarantine), как при прямой загрузке.
+"""
+import time
+
+import psycopg2
+
+from erknm import metrics
+from erknm.db.connection import get_connection, get_cursor
+from erknm.db.models import OperationLog, Settings
+from erknm.loader import raw_storage
+from erknm.loader.quarantine import quarantine_records
+from erknm.loader.xml_stream import BATCH_SIZE, RAW_TABLES, RECORD_ERRORS, RecordWriter, copy_rows
+from erknm.logger.messages import get_message
+
+MODES = ('direct', 'staging')
+
+STAGING_COLUMNS = ['xml_fragment_id', 'zip_archive_id', 'record_type', 'record_offset',
+                   'record_key', 'record_date', 'payload_json'] + raw_storage.STORED_COLUMNS
+
+
+def resolve_mode() -> str:
+    """Режим загрузки архивов из настройки ingest_mode ('direct' по умолчанию)"""
+    try:
+        mode = (Settings.get_typed('ingest_mode') or '').strip().lower()
+    except Exception:
+        return 'direct'
+    return mode if mode in MODES else 'direct'
+
+
+class StagingWriter(RecordWriter):
+    """Пакетная запись записей в staging_records"""
+
+    def _insert(self, cur, items):
+        from psycopg2.extras import execute_values
+
+        rows = []
+        for offset, raw_row, parsed_row in items:
+            _, _, _, record_key, record_date, payload_json = parsed_row
+            # Сжатый XML и указатели переносятся в итоговую таблицу как есть
+            raw_values = raw_storage.stored_values(raw_row[1], self.raw_storage, raw_row[2])
+            rows.append((self.fragment_id, self.archive_id, self.data_type, offset,
+                         record_key, record_date, payload_json) + raw_values)
+        if self.use_copy:
+            copy_rows(cur, 'staging_records', STAGING_COLUMNS, rows)
+            return
+        execute_values(cur, f"""
+            INSERT INTO staging_records ({', '.join(STAGING_COLUMNS)})
+            VALUES %s
+        """, rows, page_size=self.batch_size)
+
+    def _record_position(self, cur, batch_written: int):
+        # Позиция - наибольший record_offset фрагмента в staging_records
+        pass
+
+
+def resume_position(fragment_id: int) -> int:
+    """
+    Позиция, с которой продолжить разбор фрагмента в промежуточную таблицу
+
+    Записи карантина после позиции удаляются: они будут разобраны повторно.
+    """
+    conn = get_connection()
+    cur = get_cursor(conn)
+    try:
+        cur.execute("""
+            SELECT COALESCE(MAX(record_offset), 0) AS position
+            FROM staging_records WHERE xml_fragment_id = %s
+        """, (fragment_id,))
+        position = cur.fetchone()['position']
+        cur.execute("""
+            DELETE FROM quarantined_records
+            WHERE xml_fragment_id = %s AND record_offset > %s
+        """, (fragment_id, position))
+        conn.commit()
+        return position
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+        conn.close()
+
+
+def _merge_set_based(cur, fragment_id: int, raw_table: str) -> int:
+    # DISTINCT ON убирает повторы позиций, порядок вставки - порядок документа
+    cur.execute(f"""
+        INSERT INTO {raw_table}
+        (xml_fragment_id, xml_content, xml_compressed, xml_codec, xml_length, xml_sha256, xml_offset)
+        SELECT xml_fragment_id, xml_content::xml, xml_compressed, xml_codec, xml_length, xml_sha256, xml_offset
+        FROM (
+            SELECT DISTINCT ON (record_offset) *
+            FROM staging_records WHERE xml_fragment_id = %s
+            ORDER BY record_offset
+        ) s
+        ORDER BY record_offset
+    """, (fragment_id,))
+    cur.execute("""
+        INSERT INTO parsed_records
+        (zip_archive_id, xml_fragment_id, record_type, record_key, record_date, payload_json)
+        SELECT zip_archive_id, xml_fragment_id, record_type, record_key, record_date, payload_json::jsonb
+        FROM (
+            SELECT DISTINCT ON (record_offset) *
+            FROM staging_records WHERE xml_fragment_id = %s
+            ORDER BY record_offset
+        ) s
+        ORDER BY record_offset
+    """, (fragment_id,))
+    return cur.rowcount
+
+
+def _pointer(row):
+    if row['xml_codec'] != 'pointer':
+        return None
+    return row['xml_offset'], row['xml_length'], row['xml_sha256']
+
+
+def _merge_isolated(cur, writer: RecordWriter, rejected: list) -> int:
+    """Перенести записи пакетами с поиском отклоненных (в текущей транзакции)"""
+    written = 0
+    position = 0
+    while True:
+        cur.execute(f"""
+            SELECT DISTINCT ON (record_offset) record_offset, zip_archive_id, record_key,
+                   record_date, payload_json, {raw_storage.select_columns('s')}
+            FROM staging_records s
+            WHERE xml_fragment_id = %s AND record_offset > %s
+            ORDER BY record_offset
+            LIMIT %s
+        """, (writer.fragment_id, position, BATCH_SIZE))
+        rows = cur.fetchall()
+        if not rows:
+            return written
+        items = [
+            (row['record_offset'], (writer.fragment_id, raw_storage.row_text(row), _pointer(row)),
+             (row['zip_archive_id'], writer.fragment_id, writer.data_type, row['record_key'],
+              row['record_date'], row['payload_json']))
+            for row in rows
+        ]
+        batch_rejected = []
+        writer._insert_isolated(cur, items, batch_rejected)
+        written += len(items) - len(batch_rejected)
+        rejected.extend(batch_rejected)
+        position = rows[-1]['record_offset']
+
+
+def _truncate_if_empty(conn):
+    """Очистить staging_records, если в ней не осталось записей других загрузок"""
+    cur = conn.cursor()
+    try:
+        # Пока идет загрузка другого архива, блокировка не берется - очистка пропускается
+        cur.execute("LOCK TABLE staging_records IN ACCESS EXCLUSIVE MODE NOWAIT")
+        cur.execute("SELECT 1 FROM staging_records LIMIT 1")
+        if cur.fetchone() is None:
+            cur.execute("TRUNCATE staging_records")
+        conn.commit()
+    except psycopg2.OperationalError:
+        conn.rollback()
+    finally:
+        cur.close()
+
+
+def merge(fragment_id: int, archive_id: int, data_type: str, sync_run_id=None,
+          source_name: str = '') -> int:
+    """
+    Перенести записи фрагмента из staging_records в итоговые таблицы
+
+    Перенос, отметка фрагмента загруженным, архива - обработанным и удаление
+    записей фрагмента из staging_records выполняются одной транзакцией.
+
+    Returns:
+        Количество перенесенных записей
+    """
+    if data_type not in RAW_TABLES:
+        raise ValueError(f"Неизвестный тип данных: {data_type}")
+
+    conn = get_connection()
+    cur = get_cursor(conn)
+    started = time.perf_counter()
+    rejected = []
+    try:
+        with metrics.timer('staging_merge'):
+            cur.execute("""
+                SELECT COALESCE(MAX(record_offset), 0) AS position
+                FROM staging_records WHERE xml_fragment_id = %s
+            """, (fragment_id,))
+            position = cur.fetchone()['position']
+            try:
+                written = _merge_set_based(cur, fragment_id, RAW_TABLES[data_type])
+            except RECORD_ERRORS:
+                conn.rollback()
+                writer = RecordWriter(conn, fragment_id, archive_id, data_type,
+                                      sync_run_id=sync_run_id, source_name=source_name,
+                                      raw_storage=raw_storage.resolve_mode())
+                written = _merge_isolated(cur, writer, rejected)
+                quarantine_records(cur, fragment_id, archive_id, data_type, rejected)
+
+            cur.execute("""
+                UPDATE xml_fragments
+                SET status = 'loaded', data_type = %s, error_message = NULL,
+                    records_count = COALESCE(records_count, 0) + %s,
+                    records_committed = GREATEST(records_committed, %s)
+                WHERE id = %s
+            """, (data_type, written, position, fragment_id))
+            cur.execute("""
+                UPDATE zip_archives
+                SET status = 'processed', processed_at = CURRENT_TIMESTAMP
+                WHERE id = %s
+            """, (archive_id,))
+            cur.execute("DELETE FROM staging_records WHERE xml_fragment_id = %s", (fragment_id,))
+            conn.commit()
+
+        _truncate_if_empty(conn)
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+        conn.close()
+
+    metrics.inc('records_total', written, type=data_type)
+    if rejected:
+        metrics.inc('records_quarantined_total', len(rejected), type=data_type)
+    if sync_run_id:
+        if rejected:
+            OperationLog.log(sync_run_id, "data",
+                           get_message('records_quarantined', count=len(rejected), total=written + len(rejected),
+                                       filename=source_name,
+                                       offsets=', '.join(str(item[0]) for item, _ in rejected[:10]),
+                                       reason=rejected[0][1].splitlines()[0] if rejected[0][1] else ''),
+                           level="WARNING", stage='data')
+        OperationLog.log(sync_run_id, "data",
+                       get_message('staging_merged', filename=source_name, count=written,
+                                   seconds=time.perf_counter() - started),
+                       stage='data')
+    return written
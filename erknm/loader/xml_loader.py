@@ -1,17 +1,24 @@
 """Загрузчик XML данных в БД"""
+import zipfile
 from pathlib import Path
-from lxml import etree
 from erknm.db.connection import get_connection, get_cursor
 from erknm.db.models import XmlFragment, OperationLog
-from erknm.classifier.classifier import classify_xml_file
+from erknm.classifier.classifier import classify_xml_file, sniff_xml_member
+from erknm.loader.xml_stream import load_records
 
 
 def load_xml_to_db(xml_fragment_id: int, sync_run_id=None) -> int:
     """
     Загрузить XML-фрагмент в БД
     
+    Файл читается потоково (тот же путь, что и для XML внутри ZIP): память
+    не зависит от размера файла, записи пишутся пакетами, в том числе в
+    parsed_records. Если фрагмент не распакован на диск (file_path пуст),
+    XML читается напрямую из ZIP-архива фрагмента. Прерванная загрузка
+    продолжается с позиции фрагмента (records_committed).
+    
     Returns:
-        Количество загруженных записей
+        Количество загруженных в этот раз записей
     """
     conn = get_connection()
     cur = get_cursor(conn)
@@ -19,85 +26,78 @@ def load_xml_to_db(xml_fragment_id: int, sync_run_id=None) -> int:
     try:
         # Получаем информацию о фрагменте
         cur.execute("""
-            SELECT xf.id, xf.file_path, xf.data_type, za.id as zip_id
+            SELECT xf.id, xf.file_name, xf.file_path, xf.data_type, 
+                   xf.records_count, xf.records_committed,
+                   za.id as zip_id, za.file_path as zip_path
             FROM xml_fragments xf
-            JOIN zip_archives za ON xf.zip_archive_id = za.id
+            LEFT JOIN zip_archives za ON xf.zip_archive_id = za.id
             WHERE xf.id = %s
         """, (xml_fragment_id,))
         
         fragment = cur.fetchone()
-        if not fragment:
-            raise Exception(f"XML-фрагмент {xml_fragment_id} не найден")
-        
-        file_path = Path(fragment['file_path'])
-        data_type = fragment['data_type']
-        
-        if not file_path.exists():
-            raise Exception(f"Файл не найден: {file_path}")
-        
-        # Классифицируем, если еще не классифицирован
-        if not data_type:
-            data_type = classify_xml_file(file_path)
-            if data_type:
-                XmlFragment.update_status(xml_fragment_id, 'pending', data_type=data_type)
-        
-        # Парсим XML
-        try:
-            tree = etree.parse(str(file_path))
-            root = tree.getroot()
-        except Exception as e:
-            raise Exception(f"Ошибка парсинга XML: {str(e)}")
-        
-        # Определяем тип данных и загружаем
-        records_count = 0
-        
-        if data_type == 'plan':
-            # Загружаем планы проверок
-            plans = root.xpath('.//PLAN | .//plan')
-            for plan in plans:
-                plan_xml = etree.tostring(plan, encoding='unicode')
-                cur.execute("""
-                    INSERT INTO plans_raw (xml_fragment_id, xml_content)
-                    VALUES (%s, %s::xml)
-                """, (xml_fragment_id, plan_xml))
-                records_count += 1
-            
-            XmlFragment.update_status(xml_fragment_id, 'loaded', records_count=records_count)
-            
-        elif data_type == 'inspection':
-            # Загружаем проверки
-            inspections = root.xpath('.//INSPECTION | .//inspection')
-            for inspection in inspections:
-                inspection_xml = etree.tostring(inspection, encoding='unicode')
-                cur.execute("""
-                    INSERT INTO inspections_raw (xml_fragment_id, xml_content)
-                    VALUES (%s, %s::xml)
-                """, (xml_fragment_id, inspection_xml))
-                records_count += 1
-            
-            XmlFragment.update_status(xml_fragment_id, 'loaded', records_count=records_count)
+    finally:
+        cur.close()
+        conn.close()
+    
+    if not fragment:
+        raise Exception(f"XML-фрагмент {xml_fragment_id} не найден")
+    
+    file_path = Path(fragment['file_path']) if fragment['file_path'] else None
+    zip_path = Path(fragment['zip_path']) if fragment['zip_path'] else None
+    data_type = fragment['data_type']
+    source_name = file_path.name if file_path else fragment['file_name']
+    skip = fragment['records_committed'] or 0
+    committed = (fragment['records_count'] or 0) if skip else 0
+    
+    try:
+        if file_path is not None and file_path.exists():
+            # Классифицируем, если еще не классифицирован (результат кэшируется)
+            if not data_type:
+                data_type = classify_xml_file(file_path)
+                if data_type:
+                    XmlFragment.update_status(xml_fragment_id, 'pending', data_type=data_type)
             
+            if data_type:
+                with open(file_path, 'rb') as source:
+                    records_count, _ = load_records(source, xml_fragment_id, fragment['zip_id'],
+                                                    source_name, sync_run_id, data_type, skip=skip)
+        elif zip_path is not None and zip_path.exists():
+            with zipfile.ZipFile(zip_path, 'r') as zip_ref:
+                if not data_type:
+                    data_type = sniff_xml_member(zip_ref, fragment['file_name'])['data_type']
+                    if data_type:
+                        XmlFragment.update_status(xml_fragment_id, 'pending', data_type=data_type)
+                
+                if data_type:
+                    with zip_ref.open(fragment['file_name']) as source:
+                        records_count, _ = load_records(source, xml_fragment_id, fragment['zip_id'],
+                                                        source_name, sync_run_id, data_type, skip=skip,
+                                                        pointers=True)
         else:
+            raise Exception(f"Файл не найден: {file_path or zip_path}")
+        
+        if not data_type:
             # Неклассифицированные данные - помечаем как ошибку
             XmlFragment.update_status(xml_fragment_id, 'error', 
                                      error_message='Неклассифицированные данные',
                                      data_type='unknown')
             if sync_run_id:
                 OperationLog.log(sync_run_id, "xml_loader", 
-                               f"Неклассифицированный файл: {file_path}", 
+                               f"Неклассифицированный файл: {source_name}", 
                                level="WARNING")
             return 0
         
-        conn.commit()
+        XmlFragment.update_status(xml_fragment_id, 'loaded', records_count=committed + records_count)
         
         if sync_run_id:
             OperationLog.log(sync_run_id, "data", 
-                           f"Загружено {records_count} записей из {file_path.name}", stage='data')
+                           f"Загружено {records_count} записей из {source_name}", stage='data')
         
         return records_count
         
+    except StopIteration:
+        raise
     except Exception as e:
-        conn.rollback()
         error_msg = str(e)
         XmlFragment.update_status(xml_fragment_id, 'error', error_message=error_msg)
         if sync_run_id:
@@ -105,11 +105,3 @@ def load_xml_to_db(xml_fragment_id: int, sync_run_id=None) -> int:
                            f"Ошибка загрузки XML {xml_fragment_id}: {error_msg}", 
                            level="ERROR", stage='data')
         raise
-    finally:
-        cur.close()
-        conn.close()
-
-
-
-
-
@@ -0,0 +1,647 @@
+"""Потоковый разбор XML и пакетная запись записей в БД
+
+Общий путь загрузки для XML внутри ZIP-архивов и для отдельных XML файлов:
+iterparse только по тегам записей с освобождением обработанных элементов
+(память не зависит от размера документа) и запись пакетами в plans_raw/inspections_raw и parsed_records.
+
+Вместе с каждым пакетом в той же транзакции фиксируется позиция фрагмента
+(xml_fragments.records_committed - сколько записей документа обработано).
+Повторная загрузка фрагмента пропускает записи до этой позиции без
+извлечения полей и записи в БД, поэтому прерванная загрузка продолжается с
+места остановки и не дублирует уже записанные строки.
+
+Если БД отклоняет пакет из-за отдельных записей (например, некорректный XML
+для %s::xml), пакет повторяется половинами в точках сохранения, пока не
+останутся только отклоненные записи; они переносятся в quarantined_records
+(erknm.loader.quarantine), остальные записываются. Ошибки, не связанные с
+данными (потеря соединения и т.п.), прерывают загрузку фрагмента - повторная
+загрузка продолжится с позиции.
+
+В режиме массовой загрузки (bulk_load, см. erknm.sync.backfill) пакеты
+пишутся командой COPY, а транзакции фиксируются без ожидания записи WAL на
+диск (synchronous_commit = off): при сбое сервера теряются только последние
+пакеты вместе с их позицией, и они загружаются повторно.
+"""
+import contextvars
+import io
+import json
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Iterator, List, Optional, Tuple
+import psycopg2
+from lxml import etree
+from erknm import metrics
+from erknm.db.connection import get_connection
+from erknm.db.models import OperationLog
+from erknm.loader import raw_storage as raw_storage_format
+from erknm.logger.messages import get_message
+
+
+# Количество записей в одном пакете INSERT (и в одной транзакции)
+BATCH_SIZE = 500
+
+# Как часто писать в журнал прогресс обработки (в записях)
+PROGRESS_LOG_EVERY = 1000
+
+# Ошибки, вызванные содержимым отдельных записей: такие записи уходят в карантин
+# (ValueError - psycopg2 не может передать значение, например символ NUL)
+RECORD_ERRORS = (psycopg2.DataError, psycopg2.IntegrityError, ValueError)
+
+# Режим массовой загрузки текущего потока (bulk_load)
+_bulk_load: contextvars.ContextVar = contextvars.ContextVar('erknm_bulk_load', default=False)
+
+# Таблицы сырого XML по типу данных
+RAW_TABLES = {
+    'plan': 'plans_raw',
+    'inspection': 'inspections_raw',
+}
+
+# Список типичных полей для извлечения в payload_json
+IMPORTANT_FIELDS = [
+    'Number', 'number', 'Num', 'num',  # Номер
+    'Name', 'name', 'Title', 'title',  # Название
+    'Status', 'status', 'State', 'state',  # Статус
+    'Type', 'type', 'Kind', 'kind',  # Тип
+    'Region', 'region', 'Subject', 'subject',  # Регион
+    'Organization', 'organization', 'Org', 'org',  # Организация
+    'INN', 'inn', 'OGRN', 'ogrn', 'KPP', 'kpp',  # Реквизиты
+    'StartDate', 'startDate', 'EndDate', 'endDate',  # Даты
+    'Address', 'address', 'Location', 'location',  # Адрес
+    'Inspector', 'inspector', 'Executor', 'executor',  # Исполнитель
+    'Result', 'result', 'Conclusion', 'conclusion',  # Результат
+    'Violations', 'violations', 'ViolationsCount',  # Нарушения
+    'ActNumber', 'actNumber', 'OrderNumber', 'orderNumber',  # Номера документов
+]
+
+
+# Локальные имена тегов записей по типу данных (регистр в выгрузках бывает разный)
+RECORD_TAG_NAMES = {
+    'plan': ('PLAN', 'plan'),
+    'inspection': ('INSPECTION', 'inspection'),
+}
+
+
+def record_type_of(tag) -> Optional[str]:
+    """Тип записи по тегу элемента ('plan', 'inspection' или None)"""
+    if not isinstance(tag, str):
+        return None
+    local_name = tag.rsplit('}', 1)[-1].lower()
+    if local_name == 'plan':
+        return 'plan'
+    if local_name == 'inspection':
+        return 'inspection'
+    return None
+
+
+def record_tags(data_type: Optional[str] = None) -> List[str]:
+    """
+    Теги для iterparse(tag=...) без привязки к namespace
+    
+    '{*}PLAN' совпадает с PLAN в любом namespace и без него, поэтому
+    фильтрация выполняется внутри libxml2, а не в Python на каждом элементе.
+    """
+    types = [data_type] if data_type else list(RECORD_TAG_NAMES)
+    return [f'{{*}}{name}' for dt in types for name in RECORD_TAG_NAMES[dt]]
+
+
+def release_element(elem):
+    """
+    Освободить обработанную запись и все, что было разобрано до нее
+    
+    Очищается сама запись, затем удаляются предыдущие соседи записи и каждого
+    из ее предков: так из памяти уходят и записи, и промежуточные контейнеры
+    (заголовки, уже закрытые группы записей), а дерево остается в виде одной
+    ветки от корня до текущей позиции.
+    """
+    elem.clear()
+    node = elem
+    while node is not None:
+        parent = node.getparent()
+        if parent is None:
+            break
+        while node.getprevious() is not None:
+            del parent[0]
+        node = parent
+
+
+def iter_records(source, data_type: Optional[str] = None) -> Iterator[Tuple[str, object]]:
+    """
+    Потоково перебрать записи XML документа
+    
+    Выдает (тип записи, элемент). Элемент освобождается после того, как
+    вызывающий код запросил следующую запись, поэтому использовать его можно
+    только до следующей итерации.
+    
+    Args:
+        source: бинарный поток или путь к XML
+        data_type: тип записей; если None - определяется по первой открытой
+            (внешней) записи документа, записи другого типа пропускаются
+    """
+    # Без типа нужны и события start: вложенная запись (INSPECTION внутри PLAN)
+    # закрывается раньше внешней, а тип документа - тип внешней записи
+    events = ('end',) if data_type is not None else ('start', 'end')
+    context = etree.iterparse(source, events=events, tag=record_tags(data_type),
+                              huge_tree=True, recover=True)
+    try:
+        for event, elem in context:
+            record_type = record_type_of(elem.tag)
+            if event == 'start':
+                if data_type is None:
+                    data_type = record_type
+                continue
+            if record_type != data_type:
+                # Вложенная запись другого типа - остается частью родительской записи
+                continue
+            yield record_type, elem
+            release_element(elem)
+    finally:
+        del context
+
+
+def extract_record_fields(elem) -> Tuple[Optional[str], Optional[object], dict]:
+    """
+    Извлечь базовые метаданные записи для витрины parsed_records
+    
+    Returns:
+        Tuple (record_key, record_date, payload_json)
+    """
+    record_key = None
+    record_date = None
+    payload_json = {}
+    
+    # Пробуем извлечь GUID/номер/дату и другие поля из элементов
+    try:
+        # Один проход по поддереву вместо отдельного поиска на каждое поле:
+        # первый в порядке документа элемент по локальному имени (в любом
+        # namespace) и по паре (namespace, имя) - как это делал бы find()
+        first_any = {}
+        first_by_ns = {}
+        for child in elem.iterdescendants():
+            tag = child.tag
+            if not isinstance(tag, str):
+                continue
+            if tag[0] == '{':
+                ns, local_name = tag[1:].split('}', 1)
+            else:
+                ns, local_name = None, tag
+            first_any.setdefault(local_name, child)
+            first_by_ns.setdefault((ns, local_name), child)
+        
+        # Ищем типичные поля
+        guid_elem = first_any.get('GUID')
+        if guid_elem is None:
+            guid_elem = first_any.get('guid')
+        if guid_elem is None:
+            guid_elem = first_any.get('Id')
+        if guid_elem is not None and guid_elem.text:
+            record_key = guid_elem.text
+            payload_json['guid'] = guid_elem.text
+        
+        # Ищем дату
+        date_elem = first_any.get('Date')
+        if date_elem is None:
+            date_elem = first_any.get('date')
+        if date_elem is not None and date_elem.text:
+            date_str = date_elem.text[:10]  # Первые 10 символов
+            for fmt in ['%Y-%m-%d', '%d.%m.%Y']:
+                try:
+                    record_date = datetime.strptime(date_str, fmt).date()
+                    payload_json['date'] = date_elem.text
+                    break
+                except ValueError:
+                    continue
+        
+        # Извлекаем дополнительные важные поля
+        ns = elem.nsmap.get(None, "") if elem.nsmap else ""
+        for field_name in IMPORTANT_FIELDS:
+            field_elem = None
+            # Попробуем найти с namespace по умолчанию
+            if ns:
+                field_elem = first_by_ns.get((ns, field_name))
+            # Попробуем найти напрямую
+            if field_elem is None:
+                field_elem = first_by_ns.get((None, field_name))
+            if field_elem is not None and field_elem.text:
+                # Нормализуем имя поля (первая буква маленькая)
+                normalized_name = field_name[0].lower() + field_name[1:]
+                # Обрезаем очень длинные значения
+                value = field_elem.text.strip()
+                if len(value) > 500:
+                    value = value[:500] + '...'
+                if value:
+                    payload_json[normalized_name] = value
+    except Exception:
+        pass
+    
+    return record_key, record_date, payload_json
+
+
+@contextmanager
+def bulk_load():
+    """Включить режим массовой загрузки (COPY, synchronous_commit = off) в текущем потоке"""
+    token = _bulk_load.set(True)
+    try:
+        yield
+    finally:
+        _bulk_load.reset(token)
+
+
+def _copy_value(value) -> str:
+    if value is None:
+        return '\\N'
+    if isinstance(value, (bytes, memoryview)):
+        # bytea в шестнадцатеричном виде (обратная косая черта экранируется)
+        return '\\\\x' + bytes(value).hex()
+    return (str(value).replace('\\', '\\\\').replace('\t', '\\t')
+            .replace('\n', '\\n').replace('\r', '\\r'))
+
+
+def copy_rows(cur, table: str, columns: List[str], rows: List[Tuple]):
+    """Записать строки в таблицу командой COPY (текстовый формат)"""
+    buffer = io.StringIO()
+    for row in rows:
+        buffer.write('\t'.join(_copy_value(value) for value in row))
+        buffer.write('\n')
+    buffer.seek(0)
+    cur.copy_expert(f"COPY {table} ({', '.join(columns)}) FROM STDIN", buffer)
+
+
+class RecordWriter:
+    """Пакетная запись записей в таблицу сырого XML и в parsed_records"""
+    
+    def __init__(self, conn, fragment_id: int, archive_id: Optional[int], data_type: str,
+                 sync_run_id=None, source_name: str = '', batch_size: int = BATCH_SIZE,
+                 position: int = 0, raw_storage: str = 'xml'):
+        if data_type not in RAW_TABLES:
+            raise ValueError(f"Неизвестный тип данных: {data_type}")
+        self.conn = conn
+        self.fragment_id = fragment_id
+        self.archive_id = archive_id
+        self.data_type = data_type
+        self.sync_run_id = sync_run_id
+        self.source_name = source_name
+        self.batch_size = batch_size
+        self.raw_table = RAW_TABLES[data_type]
+        self.written = 0
+        self.quarantined = 0
+        # Пакеты пишутся через COPY в режиме массовой загрузки
+        self.use_copy = _bulk_load.get()
+        # Формат хранения сырого XML (erknm.loader.raw_storage)
+        self.raw_storage = raw_storage
+        # Порядковый номер последней добавленной записи документа
+        self.position = position
+        self._raw_rows = []
+        self._parsed_rows = []
+        self._offsets = []
+    
+    def add(self, xml_content: str, record_key=None, record_date=None, payload_json=None, pointer=None):
+        """
+        Добавить запись в пакет (пакет записывается при заполнении)
+        
+        Args:
+            pointer: (смещение, длина, SHA-256) записи в XML архива для формата pointer
+        """
+        self.position += 1
+        offset, raw_row, parsed_row = self._item(
+            self.position, xml_content, record_key, record_date,
+            json.dumps(payload_json, ensure_ascii=False) if payload_json else None, pointer)
+        self._offsets.append(offset)
+        self._raw_rows.append(raw_row)
+        self._parsed_rows.append(parsed_row)
+        if len(self._raw_rows) >= self.batch_size:
+            self.flush()
+    
+    def insert_record(self, cur, offset: int, xml_content: str, record_key=None, record_date=None,
+                      payload_text: Optional[str] = None, pointer=None):
+        """
+        Записать одну запись в транзакции cur, минуя пакет
+        
+        Позиция фрагмента и счетчик записей не меняются - это делает вызывающий
+        (повтор записи из карантина).
+        
+        Args:
+            offset: Порядковый номер записи в документе
+            payload_text: JSON полей записи (уже сериализованный)
+        """
+        self._insert(cur, [self._item(offset, xml_content, record_key, record_date, payload_text, pointer)])
+    
+    def _item(self, offset: int, xml_content: str, record_key, record_date, payload_text, pointer):
+        """Запись пакета: (позиция в документе, строка сырого XML, строка parsed_records)"""
+        return (
+            offset,
+            (self.fragment_id, xml_content, pointer),
+            (self.archive_id, self.fragment_id, self.data_type, record_key, record_date, payload_text),
+        )
+    
+    def _insert(self, cur, items):
+        """
+        Записать записи (позиция в документе, строка сырого XML, строка parsed_records)
+        
+        Строка сырого XML - (ID фрагмента, XML, указатель на запись в архиве или None).
+        """
+        if self.raw_storage == 'xml':
+            raw_columns = ['xml_fragment_id', 'xml_content']
+            raw_rows = [item[1][:2] for item in items]
+            template = "(%s, %s::xml)"
+        else:
+            raw_columns = ['xml_fragment_id'] + raw_storage_format.STORED_COLUMNS
+            raw_rows = [(item[1][0],) + raw_storage_format.stored_values(item[1][1], self.raw_storage, item[1][2])
+                        for item in items]
+            template = "(%s, %s::xml, %s, %s, %s, %s, %s)"
+        
+        if self.use_copy:
+            copy_rows(cur, self.raw_table, raw_columns, raw_rows)
+            copy_rows(cur, 'parsed_records',
+                      ['zip_archive_id', 'xml_fragment_id', 'record_type', 'record_key', 'record_date', 'payload_json'],
+                      [item[2] for item in items])
+            return
+        
+        from psycopg2.extras import execute_values
+        
+        execute_values(cur, f"""
+            INSERT INTO {self.raw_table} ({', '.join(raw_columns)})
+            VALUES %s
+        """, raw_rows, template=template, page_size=self.batch_size)
+        execute_values(cur, """
+            INSERT INTO parsed_records 
+            (zip_archive_id, xml_fragment_id, record_type, record_key, record_date, payload_json)
+            VALUES %s
+        """, [item[2] for item in items], template="(%s, %s, %s, %s, %s, %s::jsonb)", page_size=self.batch_size)
+    
+    def _record_position(self, cur, batch_written: int):
+        """Зафиксировать позицию фрагмента в транзакции пакета"""
+        # После сбоя позиция указывает ровно на конец последнего записанного пакета
+        cur.execute("""
+            UPDATE xml_fragments
+            SET records_committed = %s, records_count = COALESCE(records_count, 0) + %s
+            WHERE id = %s
+        """, (self.position, batch_written, self.fragment_id))
+    
+    def _insert_isolated(self, cur, items, rejected):
+        """
+        Записать записи в точке сохранения; при отказе - повторить половинами
+        
+        Args:
+            items: кортежи (позиция в документе, строка сырого XML, строка parsed_records)
+            rejected: сюда добавляются (запись, причина) для отклоненных записей
+        """
+        cur.execute("SAVEPOINT erknm_records")
+        try:
+            self._insert(cur, items)
+        except RECORD_ERRORS as e:
+            cur.execute("ROLLBACK TO SAVEPOINT erknm_records")
+            cur.execute("RELEASE SAVEPOINT erknm_records")
+            if len(items) == 1:
+                rejected.append((items[0], str(e).strip()))
+                return
+            middle = len(items) // 2
+            self._insert_isolated(cur, items[:middle], rejected)
+            self._insert_isolated(cur, items[middle:], rejected)
+            return
+        cur.execute("RELEASE SAVEPOINT erknm_records")
+    
+    def flush(self):
+        """
+        Записать накопленный пакет одной транзакцией
+        
+        Отклоненные БД записи пакета переносятся в карантин в той же транзакции.
+        """
+        if not self._raw_rows:
+            return
+        
+        from erknm.loader.quarantine import quarantine_records
+        
+        items = list(zip(self._offsets, self._raw_rows, self._parsed_rows))
+        self._raw_rows, self._parsed_rows, self._offsets = [], [], []
+        
+        rejected = []
+        cur = self.conn.cursor()
+        try:
+            try:
+                self._insert(cur, items)
+            except RECORD_ERRORS:
+                # Быстрый путь не прошел: ищем отклоненные записи делением пакета
+                self.conn.rollback()
+                self._insert_isolated(cur, items, rejected)
+                quarantine_records(cur, self.fragment_id, self.archive_id, self.data_type, rejected)
+            batch_written = len(items) - len(rejected)
+            self._record_position(cur, batch_written)
+            self.conn.commit()
+        except Exception:
+            # Пакет не записан, позиция не сдвинута - повторная загрузка начнет с него
+            self.conn.rollback()
+            raise
+        finally:
+            cur.close()
+        
+        if rejected:
+            self.quarantined += len(rejected)
+            metrics.inc('records_quarantined_total', len(rejected), type=self.data_type)
+            if self.sync_run_id:
+                OperationLog.log(self.sync_run_id, "data",
+                               get_message('records_quarantined', count=len(rejected), total=len(items),
+                                           filename=self.source_name,
+                                           offsets=', '.join(str(item[0]) for item, _ in rejected[:10]),
+                                           reason=rejected[0][1].splitlines()[0] if rejected[0][1] else ''),
+                               level="WARNING", stage='data')
+        
+        previous = self.written
+        self.written += batch_written
+        
+        if self.sync_run_id:
+            # Проверяем остановку после каждого пакета
+            from erknm.db.models import SyncRun
+            if SyncRun.is_stop_requested(self.sync_run_id):
+                raise StopIteration("Остановка запрошена пользователем")
+            if self.written // PROGRESS_LOG_EVERY > previous // PROGRESS_LOG_EVERY:
+                OperationLog.log(self.sync_run_id, "data", 
+                               get_message('processed_records_with_file', 
+                                         count=self.written, 
+                                         filename=self.source_name), 
+                               stage='data')
+
+
+def writer_connection():
+    """Соединение для RecordWriter (в режиме массовой загрузки - без ожидания WAL)"""
+    conn = get_connection()
+    if _bulk_load.get():
+        with conn.cursor() as cur:
+            cur.execute("SET synchronous_commit TO off")
+        conn.commit()
+    return conn
+
+
+def storage_mode(raw_storage: Optional[str] = None, pointers: bool = False) -> str:
+    """
+    Формат хранения сырого XML для загрузки
+    
+    Args:
+        raw_storage: формат ('xml', 'compressed', 'pointer'); None - из настройки raw_storage
+        pointers: источник - несжатый поток XML фрагмента из его ZIP архива;
+            без этого формат pointer заменяется на compressed
+    """
+    if raw_storage is None:
+        raw_storage = raw_storage_format.resolve_mode()
+    if raw_storage == 'pointer' and not pointers:
+        raw_storage = 'compressed'
+    return raw_storage
+
+
+def parse_records(source, source_name: str = '', sync_run_id=None, data_type: Optional[str] = None,
+                  skip: int = 0, raw_storage: str = 'xml',
+                  timings: Optional[dict] = None) -> Iterator[Tuple[str, Optional[Tuple]]]:
+    """
+    Потоково разобрать записи XML в значения для RecordWriter.add
+    
+    Выдает (тип записи, (XML, ключ, дата, payload_json, указатель)); для первых
+    skip записей (уже загружены) вместо значений выдается None - они только
+    разбираются и освобождаются. Разбор не обращается к БД, поэтому может
+    выполняться в другом потоке, чем запись.
+    
+    Args:
+        raw_storage: формат хранения (результат storage_mode)
+        timings: сюда добавляется время этапов xml_parse и payload_extract
+    """
+    if timings is None:
+        timings = {'xml_parse': 0.0, 'payload_extract': 0.0}
+    # Сжатый XML хранится в каноническом виде (в формате pointer - записи без указателя)
+    if raw_storage in ('compressed', 'pointer'):
+        serialize = raw_storage_format.canonicalize
+    else:
+        serialize = lambda elem: etree.tostring(elem, encoding='unicode')
+    # Границы записей в потоке для указателей (erknm.loader.pointer_store)
+    reader = None
+    if raw_storage == 'pointer':
+        from erknm.loader.pointer_store import RecordScanner, ScanningReader
+        reader = ScanningReader(source, RecordScanner(data_type))
+        source = reader
+    position = 0
+    
+    mark = time.perf_counter()
+    for record_type, elem in iter_records(source, data_type):
+        scanner = reader.scanner if reader is not None else None
+        if scanner is not None and data_type is None:
+            scanner.restrict(record_type)
+        data_type = record_type
+        position += 1
+        if position <= skip:
+            # Запись уже загружена в прошлый раз
+            if scanner is not None:
+                scanner.pop(record_type)
+            yield record_type, None
+            mark = time.perf_counter()
+            continue
+        parsed = time.perf_counter()
+        timings['xml_parse'] += parsed - mark
+        record_key, record_date, payload_json = extract_record_fields(elem)
+        pointer = None
+        if scanner is not None:
+            pointer, xml_content = _record_pointer(scanner, record_type, elem, record_key)
+            if pointer is None:
+                # Границы разошлись с разбором - дальше указатели не ведутся
+                reader.scanner = None
+                if sync_run_id:
+                    OperationLog.log(sync_run_id, "data",
+                                   get_message('pointer_fallback', position=position, filename=source_name),
+                                   level="WARNING", stage='data')
+        if pointer is None:
+            xml_content = serialize(elem)
+        timings['payload_extract'] += time.perf_counter() - parsed
+        yield record_type, (xml_content, record_key, record_date, payload_json, pointer)
+        mark = time.perf_counter()
+
+
+def load_records(source, fragment_id: int, archive_id: Optional[int], source_name: str,
+                 sync_run_id=None, data_type: Optional[str] = None,
+                 skip: int = 0, staging: bool = False,
+                 raw_storage: Optional[str] = None, pointers: bool = False) -> Tuple[int, Optional[str]]:
+    """
+    Потоково разобрать XML и загрузить записи в БД пакетами
+    
+    Args:
+        source: бинарный поток или путь к XML
+        fragment_id: ID XML-фрагмента
+        archive_id: ID архива (для parsed_records), может быть None
+        source_name: имя файла для журнала
+        sync_run_id: ID запуска синхронизации для логирования
+        data_type: тип данных; если None - определяется по первой открытой (внешней) записи
+        skip: позиция фрагмента (records_committed) - столько первых записей
+            уже записано, они только разбираются и освобождаются
+        staging: писать в промежуточную таблицу staging_records
+            (erknm.loader.staging), перенос в итоговые таблицы - staging.merge
+        raw_storage: формат хранения сырого XML ('xml', 'compressed', 'pointer');
+            None - из настройки raw_storage
+        pointers: source - несжатый поток XML фрагмента из его ZIP архива
+            (от начала); без этого формат pointer заменяется на compressed
+    
+    Returns:
+        Tuple (количество загруженных в этот раз записей, тип данных)
+    """
+    if staging:
+        from erknm.loader.staging import StagingWriter as writer_class
+    else:
+        writer_class = RecordWriter
+    raw_storage = storage_mode(raw_storage, pointers)
+    
+    conn = writer_connection()
+    writer = None
+    # Время разбора, извлечения полей и записи копится локально и сбрасывается
+    # в метрики пакетами: таймер на каждую запись заметно замедлил бы цикл
+    timings = {'xml_parse': 0.0, 'payload_extract': 0.0, 'db_insert': 0.0}
+    pending = 0
+    
+    try:
+        for record_type, values in parse_records(source, source_name, sync_run_id, data_type,
+                                                 skip=skip, raw_storage=raw_storage, timings=timings):
+            data_type = record_type
+            if values is None:
+                continue
+            if writer is None:
+                writer = writer_class(conn, fragment_id, archive_id, data_type,
+                                      sync_run_id=sync_run_id, source_name=source_name,
+                                      position=skip, raw_storage=raw_storage)
+            started = time.perf_counter()
+            writer.add(*values)
+            timings['db_insert'] += time.perf_counter() - started
+            pending += 1
+            if pending >= BATCH_SIZE:
+                _report_timings(timings, pending)
+                pending = 0
+        
+        if writer is not None:
+            started = time.perf_counter()
+            writer.flush()
+            timings['db_insert'] += time.perf_counter() - started
+        
+        return (writer.written if writer else 0), data_type
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        _report_timings(timings, pending)
+        # В промежуточном режиме записи учитываются при переносе
+        if writer is not None and writer.written and not staging:
+            metrics.inc('records_total', writer.written, type=writer.data_type)
+        conn.close()
+
+
+def _record_pointer(scanner, record_type: str, elem, record_key) -> Tuple[Optional[Tuple], Optional[str]]:
+    """Указатель (смещение, длина, SHA-256) и XML записи по границам из потока"""
+    span = scanner.pop(record_type, elem.sourceline, record_key)
+    if span is None:
+        return None, None
+    offset, length, sha256, data = span
+    try:
+        return (offset, length, sha256), data.decode('utf-8')
+    except UnicodeDecodeError:
+        # Документ не в UTF-8: при чтении указателя текст не восстановить
+        return None, None
+
+
+def _report_timings(timings: dict, records: int):
+    """Передать накопленное время этапов в метрики и обнулить его"""
+    for stage, seconds in timings.items():
+        if seconds:
+            metrics.add_time(stage, seconds, calls=records)
+            timings[stage] = 0.0
@@ -3,27 +3,37 @@ import zipfile
 import hashlib
 import io
 from pathlib import Path
-from typing import List, Optional, Tuple
-import requests
-from lxml import etree
-from erknm.config import DOWNLOAD_DIR, EXTRACT_ZIPS
+from typing import Dict, List, Optional, Tuple
+from erknm import metrics
+from erknm.config import EXTRACT_ZIPS
+from erknm.sync import http_client, rate_limiter
 from erknm.db.models import ZipArchive, XmlFragment, OperationLog
 from erknm.logger.messages import get_message
 
+# Интервал проверки остановки при скачивании архива, байт
+STOP_CHECK_BYTES = 8 * 1024 * 1024
+
 
 def calculate_sha256(file_path: Path) -> str:
     """Вычислить SHA256 хеш файла"""
     sha256_hash = hashlib.sha256()
-    with open(file_path, "rb") as f:
-        for byte_block in iter(lambda: f.read(4096), b""):
-            sha256_hash.update(byte_block)
+    size = 0
+    with metrics.timer('sha256'):
+        with open(file_path, "rb") as f:
+            for byte_block in iter(lambda: f.read(4096), b""):
+                sha256_hash.update(byte_block)
+                size += len(byte_block)
+    metrics.inc('bytes_total', size, kind='sha256')
     return sha256_hash.hexdigest()
 
 
-def download_zip(url: str, output_path: Path, sync_run_id=None, max_retries=5, delay=10.0) -> Path:
+def download_zip(url: str, output_path: Path, sync_run_id=None, max_retries=5, delay=10.0) -> Tuple[Path, str]:
     """
     Скачать ZIP-архив с retry механизмом и правильными заголовками браузера
     
+    Частота запросов к хосту ограничивается erknm.sync.rate_limiter; ответы
+    429/403 и HTML вместо ZIP снижают ее.
+    
     Args:
         url: URL ZIP-архива
         output_path: Путь для сохранения файла
@@ -32,12 +42,9 @@ def download_zip(url: str, output_path: Path, sync_run_id=None, max_retries=5, d
         delay: Базовая задержка между попытками в секундах
     
     Returns:
-        Path к скачанному файлу
+        (Path к скачанному файлу, SHA-256 файла - вычисляется по мере скачивания)
     """
-    import time
     import random
-    from requests.adapters import HTTPAdapter
-    from urllib3.util.retry import Retry
     
     # Проверяем, не скачан ли уже файл
     if output_path.exists():
@@ -45,29 +52,22 @@ def download_zip(url: str, output_path: Path, sync_run_id=None, max_retries=5, d
             OperationLog.log(sync_run_id, "dataset", 
                           get_message('zip_already_downloaded') + f": {output_path.name}", 
                           stage='dataset')
-        return output_path
-    
-    # Заголовки как у реального браузера (проверено в тестах)
-    headers = {
-        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
-        'Accept': '*/*',
-        'Accept-Language': 'ru-RU,ru;q=0.9,en-US;q=0.8,en;q=0.7',
-        'Accept-Encoding': 'gzip, deflate, br',
-        'Connection': 'keep-alive',
-        'Referer': 'https://proverki.gov.ru/',
-        'Sec-Fetch-Dest': 'document',
-        'Sec-Fetch-Mode': 'navigate',
-        'Sec-Fetch-Site': 'same-origin',
-    }
+        return output_path, calculate_sha256(output_path)
     
     last_error = None
+    # Предыдущая попытка получила ответ-ограничение (429/403)
+    throttled = False
     
     for attempt in range(max_retries):
+        # Ответ уже учтен ограничителем частоты (чтобы не учитывать ошибку дважды)
+        signalled = False
+        response = None
         try:
             # Задержка между попытками (кроме первой)
             if attempt > 0:
-                # Экспоненциальная задержка с jitter
-                wait_time = delay * (2 ** attempt) + random.uniform(0, 2)
+                # Экспоненциальная задержка с jitter; после ограничения паузу
+                # (Retry-After) выдерживает ограничитель частоты
+                wait_time = 0 if throttled else delay * (2 ** attempt) + random.uniform(0, 2)
                 if sync_run_id:
                     OperationLog.log(sync_run_id, "dataset", 
                                    get_message('retry_attempt', 
@@ -75,34 +75,27 @@ def download_zip(url: str, output_path: Path, sync_run_id=None, max_retries=5, d
                                               max_retries=max_retries, 
                                               wait_time=wait_time), 
                                    stage='dataset')
-                time.sleep(wait_time)
+                metrics.inc('retries_total', kind='zip')
+                metrics.sleep(wait_time, 'retry_backoff')
+            throttled = False
             
             if sync_run_id:
                 OperationLog.log(sync_run_id, "dataset", 
                                get_message('zip_downloading') + f": {url} (попытка {attempt + 1}/{max_retries})", 
                                stage='dataset')
             
-            # Создаем сессию с retry
-            session = requests.Session()
-            session.headers.update(headers)
-            retry_strategy = Retry(
-                total=1,  # Уменьшаем retry на уровне адаптера, т.к. у нас свой retry
-                backoff_factor=1,
-                status_forcelist=[429, 500, 502, 503, 504],
-                allowed_methods=["GET", "HEAD"]
-            )
-            adapter = HTTPAdapter(max_retries=retry_strategy)
-            session.mount("http://", adapter)
-            session.mount("https://", adapter)
+            # Ждем разрешения ограничителя частоты запросов к хосту
+            rate_limiter.acquire(url, sync_run_id)
             
-            response = session.get(
-                url, 
-                timeout=(30, 300),  # connect timeout, read timeout (увеличено)
-                stream=True
-            )
+            # Соединение с хостом берется из общего пула (keep-alive между архивами)
+            response = http_client.get(url)
             
             # Валидация HTTP статуса - должен быть 200
             if response.status_code != 200:
+                signal = rate_limiter.signal_for_status(response.status_code)
+                rate_limiter.feedback(url, signal, rate_limiter.parse_retry_after(response.headers.get('Retry-After')))
+                signalled = True
+                throttled = signal == rate_limiter.SIGNAL_THROTTLED
                 raise Exception(f"HTTP статус {response.status_code} вместо 200. Content-Type: {response.headers.get('Content-Type', 'unknown')}")
             
             # Атомарная загрузка: сначала скачиваем в .part файл
@@ -116,23 +109,26 @@ def download_zip(url: str, output_path: Path, sync_run_id=None, max_retries=5, d
             file_size = 0
             content_type = response.headers.get('Content-Type', '')
             
-            # Скачиваем в .part файл
+            # Скачиваем в .part файл, хеш - по мере записи
             from erknm.db.models import SyncRun
-            chunk_count = 0
+            # Размер скачанного при прошлой проверке остановки
+            checked_size = 0
+            sha256_hash = hashlib.sha256()
             with open(temp_path, 'wb') as f:
-                for chunk in response.iter_content(chunk_size=8192):
-                    # Проверяем остановку каждые 1000 chunk-ов (примерно каждые 8MB)
-                    if sync_run_id and chunk_count > 0 and chunk_count % 1000 == 0:
+                for chunk in response.iter_content(http_client.CHUNK_SIZE):
+                    # Проверяем остановку примерно каждые 8MB
+                    if sync_run_id and file_size - checked_size >= STOP_CHECK_BYTES:
+                        checked_size = file_size
                         if SyncRun.is_stop_requested(sync_run_id):
                             response.close()
-                            session.close()
                             if temp_path.exists():
                                 temp_path.unlink()
                             raise StopIteration("Остановка запрошена пользователем")
-                    if chunk:
-                        f.write(chunk)
-                        file_size += len(chunk)
-                        chunk_count += 1
+                    f.write(chunk)
+                    sha256_hash.update(chunk)
+                    file_size += len(chunk)
+            # Соединение возвращается в пул
+            response.close()
             
             # Проверяем, что файл не пустой
             if not temp_path.exists() or temp_path.stat().st_size == 0:
@@ -145,7 +141,7 @@ def download_zip(url: str, output_path: Path, sync_run_id=None, max_retries=5, d
             first_bytes = b''
             try:
                 with open(temp_path, 'rb') as f:
-                    first_bytes = f.read(4)  # Читаем первые 4 байта для диагностики
+                    first_bytes = f.read(512)  # Начало файла для диагностики (и распознавания HTML)
                     # PK - это сигнатура ZIP файла (PK\x03\x04 или PK\x05\x06)
                     if first_bytes[:2] == b'PK':
                         # Дополнительная проверка через zipfile
@@ -155,12 +151,17 @@ def download_zip(url: str, output_path: Path, sync_run_id=None, max_retries=5, d
                 is_valid_zip = False
             
             if not is_valid_zip:
+                # HTML вместо архива - заглушка/капча, источник ограничивает запросы
+                rate_limiter.feedback(url, rate_limiter.SIGNAL_THROTTLED
+                                      if rate_limiter.is_html(content_type, first_bytes) else rate_limiter.SIGNAL_OK)
+                signalled = True
+                
                 # Quarantine: сохраняем диагностическую информацию
                 error_details = {
                     'url': url,
                     'content_type': content_type,
                     'file_size': file_size,
-                    'first_bytes_hex': first_bytes.hex() if first_bytes else 'empty',
+                    'first_bytes_hex': first_bytes[:4].hex() if first_bytes else 'empty',
                     'first_bytes_repr': repr(first_bytes[:100]) if first_bytes else 'empty'
                 }
                 
@@ -214,19 +215,19 @@ def download_zip(url: str, output_path: Path, sync_run_id=None, max_retries=5, d
                                get_message('zip_downloaded') + f": {output_path.name} ({output_path.stat().st_size} bytes)", 
                                stage='dataset')
             
-            # КРИТИЧЕСКИ ВАЖНО: Задержка перед следующим запросом
-            # Аналогично мета-XML, задержка 10+ секунд работает надежно
-            wait_time = delay + random.uniform(3, 7)  # 10-17 секунд
-            if sync_run_id:
-                OperationLog.log(sync_run_id, "dataset", 
-                               get_message('delay_before_next_request', delay=wait_time), 
-                               stage='dataset')
-            time.sleep(wait_time)
+            # Паузу перед следующим запросом выдерживает ограничитель частоты
+            rate_limiter.feedback(url, rate_limiter.SIGNAL_OK)
+            metrics.inc('bytes_total', file_size, kind='download')
             
-            return output_path
+            return output_path, sha256_hash.hexdigest()
             
+        except StopIteration:
+            # Остановка запрошена - пробрасываем дальше
+            raise
         except Exception as e:
             error_str = str(e)
+            if response is not None:
+                response.close()
             
             # Очищаем .part файл при ошибке
             temp_path = output_path.with_suffix(output_path.suffix + '.part')
@@ -259,6 +260,8 @@ def download_zip(url: str, output_path: Path, sync_run_id=None, max_retries=5, d
             # Ретраи на SSL/timeout/5xx ошибки
             if is_connection_error or is_server_error:
                 is_retryable_error = True
+                if not signalled:
+                    rate_limiter.feedback(url, rate_limiter.SIGNAL_ERROR)
                 last_error = get_message('connection_error') + f": {error_str}"
             else:
                 last_error = get_message('download_error') + f": {error_str}"
@@ -267,13 +270,13 @@ def download_zip(url: str, output_path: Path, sync_run_id=None, max_retries=5, d
                 OperationLog.log(sync_run_id, "dataset", last_error, level="WARNING", stage='dataset')
             
             # Для ретраируемых ошибок делаем задержку перед повтором
-            if is_retryable_error and attempt < max_retries - 1:
+            if is_retryable_error and not throttled and attempt < max_retries - 1:
                 extra_wait = delay * (2 ** attempt) + random.uniform(2, 5)
                 if sync_run_id:
                     OperationLog.log(sync_run_id, "dataset", 
                                    get_message('additional_delay_before_retry', delay=extra_wait), 
                                    stage='dataset')
-                time.sleep(extra_wait)
+                metrics.sleep(extra_wait, 'retry_backoff')
             
             if attempt == max_retries - 1:
                 error_msg = get_message('download_error_after_retries', url=url, max_retries=max_retries) + f": {last_error}"
@@ -339,11 +342,77 @@ def select_xml_from_zip(zip_path: Path, sync_run_id=None) -> Optional[Tuple[str,
         raise Exception(error_msg)
 
 
+def select_xml_members(zip_path: Path, sync_run_id=None) -> List[Tuple[str, zipfile.ZipInfo]]:
+    """
+    Все XML файлы ZIP архива (режим zip_members = 'all') в порядке имен
+    
+    Returns:
+        Список (имя файла, ZipInfo); пустой, если XML не найден
+    """
+    try:
+        with zipfile.ZipFile(zip_path, 'r') as zip_ref:
+            members = [(info.filename, info) for info in zip_ref.infolist()
+                       if info.filename.lower().endswith('.xml') and not info.is_dir()]
+    except Exception as e:
+        error_msg = get_message('xml_selection_error') + f": {zip_path}: {str(e)}"
+        if sync_run_id:
+            OperationLog.log(sync_run_id, "dataset", error_msg, level="ERROR", stage='dataset')
+        raise Exception(error_msg)
+    
+    if not members and sync_run_id:
+        OperationLog.log(sync_run_id, "dataset", 
+                       get_message('xml_not_found_in_zip') + f" {zip_path.name}", 
+                       level="WARNING", stage='dataset')
+    members.sort(key=lambda member: member[0])
+    return members
+
+
+def member_fingerprint(zip_info: zipfile.ZipInfo) -> str:
+    """Отпечаток XML в архиве (CRC-32 и размер), к которому относится позиция фрагмента"""
+    return f"{zip_info.CRC:08x}:{zip_info.file_size}"
+
+
+def prepare_fragment(archive_id: int, xml_name: str, zip_info: zipfile.ZipInfo) -> Tuple[Dict, int, int]:
+    """
+    Фрагмент для загрузки XML архива
+    
+    Фрагмент прерванной загрузки этого XML продолжается с его позиции;
+    если XML в архиве другой (или позиция не велась) - загружается заново.
+    
+    Returns:
+        Tuple (фрагмент, позиция - сколько записей пропустить, уже загружено записей)
+    """
+    fingerprint = member_fingerprint(zip_info)
+    skip = 0
+    committed = 0
+    fragment = XmlFragment.find_latest(archive_id, xml_name)
+    if fragment is None:
+        # Создаем запись о XML-фрагменте (без file_path, т.к. не распаковываем)
+        fragment = XmlFragment.create(
+            zip_archive_id=archive_id,
+            file_name=xml_name,
+            file_path=None,  # Не распаковываем на диск
+            status='parsing',
+            source_fingerprint=fingerprint
+        )
+    elif fragment['source_fingerprint'] != fingerprint:
+        XmlFragment.reset_progress(fragment['id'], fingerprint)
+    else:
+        skip = fragment['records_committed'] or 0
+        committed = fragment['records_count'] or 0
+    return fragment, skip, committed
+
+
 def stream_parse_xml_from_zip(zip_path: Path, xml_name: str, zip_info: zipfile.ZipInfo,
                                archive_id: int, sync_run_id=None) -> int:
     """
     Потоковый парсинг XML из ZIP и загрузка данных в БД.
     Использует iterparse для обработки больших XML без загрузки всего файла в память.
+    Повторный вызов для того же XML архива продолжает загрузку с позиции
+    фрагмента (xml_fragments.records_committed), а не начинает заново.
+    В режиме ingest_mode = 'staging' записи загружаются через промежуточную
+    таблицу (erknm.loader.staging) и переносятся одной транзакцией, которая
+    отмечает архив обработанным.
     
     Args:
         zip_path: Путь к ZIP архиву
@@ -353,16 +422,14 @@ def stream_parse_xml_from_zip(zip_path: Path, xml_name: str, zip_info: zipfile.Z
         sync_run_id: ID запуска синхронизации для логирования
     
     Returns:
-        Количество загруженных записей
+        Количество загруженных в этот раз записей
     """
-    from erknm.db.connection import get_connection, get_cursor
-    from erknm.classifier.classifier import classify_xml_file
-    
-    conn = get_connection()
-    cur = get_cursor(conn)
+    from erknm.classifier.classifier import sniff_xml_member
+    from erknm.loader import staging
+    from erknm.loader.xml_stream import load_records
     
     records_count = 0
-    data_type = None
+    fragment_id = None
     
     try:
         if sync_run_id:
@@ -370,224 +437,45 @@ def stream_parse_xml_from_zip(zip_path: Path, xml_name: str, zip_info: zipfile.Z
                            get_message('streaming_parse_started') + f": {xml_name} (estimated size: {zip_info.file_size} bytes)", 
                            stage='dataset')
         
-        # Используем ZipInfo.file_size для оценки размера XML без распаковки
-        
-        # Создаем запись о XML-фрагменте (без file_path, т.к. не распаковываем)
-        fragment = XmlFragment.create(
-            zip_archive_id=archive_id,
-            file_name=xml_name,
-            file_path=None,  # Не распаковываем на диск
-            status='parsing'
-        )
+        fragment, skip, committed = prepare_fragment(archive_id, xml_name, zip_info)
         fragment_id = fragment['id']
+        XmlFragment.update_status(fragment_id, 'parsing')
+        
+        # Фрагмент, начатый прямой загрузкой, ей же и продолжается
+        use_staging = not skip and staging.resolve_mode() == 'staging'
+        if use_staging:
+            skip = staging.resume_position(fragment_id)
+        
+        if skip and sync_run_id:
+            OperationLog.log(sync_run_id, "dataset",
+                           get_message('fragment_resumed', filename=xml_name, position=skip, count=committed),
+                           stage='dataset')
         
-        # Открываем ZIP и читаем XML как поток байтов
-        # КРИТИЧНО: lxml.etree.iterparse требует bytes stream, где .read() возвращает bytes
         with zipfile.ZipFile(zip_path, 'r') as zip_ref:
-            # zipfile.ZipFile.open() БЕЗ параметра mode по умолчанию открывает в бинарном режиме
-            # Но явно указываем, что нужен bytes stream для iterparse
-            zip_file_obj = zip_ref.open(xml_name)  # По умолчанию бинарный режим
-            import io
-            
-            # Оборачиваем в BufferedReader для гарантии правильного интерфейса
-            # BufferedReader гарантирует, что .read() возвращает bytes
-            zip_file = io.BufferedReader(zip_file_obj, buffer_size=8192)
+            # Тип данных определяем по началу документа (кэшируется по CRC члена архива)
+            data_type = sniff_xml_member(zip_ref, xml_name, zip_info)['data_type']
+            if data_type:
+                XmlFragment.update_status(fragment_id, 'parsing', data_type=data_type)
             
-            try:
-                # lxml.etree.iterparse требует bytes stream, где .read() возвращает bytes
-                context = etree.iterparse(zip_file, events=('end',), huge_tree=True, recover=True)
-                
-                # Переменные для отслеживания
-                root_elem = None
-                first_elem_processed = False
-                
-                for event, elem in context:
-                    tag_lower = elem.tag.lower() if elem.tag else ''
-                    
-                    # Определяем корневой элемент при первом проходе
-                    if root_elem is None and event == 'end':
-                        # Находим корневой элемент
-                        parent = elem.getparent()
-                        while parent is not None:
-                            root_elem = parent
-                            parent = parent.getparent()
-                        if root_elem is None:
-                            root_elem = elem.getroottree().getroot()
-                        
-                        # Определяем тип по корневому элементу
-                        root_tag_lower = root_elem.tag.lower() if root_elem.tag else ''
-                        if 'plan' in root_tag_lower:
-                            data_type = 'plan'
-                        elif 'inspection' in root_tag_lower:
-                            data_type = 'inspection'
-                    
-                    # Обрабатываем только конечные элементы PLAN и INSPECTION
-                    # Извлекаем имя тега без namespace
-                    tag_name = tag_lower.split('}')[-1] if '}' in tag_lower else tag_lower
-                    is_plan_tag = (tag_name == 'plan')
-                    is_inspection_tag = (tag_name == 'inspection')
-                    
-                    if event == 'end' and (is_plan_tag or is_inspection_tag):
-                        # Если тип еще не определен, определяем по самому элементу
-                        if not data_type:
-                            if is_plan_tag:
-                                data_type = 'plan'
-                            elif is_inspection_tag:
-                                data_type = 'inspection'
-                        
-                        if not first_elem_processed and data_type:
-                            XmlFragment.update_status(fragment_id, 'parsing', data_type=data_type)
-                            first_elem_processed = True
-                        
-                        if data_type:
-                            xml_content = etree.tostring(elem, encoding='unicode')
-                            try:
-                                # Извлекаем базовые метаданные из элемента
-                                record_key = None
-                                record_date = None
-                                payload_json = {}
-                                
-                                # Пробуем извлечь GUID/номер/дату и другие поля из элементов
-                                try:
-                                    # Ищем типичные поля
-                                    guid_elem = elem.find('.//{*}GUID')
-                                    if guid_elem is None:
-                                        guid_elem = elem.find('.//{*}guid')
-                                    if guid_elem is None:
-                                        guid_elem = elem.find('.//{*}Id')
-                                    if guid_elem is not None and guid_elem.text:
-                                        record_key = guid_elem.text
-                                        payload_json['guid'] = guid_elem.text
-                                    
-                                    # Ищем дату
-                                    date_elem = elem.find('.//{*}Date')
-                                    if date_elem is None:
-                                        date_elem = elem.find('.//{*}date')
-                                    if date_elem is not None and date_elem.text:
-                                        try:
-                                            from datetime import datetime
-                                            date_str = date_elem.text[:10]  # Первые 10 символов
-                                            for fmt in ['%Y-%m-%d', '%d.%m.%Y']:
-                                                try:
-                                                    record_date = datetime.strptime(date_str, fmt).date()
-                                                    payload_json['date'] = date_elem.text
-                                                    break
-                                                except:
-                                                    continue
-                                        except:
-                                            pass
-                                    
-                                    # Извлекаем дополнительные важные поля
-                                    # Список типичных полей для извлечения
-                                    important_fields = [
-                                        'Number', 'number', 'Num', 'num',  # Номер
-                                        'Name', 'name', 'Title', 'title',  # Название
-                                        'Status', 'status', 'State', 'state',  # Статус
-                                        'Type', 'type', 'Kind', 'kind',  # Тип
-                                        'Region', 'region', 'Subject', 'subject',  # Регион
-                                        'Organization', 'organization', 'Org', 'org',  # Организация
-                                        'INN', 'inn', 'OGRN', 'ogrn', 'KPP', 'kpp',  # Реквизиты
-                                        'StartDate', 'startDate', 'EndDate', 'endDate',  # Даты
-                                        'Address', 'address', 'Location', 'location',  # Адрес
-                                        'Inspector', 'inspector', 'Executor', 'executor',  # Исполнитель
-                                        'Result', 'result', 'Conclusion', 'conclusion',  # Результат
-                                        'Violations', 'violations', 'ViolationsCount',  # Нарушения
-                                        'ActNumber', 'actNumber', 'OrderNumber', 'orderNumber',  # Номера документов
-                                    ]
-                                    
-                                    for field_name in important_fields:
-                                        field_elem = None
-                                        # Попробуем найти с namespace
-                                        if elem.nsmap:
-                                            ns = elem.nsmap.get(None, "")
-                                            if ns:
-                                                field_elem = elem.find(f'.//{{{ns}}}{field_name}')
-                                        # Попробуем найти по local-name
-                                        if field_elem is None:
-                                            try:
-                                                field_elem = elem.find(f'.//*[local-name()="{field_name}"]')
-                                            except:
-                                                pass
-                                        # Попробуем найти напрямую
-                                        if field_elem is None:
-                                            field_elem = elem.find(f'.//{field_name}')
-                                        if field_elem is not None and field_elem.text:
-                                            # Нормализуем имя поля (первая буква маленькая)
-                                            normalized_name = field_name[0].lower() + field_name[1:] if field_name else field_name
-                                            # Обрезаем очень длинные значения
-                                            value = field_elem.text.strip()
-                                            if len(value) > 500:
-                                                value = value[:500] + '...'
-                                            if value:
-                                                payload_json[normalized_name] = value
-                                except:
-                                    pass
-                                
-                                # Сохраняем в plans_raw/inspections_raw
-                                if data_type == 'plan':
-                                    cur.execute("""
-                                        INSERT INTO plans_raw (xml_fragment_id, xml_content)
-                                        VALUES (%s, %s::xml)
-                                    """, (fragment_id, xml_content))
-                                elif data_type == 'inspection':
-                                    cur.execute("""
-                                        INSERT INTO inspections_raw (xml_fragment_id, xml_content)
-                                        VALUES (%s, %s::xml)
-                                    """, (fragment_id, xml_content))
-                                
-                                # Сохраняем в parsed_records для витрины (если таблица существует)
-                                try:
-                                    import json
-                                    cur.execute("""
-                                        INSERT INTO parsed_records 
-                                        (zip_archive_id, xml_fragment_id, record_type, record_key, record_date, payload_json)
-                                        VALUES (%s, %s, %s, %s, %s, %s::jsonb)
-                                    """, (archive_id, fragment_id, data_type, record_key, record_date, 
-                                          json.dumps(payload_json) if payload_json else None))
-                                except Exception as e:
-                                    # Таблица может не существовать - это нормально, пропускаем
-                                    pass
-                                
-                                records_count += 1
-                                
-                                # Коммитим пакетами для производительности
-                                if records_count % 100 == 0:
-                                    conn.commit()
-                                    # Проверяем остановку каждые 100 записей
-                                    if sync_run_id:
-                                        from erknm.db.models import SyncRun
-                                        if SyncRun.is_stop_requested(sync_run_id):
-                                            conn.rollback()
-                                            raise StopIteration("Остановка запрошена пользователем")
-                                    if sync_run_id and records_count % 1000 == 0:
-                                        OperationLog.log(sync_run_id, "data", 
-                                                       get_message('processed_records_with_file', 
-                                                                 count=records_count, 
-                                                                 filename=xml_name), 
-                                                       stage='data')
-                            except Exception as e:
-                                # Логируем ошибку, но продолжаем обработку
-                                if sync_run_id:
-                                    OperationLog.log(sync_run_id, "data", 
-                                                   get_message('insert_error') + f": {str(e)}", 
-                                                   level="WARNING", stage='data')
-                                conn.rollback()
-                        
-                        # Очищаем элемент из памяти
-                        elem.clear()
-                        # Очищаем предков для освобождения памяти
-                        while elem.getprevious() is not None:
-                            del elem.getparent()[0]
-                
-                # Финальный коммит
-                if records_count > 0:
-                    conn.commit()
-            finally:
-                zip_file.close()
+            # ZipFile.open() отдает бинарный поток, который iterparse читает по частям
+            with zip_ref.open(xml_name) as zip_file:
+                records_count, detected_type = load_records(
+                    io.BufferedReader(zip_file, buffer_size=64 * 1024),
+                    fragment_id, archive_id, xml_name,
+                    sync_run_id=sync_run_id, data_type=data_type, skip=skip, staging=use_staging,
+                    pointers=True
+                )
+        
+        metrics.inc('bytes_total', zip_info.file_size, kind='xml')
+        
+        if use_staging and detected_type:
+            records_count = staging.merge(fragment_id, archive_id, detected_type,
+                                          sync_run_id=sync_run_id, source_name=xml_name)
         
         # Обновляем статус фрагмента
-        if data_type and records_count > 0:
-            XmlFragment.update_status(fragment_id, 'loaded', records_count=records_count)
+        if detected_type and committed + records_count > 0:
+            XmlFragment.update_status(fragment_id, 'loaded', records_count=committed + records_count,
+                                      data_type=detected_type)
             if sync_run_id:
                 OperationLog.log(sync_run_id, "data", 
                                get_message('records_inserted_updated', count=records_count, filename=xml_name), 
@@ -605,10 +493,8 @@ def stream_parse_xml_from_zip(zip_path: Path, xml_name: str, zip_info: zipfile.Z
         
     except StopIteration:
         # Остановка запрошена - пробрасываем дальше
-        conn.rollback()
         raise
     except Exception as e:
-        conn.rollback()
         error_msg = str(e)
         if fragment_id:
             XmlFragment.update_status(fragment_id, 'error', error_message=error_msg)
@@ -617,9 +503,6 @@ def stream_parse_xml_from_zip(zip_path: Path, xml_name: str, zip_info: zipfile.Z
                            get_message('parsing_error') + f" {xml_name}: {error_msg}", 
                            level="ERROR", stage='dataset')
         raise
-    finally:
-        cur.close()
-        conn.close()
 
 
 def extract_zip(zip_path: Path, extract_to: Path, sync_run_id=None) -> List[Path]:
@@ -661,19 +544,46 @@ def extract_zip(zip_path: Path, extract_to: Path, sync_run_id=None) -> List[Path
         raise Exception(error_msg)
 
 
-def process_zip_archive(url: str, sync_run_id=None) -> int:
+def process_zip_archive(url: str, sync_run_id=None, known: Optional[dict] = None) -> int:
     """
     Обработать ZIP-архив: скачать, прочитать XML напрямую из ZIP (streaming), загрузить в БД.
     Не распаковывает XML на диск.
     Строгая последовательность: download → parse → insert → next
     
+    Args:
+        url: URL архива
+        sync_run_id: ID запуска синхронизации
+        known: Снимок состояния архивов (ZipArchive.load_states); уже обработанные
+               и NOT_ZIP архивы из снимка пропускаются без обращения к БД.
+               Снимок обновляется по результату обработки
+    
     Returns:
         Количество обработанных записей (не файлов)
     """
     from erknm.db.models import SyncRun
+    from erknm.loader import object_store
+    from erknm.sync import retention
     
     zip_filename = Path(url).name
-    zip_path = DOWNLOAD_DIR / "zips" / zip_filename
+    
+    # Шаг 0: Проверка по снимку, загруженному один раз на запуск
+    known_state = known.get(url) if known is not None else None
+    if known_state is not None:
+        if known_state['status'] == 'processed':
+            if sync_run_id:
+                sha_short = known_state['sha256_hash'][:16] + '...' if known_state['sha256_hash'] else 'N/A'
+                OperationLog.log(sync_run_id, "dataset", 
+                               get_message('zip_already_processed') + f": {zip_filename} (sha256: {sha_short})", 
+                               stage='dataset')
+            metrics.inc('archives_total', result='skipped')
+            return 0
+        if known_state['status'] == 'error' and known_state['error_message'] and 'NOT_ZIP' in known_state['error_message']:
+            if sync_run_id:
+                OperationLog.log(sync_run_id, "dataset", 
+                               get_message('zip_marked_not_zip') + f": {zip_filename}", 
+                               level="WARNING", stage='dataset')
+            metrics.inc('archives_total', result='not_zip')
+            return 0
     
     # Проверяем остановку перед началом обработки
     if sync_run_id and SyncRun.is_stop_requested(sync_run_id):
@@ -683,6 +593,8 @@ def process_zip_archive(url: str, sync_run_id=None) -> int:
     from erknm.db.connection import get_connection, get_cursor
     conn = get_connection()
     cur = get_cursor(conn)
+    # Строка архива от прошлой обработки: ее объект не скачивается повторно
+    existing_row = None
     try:
         # Проверяем по URL
         existing = ZipArchive.exists(url)
@@ -696,6 +608,7 @@ def process_zip_archive(url: str, sync_run_id=None) -> int:
                         OperationLog.log(sync_run_id, "dataset", 
                                        get_message('zip_already_processed') + f": {zip_filename} (sha256: {sha_short})", 
                                        stage='dataset')
+                    metrics.inc('archives_total', result='skipped')
                     return 0
                 # Если файл помечен как NOT_ZIP, не обрабатываем его снова
                 if existing_row['status'] == 'error' and existing_row['error_message'] and 'NOT_ZIP' in existing_row['error_message']:
@@ -703,23 +616,9 @@ def process_zip_archive(url: str, sync_run_id=None) -> int:
                         OperationLog.log(sync_run_id, "dataset", 
                                        get_message('zip_marked_not_zip') + f": {zip_filename}", 
                                        level="WARNING", stage='dataset')
+                    metrics.inc('archives_total', result='not_zip')
                     return 0
         
-        # Если файл уже скачан, проверяем по хешу
-        if zip_path.exists():
-            file_size = zip_path.stat().st_size
-            sha256_hash = calculate_sha256(zip_path)
-            
-            # Проверяем по хешу
-            cur.execute("SELECT id, status FROM zip_archives WHERE sha256_hash = %s", (sha256_hash,))
-            existing_by_hash = cur.fetchone()
-            if existing_by_hash and existing_by_hash['status'] == 'processed':
-                if sync_run_id:
-                    OperationLog.log(sync_run_id, "dataset", 
-                                   get_message('zip_already_processed') + f" (by hash): {zip_filename} (sha256: {sha256_hash[:16]}...)", 
-                                   stage='dataset')
-                return 0
-        
     finally:
         cur.close()
         conn.close()
@@ -740,6 +639,7 @@ def process_zip_archive(url: str, sync_run_id=None) -> int:
                         OperationLog.log(sync_run_id, "dataset", 
                                        get_message('zip_already_processed') + f": {zip_filename}", 
                                        stage='dataset')
+                    metrics.inc('archives_total', result='skipped')
                     return 0
             finally:
                 cur2.close()
@@ -768,22 +668,19 @@ def process_zip_archive(url: str, sync_run_id=None) -> int:
                            get_message('zip_processing_started') + f": {zip_filename}", 
                            stage='dataset')
         
-        # Шаг 3: Скачивание (или пропуск если уже скачан)
-        if not zip_path.exists():
-            try:
-                download_zip(url, zip_path, sync_run_id)
-            except Exception as download_error:
-                error_str = str(download_error)
-                # Если это NOT_ZIP ошибка, она уже обработана в download_zip (статус обновлен в БД)
-                if 'NOT_ZIP' in error_str:
-                    if sync_run_id:
-                        OperationLog.log(sync_run_id, "data", 
-                                       f"NOT_ZIP файл обнаружен при скачивании: {zip_filename}. Пропускаем обработку.", 
-                                       level="WARNING", stage='data')
-                    return 0
-                # Для других ошибок пробрасываем дальше
-                raise
-        else:
+        # Шаг 3: Скачивание в хранилище объектов (или пропуск если уже скачан)
+        # Старый файл каталога zips - только записанный в строке этого URL
+        legacy_path = object_store.legacy_file(existing_row['file_path']) if existing_row else None
+        stored_path = (object_store.object_path(existing_row['sha256_hash'])
+                       if existing_row and existing_row['sha256_hash'] else None)
+        if stored_path is not None and stored_path.is_file():
+            zip_path, sha256_hash = stored_path, existing_row['sha256_hash']
+            retention.touch(zip_path)
+            if sync_run_id:
+                OperationLog.log(sync_run_id, "dataset", 
+                               get_message('zip_already_downloaded') + f": {zip_filename}", 
+                               stage='dataset')
+        elif legacy_path is not None:
             if sync_run_id:
                 OperationLog.log(sync_run_id, "dataset", 
                                get_message('zip_already_downloaded') + f": {zip_filename}", 
@@ -791,20 +688,47 @@ def process_zip_archive(url: str, sync_run_id=None) -> int:
             
             # Проверяем, что существующий файл действительно ZIP
             import zipfile
-            if not zipfile.is_zipfile(zip_path):
+            if not zipfile.is_zipfile(legacy_path):
                 error_msg = f"Существующий файл не является ZIP: {zip_filename}"
                 ZipArchive.update_status(archive_id, 'error', error_message=f"NOT_ZIP: {error_msg}")
                 if sync_run_id:
                     OperationLog.log(sync_run_id, "dataset", 
                                    f"NOT_ZIP: {error_msg}. Пропускаем обработку.", 
                                    level="ERROR", stage='dataset')
+                metrics.inc('archives_total', result='not_zip')
                 return 0
+            
+            # Архив, скачанный до хранилища объектов, переносится жесткой ссылкой
+            zip_path, sha256_hash, _ = object_store.adopt(legacy_path)
+        else:
+            try:
+                with metrics.timer('zip_download'):
+                    temp_path, sha256_hash = download_zip(url, object_store.incoming_path(url), sync_run_id)
+            except Exception as download_error:
+                error_str = str(download_error)
+                # Если это NOT_ZIP ошибка, она уже обработана в download_zip (статус обновлен в БД)
+                if 'NOT_ZIP' in error_str:
+                    if sync_run_id:
+                        OperationLog.log(sync_run_id, "data", 
+                                       f"NOT_ZIP файл обнаружен при скачивании: {zip_filename}. Пропускаем обработку.", 
+                                       level="WARNING", stage='data')
+                    metrics.inc('archives_total', result='not_zip')
+                    return 0
+                # Для других ошибок пробрасываем дальше
+                raise
+            zip_path, deduplicated = object_store.store(temp_path, sha256_hash)
+            if deduplicated:
+                retention.touch(zip_path)
+                metrics.inc('archives_deduplicated_total')
+                if sync_run_id:
+                    OperationLog.log(sync_run_id, "dataset", 
+                                   get_message('zip_deduplicated', sha=sha256_hash[:16]) + f": {zip_filename}", 
+                                   stage='dataset')
         
-        # Вычисляем хеш и размер
+        # Размер; хеш уже известен (вычислен при скачивании или переносе)
         file_size = zip_path.stat().st_size
-        sha256_hash = calculate_sha256(zip_path)
         
-        # Обновляем статус архива
+        # Обновляем статус архива: URL связывается с объектом
         ZipArchive.update_status(archive_id, 'downloaded', 
                                  file_path=str(zip_path), 
                                  file_size=file_size, 
@@ -822,6 +746,27 @@ def process_zip_archive(url: str, sync_run_id=None) -> int:
                     OperationLog.log(sync_run_id, "dataset", 
                                    get_message('zip_already_processed') + f" (race condition): {zip_filename} (sha256: {sha_short})", 
                                    stage='dataset')
+                metrics.inc('archives_total', result='skipped')
+                return 0
+            
+            # Тот же архив, опубликованный по другому URL, уже загружен: URL
+            # связан с объектом, записи не дублируются
+            cur.execute("""
+                SELECT id FROM zip_archives
+                WHERE sha256_hash = %s AND status = 'processed' AND id <> %s
+                LIMIT 1
+            """, (sha256_hash, archive_id))
+            existing_by_hash = cur.fetchone()
+            if existing_by_hash:
+                ZipArchive.update_status(archive_id, 'processed')
+                if known is not None:
+                    known[url] = {'id': archive_id, 'status': 'processed', 'sha256_hash': sha256_hash, 'error_message': None}
+                if sync_run_id:
+                    OperationLog.log(sync_run_id, "dataset", 
+                                   get_message('zip_already_processed') + f" (by hash, архив #{existing_by_hash['id']}): "
+                                   f"{zip_filename} (sha256: {sha256_hash[:16]}...)", 
+                                   stage='dataset')
+                metrics.inc('archives_total', result='skipped')
                 return 0
         finally:
             cur.close()
@@ -832,8 +777,14 @@ def process_zip_archive(url: str, sync_run_id=None) -> int:
             ZipArchive.update_status(archive_id, 'error', error_message='Остановка запрошена пользователем')
             raise StopIteration("Остановка запрошена пользователем")
         
-        # Шаг 4: Выбираем XML файл из ZIP (не распаковывая)
-        xml_selection = select_xml_from_zip(zip_path, sync_run_id)
+        # Шаг 4: Выбираем XML файл из ZIP (не распаковывая); в режиме zip_members = 'all' - все XML
+        from erknm.loader import members
+        all_members = members.resolve_mode() == 'all'
+        with metrics.timer('zip_select'):
+            if all_members:
+                xml_selection = select_xml_members(zip_path, sync_run_id)
+            else:
+                xml_selection = select_xml_from_zip(zip_path, sync_run_id)
         
         if not xml_selection:
             ZipArchive.update_status(archive_id, 'error', error_message='XML файлы не найдены в архиве')
@@ -841,15 +792,15 @@ def process_zip_archive(url: str, sync_run_id=None) -> int:
                 OperationLog.log(sync_run_id, "dataset", 
                                get_message('zip_processing_finished') + f": {zip_filename} - XML не найден", 
                                level="WARNING", stage='dataset')
+            metrics.inc('archives_total', result='no_xml')
             return 0
         
-        xml_name, zip_info = xml_selection
-        
         # Логируем выбор XML
         if sync_run_id:
-            OperationLog.log(sync_run_id, "dataset", 
-                           get_message('selected_inner_xml') + f": {xml_name} size={zip_info.file_size} bytes", 
-                           stage='dataset')
+            for xml_name, zip_info in (xml_selection if all_members else [xml_selection]):
+                OperationLog.log(sync_run_id, "dataset", 
+                               get_message('selected_inner_xml') + f": {xml_name} size={zip_info.file_size} bytes", 
+                               stage='dataset')
         
         # Проверяем остановку перед потоковым парсингом
         if sync_run_id and SyncRun.is_stop_requested(sync_run_id):
@@ -857,10 +808,17 @@ def process_zip_archive(url: str, sync_run_id=None) -> int:
             raise StopIteration("Остановка запрошена пользователем")
         
         # Шаг 5: Потоковый парсинг и загрузка в БД
-        records_count = stream_parse_xml_from_zip(zip_path, xml_name, zip_info, archive_id, sync_run_id)
+        if all_members:
+            records_count = members.load_members(zip_path, xml_selection, archive_id, sync_run_id)
+        else:
+            xml_name, zip_info = xml_selection
+            records_count = stream_parse_xml_from_zip(zip_path, xml_name, zip_info, archive_id, sync_run_id)
         
         # Шаг 6: Обновляем статус архива
         ZipArchive.update_status(archive_id, 'processed')
+        metrics.inc('archives_total', result='processed')
+        if known is not None:
+            known[url] = {'id': archive_id, 'status': 'processed', 'sha256_hash': sha256_hash, 'error_message': None}
         
         if sync_run_id:
             OperationLog.log(sync_run_id, "dataset", 
@@ -875,6 +833,7 @@ def process_zip_archive(url: str, sync_run_id=None) -> int:
     except Exception as e:
         error_msg = str(e)
         ZipArchive.update_status(archive_id, 'error', error_message=error_msg)
+        metrics.inc('archives_total', result='error')
         if sync_run_id:
             OperationLog.log(sync_run_id, "dataset", 
                            get_message('zip_processing_error') + f": {zip_filename}: {error_msg}", 
@@ -9,6 +9,7 @@ MESSAGES = {
     'zip_downloading': 'Скачивание ZIP',
     'zip_already_downloaded': 'ZIP уже скачан',
     'zip_already_processed': 'ZIP уже обработан, пропускаем разбор',
+    'zip_deduplicated': 'Содержимое ZIP совпадает с уже скачанным архивом (sha256: {sha}...), копия не сохраняется',
     'zip_processing_finished': 'Обработка ZIP завершена',
     'zip_processing_error': 'Ошибка обработки ZIP',
     'zip_not_found': 'ZIP не найден',
@@ -18,9 +19,29 @@ MESSAGES = {
     'streaming_parse_started': 'Потоковый разбор XML запущен',
     'selected_inner_xml': 'выбран внутренний XML',
     'xml_not_found_in_zip': 'ZIP inner xml selected: нет XML файлов в архиве',
+    'fragment_resumed': 'Продолжение загрузки {filename} с записи {position} (уже загружено {count})',
+    'members_started': 'Разбор XML архива в {workers} потоков: к загрузке {count} из {total}',
+    'member_loaded': 'XML {filename} загружен: {count} записей ({done} из {total})',
+    'member_failed': 'Ошибка разбора XML {filename} ({done} из {total}): {error}',
+    'members_failed': 'Не загружено XML архива: {count} из {total} ({names})',
+    
+    # Объем скачанных файлов
+    'storage_evicted': ('Объем скачанных файлов превысил лимит {limit_mb:.0f} МБ: удалено {count} файлов '
+                        '({size_mb:.1f} МБ), занято {used_mb:.1f} МБ, закреплено {pinned_mb:.1f} МБ'),
+    'storage_over_limit': ('Объем скачанных файлов {used_mb:.1f} МБ превышает лимит {limit_mb:.0f} МБ: '
+                           'остальные файлы закреплены (не обработаны или нужны для указателей)'),
+    'storage_skipped': 'Ограничение объема скачанных файлов пропущено: выполняется другой запуск',
     
     # Задержки (Dataset)
-    'delay_before_next_request': 'Задержка {delay:.1f}с перед следующим запросом',
+    'rate_limit_report': ('Запросы к {host}: {requests} (ограничений {throttled}, ошибок {errors}), '
+                          'достигнутая частота {achieved_rpm:.1f} запр/мин, текущий лимит {rpm:.1f} запр/мин, '
+                          'ожидание {waited_seconds:.0f}с'),
+    'meta_browser_fallback': 'Мета-XML по HTTP не получен ({reason}), скачивание через браузер',
+    'meta_cookies_handed_off': 'Cookies браузера ({count}) переданы HTTP клиенту для {host}',
+    'meta_http_disabled': ('Проверка {host} повторяется после передачи cookies ({count} раз подряд): '
+                           'до конца запуска мета-XML скачиваются через браузер'),
+    'meta_fetch_report': ('Мета-XML: по HTTP {http}, через браузер {browser}, не изменились (304) {not_modified}, '
+                          'проверены недавно {recent}, передач cookies {handoffs}'),
     'additional_delay_before_retry': 'Дополнительная задержка {delay:.1f}с перед повтором',
     
     # Прогресс обработки записей (Data)
@@ -38,6 +59,11 @@ MESSAGES = {
     'download_failed': 'Не удалось скачать ZIP {url} после {max_retries} попыток',
     'parsing_error': 'Ошибка потокового парсинга',
     'insert_error': 'Ошибка вставки записи',
+    'records_quarantined': ('В карантин перенесено {count} из {total} записей пакета (файл: {filename}, '
+                            'позиции: {offsets}): {reason}'),
+    'staging_merged': 'Записи {filename} перенесены из промежуточной таблицы: {count} за {seconds:.1f}с',
+    'pointer_fallback': ('Границы записи {position} в {filename} не совпали с разбором XML: '
+                         'дальше записи файла хранятся сжатыми, а не указателями на архив'),
     'unclassified_file': 'Неклассифицированный файл или нет записей',
     'xml_selection_error': 'Ошибка при выборе XML из ZIP',
     'extraction_error': 'Ошибка при распаковке ZIP',
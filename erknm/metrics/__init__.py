@@ -0,0 +1,18 @@
+"""Модуль метрик производительности"""
+from erknm.metrics.registry import (
+    add_time, begin_run, current_run, end_run, inc, record_db_call,
+    render_prometheus, reset, set_gauge, sleep, timer
+)
+
+__all__ = [
+    'add_time', 'begin_run', 'current_run', 'end_run', 'inc', 'record_db_call',
+    'render_prometheus', 'reset', 'set_gauge', 'sleep', 'timer'
+]
+
+
+
+
+
+
+
+
@@ -0,0 +1,257 @@
+"""Профилирование запусков синхронизации
+
+Режимы:
+    sampling - семплирующий профайлер: раз в SAMPLE_INTERVAL секунд снимает
+               стеки потока запуска и рабочих потоков erknm-*; накладные
+               расходы малы, можно включать на рабочей синхронизации;
+    cprofile - детерминированный профайлер cProfile (только поток запуска)
+               плюс тот же семплер для стеков; точные числа вызовов, но
+               заметно замедляет разбор XML.
+
+Артефакты сохраняются в DOWNLOAD_DIR/profiles/run-<id>/:
+    stacks.collapsed - свернутые стеки (flamegraph.pl, speedscope, inferno);
+    profile.pstats   - дамп cProfile (только режим cprofile), открывается
+                       через pstats/snakeviz;
+    summary.txt      - сводка: самые затратные функции.
+"""
+import cProfile
+import io
+import pstats
+import shutil
+import sys
+import sysconfig
+import threading
+import time
+from collections import Counter
+from pathlib import Path
+from typing import Dict, List, Optional
+
+MODES = ('sampling', 'cprofile')
+
+# Интервал семплирования, с
+SAMPLE_INTERVAL = 0.01
+
+# Префикс имен рабочих потоков, которые семплируются вместе с потоком запуска
+WORKER_THREAD_PREFIX = 'erknm-'
+
+# Файлы артефактов профиля (имя -> описание)
+ARTIFACTS = {
+    'stacks.collapsed': 'Свернутые стеки для flamegraph',
+    'profile.pstats': 'Дамп cProfile (pstats)',
+    'summary.txt': 'Сводка',
+}
+
+# Количество функций в сводке
+SUMMARY_TOP = 40
+
+_PACKAGE_ROOT = str(Path(__file__).resolve().parents[2])
+_STDLIB_ROOT = sysconfig.get_paths()['stdlib']
+
+
+def resolve_mode(profile: Optional[str]) -> Optional[str]:
+    """
+    Определить режим профилирования
+
+    Args:
+        profile: Режим из параметров запуска; None - взять из настройки
+                 profile_mode, 'off' - не профилировать
+
+    Returns:
+        'sampling', 'cprofile' или None
+    """
+    if profile is None:
+        from erknm.db.models import Settings
+        try:
+            profile = Settings.get_typed('profile_mode')
+        except Exception:
+            return None
+    profile = (profile or '').strip().lower()
+    return profile if profile in MODES else None
+
+
+def get_profile_dir(run_id: int) -> Path:
+    from erknm.config import get_download_dir
+    return get_download_dir() / 'profiles' / f'run-{run_id}'
+
+
+def list_artifacts(run_id: int) -> List[Dict]:
+    """Артефакты профиля запуска (пустой список - запуск не профилировался)"""
+    profile_dir = get_profile_dir(run_id)
+    artifacts = []
+    for name, title in ARTIFACTS.items():
+        path = profile_dir / name
+        if path.is_file():
+            artifacts.append({'name': name, 'title': title, 'size': path.stat().st_size})
+    return artifacts
+
+
+def delete_artifacts(run_id: int):
+    """Удалить артефакты профиля запуска"""
+    shutil.rmtree(get_profile_dir(run_id), ignore_errors=True)
+
+
+def _frame_label(code, cache: Dict) -> str:
+    label = cache.get(code)
+    if label is None:
+        filename = code.co_filename
+        if filename.startswith(_PACKAGE_ROOT):
+            filename = filename[len(_PACKAGE_ROOT):].lstrip('/\\')
+        elif 'site-packages' in filename:
+            filename = filename.split('site-packages', 1)[1].lstrip('/\\')
+        elif filename.startswith(_STDLIB_ROOT):
+            filename = filename[len(_STDLIB_ROOT):].lstrip('/\\')
+        label = f'{code.co_name} ({filename}:{code.co_firstlineno})'
+        cache[code] = label
+    return label
+
+
+class RunProfiler:
+    """Профайлер одного запуска синхронизации"""
+
+    def __init__(self, run_id: int, mode: str = 'sampling', interval: float = SAMPLE_INTERVAL):
+        if mode not in MODES:
+            raise ValueError(f"Неизвестный режим профилирования: {mode}")
+        self.run_id = run_id
+        self.mode = mode
+        self.interval = interval
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self._labels: Dict = {}
+        self._thread_id = None
+        self._thread_name = None
+        self._profile: Optional[cProfile.Profile] = None
+        self._sampler: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self._started = 0.0
+        self._elapsed = 0.0
+
+    def start(self) -> 'RunProfiler':
+        """Начать профилирование текущего потока"""
+        self._thread_id = threading.get_ident()
+        self._thread_name = threading.current_thread().name
+        self._started = time.monotonic()
+        self._sampler = threading.Thread(target=self._sample_loop, name='profiler-sampler', daemon=True)
+        self._sampler.start()
+        if self.mode == 'cprofile':
+            self._profile = cProfile.Profile()
+            self._profile.enable()
+        return self
+
+    def _target_threads(self) -> Dict[int, str]:
+        targets = {self._thread_id: self._thread_name}
+        for thread in threading.enumerate():
+            if thread.name.startswith(WORKER_THREAD_PREFIX) and thread.ident is not None:
+                targets[thread.ident] = thread.name
+        return targets
+
+    def _sample_loop(self):
+        next_enum = 0.0
+        targets = {}
+        while not self._stop.wait(self.interval):
+            now = time.monotonic()
+            if now >= next_enum:
+                # Список потоков меняется редко - обновляем раз в секунду
+                targets = self._target_threads()
+                next_enum = now + 1.0
+            frames = sys._current_frames()
+            for ident, thread_name in targets.items():
+                frame = frames.get(ident)
+                if frame is None:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(_frame_label(frame.f_code, self._labels))
+                    frame = frame.f_back
+                stack.append(thread_name)
+                stack.reverse()
+                self.stacks[';'.join(stack)] += 1
+                self.samples += 1
+            del frames
+
+    def stop(self) -> Path:
+        """
+        Остановить профилирование и сохранить артефакты
+
+        Returns:
+            Каталог с артефактами
+        """
+        if self._profile is not None:
+            self._profile.disable()
+        self._stop.set()
+        if self._sampler is not None:
+            self._sampler.join()
+        self._elapsed = time.monotonic() - self._started
+        return self.save()
+
+    def save(self) -> Path:
+        profile_dir = get_profile_dir(self.run_id)
+        profile_dir.mkdir(parents=True, exist_ok=True)
+
+        with open(profile_dir / 'stacks.collapsed', 'w', encoding='utf-8') as f:
+            for stack, count in sorted(self.stacks.items()):
+                f.write(f'{stack} {count}\n')
+
+        if self._profile is not None:
+            self._profile.dump_stats(str(profile_dir / 'profile.pstats'))
+
+        (profile_dir / 'summary.txt').write_text(self.render_summary(), encoding='utf-8')
+        return profile_dir
+
+    def render_summary(self) -> str:
+        lines = [
+            f'Запуск: {self.run_id}',
+            f'Режим: {self.mode}',
+            f'Длительность: {self._elapsed:.1f} с',
+            f'Семплов: {self.samples} (интервал {self.interval * 1000:.0f} мс)',
+            '',
+        ]
+
+        # Собственное и суммарное время функций по семплам
+        own: Counter = Counter()
+        total: Counter = Counter()
+        for stack, count in self.stacks.items():
+            frames = stack.split(';')[1:]
+            if not frames:
+                continue
+            own[frames[-1]] += count
+            for label in set(frames):
+                total[label] += count
+
+        if self.samples:
+            lines.append(f'Собственное время по семплам (топ {SUMMARY_TOP}):')
+            lines.append(f"{'%':>6} {'семплов':>8}  функция")
+            for label, count in own.most_common(SUMMARY_TOP):
+                lines.append(f'{count * 100 / self.samples:>6.1f} {count:>8}  {label}')
+            lines.append('')
+            lines.append(f'Суммарное время по семплам (топ {SUMMARY_TOP}):')
+            lines.append(f"{'%':>6} {'семплов':>8}  функция")
+            for label, count in total.most_common(SUMMARY_TOP):
+                lines.append(f'{count * 100 / self.samples:>6.1f} {count:>8}  {label}')
+            lines.append('')
+
+        if self._profile is not None:
+            out = io.StringIO()
+            stats = pstats.Stats(self._profile, stream=out)
+            stats.sort_stats('cumulative').print_stats(SUMMARY_TOP)
+            stats.sort_stats('tottime').print_stats(SUMMARY_TOP)
+            lines.append('cProfile:')
+            lines.append(out.getvalue())
+
+        return '\n'.join(lines) + '\n'
+
+
+def start(run_id: int, profile: Optional[str] = None) -> Optional[RunProfiler]:
+    """
+    Запустить профилирование запуска, если оно включено
+
+    Args:
+        run_id: ID запуска синхронизации
+        profile: Режим ('sampling', 'cprofile', 'off'); None - из настройки profile_mode
+
+    Returns:
+        Профайлер (остановить через stop()) или None
+    """
+    mode = resolve_mode(profile)
+    if mode is None:
+        return None
+    return RunProfiler(run_id, mode).start()
@@ -0,0 +1,273 @@
+"""Таймеры и счетчики этапов синхронизации и загрузки
+
+Метрики накапливаются в двух местах:
+    - в процессе (с момента запуска) - для /metrics в формате Prometheus;
+    - в текущем запуске синхронизации - сводка сохраняется в sync_runs.metrics
+      при завершении запуска (SyncRun.finish).
+
+Запуск привязывается к потоку, в котором он создан (SyncRun.create), поэтому
+синхронизация в фоновом потоке веб-интерфейса и ручная загрузка не смешивают
+свои сводки.
+"""
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Optional, Tuple
+
+# Описания метрик для /metrics (имя без префикса erknm_)
+METRIC_HELP = {
+    'stage_seconds_total': 'Суммарное время этапа, с',
+    'stage_calls_total': 'Количество выполнений этапа',
+    'stage_seconds_max': 'Максимальная длительность одного выполнения этапа, с',
+    'bytes_total': ('Объем обработанных данных по видам (download - скачано, sha256 - захешировано, xml - разобрано, '
+                    'evicted - удалено при ограничении объема скачанных файлов)'),
+    'records_total': 'Загруженные записи по типу данных',
+    'archives_total': 'Архивы по результату обработки',
+    'archives_deduplicated_total': 'Скачанные архивы, содержимое которых уже было в хранилище объектов',
+    'storage_evicted_total': 'Файлы, удаленные при ограничении объема скачанных файлов, по видам (zip, meta)',
+    'storage_used_bytes': 'Объем скачанных архивов и мета-XML после последней проверки лимита, байт',
+    'records_quarantined_total': 'Записи, отклоненные БД и перенесенные в карантин, по типу данных',
+    'datasets_total': 'Наборы данных по результату сравнения отпечатка версий (unchanged, changed)',
+    'retries_total': 'Повторные попытки запросов по видам',
+    'sleep_seconds_total': 'Время в паузах по причинам, с',
+    'db_calls_total': 'Обращения к БД по видам (connections, queries, commits, rollbacks)',
+    'requests_total': 'Запросы к источнику по хостам и сигналам ограничителя (ok, throttled, error)',
+    'rate_limit_rpm': 'Текущий лимит запросов к хосту, запросов в минуту',
+    'rate_limit_achieved_rpm': 'Достигнутая частота запросов к хосту за запуск, запросов в минуту',
+    'http_requests_total': 'HTTP запросы к хосту через общий пул соединений',
+    'http_connections_total': 'Новые соединения с хостом (остальные запросы переиспользуют открытые; для HTTP/2 не считаются)',
+    'http_bytes_total': 'Объем тел ответов хоста, байт',
+    'http_transfer_seconds_total': 'Время передачи тел ответов хоста, с',
+    'http_bandwidth_bytes_per_second': 'Скорость последней передачи с хоста (тела от 1 МБ), байт/с',
+    'meta_fetch_total': ('Скачанные и перепроверенные мета-XML по способам (http - HTTP клиент, browser - Playwright, '
+                         'not_modified - ответ 304)'),
+    'meta_cookie_handoffs_total': 'Передачи cookies браузера HTTP клиенту после проверки источника',
+}
+
+# Этапы с понятными названиями для сводки запуска
+STAGE_TITLES = {
+    'list_download': 'Скачивание list.xml',
+    'list_parse': 'Разбор list.xml',
+    'known_state': 'Загрузка известных наборов, версий и архивов',
+    'meta_download': 'Скачивание мета-XML',
+    'meta_parse': 'Разбор мета-XML',
+    'zip_download': 'Скачивание ZIP',
+    'sha256': 'SHA-256',
+    'zip_select': 'Выбор XML в архиве',
+    'xml_parse': 'Разбор XML',
+    'payload_extract': 'Извлечение полей и сериализация',
+    'db_insert': 'Запись в БД',
+    'staging_merge': 'Перенос из промежуточной таблицы',
+}
+
+_lock = threading.Lock()
+_counters: Dict[Tuple[str, Tuple], float] = {}
+_stages: Dict[str, list] = {}
+_gauges: Dict[Tuple[str, Tuple], float] = {}
+_runs: Dict[int, 'RunMetrics'] = {}
+_current_run: contextvars.ContextVar = contextvars.ContextVar('erknm_metrics_run', default=None)
+
+
+class RunMetrics:
+    """Метрики одного запуска синхронизации"""
+
+    def __init__(self, run_id: int):
+        self.run_id = run_id
+        self.started = time.monotonic()
+        self.counters: Dict[Tuple[str, Tuple], float] = {}
+        self.stages: Dict[str, list] = {}
+        self.gauges: Dict[Tuple[str, Tuple], float] = {}
+        self._lock = threading.Lock()
+
+    def add_time(self, stage: str, seconds: float, calls: int = 1):
+        with self._lock:
+            _add_stage(self.stages, stage, seconds, calls)
+
+    def inc(self, key: Tuple[str, Tuple], value: float):
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def set_gauge(self, key: Tuple[str, Tuple], value: float):
+        with self._lock:
+            self.gauges[key] = value
+
+    def summary(self) -> Dict:
+        """Сводка запуска для сохранения в БД"""
+        with self._lock:
+            stages = {
+                stage: {'calls': calls, 'seconds': round(seconds, 3), 'max_seconds': round(max_seconds, 3)}
+                for stage, (calls, seconds, max_seconds) in self.stages.items()
+            }
+            counters = _group_by_label(self.counters)
+            gauges = _group_by_label(self.gauges)
+        summary = {
+            'elapsed_seconds': round(time.monotonic() - self.started, 3),
+            'stages': stages,
+            'counters': counters,
+        }
+        if gauges:
+            summary['gauges'] = gauges
+        return summary
+
+
+def _group_by_label(values: Dict[Tuple[str, Tuple], float]) -> Dict[str, Dict]:
+    grouped = {}
+    for (name, labels), value in values.items():
+        label = ','.join(f'{k}={v}' for k, v in labels) or 'total'
+        grouped.setdefault(name, {})[label] = round(value, 3) if isinstance(value, float) else value
+    return grouped
+
+
+def _add_stage(stages: Dict[str, list], stage: str, seconds: float, calls: int):
+    entry = stages.get(stage)
+    if entry is None:
+        stages[stage] = [calls, seconds, seconds / calls if calls else seconds]
+    else:
+        entry[0] += calls
+        entry[1] += seconds
+        entry[2] = max(entry[2], seconds / calls if calls else seconds)
+
+
+def _key(name: str, labels: Dict) -> Tuple[str, Tuple]:
+    return name, tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def begin_run(run_id: int) -> RunMetrics:
+    """Начать сбор метрик запуска в текущем потоке"""
+    run = RunMetrics(run_id)
+    with _lock:
+        _runs[run_id] = run
+    _current_run.set(run)
+    return run
+
+
+def end_run(run_id: int) -> Optional[Dict]:
+    """Завершить сбор метрик запуска и вернуть сводку (None - запуск не отслеживался)"""
+    with _lock:
+        run = _runs.pop(run_id, None)
+    if run is None:
+        return None
+    if _current_run.get() is run:
+        _current_run.set(None)
+    return run.summary()
+
+
+def current_run() -> Optional[RunMetrics]:
+    return _current_run.get()
+
+
+def add_time(stage: str, seconds: float, calls: int = 1):
+    """Добавить время этапа (для циклов, где таймер на каждую итерацию слишком дорог)"""
+    with _lock:
+        _add_stage(_stages, stage, seconds, calls)
+    run = _current_run.get()
+    if run is not None:
+        run.add_time(stage, seconds, calls)
+
+
+@contextmanager
+def timer(stage: str):
+    """Замерить время этапа"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        add_time(stage, time.perf_counter() - started)
+
+
+def inc(name: str, value: float = 1, **labels):
+    """Увеличить счетчик"""
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+    run = _current_run.get()
+    if run is not None:
+        run.inc(key, value)
+
+
+def set_gauge(name: str, value: float, **labels):
+    """Установить значение показателя (последнее значение, а не сумма)"""
+    key = _key(name, labels)
+    with _lock:
+        _gauges[key] = value
+    run = _current_run.get()
+    if run is not None:
+        run.set_gauge(key, value)
+
+
+def sleep(seconds: float, reason: str):
+    """Пауза с учетом в sleep_seconds_total"""
+    if seconds <= 0:
+        return
+    time.sleep(seconds)
+    inc('sleep_seconds_total', seconds, reason=reason)
+
+
+def record_db_call(kind: str, n: int = 1):
+    """Учесть обращение к БД в сводке текущего запуска (счетчики процесса ведет erknm.db.connection)"""
+    run = _current_run.get()
+    if run is not None:
+        run.inc(_key('db_calls_total', {'kind': kind}), n)
+
+
+def _format_labels(labels: Tuple) -> str:
+    if not labels:
+        return ''
+    escaped = ','.join(
+        '{}="{}"'.format(k, v.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for k, v in labels
+    )
+    return '{' + escaped + '}'
+
+
+def _format_value(value: float) -> str:
+    if isinstance(value, int) or float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def render_prometheus() -> str:
+    """Метрики процесса в текстовом формате Prometheus"""
+    from erknm.db.connection import get_db_stats
+
+    with _lock:
+        counters = dict(_counters)
+        stages = {stage: list(entry) for stage, entry in _stages.items()}
+        gauges = dict(_gauges)
+        active_runs = len(_runs)
+
+    families: Dict[str, list] = {}
+    for (name, labels), value in counters.items():
+        families.setdefault(name, []).append((labels, value))
+    for (name, labels), value in gauges.items():
+        families.setdefault(name, []).append((labels, value))
+    for stage, (calls, seconds, max_seconds) in stages.items():
+        labels = (('stage', stage),)
+        families.setdefault('stage_calls_total', []).append((labels, calls))
+        families.setdefault('stage_seconds_total', []).append((labels, seconds))
+        families.setdefault('stage_seconds_max', []).append((labels, max_seconds))
+    db_stats = get_db_stats()
+    for kind in ('connections', 'queries', 'commits', 'rollbacks'):
+        families.setdefault('db_calls_total', []).append(((('kind', kind),), db_stats[kind]))
+
+    lines = []
+    for name in sorted(families):
+        metric = f'erknm_{name}'
+        metric_type = 'counter' if name.endswith('_total') else 'gauge'
+        lines.append(f'# HELP {metric} {METRIC_HELP.get(name, name)}')
+        lines.append(f'# TYPE {metric} {metric_type}')
+        for labels, value in sorted(families[name]):
+            lines.append(f'{metric}{_format_labels(labels)} {_format_value(value)}')
+    lines.append('# HELP erknm_sync_runs_active Запуски синхронизации, выполняющиеся в процессе')
+    lines.append('# TYPE erknm_sync_runs_active gauge')
+    lines.append(f'erknm_sync_runs_active {active_runs}')
+    return '\n'.join(lines) + '\n'
+
+
+def reset():
+    """Обнулить метрики процесса (для бенчмарков)"""
+    with _lock:
+        _counters.clear()
+        _stages.clear()
+        _gauges.clear()
@@ -2,27 +2,40 @@
 from pathlib import Path
 from lxml import etree
 from typing import List, Dict, Optional
-import time
-import random
-from erknm.browser.meta_downloader import download_meta_xml_browser
 
 
 def download_meta_xml(url: str, output_path: Path, max_retries=5, delay=10.0, sync_run_id=None) -> Path:
     """
-    Скачать мета-XML файл через браузерную автоматизацию с retry механизмом
+    Скачать мета-XML файл: по HTTP, при проверке источника - через браузер
+    (erknm.sync.meta_fetcher)
     
     Args:
         url: URL файла
         output_path: Путь для сохранения
-        max_retries: Максимальное количество попыток
-        delay: Базовая задержка между попытками в секундах (3-5 секунд)
+        max_retries: Максимальное количество попыток браузера
+        delay: Базовая задержка между попытками браузера в секундах
         sync_run_id: ID запуска синхронизации для логирования (опционально)
     
     Returns:
         Path к скачанному файлу
     """
-    # Используем браузерную автоматизацию через Playwright
-    return download_meta_xml_browser(url, output_path, sync_run_id, max_retries, delay)
+    from erknm.sync.meta_fetcher import fetch
+    return fetch(url, output_path, sync_run_id, max_retries, delay)
+
+
+def refresh_meta_xml(url: str, output_path: Path, max_retries=5, delay=10.0, sync_run_id=None,
+                     max_age=None) -> bool:
+    """
+    Перепроверить скачанный мета-XML у источника (условный запрос, erknm.sync.meta_fetcher)
+    
+    Args:
+        max_age: Не запрашивать мета-XML, проверенный меньше max_age секунд назад
+    
+    Returns:
+        True - мета-XML изменился, файл заменен новым
+    """
+    from erknm.sync.meta_fetcher import refresh
+    return refresh(url, output_path, sync_run_id, max_retries, delay, max_age=max_age)
 
 
 def parse_meta_xml(file_path: Path) -> Dict:
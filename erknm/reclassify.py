@@ -29,7 +29,7 @@ def reclassify_dataset(dataset_id: int, new_data_type: str, sync_run_id=None):
         # Находим все необработанные XML-фрагменты этого набора
         # (через zip_archives -> dataset_versions)
         cur.execute("""
-            SELECT DISTINCT xf.id, xf.file_path
+            SELECT DISTINCT xf.id, xf.file_path, xf.source_fingerprint
             FROM xml_fragments xf
             JOIN zip_archives za ON xf.zip_archive_id = za.id
             JOIN dataset_versions dv ON za.url = dv.source_url
@@ -44,14 +44,8 @@ def reclassify_dataset(dataset_id: int, new_data_type: str, sync_run_id=None):
         for fragment in fragments:
             fragment_id = fragment['id']
             
-            # Удаляем старые записи, если они были загружены
-            cur.execute("""
-                DELETE FROM plans_raw WHERE xml_fragment_id = %s
-            """, (fragment_id,))
-            cur.execute("""
-                DELETE FROM inspections_raw WHERE xml_fragment_id = %s
-            """, (fragment_id,))
-            conn.commit()
+            # Удаляем старые записи, если они были загружены (вместе с позицией загрузки)
+            XmlFragment.reset_progress(fragment_id, fragment['source_fingerprint'])
             
             # Обновляем тип фрагмента
             XmlFragment.update_status(fragment_id, 'pending', data_type=new_data_type)
@@ -92,14 +86,10 @@ def reclassify_xml_fragment(fragment_id: int, new_data_type: str, sync_run_id=No
     cur = get_cursor(conn)
     
     try:
-        # Удаляем старые записи
-        cur.execute("""
-            DELETE FROM plans_raw WHERE xml_fragment_id = %s
-        """, (fragment_id,))
-        cur.execute("""
-            DELETE FROM inspections_raw WHERE xml_fragment_id = %s
-        """, (fragment_id,))
-        conn.commit()
+        # Удаляем старые записи (вместе с позицией загрузки)
+        cur.execute("SELECT source_fingerprint FROM xml_fragments WHERE id = %s", (fragment_id,))
+        row = cur.fetchone()
+        XmlFragment.reset_progress(fragment_id, row['source_fingerprint'] if row else None)
         
         # Обновляем тип и статус
         XmlFragment.update_status(fragment_id, 'pending', data_type=new_data_type)
@@ -1,17 +1,21 @@
 """Модуль для запуска по расписанию"""
 import schedule
 import time
-from erknm.sync.synchronizer import sync
-from erknm.config import (
-    SCHEDULE_ENABLED, SCHEDULE_MODE, SCHEDULE_TIME,
-    SCHEDULE_DAY_OF_WEEK, SCHEDULE_DAY_OF_MONTH
-)
+from erknm import config
 
 
 def run_scheduler():
     """
     Запустить планировщик синхронизации с настройками из БД
     """
+    # Настройки читаются при запуске, а не при импорте модуля
+    from erknm.sync.synchronizer import sync
+    SCHEDULE_ENABLED = config.SCHEDULE_ENABLED
+    SCHEDULE_MODE = config.SCHEDULE_MODE
+    SCHEDULE_TIME = config.SCHEDULE_TIME
+    SCHEDULE_DAY_OF_WEEK = config.SCHEDULE_DAY_OF_WEEK
+    SCHEDULE_DAY_OF_MONTH = config.SCHEDULE_DAY_OF_MONTH
+    
     if not SCHEDULE_ENABLED:
         print("Планировщик отключен в настройках.")
         return
@@ -22,16 +26,21 @@ def run_scheduler():
     except:
         hour, minute = 2, 0
     
+    # Запуск по расписанию продолжает прерванную синхронизацию с ее контрольной
+    # точки (если прерванной нет - обычная синхронизация с начала списка)
+    def scheduled_sync():
+        sync(is_manual=False, resume=True)
+    
     # Настраиваем расписание в зависимости от режима
     if SCHEDULE_MODE == 'daily':
-        schedule.every().day.at(f"{hour:02d}:{minute:02d}").do(sync, is_manual=False)
+        schedule.every().day.at(f"{hour:02d}:{minute:02d}").do(scheduled_sync)
         print(f"Планировщик запущен. Синхронизация будет выполняться ежедневно в {SCHEDULE_TIME}.")
     elif SCHEDULE_MODE == 'weekly':
         day_map = {1: schedule.every().monday, 2: schedule.every().tuesday, 3: schedule.every().wednesday,
                    4: schedule.every().thursday, 5: schedule.every().friday, 6: schedule.every().saturday,
                    7: schedule.every().sunday}
         day = SCHEDULE_DAY_OF_WEEK if 1 <= SCHEDULE_DAY_OF_WEEK <= 7 else 1
-        day_map[day].at(f"{hour:02d}:{minute:02d}").do(sync, is_manual=False)
+        day_map[day].at(f"{hour:02d}:{minute:02d}").do(scheduled_sync)
         print(f"Планировщик запущен. Синхронизация будет выполняться еженедельно в {SCHEDULE_TIME} (день недели: {day}).")
     elif SCHEDULE_MODE == 'monthly':
         # Для ежемесячного режима используем день месяца
@@ -39,12 +48,12 @@ def run_scheduler():
         # Schedule не поддерживает напрямую месячный режим, используем ежедневную проверку
         def monthly_job():
             if time.localtime().tm_mday == day:
-                sync(is_manual=False)
+                scheduled_sync()
         schedule.every().day.at(f"{hour:02d}:{minute:02d}").do(monthly_job)
         print(f"Планировщик запущен. Синхронизация будет выполняться ежемесячно {day} числа в {SCHEDULE_TIME}.")
     else:
         # Дефолт - ежедневно
-        schedule.every().day.at(f"{hour:02d}:{minute:02d}").do(sync, is_manual=False)
+        schedule.every().day.at(f"{hour:02d}:{minute:02d}").do(scheduled_sync)
         print(f"Планировщик запущен. Синхронизация будет выполняться ежедневно в {SCHEDULE_TIME}.")
     
     print("Нажмите Ctrl+C для остановки.")
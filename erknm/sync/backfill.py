@@ -0,0 +1,294 @@
+"""Первичная загрузка (backfill) всей истории в пустую БД
+
+При обычной загрузке каждая запись обновляет четыре вторичных индекса
+parsed_records и проверяет внешние ключи к xml_fragments/zip_archives. Для
+первичной загрузки это лишняя работа: индекс, построенный один раз по всем
+строкам, обходится намного дешевле. Режим backfill:
+    1. проверяет целевые таблицы: непустые (они перестроятся целиком)
+       обрабатываются только с force;
+    2. удаляет вторичные индексы и внешние ключи целевых таблиц;
+    3. выполняет синхронизацию в режиме массовой загрузки (COPY,
+       synchronous_commit = off, см. erknm.loader.xml_stream.bulk_load);
+    4. строит индексы параллельно (CONCURRENTLY - если БД используется
+       во время построения) и восстанавливает внешние ключи: NOT VALID, затем
+       VALIDATE CONSTRAINT (проверка не блокирует запись).
+
+Шаг 4 выполняется и при ошибке синхронизации; если процесс был прерван,
+индексы и ключи восстанавливает finish (команда backfill --finish-only).
+Пока ключи удалены, удаление фрагментов и архивов не удаляет каскадно их
+записи - во время backfill его выполнять не следует.
+"""
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from typing import Callable, Dict, List, Optional
+
+from erknm.db.connection import get_connection, get_cursor
+
+# Таблицы, в которые пишутся записи
+TARGET_TABLES = ('parsed_records', 'plans_raw', 'inspections_raw')
+
+# Вторичные индексы, которые строятся после загрузки (имя -> определение)
+DEFERRED_INDEXES = {
+    'idx_parsed_records_archive': 'parsed_records(zip_archive_id)',
+    'idx_parsed_records_type': 'parsed_records(record_type)',
+    'idx_parsed_records_date': 'parsed_records(record_date)',
+    'idx_parsed_records_created': 'parsed_records(created_at)',
+}
+
+# Внешние ключи целевых таблиц: (таблица, имя, определение)
+DEFERRED_FOREIGN_KEYS = [
+    ('parsed_records', 'parsed_records_zip_archive_id_fkey',
+     'FOREIGN KEY (zip_archive_id) REFERENCES zip_archives(id) ON DELETE CASCADE'),
+    ('parsed_records', 'parsed_records_xml_fragment_id_fkey',
+     'FOREIGN KEY (xml_fragment_id) REFERENCES xml_fragments(id) ON DELETE SET NULL'),
+    ('plans_raw', 'plans_raw_xml_fragment_id_fkey',
+     'FOREIGN KEY (xml_fragment_id) REFERENCES xml_fragments(id) ON DELETE CASCADE'),
+    ('inspections_raw', 'inspections_raw_xml_fragment_id_fkey',
+     'FOREIGN KEY (xml_fragment_id) REFERENCES xml_fragments(id) ON DELETE CASCADE'),
+]
+
+# Параллельно строящихся индексов по умолчанию
+DEFAULT_JOBS = 2
+
+# Параметры сеанса построения индекса
+MAINTENANCE_WORK_MEM = '512MB'
+MAX_PARALLEL_MAINTENANCE_WORKERS = 2
+
+# Интервал сообщений о прогрессе, с
+PROGRESS_INTERVAL = 10.0
+
+
+def _report(progress: Optional[Callable[[str], None]], message: str):
+    if progress is not None:
+        progress(message)
+
+
+def inspect_target() -> Dict:
+    """
+    Состояние целевых таблиц
+
+    Returns:
+        {'empty': все таблицы пусты, 'tables': {таблица: оценка числа строк}}
+    """
+    conn = get_connection()
+    cur = get_cursor(conn)
+    try:
+        tables = {}
+        empty = True
+        for table in TARGET_TABLES:
+            cur.execute(f"SELECT EXISTS (SELECT 1 FROM {table}) AS has_rows")
+            has_rows = cur.fetchone()['has_rows']
+            # reltuples - оценка по статистике (-1, если таблица не анализировалась)
+            cur.execute("SELECT GREATEST(reltuples, 0)::bigint AS estimate FROM pg_class WHERE oid = %s::regclass",
+                        (table,))
+            tables[table] = max(cur.fetchone()['estimate'], 1 if has_rows else 0)
+            empty = empty and not has_rows
+        return {'empty': empty, 'tables': tables}
+    finally:
+        cur.close()
+        conn.close()
+
+
+def defer(progress: Optional[Callable[[str], None]] = None):
+    """Удалить вторичные индексы и внешние ключи целевых таблиц"""
+    conn = get_connection()
+    cur = conn.cursor()
+    try:
+        for table, name, _ in DEFERRED_FOREIGN_KEYS:
+            cur.execute(f"ALTER TABLE {table} DROP CONSTRAINT IF EXISTS {name}")
+        for name in DEFERRED_INDEXES:
+            cur.execute(f"DROP INDEX IF EXISTS {name}")
+        conn.commit()
+        _report(progress, f"Удалено индексов: {len(DEFERRED_INDEXES)}, внешних ключей: {len(DEFERRED_FOREIGN_KEYS)}")
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+        conn.close()
+
+
+def _build_index(name: str, definition: str, concurrently: bool) -> float:
+    """Построить индекс в отдельном соединении; вернуть длительность, с"""
+    started = time.monotonic()
+    conn = get_connection()
+    # CREATE INDEX CONCURRENTLY нельзя выполнять внутри транзакции
+    conn.autocommit = True
+    cur = conn.cursor()
+    try:
+        cur.execute("SET maintenance_work_mem = %s", (MAINTENANCE_WORK_MEM,))
+        cur.execute("SET max_parallel_maintenance_workers = %s", (MAX_PARALLEL_MAINTENANCE_WORKERS,))
+        # Прерванный CREATE INDEX CONCURRENTLY оставляет невалидный индекс - строим заново
+        cur.execute("""
+            SELECT NOT i.indisvalid FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid
+            WHERE c.relname = %s
+        """, (name,))
+        row = cur.fetchone()
+        if row and row[0]:
+            cur.execute(f"DROP INDEX {'CONCURRENTLY ' if concurrently else ''}{name}")
+        cur.execute(f"CREATE INDEX {'CONCURRENTLY ' if concurrently else ''}IF NOT EXISTS {name} ON {definition}")
+        return time.monotonic() - started
+    finally:
+        cur.close()
+        conn.close()
+
+
+def _index_progress() -> List[str]:
+    """Прогресс построения индексов по pg_stat_progress_create_index"""
+    conn = get_connection()
+    cur = get_cursor(conn)
+    try:
+        cur.execute("""
+            SELECT COALESCE(i.relname, t.relname) AS name, p.phase, p.blocks_done, p.blocks_total,
+                   p.tuples_done, p.tuples_total
+            FROM pg_stat_progress_create_index p
+            LEFT JOIN pg_class i ON i.oid = p.index_relid
+            LEFT JOIN pg_class t ON t.oid = p.relid
+            ORDER BY 1
+        """)
+        lines = []
+        for row in cur.fetchall():
+            if row['blocks_total']:
+                done = f"{row['blocks_done'] * 100 // row['blocks_total']}% блоков"
+            elif row['tuples_total']:
+                done = f"{row['tuples_done'] * 100 // row['tuples_total']}% строк"
+            else:
+                done = ''
+            lines.append(f"{row['name']}: {row['phase']} {done}".rstrip())
+        return lines
+    finally:
+        cur.close()
+        conn.close()
+
+
+def _restore_foreign_keys(progress: Optional[Callable[[str], None]] = None):
+    conn = get_connection()
+    cur = conn.cursor()
+    try:
+        for table, name, definition in DEFERRED_FOREIGN_KEYS:
+            cur.execute("SELECT 1 FROM pg_constraint WHERE conrelid = %s::regclass AND conname = %s",
+                        (table, name))
+            if cur.fetchone() is None:
+                # NOT VALID - без проверки существующих строк и долгой блокировки
+                cur.execute(f"ALTER TABLE {table} ADD CONSTRAINT {name} {definition} NOT VALID")
+                conn.commit()
+            started = time.monotonic()
+            cur.execute(f"ALTER TABLE {table} VALIDATE CONSTRAINT {name}")
+            conn.commit()
+            _report(progress, f"Внешний ключ {name} проверен за {time.monotonic() - started:.1f}с")
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+        conn.close()
+
+
+def finish(concurrently: bool = False, jobs: int = DEFAULT_JOBS,
+           progress: Optional[Callable[[str], None]] = None):
+    """
+    Построить отложенные индексы, восстановить внешние ключи и обновить статистику
+
+    Выполнение повторяемо: существующие индексы и ключи пропускаются.
+
+    Args:
+        concurrently: CREATE INDEX CONCURRENTLY - не блокировать запись в таблицы
+        jobs: количество индексов, строящихся одновременно
+    """
+    started = time.monotonic()
+    with ThreadPoolExecutor(max_workers=max(jobs, 1), thread_name_prefix='erknm-backfill') as pool:
+        futures = {
+            pool.submit(_build_index, name, definition, concurrently): name
+            for name, definition in DEFERRED_INDEXES.items()
+        }
+        pending = set(futures)
+        while pending:
+            done, pending = wait(pending, timeout=PROGRESS_INTERVAL)
+            for future in done:
+                _report(progress, f"Индекс {futures[future]} построен за {future.result():.1f}с")
+            if pending:
+                for line in _index_progress():
+                    _report(progress, f"  {line}")
+
+    _restore_foreign_keys(progress)
+
+    conn = get_connection()
+    conn.autocommit = True
+    cur = conn.cursor()
+    try:
+        for table in TARGET_TABLES:
+            cur.execute(f"ANALYZE {table}")
+    finally:
+        cur.close()
+        conn.close()
+    _report(progress, f"Индексы и внешние ключи восстановлены за {time.monotonic() - started:.1f}с")
+
+
+def _count_inserted() -> int:
+    """Вставлено строк в parsed_records по статистике сервера (без COUNT по таблице)"""
+    conn = get_connection()
+    cur = get_cursor(conn)
+    try:
+        cur.execute("SELECT n_tup_ins FROM pg_stat_user_tables WHERE relname = 'parsed_records'")
+        row = cur.fetchone()
+        return row['n_tup_ins'] if row else 0
+    finally:
+        cur.close()
+        conn.close()
+
+
+def _progress_loop(stop: threading.Event, progress: Callable[[str], None]):
+    started = time.monotonic()
+    initial = _count_inserted()
+    while not stop.wait(PROGRESS_INTERVAL):
+        try:
+            loaded = _count_inserted() - initial
+        except Exception:
+            continue
+        elapsed = time.monotonic() - started
+        _report(progress, f"Загружено записей: {loaded} ({loaded / elapsed:.0f} зап/с)")
+
+
+def run(resume=None, force: bool = False, concurrently: bool = False, jobs: int = DEFAULT_JOBS,
+        progress: Optional[Callable[[str], None]] = None):
+    """
+    Выполнить первичную загрузку
+
+    Args:
+        resume: продолжить прерванную синхронизацию (как в sync)
+        force: разрешить загрузку в непустые таблицы
+        concurrently: строить индексы CONCURRENTLY
+        jobs: количество индексов, строящихся одновременно
+        progress: функция для сообщений о ходе загрузки
+
+    Raises:
+        RuntimeError: целевые таблицы не пусты, а force не указан
+    """
+    from erknm.loader.xml_stream import bulk_load
+    from erknm.sync.synchronizer import sync
+
+    target = inspect_target()
+    sizes = ', '.join(f"{table}: ~{rows}" for table, rows in target['tables'].items())
+    if not target['empty']:
+        if not force:
+            raise RuntimeError(f"Целевые таблицы не пусты ({sizes}). Индексы будут перестроены по всем "
+                               f"строкам - укажите force, если это ожидаемо")
+        _report(progress, f"Целевые таблицы не пусты ({sizes}), индексы будут перестроены")
+
+    defer(progress)
+    stop = threading.Event()
+    reporter = None
+    if progress is not None:
+        reporter = threading.Thread(target=_progress_loop, args=(stop, progress),
+                                    name='erknm-backfill-progress', daemon=True)
+        reporter.start()
+    try:
+        with bulk_load():
+            sync(is_manual=False, resume=resume)
+    finally:
+        stop.set()
+        if reporter is not None:
+            reporter.join()
+        _report(progress, "Построение индексов и восстановление внешних ключей...")
+        finish(concurrently=concurrently, jobs=jobs, progress=progress)
@@ -0,0 +1,121 @@
+"""Контрольная точка синхронизации
+
+Позиция обработки (хеш list.xml, индекс набора данных, индекс версии в
+мета-XML, обрабатываемый архив) хранится в sync_runs.checkpoint. Прерванный
+запуск (остановка, ошибка, reconcile_stale_runs) продолжается с этой позиции:
+наборы до нее не обходятся заново.
+
+Позиция указывает на элемент, обработка которого начата, но не подтверждена;
+при продолжении он обрабатывается повторно (загрузка архива идемпотентна).
+Запись в БД выполняется не чаще раза в CHECKPOINT_INTERVAL секунд и при
+завершении запуска, поэтому после аварии повторно проверяется не больше
+нескольких уже обработанных версий.
+"""
+import hashlib
+import time
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from erknm.db.models import SyncRun
+
+# Минимальный интервал записи контрольной точки, с
+CHECKPOINT_INTERVAL = 5.0
+
+
+def file_sha256(path: Path) -> str:
+    sha256 = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            sha256.update(block)
+    return sha256.hexdigest()
+
+
+class SyncCheckpoint:
+    """Контрольная точка текущего запуска"""
+
+    def __init__(self, run_id: int, list_hash: str, sync_order: str, resumed_from: Optional[int] = None):
+        self.run_id = run_id
+        self.data = {
+            'list_hash': list_hash,
+            'sync_order': sync_order,
+            'dataset_index': 0,
+            'dataset_identifier': None,
+            'version_index': 0,
+            'version_url': None,
+            'completed': False,
+        }
+        if resumed_from:
+            self.data['resumed_from'] = resumed_from
+        self._saved_at = 0.0
+        self._dirty = False
+
+    def move_to_dataset(self, index: int, identifier: str):
+        self.data.update(dataset_index=index, dataset_identifier=identifier,
+                         version_index=0, version_url=None)
+        self.save()
+
+    def move_to_version(self, index: int, url: str):
+        self.data.update(version_index=index, version_url=url)
+        self.save()
+
+    def save(self, force: bool = False):
+        """Записать точку в БД (без force - не чаще CHECKPOINT_INTERVAL)"""
+        now = time.monotonic()
+        if not force and now - self._saved_at < CHECKPOINT_INTERVAL:
+            self._dirty = True
+            return
+        try:
+            SyncRun.save_checkpoint(self.run_id, self.data)
+            self._saved_at = now
+            self._dirty = False
+        except Exception:
+            # Сбой записи точки не должен прерывать синхронизацию
+            self._dirty = True
+
+    def flush(self):
+        """Записать несохраненную позицию"""
+        if self._dirty or not self._saved_at:
+            self.save(force=True)
+
+    def complete(self):
+        """Отметить, что список обработан полностью (продолжать нечего)"""
+        self.data['completed'] = True
+        self.save(force=True)
+
+
+def find_dataset_position(checkpoint: Dict, datasets: List[Dict], list_hash: str,
+                          sync_order: str) -> Tuple[int, Optional[str]]:
+    """
+    Найти в списке наборов позицию, на которой прервался запуск
+
+    Если list.xml и порядок обработки не изменились, используется индекс;
+    иначе набор ищется по идентификатору.
+
+    Returns:
+        (индекс набора, описание способа) - (0, None), если позиция не найдена
+    """
+    index = checkpoint.get('dataset_index') or 0
+    identifier = checkpoint.get('dataset_identifier')
+    same_list = checkpoint.get('list_hash') == list_hash and checkpoint.get('sync_order') == sync_order
+    if same_list and 0 <= index < len(datasets):
+        if identifier is None or datasets[index].get('identifier') == identifier:
+            return index, 'list.xml не изменился'
+    if identifier:
+        for position, dataset in enumerate(datasets):
+            if dataset.get('identifier') == identifier:
+                return position, 'list.xml изменился, набор найден по идентификатору'
+    return 0, None
+
+
+def find_version_position(checkpoint: Dict, versions: List[Dict]) -> int:
+    """Индекс версии в мета-XML, с которой продолжить обработку набора"""
+    index = checkpoint.get('version_index') or 0
+    url = checkpoint.get('version_url')
+    if url is None:
+        return min(index, len(versions))
+    if 0 <= index < len(versions) and versions[index].get('source') == url:
+        return index
+    for position, version in enumerate(versions):
+        if version.get('source') == url:
+            return position
+    return 0
@@ -0,0 +1,40 @@
+"""Отпечатки источника для быстрого пути синхронизации
+
+Набор данных, у которого набор версий в мета-XML не изменился с прошлой
+полной обработки (datasets.versions_fingerprint) и все архивы уже обработаны,
+пропускается целиком: без обхода версий, проверок архивов и записей в журнал
+по каждой версии. Отпечаток сохраняется только после обработки всех версий
+набора без ошибок, поэтому набор с ошибкой проверяется заново в следующем запуске.
+"""
+import hashlib
+from typing import Dict, List, Optional
+
+# Статусы архивов, повторная обработка которых ничего не даст
+SETTLED_STATUSES = ('processed',)
+
+
+def versions_fingerprint(data_versions: List[Dict]) -> str:
+    """Отпечаток набора версий мета-XML (не зависит от порядка версий)"""
+    sha256 = hashlib.sha256()
+    for source, created, structure in sorted(
+        (v.get('source') or '', v.get('created') or '', v.get('structure') or '')
+        for v in data_versions
+    ):
+        sha256.update(f'{source}\t{created}\t{structure}\n'.encode('utf-8'))
+    return sha256.hexdigest()
+
+
+def is_settled(state: Optional[Dict]) -> bool:
+    """Архив из снимка ZipArchive.load_states обработан окончательно (или это не ZIP)"""
+    if state is None:
+        return False
+    if state['status'] in SETTLED_STATUSES:
+        return True
+    return state['status'] == 'error' and 'NOT_ZIP' in (state['error_message'] or '')
+
+
+def is_unchanged(dataset: Dict, fingerprint: str, data_versions: List[Dict], known_archives: Dict) -> bool:
+    """Набор версий совпадает с сохраненным отпечатком и все его архивы обработаны"""
+    if not dataset.get('versions_fingerprint') or dataset['versions_fingerprint'] != fingerprint:
+        return False
+    return all(is_settled(known_archives.get(version['source'])) for version in data_versions)
@@ -0,0 +1,259 @@
+"""Общий HTTP клиент для запросов к источнику
+
+Клиент один на процесс: соединения с каждым хостом остаются открытыми
+(keep-alive) в пуле и переиспользуются следующими архивами и повторными
+попытками, поэтому TCP и TLS соединение устанавливается один раз, а не на
+каждый файл. Пул хранит соединения с POOL_HOSTS хостами, по POOL_MAXSIZE на
+хост; разорванное соединение пул отбрасывает сам.
+
+Тела ответов читаются блоками CHUNK_SIZE, у сокетов увеличен буфер приема
+(SOCKET_RCVBUF) и включен SO_KEEPALIVE: на больших архивах меньше системных
+вызовов и простоев окна TCP.
+
+Cookies и заголовки, полученные браузером при прохождении проверки
+источника, передаются клиенту (set_cookies, update_headers, см.
+erknm.sync.meta_fetcher) и сохраняются до пересоздания клиента.
+
+HTTP/2 (настройка http2_enabled) работает через httpx, если установлены
+httpx и h2 (pip install .[http2]); без них - HTTP/1.1 через requests.
+
+Метрики по хостам: http_requests_total, http_connections_total (новые
+соединения; для HTTP/2 не считаются), http_bytes_total и
+http_transfer_seconds_total (объем и время передачи тел),
+http_bandwidth_bytes_per_second (скорость последней передачи больше
+BANDWIDTH_MIN_BYTES).
+"""
+import socket
+import threading
+import time
+from typing import Dict, Iterator, List, Optional
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection
+from urllib3.util.retry import Retry
+
+from erknm import metrics
+from erknm.sync.rate_limiter import host_of
+
+try:
+    import h2  # noqa: F401 - без h2 httpx не поддерживает HTTP/2
+    import httpx
+except ImportError:
+    # Необязательная зависимость: без нее используется HTTP/1.1
+    httpx = None
+
+# Заголовки как у реального браузера (проверено в тестах)
+BROWSER_HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
+    'Accept': '*/*',
+    'Accept-Language': 'ru-RU,ru;q=0.9,en-US;q=0.8,en;q=0.7',
+    'Accept-Encoding': 'gzip, deflate, br',
+    'Connection': 'keep-alive',
+    'Referer': 'https://proverki.gov.ru/',
+    'Sec-Fetch-Dest': 'document',
+    'Sec-Fetch-Mode': 'navigate',
+    'Sec-Fetch-Site': 'same-origin',
+}
+
+# Таймауты соединения и чтения, с
+CONNECT_TIMEOUT = 30
+READ_TIMEOUT = 300
+
+# Хостов в пуле и соединений на хост
+POOL_HOSTS = 10
+POOL_MAXSIZE = 4
+
+# Размер блока чтения тела ответа
+CHUNK_SIZE = 1024 * 1024
+
+# Буфер приема сокета (ядро удваивает значение и отключает для сокета автоподбор)
+SOCKET_RCVBUF = 4 * 1024 * 1024
+
+# Скорость передачи публикуется только для тел не меньше этого размера
+BANDWIDTH_MIN_BYTES = 1024 * 1024
+
+_SOCKET_OPTIONS = [
+    (socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1),
+    (socket.SOL_SOCKET, socket.SO_RCVBUF, SOCKET_RCVBUF),
+]
+
+
+class _PoolAdapter(HTTPAdapter):
+    """HTTPAdapter с параметрами сокетов для больших тел"""
+
+    def init_poolmanager(self, *args, **kwargs):
+        kwargs['socket_options'] = HTTPConnection.default_socket_options + _SOCKET_OPTIONS
+        super().init_poolmanager(*args, **kwargs)
+
+
+class Response:
+    """Ответ источника (requests или httpx) с учетом объема и времени передачи"""
+
+    def __init__(self, raw, host: str, http2: bool):
+        self._raw = raw
+        self._http2 = http2
+        self._started = time.perf_counter()
+        self._received = 0
+        self._closed = False
+        self.host = host
+        self.status_code = raw.status_code
+        self.headers = raw.headers
+        self.url = str(raw.url)
+
+    def iter_content(self, chunk_size: int = CHUNK_SIZE) -> Iterator[bytes]:
+        chunks = self._raw.iter_bytes(chunk_size) if self._http2 else self._raw.iter_content(chunk_size=chunk_size)
+        for chunk in chunks:
+            if chunk:
+                self._received += len(chunk)
+                yield chunk
+
+    def read(self) -> bytes:
+        """Все тело ответа"""
+        return b''.join(self.iter_content())
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        self._raw.close()
+        elapsed = time.perf_counter() - self._started
+        metrics.inc('http_bytes_total', self._received, host=self.host)
+        metrics.inc('http_transfer_seconds_total', elapsed, host=self.host)
+        if self._received >= BANDWIDTH_MIN_BYTES and elapsed > 0:
+            metrics.set_gauge('http_bandwidth_bytes_per_second', self._received / elapsed, host=self.host)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class HttpClient:
+    """Пул соединений процесса"""
+
+    def __init__(self, http2: bool = False):
+        self.http2 = http2 and httpx is not None
+        self._lock = threading.Lock()
+        # Соединений, открытых пулами хоста, на момент прошлого запроса
+        self._connections: Dict[str, int] = {}
+        if self.http2:
+            self.session = httpx.Client(
+                http2=True,
+                headers=BROWSER_HEADERS,
+                timeout=httpx.Timeout(READ_TIMEOUT, connect=CONNECT_TIMEOUT),
+                limits=httpx.Limits(max_keepalive_connections=POOL_HOSTS * POOL_MAXSIZE),
+                follow_redirects=True,
+            )
+            self.adapter = None
+            return
+        self.session = requests.Session()
+        self.session.headers.update(BROWSER_HEADERS)
+        self.adapter = _PoolAdapter(
+            pool_connections=POOL_HOSTS,
+            pool_maxsize=POOL_MAXSIZE,
+            max_retries=Retry(
+                total=1,  # Уменьшаем retry на уровне адаптера, т.к. у вызывающего свой retry
+                backoff_factor=1,
+                # 429 не повторяем на уровне адаптера: ответ нужен ограничителю частоты
+                status_forcelist=[500, 502, 503, 504],
+                respect_retry_after_header=False,
+                allowed_methods=["GET", "HEAD"],
+            ),
+        )
+        self.session.mount("http://", self.adapter)
+        self.session.mount("https://", self.adapter)
+
+    def _count_connections(self, url: str, host: str):
+        """Новые соединения с хостом с прошлого запроса (по счетчикам пулов urllib3)"""
+        parsed = urlparse(url)
+        port = parsed.port or (443 if parsed.scheme == 'https' else 80)
+        pools = self.adapter.poolmanager.pools
+        opened_total = 0
+        # Пулов хоста может быть несколько: ключ пула включает параметры TLS
+        for key in pools.keys():
+            if (key.key_scheme, key.key_host, key.key_port) == (parsed.scheme, parsed.hostname, port):
+                pool = pools.get(key)
+                if pool is not None:
+                    opened_total += pool.num_connections
+        with self._lock:
+            opened = opened_total - self._connections.get(host, 0)
+            self._connections[host] = opened_total
+        if opened > 0:
+            metrics.inc('http_connections_total', opened, host=host)
+
+    def get(self, url: str, headers: Optional[Dict] = None) -> Response:
+        """GET с потоковым чтением тела; ответ нужно закрыть (close или with)"""
+        host = host_of(url)
+        metrics.inc('http_requests_total', host=host)
+        if self.http2:
+            raw = self.session.send(self.session.build_request('GET', url, headers=headers), stream=True)
+        else:
+            raw = self.session.get(url, headers=headers, timeout=(CONNECT_TIMEOUT, READ_TIMEOUT), stream=True)
+            self._count_connections(url, host)
+        return Response(raw, host, self.http2)
+
+    def set_cookies(self, cookies: List[Dict]):
+        """Добавить cookies (формат Playwright: name, value, domain, path)"""
+        for cookie in cookies:
+            self.session.cookies.set(cookie['name'], cookie['value'],
+                                     domain=cookie.get('domain', ''), path=cookie.get('path', '/'))
+
+    def update_headers(self, headers: Dict):
+        """Заменить заголовки всех следующих запросов"""
+        self.session.headers.update(headers)
+
+    def close(self):
+        self.session.close()
+
+
+_client_lock = threading.Lock()
+_client: Optional[HttpClient] = None
+
+
+def _http2_enabled() -> bool:
+    """Настройка http2_enabled (если БД недоступна - HTTP/1.1)"""
+    from erknm.config import get_setting
+    return bool(get_setting('http2_enabled', False))
+
+
+def get_client() -> HttpClient:
+    """Клиент процесса (создается при первом обращении)"""
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = HttpClient(http2=_http2_enabled())
+        return _client
+
+
+def get(url: str, headers: Optional[Dict] = None) -> Response:
+    return get_client().get(url, headers)
+
+
+def set_cookies(cookies: List[Dict]):
+    get_client().set_cookies(cookies)
+
+
+def update_headers(headers: Dict):
+    get_client().update_headers(headers)
+
+
+def configure():
+    """Начало запуска: пересоздать клиент, если изменилась настройка http2_enabled"""
+    global _client
+    http2 = _http2_enabled() and httpx is not None
+    with _client_lock:
+        if _client is not None and _client.http2 != http2:
+            _client.close()
+            _client = None
+
+
+def reset():
+    """Закрыть клиент и его соединения (для тестов и бенчмарков)"""
+    global _client
+    with _client_lock:
+        if _client is not None:
+            _client.close()
+        _client = None
@@ -0,0 +1,319 @@
+"""Скачивание мета-XML: сначала HTTP, браузер - только для проверки источника
+
+Мета-XML запрашивается обычным HTTP через общий пул соединений
+(erknm.sync.http_client) с заголовками браузера. Если источник отвечает
+ограничением (403, 429) или HTML страницей проверки вместо XML, набор
+скачивается через Playwright (erknm.browser.meta_downloader): браузер
+проходит проверку, после чего его cookies и User-Agent передаются HTTP
+клиенту, и следующие мета-XML снова скачиваются по HTTP.
+
+Если проверка повторяется сразу после передачи cookies MAX_FAILED_HANDOFFS
+раз подряд, HTTP для хоста отключается до конца запуска: каждый мета-XML
+скачивается браузером без лишнего HTTP запроса. Ошибки соединения и сервера
+на HTTP также передают набор браузеру (у него свои повторные попытки), но
+cookies не передаются. Настройка meta_http_enabled = false отключает HTTP.
+
+Частоту запросов обоих способов ограничивает erknm.sync.rate_limiter. Ответ
+429 сообщается ограничителю сразу; 403 и HTML на HTTP - нет: это проверка
+клиента, и ответ браузера на тот же URL учитывается им самим.
+
+Уже скачанный мета-XML перепроверяется в каждом запуске (refresh):
+условный запрос с ETag/Last-Modified прошлого ответа (хранятся рядом с
+файлом, <имя>.http.json). 304 - набор версий не изменился; новый ответ
+заменяет файл, только если его содержимое другое. Источник без ETag и
+Last-Modified отдает файл целиком, и он сравнивается побайтно. Время
+проверки тоже хранится в <имя>.http.json: если list.xml не изменился и все
+архивы обработаны, синхронизатор передает max_age, и мета-XML, проверенный
+позже, не запрашивается (настройка meta_revalidate_hours).
+
+Использование способов публикуется в метриках meta_fetch_total{tier}
+(http, browser, not_modified - ответ 304) и meta_cookie_handoffs_total, итог
+запуска (вместе с числом мета-XML, проверенных недавно и не запрошенных) пишется
+в журнал (report).
+"""
+import json
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+from erknm import metrics
+from erknm.db.models import OperationLog
+from erknm.logger.messages import get_message
+from erknm.sync import http_client, rate_limiter
+from erknm.sync.rate_limiter import host_of
+
+TIER_HTTP = 'http'
+TIER_BROWSER = 'browser'
+# Перепроверка: мета-XML не изменился (ответ 304)
+TIER_NOT_MODIFIED = 'not_modified'
+
+# Суффикс файла с ETag/Last-Modified ответа рядом с мета-XML
+VALIDATORS_SUFFIX = '.http.json'
+
+# Проверок подряд сразу после передачи cookies, после которых HTTP для хоста отключается
+MAX_FAILED_HANDOFFS = 2
+
+_lock = threading.Lock()
+# Состояние хостов за запуск: {'handed_off': cookies переданы, 'failed_handoffs', 'disabled'}
+_hosts: Dict[str, Dict] = {}
+_counts = {TIER_HTTP: 0, TIER_BROWSER: 0, TIER_NOT_MODIFIED: 0, 'handoffs': 0, 'recent': 0}
+
+
+def _http_enabled() -> bool:
+    from erknm.config import get_setting
+    return bool(get_setting('meta_http_enabled', True))
+
+
+def _host_state(host: str) -> Dict:
+    with _lock:
+        return _hosts.setdefault(host, {'handed_off': False, 'failed_handoffs': 0, 'disabled': False})
+
+
+def is_meta_xml(body: bytes) -> bool:
+    """Тело ответа - мета-XML (а не страница-заглушка)"""
+    return b'<?xml' in body[:100] or b'<meta' in body[:200] or b'<dataset' in body[:200]
+
+
+def validators_path(output_path: Path) -> Path:
+    """Файл с ETag/Last-Modified ответа, из которого получен мета-XML, и временем проверки"""
+    return output_path.with_name(output_path.name + VALIDATORS_SUFFIX)
+
+
+def _load_validators(output_path: Path) -> Dict:
+    try:
+        return json.loads(validators_path(output_path).read_text(encoding='utf-8'))
+    except (OSError, ValueError):
+        return {}
+
+
+def _save_validators(output_path: Path, validators: Dict):
+    """Сохранить ETag/Last-Modified ответа и отметить время проверки"""
+    values = {key: validators[key] for key in ('etag', 'last_modified') if validators.get(key)}
+    values['checked_at'] = time.time()
+    validators_path(output_path).write_text(json.dumps(values), encoding='utf-8')
+
+
+def checked_age(output_path: Path) -> Optional[float]:
+    """Сколько секунд назад мета-XML скачан или перепроверен (None - неизвестно)"""
+    checked_at = _load_validators(output_path).get('checked_at')
+    if not isinstance(checked_at, (int, float)):
+        return None
+    return max(0.0, time.time() - checked_at)
+
+
+def _conditional_headers(validators: Dict) -> Optional[Dict]:
+    headers = {}
+    if validators.get('etag'):
+        headers['If-None-Match'] = validators['etag']
+    if validators.get('last_modified'):
+        headers['If-Modified-Since'] = validators['last_modified']
+    return headers or None
+
+
+def _fetch_http(url: str, output_path: Path, sync_run_id=None,
+                validators: Optional[Dict] = None) -> Tuple[Optional[str], Dict]:
+    """
+    Скачать мета-XML по HTTP
+
+    Args:
+        validators: ETag/Last-Modified прошлого ответа - условный запрос
+
+    Returns:
+        (None - файл сохранен, 'not_modified' - ответ 304, иначе причина
+        передачи браузеру: 'challenge' (403, 429, HTML) или 'error';
+        ETag/Last-Modified ответа)
+    """
+    rate_limiter.acquire(url, sync_run_id)
+    received = {}
+    try:
+        with http_client.get(url, _conditional_headers(validators or {})) as response:
+            if response.status_code == 304 and validators:
+                rate_limiter.feedback(url, rate_limiter.SIGNAL_OK)
+                return 'not_modified', received
+            if response.status_code != 200:
+                if response.status_code == 429:
+                    rate_limiter.feedback(url, rate_limiter.SIGNAL_THROTTLED,
+                                          rate_limiter.parse_retry_after(response.headers.get('Retry-After')))
+                    return 'challenge', received
+                if response.status_code in rate_limiter.THROTTLE_STATUSES:
+                    return 'challenge', received
+                if response.status_code >= 500:
+                    rate_limiter.feedback(url, rate_limiter.SIGNAL_ERROR)
+                return 'error', received
+            body = response.read()
+            content_type = response.headers.get('Content-Type', '')
+            if response.headers.get('ETag'):
+                received['etag'] = response.headers['ETag']
+            if response.headers.get('Last-Modified'):
+                received['last_modified'] = response.headers['Last-Modified']
+    except StopIteration:
+        raise
+    except Exception:
+        rate_limiter.feedback(url, rate_limiter.SIGNAL_ERROR)
+        return 'error', received
+
+    if not body or not is_meta_xml(body):
+        return ('challenge' if rate_limiter.is_html(content_type, body) else 'error'), received
+
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    temp_path = output_path.with_suffix(output_path.suffix + '.part')
+    temp_path.write_bytes(body)
+    os.replace(temp_path, output_path)
+    rate_limiter.feedback(url, rate_limiter.SIGNAL_OK)
+    metrics.inc('bytes_total', len(body), kind='download')
+    return None, received
+
+
+def _hand_off(session_state: Dict, host: str, sync_run_id=None):
+    """Передать HTTP клиенту cookies и User-Agent браузера"""
+    cookies = session_state.get('cookies') or []
+    http_client.set_cookies(cookies)
+    if session_state.get('user_agent'):
+        http_client.update_headers({'User-Agent': session_state['user_agent']})
+    with _lock:
+        _counts['handoffs'] += 1
+    metrics.inc('meta_cookie_handoffs_total', host=host)
+    if sync_run_id:
+        OperationLog.log(sync_run_id, "dataset", get_message('meta_cookies_handed_off', host=host, count=len(cookies)),
+                         stage='dataset')
+
+
+def _count(tier: str, host: str):
+    with _lock:
+        _counts[tier] += 1
+    metrics.inc('meta_fetch_total', tier=tier, host=host)
+
+
+def _download(url: str, target: Path, sync_run_id=None, max_retries=5, delay=10.0,
+              validators: Optional[Dict] = None) -> Tuple[bool, Dict]:
+    """
+    Скачать мета-XML в target: HTTP, при проверке источника - браузер
+
+    Returns:
+        (False - ответ 304, файл не скачан; ETag/Last-Modified ответа HTTP)
+    """
+    host = host_of(url)
+    state = _host_state(host)
+    reason = 'disabled'
+    received = {}
+    if _http_enabled() and not state['disabled']:
+        reason, received = _fetch_http(url, target, sync_run_id, validators)
+        if reason == 'not_modified':
+            _count(TIER_NOT_MODIFIED, host)
+            return False, validators
+        if reason is None:
+            with _lock:
+                state['failed_handoffs'] = 0
+            _count(TIER_HTTP, host)
+            if sync_run_id:
+                OperationLog.log(sync_run_id, "dataset",
+                                 f"Файл {target.name} скачан по HTTP ({target.stat().st_size} байт)",
+                                 stage='dataset')
+            return True, received
+        if reason == 'challenge' and state['handed_off']:
+            # Cookies браузера не помогли
+            with _lock:
+                state['failed_handoffs'] += 1
+                state['disabled'] = state['failed_handoffs'] >= MAX_FAILED_HANDOFFS
+            if state['disabled'] and sync_run_id:
+                OperationLog.log(sync_run_id, "dataset",
+                                 get_message('meta_http_disabled', host=host, count=MAX_FAILED_HANDOFFS),
+                                 level="WARNING", stage='dataset')
+        if sync_run_id:
+            OperationLog.log(sync_run_id, "dataset", get_message('meta_browser_fallback', reason=reason),
+                             stage='dataset')
+
+    # Playwright импортируется только когда нужен браузер
+    from erknm.browser.meta_downloader import download_meta_xml_browser
+    session_state = {} if reason == 'challenge' and not state['disabled'] else None
+    download_meta_xml_browser(url, target, sync_run_id, max_retries, delay, session_state=session_state)
+    _count(TIER_BROWSER, host)
+    if session_state:
+        _hand_off(session_state, host, sync_run_id)
+        with _lock:
+            state['handed_off'] = True
+    # Ответ браузера условным запросам не подходит
+    return True, {}
+
+
+def fetch(url: str, output_path: Path, sync_run_id=None, max_retries=5, delay=10.0) -> Path:
+    """
+    Скачать мета-XML (HTTP, при проверке источника - браузер с передачей cookies)
+
+    Args:
+        url: URL мета-XML
+        output_path: Путь для сохранения
+        sync_run_id: ID запуска синхронизации для логирования
+        max_retries: Попыток браузера
+        delay: Базовая задержка между попытками браузера, с
+
+    Returns:
+        Path к скачанному файлу
+    """
+    if output_path.exists():
+        if sync_run_id:
+            OperationLog.log(sync_run_id, "dataset", f"Файл уже существует: {output_path.name}", stage='dataset')
+        return output_path
+    _, received = _download(url, output_path, sync_run_id, max_retries, delay)
+    _save_validators(output_path, received)
+    return output_path
+
+
+def refresh(url: str, output_path: Path, sync_run_id=None, max_retries=5, delay=10.0,
+            max_age: Optional[float] = None) -> bool:
+    """
+    Перепроверить скачанный мета-XML у источника
+
+    При meta_http_enabled = false и отключенном для хоста HTTP запрос не
+    выполняется: используется скачанный файл.
+
+    Args:
+        max_age: Не запрашивать мета-XML, скачанный или перепроверенный
+                 меньше max_age секунд назад; None - перепроверить всегда
+
+    Returns:
+        True - содержимое мета-XML изменилось, файл заменен
+    """
+    host = host_of(url)
+    if not _http_enabled() or _host_state(host)['disabled']:
+        return False
+    if max_age is not None:
+        age = checked_age(output_path)
+        if age is not None and age < max_age:
+            with _lock:
+                _counts['recent'] += 1
+            return False
+    validators = _load_validators(output_path)
+    new_path = output_path.with_name(output_path.name + '.new')
+    if new_path.exists():
+        new_path.unlink()
+    try:
+        downloaded, received = _download(url, new_path, sync_run_id, max_retries, delay,
+                                         validators=validators)
+        if not downloaded:
+            _save_validators(output_path, validators)
+            return False
+        changed = new_path.read_bytes() != output_path.read_bytes()
+        if changed:
+            os.replace(new_path, output_path)
+        _save_validators(output_path, received)
+        return changed
+    finally:
+        if new_path.exists():
+            new_path.unlink()
+
+
+def configure():
+    """Начало запуска: обнулить статистику и снова разрешить HTTP для всех хостов"""
+    with _lock:
+        _hosts.clear()
+        for key in _counts:
+            _counts[key] = 0
+
+
+def report() -> Dict:
+    """Использование способов с начала запуска: {'http', 'browser', 'not_modified', 'handoffs', 'recent'}"""
+    with _lock:
+        return dict(_counts)
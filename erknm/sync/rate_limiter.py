@@ -0,0 +1,274 @@
+"""Адаптивное ограничение частоты запросов к источнику
+
+Для каждого хоста ведется token bucket: запрос выполняется, когда в корзине
+есть маркер, маркеры пополняются с текущей частотой. Частота подстраивается
+по схеме AIMD:
+    - каждый успешный ответ увеличивает частоту на rate_limit_increase_rpm
+      (до rate_limit_max_rpm);
+    - сигнал ограничения (429, 403, HTML вместо XML/ZIP) умножает частоту на
+      rate_limit_decrease_factor (не ниже rate_limit_min_rpm) и приостанавливает
+      запросы к хосту на Retry-After или rate_limit_penalty_seconds;
+    - ошибка сервера (5xx, обрыв соединения) только снижает частоту.
+
+Начальная частота - один запрос в throttle_seconds. Параметры берутся из
+robot_settings при создании ограничителя и обновляются в начале каждого
+запуска (configure). Текущий лимит и достигнутая за запуск частота
+публикуются в метриках (rate_limit_rpm, rate_limit_achieved_rpm), итог
+запуска пишется в журнал (report).
+"""
+import email.utils
+import threading
+import time
+from typing import Dict, List, Optional
+from urllib.parse import urlparse
+
+from erknm import metrics
+
+# Сигналы ответа источника
+SIGNAL_OK = 'ok'
+SIGNAL_THROTTLED = 'throttled'
+SIGNAL_ERROR = 'error'
+
+# Коды ответа, которыми источник ограничивает частоту запросов
+THROTTLE_STATUSES = (403, 429)
+
+# Максимальный шаг ожидания: между шагами проверяется запрос остановки
+WAIT_STEP_SECONDS = 1.0
+
+_lock = threading.Lock()
+_limiters: Dict[str, 'HostRateLimiter'] = {}
+
+
+def _setting(key: str):
+    from erknm.config import get_setting
+    from erknm.db.models import Settings
+    # Если БД недоступна - значение по умолчанию из Settings.DEFAULTS
+    return get_setting(key, Settings._coerce(Settings.DEFAULTS[key], Settings.TYPES[key]))
+
+
+def load_params() -> Dict:
+    """Параметры ограничителя из robot_settings"""
+    throttle_seconds = _setting('throttle_seconds')
+    min_rpm = max(_setting('rate_limit_min_rpm'), 0.1)
+    max_rpm = max(_setting('rate_limit_max_rpm'), min_rpm)
+    initial_rpm = 60.0 / throttle_seconds if throttle_seconds > 0 else max_rpm
+    return {
+        'initial_rpm': min(max(initial_rpm, min_rpm), max_rpm),
+        'min_rpm': min_rpm,
+        'max_rpm': max_rpm,
+        'increase_rpm': max(_setting('rate_limit_increase_rpm'), 0.0),
+        'decrease_factor': min(max(_setting('rate_limit_decrease_factor'), 0.05), 1.0),
+        'burst': max(_setting('rate_limit_burst'), 1),
+        'penalty_seconds': max(_setting('rate_limit_penalty_seconds'), 0.0),
+    }
+
+
+class HostRateLimiter:
+    """Ограничитель частоты запросов к одному хосту"""
+
+    def __init__(self, host: str, initial_rpm: float, min_rpm: float, max_rpm: float,
+                 increase_rpm: float, decrease_factor: float, burst: int, penalty_seconds: float):
+        self.host = host
+        self.rate = initial_rpm / 60.0
+        self.min_rate = min_rpm / 60.0
+        self.max_rate = max_rpm / 60.0
+        self.increase = increase_rpm / 60.0
+        self.decrease_factor = decrease_factor
+        self.burst = burst
+        self.penalty_seconds = penalty_seconds
+        # Первый запрос выполняется без ожидания
+        self.tokens = 1.0
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self._lock = threading.Lock()
+        self.reset_stats()
+
+    def configure(self, initial_rpm: float, min_rpm: float, max_rpm: float,
+                  increase_rpm: float, decrease_factor: float, burst: int, penalty_seconds: float):
+        """Обновить параметры, сохранив подобранную частоту (в новых границах)"""
+        with self._lock:
+            self.min_rate = min_rpm / 60.0
+            self.max_rate = max_rpm / 60.0
+            self.increase = increase_rpm / 60.0
+            self.decrease_factor = decrease_factor
+            self.burst = burst
+            self.penalty_seconds = penalty_seconds
+            self.rate = min(max(self.rate, self.min_rate), self.max_rate)
+            self.tokens = min(self.tokens, self.burst)
+
+    def reset_stats(self):
+        self.started = time.monotonic()
+        self.requests = 0
+        self.throttled = 0
+        self.errors = 0
+        self.waited_seconds = 0.0
+
+    def _refill(self, now: float):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def _try_acquire(self) -> float:
+        """Взять маркер; вернуть 0 или время до появления маркера, с"""
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            if now < self.blocked_until:
+                return self.blocked_until - now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                self.requests += 1
+                return 0.0
+            return (1 - self.tokens) / self.rate
+
+    def acquire(self, stop_check=None) -> float:
+        """
+        Дождаться разрешения на запрос
+
+        Args:
+            stop_check: Функция без аргументов; True - прервать ожидание
+
+        Returns:
+            Время ожидания, с
+
+        Raises:
+            StopIteration: Если во время ожидания запрошена остановка
+        """
+        waited = 0.0
+        while True:
+            wait = self._try_acquire()
+            if wait <= 0:
+                break
+            step = min(wait, WAIT_STEP_SECONDS)
+            metrics.sleep(step, 'rate_limit')
+            waited += step
+            if stop_check is not None and stop_check():
+                raise StopIteration("Остановка запрошена пользователем")
+        if waited:
+            with self._lock:
+                self.waited_seconds += waited
+        return waited
+
+    def feedback(self, signal: str, retry_after: Optional[float] = None):
+        """Учесть ответ источника: SIGNAL_OK, SIGNAL_THROTTLED или SIGNAL_ERROR"""
+        with self._lock:
+            if signal == SIGNAL_OK:
+                self.rate = min(self.rate + self.increase, self.max_rate)
+            else:
+                self.rate = max(self.rate * self.decrease_factor, self.min_rate)
+                if signal == SIGNAL_THROTTLED:
+                    self.throttled += 1
+                    pause = retry_after if retry_after is not None else self.penalty_seconds
+                    self.blocked_until = max(self.blocked_until, time.monotonic() + pause)
+                    self.tokens = 0.0
+                else:
+                    self.errors += 1
+            rpm = self.rate * 60
+            elapsed = time.monotonic() - self.started
+            achieved_rpm = self.requests * 60 / elapsed if elapsed > 0 else 0.0
+        metrics.inc('requests_total', host=self.host, signal=signal)
+        metrics.set_gauge('rate_limit_rpm', round(rpm, 3), host=self.host)
+        metrics.set_gauge('rate_limit_achieved_rpm', round(achieved_rpm, 3), host=self.host)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            elapsed = time.monotonic() - self.started
+            return {
+                'host': self.host,
+                'requests': self.requests,
+                'throttled': self.throttled,
+                'errors': self.errors,
+                'waited_seconds': round(self.waited_seconds, 1),
+                'achieved_rpm': round(self.requests * 60 / elapsed, 2) if elapsed > 0 else 0.0,
+                'rpm': round(self.rate * 60, 2),
+            }
+
+
+def host_of(url: str) -> str:
+    return urlparse(url).netloc.lower() or url
+
+
+def get_limiter(url: str) -> HostRateLimiter:
+    """Ограничитель для хоста URL (создается при первом обращении)"""
+    host = host_of(url)
+    with _lock:
+        limiter = _limiters.get(host)
+    if limiter is not None:
+        return limiter
+    params = load_params()
+    with _lock:
+        limiter = _limiters.get(host)
+        if limiter is None:
+            limiter = HostRateLimiter(host, **params)
+            _limiters[host] = limiter
+    return limiter
+
+
+def configure():
+    """Начало запуска: перечитать настройки и обнулить статистику ограничителей"""
+    params = load_params()
+    with _lock:
+        limiters = list(_limiters.values())
+    for limiter in limiters:
+        limiter.configure(**params)
+        limiter.reset_stats()
+
+
+def acquire(url: str, sync_run_id=None) -> float:
+    """Дождаться разрешения на запрос к хосту URL (с проверкой остановки запуска)"""
+    stop_check = None
+    if sync_run_id:
+        from erknm.db.models import SyncRun
+        stop_check = lambda: SyncRun.is_stop_requested(sync_run_id)
+    return get_limiter(url).acquire(stop_check)
+
+
+def feedback(url: str, signal: str, retry_after: Optional[float] = None):
+    get_limiter(url).feedback(signal, retry_after)
+
+
+def signal_for_status(status_code: int) -> str:
+    """Сигнал ограничителю по коду HTTP ответа"""
+    if status_code in THROTTLE_STATUSES:
+        return SIGNAL_THROTTLED
+    if status_code >= 500:
+        return SIGNAL_ERROR
+    return SIGNAL_OK
+
+
+def is_html(content_type: str = '', head: bytes = b'') -> bool:
+    """Ответ - HTML страница (заглушка/капча) вместо XML/ZIP"""
+    if 'html' in (content_type or '').lower():
+        return True
+    start = head[:512].lstrip().lower()
+    return start.startswith(b'<!doctype html') or start.startswith(b'<html')
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Значение заголовка Retry-After в секундах (число или HTTP-дата)"""
+    if not value:
+        return None
+    value = value.strip()
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        when = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if when is None:
+        return None
+    return max(when.timestamp() - time.time(), 0.0)
+
+
+def report() -> List[Dict]:
+    """Статистика ограничителей с начала запуска (хосты без запросов пропускаются)"""
+    with _lock:
+        limiters = list(_limiters.values())
+    return [stats for stats in (limiter.stats() for limiter in limiters) if stats['requests']]
+
+
+def reset():
+    """Удалить все ограничители (для тестов и бенчмарков)"""
+    with _lock:
+        _limiters.clear()
@@ -0,0 +1,298 @@
+"""Ограничение объема скачанных файлов (настройка storage_limit_mb)
+
+ZIP архивы (DOWNLOAD_DIR/objects, см. erknm.loader.object_store, и старый
+каталог zips) и мета-XML наборов (DOWNLOAD_DIR/meta) после обработки нужны
+только для повторного использования. enforce выполняется после каждой
+синхронизации: если файлы занимают больше storage_limit_mb, удаляются дольше
+всего не использовавшиеся (LRU), пока объем не станет не больше лимита.
+0 - без ограничения.
+
+Время использования - время доступа к файлу: touch выставляет его явно при
+повторном использовании архива или мета-XML, поэтому порядок не зависит от
+параметров монтирования (noatime, relatime). Время изменения не меняется - по
+нему pointer_store определяет замену архива.
+
+Не удаляются (закреплены):
+    - архивы, не отмеченные обработанными: скачиваемые, загружаемые и с
+      ошибкой - они нужны для повторной обработки и продолжения прерванного
+      запуска;
+    - архивы, записи которых хранятся указателями (raw_storage = 'pointer');
+    - мета-XML набора, на котором остановился прерванный запуск;
+    - временные файлы objects/incoming и файлы моложе PIN_RECENT_SECONDS
+      (скачаны, но еще не связаны с архивом в БД).
+
+Обработанный архив повторно не скачивается; удаленный мета-XML скачивается
+заново при следующей обработке набора. Счетчики удалений накапливаются в
+DOWNLOAD_DIR/retention.json и вместе с текущим объемом отдаются в /api/status.
+"""
+import json
+import os
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional, Set
+
+from erknm import metrics
+
+# Файлы моложе этого возраста не удаляются, с
+PIN_RECENT_SECONDS = 600
+
+# Время жизни подсчитанного объема для /api/status, с
+USAGE_TTL = 30.0
+
+STATE_FILE = 'retention.json'
+
+_usage_lock = threading.Lock()
+_usage_cache = {'at': 0.0, 'value': None}
+
+
+def resolve_limit() -> int:
+    """Лимит объема в байтах из настройки storage_limit_mb (0 - без ограничения)"""
+    from erknm.db.models import Settings
+    try:
+        limit_mb = Settings.get_typed('storage_limit_mb')
+    except Exception:
+        return 0
+    return max(limit_mb or 0, 0) * 1024 * 1024
+
+
+def touch(path):
+    """Отметить использование файла (время доступа; время изменения сохраняется)"""
+    try:
+        stat = os.stat(path)
+        os.utime(path, ns=(time.time_ns(), stat.st_mtime_ns))
+    except OSError:
+        pass
+
+
+def _key(path) -> str:
+    return str(Path(path).resolve())
+
+
+def _scan() -> List[Dict]:
+    """Файлы под управлением: путь, вид (zip, meta), размер, время использования"""
+    from erknm.config import DOWNLOAD_DIR
+    from erknm.loader import object_store
+
+    roots = [
+        (object_store.objects_dir(), 'zip', '*/*.zip'),
+        (object_store.legacy_dir(), 'zip', '*.zip'),
+        (DOWNLOAD_DIR / 'meta', 'meta', '*.xml'),
+    ]
+    files = []
+    for root, kind, pattern in roots:
+        if not root.is_dir():
+            continue
+        for path in root.glob(pattern):
+            try:
+                stat = path.stat()
+            except OSError:
+                # Удален во время обхода
+                continue
+            files.append({
+                'path': path,
+                'kind': kind,
+                'size': stat.st_size,
+                'used': max(stat.st_atime, stat.st_mtime),
+                'mtime': stat.st_mtime,
+            })
+    return files
+
+
+def _summarize(files: List[Dict]) -> Dict:
+    usage = {'files': len(files), 'used_bytes': 0, 'zip_bytes': 0, 'meta_bytes': 0}
+    for item in files:
+        usage['used_bytes'] += item['size']
+        usage[f"{item['kind']}_bytes"] += item['size']
+    return usage
+
+
+def usage(refresh: bool = False) -> Dict:
+    """Объем файлов под управлением (подсчет кэшируется на USAGE_TTL)"""
+    with _usage_lock:
+        if not refresh and _usage_cache['value'] is not None \
+                and time.monotonic() - _usage_cache['at'] < USAGE_TTL:
+            return dict(_usage_cache['value'])
+    value = _summarize(_scan())
+    with _usage_lock:
+        _usage_cache.update(at=time.monotonic(), value=value)
+    return dict(value)
+
+
+def _pinned_paths() -> Set[str]:
+    """Пути закрепленных архивов и мета-XML"""
+    from erknm.config import DOWNLOAD_DIR
+    from erknm.db.connection import get_connection, get_cursor
+    from erknm.db.models import SyncRun
+    from erknm.loader import object_store
+
+    pinned = set()
+    conn = get_connection()
+    cur = get_cursor(conn)
+    try:
+        cur.execute("""
+            SELECT z.file_path, z.sha256_hash
+            FROM zip_archives z
+            WHERE z.status <> 'processed'
+               OR EXISTS (
+                   SELECT 1 FROM xml_fragments f
+                   JOIN plans_raw r ON r.xml_fragment_id = f.id AND r.xml_codec = 'pointer'
+                   WHERE f.zip_archive_id = z.id
+               )
+               OR EXISTS (
+                   SELECT 1 FROM xml_fragments f
+                   JOIN inspections_raw r ON r.xml_fragment_id = f.id AND r.xml_codec = 'pointer'
+                   WHERE f.zip_archive_id = z.id
+               )
+        """)
+        for row in cur.fetchall():
+            if row['file_path']:
+                pinned.add(_key(row['file_path']))
+            if row['sha256_hash']:
+                # Объект, общий с другим URL
+                pinned.add(_key(object_store.object_path(row['sha256_hash'])))
+    finally:
+        cur.close()
+        conn.close()
+
+    resume_point = SyncRun.get_resumable_checkpoint()
+    if resume_point:
+        identifier = resume_point['checkpoint'].get('dataset_identifier')
+        if identifier:
+            pinned.add(_key(DOWNLOAD_DIR / 'meta' / f'{identifier}.xml'))
+    return pinned
+
+
+def _other_run_active(run_id) -> bool:
+    """Идет другой запуск: его файлы могут быть еще не отражены в БД"""
+    from erknm.db.connection import get_connection, get_cursor
+    from erknm.db.models import SyncRun
+
+    # Зависший запуск не должен навсегда отключать ограничение
+    SyncRun.reconcile_stale_runs()
+    conn = get_connection()
+    cur = get_cursor(conn)
+    try:
+        cur.execute("""
+            SELECT 1 FROM sync_runs
+            WHERE status IN ('running', 'stopping') AND id IS DISTINCT FROM %s
+            LIMIT 1
+        """, (run_id,))
+        return cur.fetchone() is not None
+    finally:
+        cur.close()
+        conn.close()
+
+
+def _state_path() -> Path:
+    from erknm.config import DOWNLOAD_DIR
+    return DOWNLOAD_DIR / STATE_FILE
+
+
+def load_state() -> Dict:
+    """Накопленные счетчики удалений и результат последнего выполнения"""
+    try:
+        return json.loads(_state_path().read_text(encoding='utf-8'))
+    except (OSError, ValueError):
+        return {}
+
+
+def _record(result: Dict, run_id=None):
+    state = load_state()
+    totals = state.get('totals') or {}
+    for name in ('evicted_files', 'evicted_bytes', 'evicted_zips', 'evicted_meta'):
+        totals[name] = totals.get(name, 0) + result[name]
+    state = {
+        'totals': totals,
+        'last': dict(result, run_id=run_id, at=datetime.now().isoformat(timespec='seconds')),
+    }
+    path = _state_path()
+    temp_path = path.with_suffix('.tmp')
+    temp_path.write_text(json.dumps(state, ensure_ascii=False), encoding='utf-8')
+    os.replace(temp_path, path)
+
+
+def enforce(run_id=None, limit: Optional[int] = None) -> Dict:
+    """
+    Удалить давно не использовавшиеся файлы сверх лимита
+
+    Args:
+        run_id: ID запуска, после которого выполняется ограничение
+        limit: лимит в байтах; None - из настройки storage_limit_mb
+
+    Returns:
+        {'limit_bytes', 'used_bytes' (после удаления), 'pinned_bytes',
+         'evicted_files', 'evicted_bytes', 'evicted_zips', 'evicted_meta',
+         'skipped' - идет другой запуск, файлы не удалялись}
+    """
+    limit = resolve_limit() if limit is None else limit
+    files = _scan()
+    used = sum(item['size'] for item in files)
+    result = {'limit_bytes': limit, 'used_bytes': used, 'pinned_bytes': 0,
+              'evicted_files': 0, 'evicted_bytes': 0, 'evicted_zips': 0, 'evicted_meta': 0,
+              'skipped': False}
+    metrics.set_gauge('storage_used_bytes', used)
+    if not limit or used <= limit:
+        with _usage_lock:
+            _usage_cache.update(at=time.monotonic(), value=_summarize(files))
+        return result
+    if _other_run_active(run_id):
+        result['skipped'] = True
+        return result
+
+    pinned = _pinned_paths()
+    now = time.time()
+    candidates = []
+    for item in files:
+        if item['path'].parent.name == 'incoming' or now - item['mtime'] < PIN_RECENT_SECONDS \
+                or _key(item['path']) in pinned:
+            result['pinned_bytes'] += item['size']
+        else:
+            candidates.append(item)
+
+    candidates.sort(key=lambda item: item['used'])
+    for item in candidates:
+        if used <= limit:
+            break
+        try:
+            item['path'].unlink()
+        except FileNotFoundError:
+            pass
+        except OSError:
+            continue
+        if item['kind'] == 'meta':
+            # ETag/Last-Modified удаленного мета-XML (erknm.sync.meta_fetcher)
+            item['path'].with_name(item['path'].name + '.http.json').unlink(missing_ok=True)
+        used -= item['size']
+        result['evicted_files'] += 1
+        result['evicted_bytes'] += item['size']
+        result['evicted_zips' if item['kind'] == 'zip' else 'evicted_meta'] += 1
+        metrics.inc('storage_evicted_total', kind=item['kind'])
+        metrics.inc('bytes_total', item['size'], kind='evicted')
+
+    result['used_bytes'] = used
+    metrics.set_gauge('storage_used_bytes', used)
+    _record(result, run_id)
+    with _usage_lock:
+        _usage_cache.update(at=0.0, value=None)
+    return result
+
+
+def status() -> Dict:
+    """Объем, лимит и счетчики удалений для /api/status"""
+    state = load_state()
+    totals = state.get('totals') or {}
+    current = usage()
+    return {
+        'limit_bytes': resolve_limit(),
+        'used_bytes': current['used_bytes'],
+        'zip_bytes': current['zip_bytes'],
+        'meta_bytes': current['meta_bytes'],
+        'files': current['files'],
+        'evicted_files': totals.get('evicted_files', 0),
+        'evicted_bytes': totals.get('evicted_bytes', 0),
+        'evicted_zips': totals.get('evicted_zips', 0),
+        'evicted_meta': totals.get('evicted_meta', 0),
+        'last': state.get('last'),
+    }
@@ -1,37 +1,69 @@
 """Основной модуль синхронизации"""
 from pathlib import Path
-import time
-import random
-from erknm.browser.downloader import download_list_xml
+from erknm import metrics
+from erknm.logger.messages import get_message
 from erknm.parser.list_parser import parse_list_xml
-from erknm.parser.meta_parser import download_meta_xml, parse_meta_xml
+from erknm.parser.meta_parser import download_meta_xml, parse_meta_xml, refresh_meta_xml
 from erknm.classifier.classifier import classify_dataset
 from erknm.loader.zip_loader import process_zip_archive
 from erknm.loader.xml_loader import load_xml_to_db
+from erknm.sync import http_client, meta_fetcher, rate_limiter, retention
+from erknm.sync.checkpoint import (SyncCheckpoint, file_sha256, find_dataset_position,
+                                   find_version_position)
+from erknm.sync.fingerprint import is_settled, is_unchanged, versions_fingerprint
 from erknm.db.models import (
     SyncRun, Dataset, DatasetVersion, ZipArchive, 
     XmlFragment, OperationLog
 )
-from erknm.config import DOWNLOAD_DIR, SOURCE_URL
 
 
-def sync(is_manual=False):
-    """Выполнить полную синхронизацию"""
+def sync(is_manual=False, profile=None, resume=None):
+    """
+    Выполнить полную синхронизацию
+
+    Args:
+        is_manual: Запуск вручную (а не по расписанию)
+        profile: Режим профилирования ('sampling', 'cprofile', 'off');
+                 None - из настройки profile_mode
+        resume: Продолжить прерванный запуск с его контрольной точки:
+                True - последний прерванный, число - ID запуска;
+                None/False - начать с начала list.xml
+    """
+    # Playwright нужен только для автоматической синхронизации
+    from erknm.browser.downloader import download_list_xml
+    from erknm.config import DOWNLOAD_DIR
+    
     run = None
     run_id = None
+    profiler = None
+    checkpoint = None
     files_processed = 0
     records_loaded = 0
     
     try:
         run = SyncRun.create(is_manual=is_manual)
         run_id = run['id']
+        profiler = _start_profiler(run_id, profile)
         
         # Читаем настройки синхронизации
         from erknm.db.models import Settings
         Settings.set_defaults()
-        sync_order = Settings.get('sync_order', 'old_to_new')
-        stop_on_repeats_enabled = Settings.get('stop_on_repeats_enabled', 'false') == 'true'
-        stop_on_repeats_count = int(Settings.get('stop_on_repeats_count', '3'))
+        rate_limiter.configure()
+        http_client.configure()
+        meta_fetcher.configure()
+        sync_order = Settings.get_typed('sync_order')
+        stop_on_repeats_enabled = Settings.get_typed('stop_on_repeats_enabled')
+        stop_on_repeats_count = Settings.get_typed('stop_on_repeats_count')
+        meta_revalidate_hours = Settings.get_typed('meta_revalidate_hours')
+        
+        # Контрольная точка прерванного запуска, с которой продолжаем
+        resume_point = None
+        if resume:
+            resume_point = SyncRun.get_resumable_checkpoint(None if resume is True else resume)
+            if resume_point is None and resume is not True:
+                resume_point = SyncRun.get_resumable_checkpoint()
+            if resume_point is None:
+                OperationLog.log(run_id, "sync", "Нет прерванного запуска для продолжения. Синхронизация с начала списка", stage='general')
         
         # Логируем параметры синхронизации
         order_text = "От старых к новым" if sync_order == 'old_to_new' else "От новых к старым"
@@ -47,7 +79,8 @@ def sync(is_manual=False):
         # Шаг 1: Скачиваем list.xml через браузер (этап A: list)
         OperationLog.log(run_id, "list", "Начало обработки списка наборов данных (list.xml)", stage='list')
         OperationLog.log(run_id, "list", "Скачивание list.xml", stage='list')
-        list_xml_path = download_list_xml(run_id)
+        with metrics.timer('list_download'):
+            list_xml_path = download_list_xml(run_id)
         
         if not list_xml_path or not list_xml_path.exists():
             OperationLog.log(run_id, "list", "Не удалось скачать list.xml", level='ERROR', stage='list')
@@ -57,7 +90,8 @@ def sync(is_manual=False):
         
         # Шаг 2: Парсим list.xml
         OperationLog.log(run_id, "list", "Парсинг list.xml", stage='list')
-        datasets_list = parse_list_xml(list_xml_path)
+        with metrics.timer('list_parse'):
+            datasets_list = parse_list_xml(list_xml_path)
         OperationLog.log(run_id, "list", f"Парсинг list.xml завершен. Найдено {len(datasets_list)} наборов данных", stage='list')
         
         # Применяем порядок обработки к списку наборов данных
@@ -67,41 +101,80 @@ def sync(is_manual=False):
         else:
             OperationLog.log(run_id, "list", "Применен исходный порядок обработки наборов данных (от старых к новым)", stage='list')
         
+        # Известные наборы и архивы загружаем один раз на запуск:
+        # проверка "уже обработан?" для каждой версии идет по этим снимкам, без запросов к БД
+        with metrics.timer('known_state'):
+            known_datasets = Dataset.load_all()
+            known_archives = ZipArchive.load_states()
+        OperationLog.log(run_id, "list",
+                       f"Загружено известное состояние: наборов {len(known_datasets)}, архивов {len(known_archives)}",
+                       stage='list')
+        
         # Проверяем, какие наборы данных новые (сравнение с уже известными)
-        from erknm.db.connection import get_connection, get_cursor
-        conn = get_connection()
-        cur = get_cursor(conn)
-        try:
-            cur.execute("SELECT identifier FROM datasets")
-            existing_identifiers = {row['identifier'] for row in cur.fetchall()}
-            new_datasets = [ds for ds in datasets_list if ds['identifier'] not in existing_identifiers]
-            
-            if new_datasets:
-                OperationLog.log(run_id, "list", f"Найдено {len(new_datasets)} новых наборов данных. Начинаем их обработку", stage='list')
-                for ds in new_datasets[:5]:  # Логируем первые 5 для краткости
-                    OperationLog.log(run_id, "list", f"Найден новый набор данных: {ds.get('identifier', 'unknown')} - {ds.get('title', 'без названия')}", stage='list')
-                if len(new_datasets) > 5:
-                    OperationLog.log(run_id, "list", f"... и еще {len(new_datasets) - 5} новых наборов данных", stage='list')
+        new_datasets = [ds for ds in datasets_list if ds['identifier'] not in known_datasets]
+        
+        if new_datasets:
+            OperationLog.log(run_id, "list", f"Найдено {len(new_datasets)} новых наборов данных. Начинаем их обработку", stage='list')
+            for ds in new_datasets[:5]:  # Логируем первые 5 для краткости
+                OperationLog.log(run_id, "list", f"Найден новый набор данных: {ds.get('identifier', 'unknown')} - {ds.get('title', 'без названия')}", stage='list')
+            if len(new_datasets) > 5:
+                OperationLog.log(run_id, "list", f"... и еще {len(new_datasets) - 5} новых наборов данных", stage='list')
+        else:
+            OperationLog.log(run_id, "list", "Новых наборов данных не найдено. Все наборы уже известны", stage='list')
+        
+        # Новые и изменившиеся наборы записываем одним запросом
+        changed_datasets = _changed_datasets(datasets_list, known_datasets)
+        if changed_datasets:
+            known_datasets.update(Dataset.upsert_many(changed_datasets))
+        
+        # Отпечаток list.xml: сравниваем с последним полностью завершенным запуском
+        list_hash = file_sha256(list_xml_path)
+        previous_list = SyncRun.get_last_list_hash(run_id)
+        # Если list.xml не изменился и все известные архивы обработаны, мета-XML
+        # перепроверяются только давно не проверявшиеся (meta_revalidate_hours)
+        meta_max_age = None
+        if previous_list and previous_list['list_hash'] == list_hash:
+            if meta_revalidate_hours > 0 and all(is_settled(state) for state in known_archives.values()):
+                meta_max_age = meta_revalidate_hours * 3600
+                OperationLog.log(run_id, "list",
+                               f"list.xml не изменился с запуска #{previous_list['run_id']}, все архивы обработаны. "
+                               f"Мета-XML перепроверяются, только если не проверялись {meta_revalidate_hours:g} ч",
+                               stage='list')
+            else:
+                OperationLog.log(run_id, "list",
+                               f"list.xml не изменился с запуска #{previous_list['run_id']}. "
+                               f"Мета-XML перепроверяются условными запросами",
+                               stage='list')
+        
+        # Позиция продолжения прерванного запуска
+        checkpoint = SyncCheckpoint(run_id, list_hash, sync_order,
+                                    resumed_from=resume_point['run_id'] if resume_point else None)
+        start_index = 0
+        if resume_point:
+            start_index, how = find_dataset_position(resume_point['checkpoint'], datasets_list, list_hash, sync_order)
+            if how:
+                OperationLog.log(run_id, "sync",
+                               f"Продолжение запуска #{resume_point['run_id']} с набора {start_index + 1} из {len(datasets_list)} "
+                               f"({datasets_list[start_index].get('identifier', 'unknown')}): {how}", stage='general')
             else:
-                OperationLog.log(run_id, "list", "Новых наборов данных не найдено. Все наборы уже известны", stage='list')
-        finally:
-            cur.close()
-            conn.close()
+                OperationLog.log(run_id, "sync",
+                               f"Позиция запуска #{resume_point['run_id']} не найдена в list.xml. Синхронизация с начала списка",
+                               level='WARNING', stage='general')
+                resume_point = None
         
-        # Шаг 3: Обрабатываем каждый набор данных порциями с паузами
-        # Обрабатываем по 3 файла, затем пауза 30-60 секунд для предотвращения блокировки
+        # Шаг 3: Обрабатываем каждый набор данных порциями
+        # Паузы между запросами к источнику выдерживает адаптивный ограничитель
+        # частоты (erknm.sync.rate_limiter), порции нужны только для журнала
         BATCH_SIZE = 3
-        BATCH_PAUSE_MIN = 30
-        BATCH_PAUSE_MAX = 60
         
         total_datasets = len(datasets_list)
         OperationLog.log(run_id, "sync", 
-                        f"Начинаем обработку {total_datasets} наборов данных порциями по {BATCH_SIZE} с паузами", stage='general')
+                        f"Начинаем обработку {total_datasets - start_index} наборов данных порциями по {BATCH_SIZE}", stage='general')
         
         # Счётчик подряд идущих повторов для остановки по повторам
         consecutive_repeats = 0
         
-        for batch_start in range(0, total_datasets, BATCH_SIZE):
+        for batch_start in range(start_index, total_datasets, BATCH_SIZE):
             # Проверяем, не запрошена ли остановка перед каждой порцией
             if SyncRun.is_stop_requested(run_id):
                 OperationLog.log(run_id, "sync", "Остановка всех процессов запрошена пользователем", level='WARNING', stage='general')
@@ -116,7 +189,11 @@ def sync(is_manual=False):
             OperationLog.log(run_id, "sync", 
                            f"Обработка порции {batch_start + 1}-{batch_end} из {total_datasets}", stage='general')
             
-            for dataset_info in batch_datasets:
+            for dataset_index, dataset_info in enumerate(batch_datasets, start=batch_start):
+                checkpoint.move_to_dataset(dataset_index, dataset_info.get('identifier'))
+                # Набор, на котором прервался продолжаемый запуск, обрабатываем с прерванной версии
+                resume_versions = resume_point is not None and dataset_index == start_index
+                
                 # Проверяем остановку перед каждым файлом
                 if SyncRun.is_stop_requested(run_id):
                     OperationLog.log(run_id, "sync", "Остановка всех процессов запрошена пользователем", level='WARNING', stage='general')
@@ -137,14 +214,9 @@ def sync(is_manual=False):
                     # Классифицируем набор
                     data_type = classify_dataset(identifier, title, link)
                     
-                    # Создаем или обновляем запись о наборе данных
-                    dataset = Dataset.get_or_create(identifier, title, link, data_type)
+                    # Создаем или обновляем запись о наборе данных (только если он новый или изменился)
+                    dataset = _get_or_create_dataset(known_datasets, identifier, title, link, data_type)
                     dataset_id = dataset['id']
-                    is_new = dataset['identifier'] == identifier and dataset_id
-                    
-                    # Если тип изменился, обновляем
-                    if dataset['data_type'] != data_type and data_type:
-                        Dataset.update_type(dataset_id, data_type)
                     
                     # Скачиваем мета-XML
                     meta_xml_path = DOWNLOAD_DIR / "meta" / f"{identifier}.xml"
@@ -153,7 +225,8 @@ def sync(is_manual=False):
                         if not meta_xml_path.exists():
                             OperationLog.log(run_id, "dataset", f"Скачивание мета-XML для набора {identifier}", stage='dataset')
                             try:
-                                download_meta_xml(link, meta_xml_path, max_retries=5, delay=10.0, sync_run_id=run_id)
+                                with metrics.timer('meta_download'):
+                                    download_meta_xml(link, meta_xml_path, max_retries=5, delay=10.0, sync_run_id=run_id)
                             except Exception as e:
                                 # Если не удалось скачать, но файл появился (race condition), используем его
                                 if meta_xml_path.exists():
@@ -162,14 +235,14 @@ def sync(is_manual=False):
                                 else:
                                     raise
                             
-                            # Задержка между запросами уже реализована в download_meta_xml_browser
-                            # Дополнительная задержка не требуется, так как браузерная автоматизация
-                            # уже включает задержки 10-17 секунд между запросами
+                            # Паузу между запросами выдерживает ограничитель частоты (и для HTTP, и для браузера)
                         else:
-                            OperationLog.log(run_id, "dataset", f"Используется уже скачанный файл: {meta_xml_path.name}", stage='dataset')
+                            _refresh_meta(run_id, link, meta_xml_path, meta_max_age)
+                            retention.touch(meta_xml_path)
                         
                         OperationLog.log(run_id, "dataset", f"Парсинг мета-XML для набора {identifier}", stage='dataset')
-                        meta_data = parse_meta_xml(meta_xml_path)
+                        with metrics.timer('meta_parse'):
+                            meta_data = parse_meta_xml(meta_xml_path)
                         
                         # Обрабатываем версии данных
                         data_versions = meta_data.get('data_versions', [])
@@ -191,10 +264,35 @@ def sync(is_manual=False):
                             # Если нет версий данных, пропускаем проверку повторов (это не повтор)
                             continue
                         
+                        # Быстрый путь: набор версий не изменился и все архивы уже обработаны
+                        fingerprint = versions_fingerprint(data_versions)
+                        unchanged = not resume_versions and is_unchanged(dataset, fingerprint, data_versions, known_archives)
+                        version_start = 0
+                        if unchanged:
+                            OperationLog.log(run_id, "dataset",
+                                           f"Набор версий {identifier} не изменился ({len(data_versions)} версий уже обработаны), пропускаем",
+                                           stage='dataset')
+                            metrics.inc('datasets_total', result='unchanged')
+                            version_start = len(data_versions)
+                        else:
+                            metrics.inc('datasets_total', result='changed')
+                            if resume_versions:
+                                version_start = find_version_position(resume_point['checkpoint'], data_versions)
+                                if version_start:
+                                    OperationLog.log(run_id, "dataset",
+                                                   f"Продолжение набора {identifier} с версии {version_start + 1} из {len(data_versions)}",
+                                                   stage='dataset')
+                            
+                            # Все версии мета-XML записываем одним запросом (идемпотентно)
+                            DatasetVersion.upsert_many(dataset_id, data_versions)
+                        
                         # Флаг для отслеживания, был ли обработан хотя бы один архив в этом наборе
                         dataset_has_new_data = False
+                        # Ошибка обработки архива - отпечаток набора не сохраняем
+                        dataset_failed = False
                         
-                        for version in data_versions:
+                        for version_index, version in enumerate(data_versions[version_start:], start=version_start):
+                            checkpoint.move_to_version(version_index, version['source'])
                             # Проверяем остановку перед каждым файлом
                             if SyncRun.is_stop_requested(run_id):
                                 OperationLog.log(run_id, "sync", "Остановка всех процессов запрошена пользователем", level='WARNING', stage='general')
@@ -205,22 +303,13 @@ def sync(is_manual=False):
                             
                             source_url = version['source']
                             
-                            # Создаем запись о версии
-                            DatasetVersion.create(
-                                dataset_id=dataset_id,
-                                source_url=source_url,
-                                created_date=version.get('created', ''),
-                                provenance=version.get('provenance', ''),
-                                structure_version=version.get('structure', '')
-                            )
-                            
                             OperationLog.log(run_id, "dataset", f"Найдена ссылка на данные: {source_url}. Запускаем обработку ZIP", stage='dataset')
                             
                             # Обрабатываем ZIP-архив (инкрементальная загрузка) - этап C: data
                             # Строгая последовательность: download → parse → insert → next
                             # process_zip_archive теперь сам загружает данные в БД через потоковый парсинг
                             try:
-                                records_count = process_zip_archive(source_url, run_id)
+                                records_count = process_zip_archive(source_url, run_id, known=known_archives)
                                 
                                 # records_count может быть 0 если уже обработан (skip) - это нормально
                                 # Увеличиваем счетчики только если была реальная обработка
@@ -237,11 +326,15 @@ def sync(is_manual=False):
                                 SyncRun.finish(run_id, 'stopped', 'Остановлено пользователем', files_processed, records_loaded)
                                 return
                             except Exception as e:
+                                dataset_failed = True
                                 OperationLog.log(run_id, "dataset", 
                                              f"Ошибка обработки ZIP {source_url}: {str(e)}", 
                                              level="ERROR", stage='dataset')
                                 continue
                         
+                        if not unchanged and not dataset_failed:
+                            _save_versions_fingerprint(dataset, fingerprint)
+                        
                         # Проверяем остановку по повторам на уровне набора данных (уровень A)
                         # Набор считается "повтором", если все его архивы уже обработаны (dataset_has_new_data = False)
                         if stop_on_repeats_enabled:
@@ -257,6 +350,7 @@ def sync(is_manual=False):
                                     OperationLog.log(run_id, "sync", 
                                                    f"Остановка синхронизации: достигнут порог {stop_on_repeats_count} подряд уже обработанных наборов данных", 
                                                    level='INFO', stage='general')
+                                    checkpoint.complete()
                                     SyncRun.finish(run_id, 'completed', 
                                                   f'Остановлено по повторам: {stop_on_repeats_count} подряд уже обработанных наборов данных', 
                                                   files_processed, records_loaded)
@@ -284,8 +378,15 @@ def sync(is_manual=False):
                                 if sync_order == 'new_to_old':
                                     data_versions_fallback = list(reversed(data_versions_fallback))
                                 
+                                version_start = 0
+                                if resume_versions:
+                                    version_start = find_version_position(resume_point['checkpoint'], data_versions_fallback)
+                                
+                                DatasetVersion.upsert_many(dataset_id, data_versions_fallback)
+                                
                                 dataset_has_new_data_fallback = False
-                                for version in data_versions_fallback:
+                                for version_index, version in enumerate(data_versions_fallback[version_start:], start=version_start):
+                                    checkpoint.move_to_version(version_index, version['source'])
                                     # Проверяем остановку перед каждым файлом
                                     if SyncRun.is_stop_requested(run_id):
                                         OperationLog.log(run_id, "sync", "Остановка всех процессов запрошена пользователем", level='WARNING', stage='general')
@@ -295,15 +396,8 @@ def sync(is_manual=False):
                                         return
                                     
                                     source_url = version['source']
-                                    DatasetVersion.create(
-                                        dataset_id=dataset_id,
-                                        source_url=source_url,
-                                        created_date=version.get('created', ''),
-                                        provenance=version.get('provenance', ''),
-                                        structure_version=version.get('structure', '')
-                                    )
                                     try:
-                                        records_count = process_zip_archive(source_url, run_id)
+                                        records_count = process_zip_archive(source_url, run_id, known=known_archives)
                                         if records_count > 0:
                                             files_processed += 1
                                             records_loaded += records_count
@@ -329,6 +423,7 @@ def sync(is_manual=False):
                                             OperationLog.log(run_id, "sync", 
                                                            f"Остановка синхронизации: достигнут порог {stop_on_repeats_count} подряд уже обработанных наборов данных", 
                                                            level='INFO', stage='general')
+                                            checkpoint.complete()
                                             SyncRun.finish(run_id, 'completed', 
                                                           f'Остановлено по повторам: {stop_on_repeats_count} подряд уже обработанных наборов данных', 
                                                           files_processed, records_loaded)
@@ -352,21 +447,6 @@ def sync(is_manual=False):
                                    level="ERROR", stage='dataset')
                     continue
             
-            # Пауза после каждой порции (кроме последней)
-            if batch_end < total_datasets:
-                pause_time = random.uniform(BATCH_PAUSE_MIN, BATCH_PAUSE_MAX)
-                OperationLog.log(run_id, "sync", 
-                               f"Пауза {pause_time:.1f}с после порции {batch_start + 1}-{batch_end} для предотвращения блокировки", stage='general')
-                
-                # Проверяем остановку во время паузы
-                pause_steps = int(pause_time)
-                for _ in range(pause_steps):
-                    if SyncRun.is_stop_requested(run_id):
-                        OperationLog.log(run_id, "sync", "Остановка синхронизации запрошена пользователем", stage='general')
-                        SyncRun.finish(run_id, 'stopped', 'Остановлено пользователем', files_processed, records_loaded)
-                        return
-                    time.sleep(1)
-                time.sleep(pause_time - pause_steps)
         
         # Финальная проверка остановки перед завершением
         if SyncRun.is_stop_requested(run_id):
@@ -375,6 +455,7 @@ def sync(is_manual=False):
         else:
             OperationLog.log(run_id, "sync", 
                            f"Синхронизация завершена. Обработано файлов: {files_processed}, загружено записей: {records_loaded}", stage='general')
+            checkpoint.complete()
             SyncRun.finish(run_id, 'completed', None, files_processed, records_loaded)
         
     except Exception as e:
@@ -390,12 +471,142 @@ def sync(is_manual=False):
             except:
                 pass  # Игнорируем ошибки завершения (но стараемся завершить)
         raise
+    finally:
+        if checkpoint is not None:
+            checkpoint.flush()
+        if run_id is not None:
+            _log_request_rates(run_id)
+            _enforce_storage_limit(run_id)
+        _stop_profiler(run_id, profiler)
+
+
+def _dataset_changed(dataset, title, link, data_type):
+    return (dataset is None or dataset['title'] != title or dataset['link'] != link
+            or (data_type and dataset['data_type'] != data_type))
+
+
+def _changed_datasets(datasets_list, known_datasets):
+    """Наборы list.xml, которых нет в снимке known_datasets или которые изменились"""
+    changed = []
+    for dataset_info in datasets_list:
+        identifier = dataset_info['identifier']
+        title, link = dataset_info['title'], dataset_info['link']
+        data_type = classify_dataset(identifier, title, link)
+        if _dataset_changed(known_datasets.get(identifier), title, link, data_type):
+            changed.append((identifier, title, link, data_type))
+    return changed
+
+
+def _get_or_create_dataset(known_datasets, identifier, title, link, data_type):
+    """Запись о наборе данных: из снимка known_datasets или (новый/изменившийся набор) из БД"""
+    dataset = known_datasets.get(identifier)
+    if _dataset_changed(dataset, title, link, data_type):
+        dataset = Dataset.get_or_create(identifier, title, link, data_type)
+        known_datasets[identifier] = dataset
+    return dataset
+
+
+def _save_versions_fingerprint(dataset, fingerprint):
+    """Запомнить отпечаток полностью обработанного набора версий (сбой не прерывает синхронизацию)"""
+    if dataset.get('versions_fingerprint') == fingerprint:
+        return
+    try:
+        Dataset.set_versions_fingerprint(dataset['id'], fingerprint)
+        dataset['versions_fingerprint'] = fingerprint
+    except Exception:
+        pass
+
+
+def _refresh_meta(run_id, link, meta_xml_path, max_age=None):
+    """
+    Перепроверить скачанный мета-XML: без этого изменение набора версий не обнаружить
+    
+    Args:
+        max_age: Не запрашивать мета-XML, проверенный меньше max_age секунд назад
+    """
+    try:
+        with metrics.timer('meta_download'):
+            changed = refresh_meta_xml(link, meta_xml_path, max_retries=5, delay=10.0, sync_run_id=run_id,
+                                       max_age=max_age)
+    except StopIteration:
+        raise
+    except Exception as e:
+        OperationLog.log(run_id, "dataset",
+                         f"Не удалось перепроверить мета-XML {meta_xml_path.name}, используется скачанный файл: {e}",
+                         level='WARNING', stage='dataset')
+        return
+    if changed:
+        OperationLog.log(run_id, "dataset", f"Мета-XML {meta_xml_path.name} изменился, файл обновлен", stage='dataset')
+    else:
+        OperationLog.log(run_id, "dataset", f"Используется уже скачанный файл: {meta_xml_path.name}", stage='dataset')
+
+
+def _log_request_rates(run_id):
+    """Записать в журнал достигнутую частоту запросов к источнику"""
+    try:
+        for stats in rate_limiter.report():
+            OperationLog.log(run_id, "sync", get_message('rate_limit_report', **stats), stage='general')
+        tiers = meta_fetcher.report()
+        if any(tiers.values()):
+            OperationLog.log(run_id, "sync", get_message('meta_fetch_report', **tiers), stage='general')
+    except Exception:
+        pass  # Сбой отчета не должен влиять на результат синхронизации
 
 
-def process_manual_file(file_path: Path, is_zip: bool = None):
-    """Обработать файл вручную"""
+def _enforce_storage_limit(run_id):
+    """Удалить давно не использовавшиеся скачанные файлы сверх лимита storage_limit_mb"""
+    from erknm.sync import retention
+    try:
+        result = retention.enforce(run_id)
+    except Exception as e:
+        OperationLog.log(run_id, "sync", f"Не удалось ограничить объем скачанных файлов: {e}",
+                         level='WARNING', stage='general')
+        return
+    mb = 1024 * 1024
+    if result['skipped']:
+        OperationLog.log(run_id, "sync", get_message('storage_skipped'), stage='general')
+    elif result['evicted_files']:
+        OperationLog.log(run_id, "sync",
+                         get_message('storage_evicted', limit_mb=result['limit_bytes'] / mb,
+                                     count=result['evicted_files'], size_mb=result['evicted_bytes'] / mb,
+                                     used_mb=result['used_bytes'] / mb, pinned_mb=result['pinned_bytes'] / mb),
+                         stage='general')
+    if result['limit_bytes'] and result['used_bytes'] > result['limit_bytes'] and not result['skipped']:
+        OperationLog.log(run_id, "sync",
+                         get_message('storage_over_limit', used_mb=result['used_bytes'] / mb,
+                                     limit_mb=result['limit_bytes'] / mb),
+                         level='WARNING', stage='general')
+
+
+def _start_profiler(run_id, profile):
+    """Включить профилирование запуска (ошибка профайлера не должна мешать синхронизации)"""
+    from erknm.metrics import profiler as run_profiler
+    try:
+        profiler = run_profiler.start(run_id, profile)
+    except Exception as e:
+        OperationLog.log(run_id, "profile", f"Не удалось включить профилирование: {e}", level='WARNING', stage='general')
+        return None
+    if profiler is not None:
+        OperationLog.log(run_id, "profile", f"Профилирование включено: {profiler.mode}", stage='general')
+    return profiler
+
+
+def _stop_profiler(run_id, profiler):
+    """Остановить профилирование и сохранить артефакты"""
+    if profiler is None:
+        return
+    try:
+        profile_dir = profiler.stop()
+        OperationLog.log(run_id, "profile", f"Профиль запуска сохранен: {profile_dir}", stage='general')
+    except Exception as e:
+        OperationLog.log(run_id, "profile", f"Не удалось сохранить профиль: {e}", level='WARNING', stage='general')
+
+
+def process_manual_file(file_path: Path, is_zip: bool = None, profile: str = None):
+    """Обработать файл вручную (profile - режим профилирования, как в sync)"""
     run = SyncRun.create(is_manual=True)
     run_id = run['id']
+    profiler = _start_profiler(run_id, profile)
     
     files_processed = 0
     records_loaded = 0
@@ -432,20 +643,28 @@ def process_manual_file(file_path: Path, is_zip: bool = None):
                 
                 # Используем потоковую обработку
                 from erknm.loader.zip_loader import select_xml_from_zip, stream_parse_xml_from_zip
-                from erknm.loader.zip_loader import calculate_sha256
+                from erknm.loader.zip_loader import calculate_sha256, select_xml_members
+                from erknm.loader import members
                 
                 # Вычисляем хеш
                 sha256_hash = calculate_sha256(file_path)
                 ZipArchive.update_status(archive_id, 'downloaded', 
                                         sha256_hash=sha256_hash)
                 
-                # Выбираем XML из ZIP
-                xml_selection = select_xml_from_zip(file_path, run_id)
+                # Выбираем XML из ZIP (в режиме zip_members = 'all' - все XML)
+                all_members = members.resolve_mode() == 'all'
+                if all_members:
+                    xml_selection = select_xml_members(file_path, run_id)
+                else:
+                    xml_selection = select_xml_from_zip(file_path, run_id)
                 
                 if xml_selection:
-                    xml_name, zip_info = xml_selection
                     # Потоковый парсинг и загрузка в БД
-                    records_count = stream_parse_xml_from_zip(file_path, xml_name, zip_info, archive_id, run_id)
+                    if all_members:
+                        records_count = members.load_members(file_path, xml_selection, archive_id, run_id)
+                    else:
+                        xml_name, zip_info = xml_selection
+                        records_count = stream_parse_xml_from_zip(file_path, xml_name, zip_info, archive_id, run_id)
                     records_loaded += records_count
                     
                     if records_count > 0:
@@ -463,10 +682,14 @@ def process_manual_file(file_path: Path, is_zip: bool = None):
             archive = ZipArchive.create(temp_url, status='processed', sync_run_id=run_id)
             archive_id = archive['id'] if archive else None
             
+            # Классифицируем по началу документа; загрузчик повторно использует
+            # закэшированный результат и не разбирает файл для классификации еще раз
+            from erknm.classifier.classifier import classify_xml_file
             fragment = XmlFragment.create(
                 zip_archive_id=archive_id,
                 file_name=file_path.name,
                 file_path=str(file_path),
+                data_type=classify_xml_file(file_path),
                 status='pending'
             )
             
@@ -485,4 +708,6 @@ def process_manual_file(file_path: Path, is_zip: bool = None):
         OperationLog.log(run_id, "manual", f"Ошибка обработки файла: {error_msg}", level="ERROR", stage='general')
         SyncRun.finish(run_id, 'error', error_msg, files_processed, records_loaded)
         raise
+    finally:
+        _stop_profiler(run_id, profiler)
 
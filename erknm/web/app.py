@@ -6,7 +6,11 @@ import os
 from erknm.db.connection import get_connection, get_cursor
 from erknm.db.schema import init_schema
 from erknm.db.models import SyncRun, OperationLog, Settings, ZipArchive, XmlFragment
-from erknm.sync.synchronizer import sync, process_manual_file
+from erknm.loader import raw_storage
+from erknm.sync import retention
+
+# Сколько запрос ждет индекс XML архива для записи-указателя, с; дальше - 503
+RAW_INDEX_WAIT_SECONDS = 2.0
 
 # Определяем путь к шаблонам относительно этого файла
 template_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'templates')
@@ -38,6 +42,13 @@ def favicon():
     return '', 204
 
 
+@app.route('/metrics')
+def metrics_endpoint():
+    """Метрики этапов синхронизации и загрузки в формате Prometheus"""
+    from erknm import metrics
+    return metrics.render_prometheus(), 200, {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
+
+
 @app.route('/api/status')
 def api_status():
     """Статус системы"""
@@ -62,7 +73,12 @@ def api_status():
                 COUNT(*) FILTER (WHERE status = 'running') as running,
                 COUNT(*) FILTER (WHERE status = 'error') as errors,
                 SUM(files_processed) as total_files,
-                SUM(records_loaded) as total_records
+                SUM(records_loaded) as total_records,
+                (SELECT jsonb_build_object('id', id, 'status', status, 'checkpoint', checkpoint)
+                 FROM sync_runs
+                 WHERE checkpoint IS NOT NULL
+                 ORDER BY id DESC
+                 LIMIT 1) as last_checkpoint
             FROM sync_runs
         """)
         stats = cur.fetchone()
@@ -108,8 +124,16 @@ def api_status():
         except:
             inspections_count = 0
         
-        # Проверяем, есть ли приостановленная синхронизация
+        # Объем скачанных файлов и удаления сверх лимита (erknm.sync.retention)
+        try:
+            storage = retention.status()
+        except Exception:
+            storage = None
+        
+        # Проверяем, есть ли приостановленная или прерванная синхронизация с контрольной точкой
         paused_run = SyncRun.get_paused_run()
+        # Контрольная точка последнего запуска получена запросом статистики выше
+        resume_point = SyncRun.resumable_checkpoint(stats['last_checkpoint'])
         
         # Проверяем наличие реально выполняющихся запусков в БД
         cur.execute("""
@@ -141,8 +165,9 @@ def api_status():
             'success': True,
             'sync_running': is_running,
             'sync_message': sync_status['message'],
-            'sync_paused': paused_run is not None,
+            'sync_paused': paused_run is not None or resume_point is not None,
             'paused_run': dict(paused_run) if paused_run else None,
+            'resume_point': resume_point,
             'stats': {
                 'total_runs': stats['total_runs'] or 0,
                 'completed': stats['completed'] or 0,
@@ -156,7 +181,8 @@ def api_status():
                 'plans': plans_count,
                 'inspections': inspections_count
             },
-            'last_run': dict(last_run) if last_run else None
+            'last_run': dict(last_run) if last_run else None,
+            'storage': storage
         })
     finally:
         cur.close()
@@ -432,6 +458,7 @@ def api_sync_start():
     
     def run_sync():
         global sync_status
+        from erknm.sync.synchronizer import sync
         sync_status['running'] = True
         sync_status['state'] = 'running'
         sync_status['message'] = 'Синхронизация запущена...'
@@ -623,7 +650,7 @@ def api_sync_force_stop():
 
 @app.route('/api/sync/resume', methods=['POST'])
 def api_sync_resume():
-    """Продолжить приостановленную синхронизацию"""
+    """Продолжить приостановленную или прерванную синхронизацию с ее контрольной точки"""
     global sync_thread, sync_status
     
     if sync_status['running']:
@@ -634,25 +661,29 @@ def api_sync_resume():
     
     try:
         paused_run = SyncRun.get_paused_run()
-        if not paused_run:
+        resume_point = SyncRun.get_resumable_checkpoint(paused_run['id'] if paused_run else None)
+        if not paused_run and not resume_point:
             return jsonify({
                 'success': False,
                 'message': 'Нет приостановленной синхронизации'
             }), 404
         
-        # Запускаем новую синхронизацию (она автоматически пропустит уже обработанные файлы)
-        # Старый paused run остается в БД для истории
-        is_manual = paused_run.get('is_manual', True)
+        # Запускаем новую синхронизацию с контрольной точки прерванного запуска
+        # (без точки - с начала списка, уже обработанные архивы пропускаются).
+        # Старый запуск остается в БД для истории
+        is_manual = paused_run.get('is_manual', True) if paused_run else True
+        resume = resume_point['run_id'] if resume_point else True
         
         def run_sync():
             global sync_status
+            from erknm.sync.synchronizer import sync
             sync_status['running'] = True
             sync_status['state'] = 'running'
             sync_status['message'] = 'Синхронизация возобновлена...'
             sync_status['current_operation'] = 'Возобновление синхронизации'
             sync_status['progress'] = {'files_processed': 0, 'records_loaded': 0, 'current_step': 'resume'}
             try:
-                sync(is_manual=is_manual)
+                sync(is_manual=is_manual, resume=resume)
                 sync_status['state'] = 'idle'
                 sync_status['message'] = 'Синхронизация завершена успешно'
                 sync_status['current_operation'] = ''
@@ -669,7 +700,8 @@ def api_sync_resume():
         
         return jsonify({
             'success': True,
-            'message': 'Синхронизация возобновлена'
+            'message': 'Синхронизация возобновлена',
+            'resume_point': resume_point
         })
     except Exception as e:
         return jsonify({
@@ -750,6 +782,7 @@ def api_upload():
         
         # Обрабатываем в отдельном потоке
         def process_file():
+            from erknm.sync.synchronizer import process_manual_file
             try:
                 process_manual_file(temp_path, is_zip=is_zip)
             except Exception as e:
@@ -1067,6 +1100,8 @@ def api_run_delete(run_id):
     """Удалить запуск и связанные данные"""
     try:
         stats = SyncRun.delete_run(run_id)
+        from erknm.metrics import profiler as run_profiler
+        run_profiler.delete_artifacts(run_id)
         return jsonify({
             'success': True,
             'message': 'Запуск успешно удален',
@@ -1090,6 +1125,9 @@ def api_run_details(run_id):
                 'error': 'Запуск не найден'
             }), 404
         
+        from erknm.metrics import profiler as run_profiler
+        stats['profile'] = run_profiler.list_artifacts(run_id)
+        
         return jsonify({
             'success': True,
             'run': stats
@@ -1101,6 +1139,22 @@ def api_run_details(run_id):
         }), 500
 
 
+@app.route('/api/runs/<int:run_id>/profile/<name>')
+def api_run_profile(run_id, name):
+    """Скачать артефакт профиля запуска"""
+    from flask import send_file
+    from erknm.metrics import profiler as run_profiler
+    
+    # Отдаем только известные файлы профиля
+    if name not in run_profiler.ARTIFACTS:
+        return jsonify({'success': False, 'error': 'Неизвестный артефакт профиля'}), 404
+    path = run_profiler.get_profile_dir(run_id) / name
+    if not path.is_file():
+        return jsonify({'success': False, 'error': 'Профиль запуска не найден'}), 404
+    return send_file(path, as_attachment=True, download_name=f'run-{run_id}-{name}',
+                     mimetype='text/plain' if name != 'profile.pstats' else 'application/octet-stream')
+
+
 @app.route('/api/runs/<int:run_id>/files')
 def api_run_files(run_id):
     """Получить список файлов запуска"""
@@ -1521,12 +1575,27 @@ def api_settings_get():
                 'retry_count': '3',
                 'retry_delay_seconds': '60',
                 'throttle_seconds': '10',
+                'rate_limit_min_rpm': '1',
+                'rate_limit_max_rpm': '30',
+                'rate_limit_increase_rpm': '1',
+                'rate_limit_decrease_factor': '0.5',
+                'rate_limit_burst': '2',
+                'rate_limit_penalty_seconds': '60',
                 'process_only_zip': 'true',
                 'unknown_policy': 'skip',
                 'operational_log_enabled': 'true',
                 'sync_order': 'old_to_new',
                 'stop_on_repeats_enabled': 'false',
-                'stop_on_repeats_count': '3'
+                'stop_on_repeats_count': '3',
+                'profile_mode': 'off',
+                'ingest_mode': 'direct',
+                'raw_storage': 'xml',
+                'zip_members': 'largest',
+                'member_workers': '2',
+                'storage_limit_mb': '0',
+                'http2_enabled': 'false',
+                'meta_http_enabled': 'true',
+                'meta_revalidate_hours': '24'
             }
             return jsonify({
                 'success': True, 
@@ -1551,12 +1620,27 @@ def api_settings_get():
                 'retry_count': '3',
                 'retry_delay_seconds': '60',
                 'throttle_seconds': '10',
+                'rate_limit_min_rpm': '1',
+                'rate_limit_max_rpm': '30',
+                'rate_limit_increase_rpm': '1',
+                'rate_limit_decrease_factor': '0.5',
+                'rate_limit_burst': '2',
+                'rate_limit_penalty_seconds': '60',
                 'process_only_zip': 'true',
                 'unknown_policy': 'skip',
                 'operational_log_enabled': 'true',
                 'sync_order': 'old_to_new',
                 'stop_on_repeats_enabled': 'false',
-                'stop_on_repeats_count': '3'
+                'stop_on_repeats_count': '3',
+                'profile_mode': 'off',
+                'ingest_mode': 'direct',
+                'raw_storage': 'xml',
+                'zip_members': 'largest',
+                'member_workers': '2',
+                'storage_limit_mb': '0',
+                'http2_enabled': 'false',
+                'meta_http_enabled': 'true',
+                'meta_revalidate_hours': '24'
             }
             return jsonify({
                 'success': True,
@@ -1576,12 +1660,27 @@ def api_settings_get():
             'retry_count': '3',
             'retry_delay_seconds': '60',
             'throttle_seconds': '10',
+            'rate_limit_min_rpm': '1',
+            'rate_limit_max_rpm': '30',
+            'rate_limit_increase_rpm': '1',
+            'rate_limit_decrease_factor': '0.5',
+            'rate_limit_burst': '2',
+            'rate_limit_penalty_seconds': '60',
             'process_only_zip': 'true',
             'unknown_policy': 'skip',
             'operational_log_enabled': 'true',
             'sync_order': 'old_to_new',
             'stop_on_repeats_enabled': 'false',
-            'stop_on_repeats_count': '3'
+            'stop_on_repeats_count': '3',
+            'profile_mode': 'off',
+            'ingest_mode': 'direct',
+            'raw_storage': 'xml',
+            'zip_members': 'largest',
+            'member_workers': '2',
+            'storage_limit_mb': '0',
+            'http2_enabled': 'false',
+            'meta_http_enabled': 'true',
+            'meta_revalidate_hours': '24'
         }
         
         for key, default_value in defaults.items():
@@ -1604,12 +1703,27 @@ def api_settings_get():
             'retry_count': '3',
             'retry_delay_seconds': '60',
             'throttle_seconds': '10',
+            'rate_limit_min_rpm': '1',
+            'rate_limit_max_rpm': '30',
+            'rate_limit_increase_rpm': '1',
+            'rate_limit_decrease_factor': '0.5',
+            'rate_limit_burst': '2',
+            'rate_limit_penalty_seconds': '60',
             'process_only_zip': 'true',
             'unknown_policy': 'skip',
             'operational_log_enabled': 'true',
             'sync_order': 'old_to_new',
             'stop_on_repeats_enabled': 'false',
-            'stop_on_repeats_count': '3'
+            'stop_on_repeats_count': '3',
+            'profile_mode': 'off',
+            'ingest_mode': 'direct',
+            'raw_storage': 'xml',
+            'zip_members': 'largest',
+            'member_workers': '2',
+            'storage_limit_mb': '0',
+            'http2_enabled': 'false',
+            'meta_http_enabled': 'true',
+            'meta_revalidate_hours': '24'
         }
         return jsonify({
             'success': True,
@@ -1626,9 +1740,8 @@ def api_settings_save():
         if not data or 'settings' not in data:
             return jsonify({'success': False, 'error': 'Нет данных для сохранения'}), 400
         
-        settings = data['settings']
-        for key, value in settings.items():
-            Settings.set(key, value)
+        # Одна транзакция + уведомление процессов, держащих снимок настроек
+        Settings.set_many(data['settings'])
         
         return jsonify({
             'success': True,
@@ -1785,21 +1898,31 @@ def api_db_record_detail(record_id):
         # Получаем сырой XML если есть
         raw_xml = None
         if record['record_type'] == 'plan' and record['xml_fragment_id']:
-            cur.execute("""
-                SELECT xml_content::text FROM plans_raw 
+            cur.execute(f"""
+                SELECT {raw_storage.select_columns('plans_raw')} FROM plans_raw 
                 WHERE xml_fragment_id = %s LIMIT 1
             """, (record['xml_fragment_id'],))
             raw = cur.fetchone()
             if raw:
-                raw_xml = raw['xml_content']
+                try:
+                    raw_xml = raw_storage.row_text(raw, wait=RAW_INDEX_WAIT_SECONDS)
+                except (OSError, ValueError):
+                    # XML хранится указателем, а архив удален или заменен (или индекс
+                    # архива еще строится - XML будет при следующем запросе)
+                    raw_xml = None
         elif record['record_type'] == 'inspection' and record['xml_fragment_id']:
-            cur.execute("""
-                SELECT xml_content::text FROM inspections_raw 
+            cur.execute(f"""
+                SELECT {raw_storage.select_columns('inspections_raw')} FROM inspections_raw 
                 WHERE xml_fragment_id = %s LIMIT 1
             """, (record['xml_fragment_id'],))
             raw = cur.fetchone()
             if raw:
-                raw_xml = raw['xml_content']
+                try:
+                    raw_xml = raw_storage.row_text(raw, wait=RAW_INDEX_WAIT_SECONDS)
+                except (OSError, ValueError):
+                    # XML хранится указателем, а архив удален или заменен (или индекс
+                    # архива еще строится - XML будет при следующем запросе)
+                    raw_xml = None
         
         return jsonify({
             'success': True,
@@ -2084,7 +2207,7 @@ def api_xml_contents():
         
         # Запрос для планов
         if data_type in ('all', 'plan') and has_plans:
-            plan_query = """
+            plan_query = f"""
                 SELECT 
                     pr.id,
                     'plan' as data_type,
@@ -2097,7 +2220,7 @@ def api_xml_contents():
                     xf.status as fragment_status,
                     xf.error_message,
                     pr.created_at,
-                    LENGTH(pr.xml_content::text) as xml_size,
+                    {raw_storage.size_expression('pr')} as xml_size,
                     xf.data_type as dataset_type
                 FROM plans_raw pr
                 JOIN xml_fragments xf ON pr.xml_fragment_id = xf.id
@@ -2125,7 +2248,7 @@ def api_xml_contents():
         
         # Запрос для проверок
         if data_type in ('all', 'inspection') and has_inspections:
-            inspection_query = """
+            inspection_query = f"""
                 SELECT 
                     ir.id,
                     'inspection' as data_type,
@@ -2138,7 +2261,7 @@ def api_xml_contents():
                     xf.status as fragment_status,
                     xf.error_message,
                     ir.created_at,
-                    LENGTH(ir.xml_content::text) as xml_size,
+                    {raw_storage.size_expression('ir')} as xml_size,
                     xf.data_type as dataset_type
                 FROM inspections_raw ir
                 JOIN xml_fragments xf ON ir.xml_fragment_id = xf.id
@@ -2272,10 +2395,10 @@ def api_xml_content_detail(content_id):
         
         # Выбираем из соответствующей таблицы
         if data_type == 'plan':
-            query = """
+            query = f"""
                 SELECT 
                     pr.id,
-                    pr.xml_content::text as xml_content,
+                    {raw_storage.select_columns('pr')},
                     pr.created_at,
                     xf.file_name,
                     xf.zip_archive_id,
@@ -2291,10 +2414,10 @@ def api_xml_content_detail(content_id):
                 WHERE pr.id = %s
             """
         elif data_type == 'inspection':
-            query = """
+            query = f"""
                 SELECT 
                     ir.id,
-                    ir.xml_content::text as xml_content,
+                    {raw_storage.select_columns('ir')},
                     ir.created_at,
                     xf.file_name,
                     xf.zip_archive_id,
@@ -2318,13 +2441,21 @@ def api_xml_content_detail(content_id):
         if not row:
             return jsonify({'success': False, 'error': 'Content not found'}), 404
         
+        # Сжатый XML распаковывается только здесь и в /raw
+        try:
+            xml_content = raw_storage.row_text(row, wait=RAW_INDEX_WAIT_SECONDS)
+        except TimeoutError as e:
+            return jsonify({'success': False, 'error': str(e)}), 503, {'Retry-After': '10'}
+        except (OSError, ValueError) as e:
+            return jsonify({'success': False, 'error': f'XML записи недоступен: {e}'}), 410
+        
         return jsonify({
             'success': True,
             'content': {
                 'id': f"{data_type}_{row['id']}",
                 'raw_id': row['id'],
                 'data_type': data_type,
-                'xml_content': row['xml_content'],
+                'xml_content': xml_content,
                 'file_name': row['file_name'],
                 'zip_archive_id': row['zip_archive_id'],
                 'archive_url': row['archive_url'],
@@ -2334,7 +2465,7 @@ def api_xml_content_detail(content_id):
                 'error_message': row['error_message'],
                 'processed_at': row['processed_at'].isoformat() if row['processed_at'] else None,
                 'created_at': row['created_at'].isoformat() if row['created_at'] else None,
-                'xml_size': len(row['xml_content']) if row['xml_content'] else 0
+                'xml_size': len(xml_content.encode('utf-8')) if xml_content else 0
             }
         })
     finally:
@@ -2360,20 +2491,27 @@ def api_xml_content_raw(content_id):
         raw_id = int(raw_id)
         
         if data_type == 'plan':
-            query = "SELECT xml_content::text as xml_content FROM plans_raw WHERE id = %s"
+            query = f"SELECT {raw_storage.select_columns('plans_raw')} FROM plans_raw WHERE id = %s"
         elif data_type == 'inspection':
-            query = "SELECT xml_content::text as xml_content FROM inspections_raw WHERE id = %s"
+            query = f"SELECT {raw_storage.select_columns('inspections_raw')} FROM inspections_raw WHERE id = %s"
         else:
             return '', 400
         
         cur.execute(query, (raw_id,))
         row = cur.fetchone()
         
-        if not row or not row['xml_content']:
+        try:
+            xml_content = raw_storage.row_text(row, wait=RAW_INDEX_WAIT_SECONDS) if row else None
+        except TimeoutError as e:
+            # Индекс XML архива строится в фоне
+            return str(e), 503, {'Retry-After': '10'}
+        except (OSError, ValueError) as e:
+            return str(e), 410
+        if not xml_content:
             return '', 404
         
         from flask import Response
-        response = Response(row['xml_content'], mimetype='application/xml; charset=utf-8')
+        response = Response(xml_content, mimetype='application/xml; charset=utf-8')
         response.headers['Content-Disposition'] = f'inline; filename="content_{content_id}.xml"'
         return response
     finally:
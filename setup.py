@@ -14,6 +14,12 @@ setup(
         "requests>=2.31.0",
         "click>=8.1.7",
     ],
+    extras_require={
+        # Сжатие сырого XML zstd (без пакета - zlib)
+        "zstd": ["zstandard>=0.21"],
+        # HTTP/2 для запросов к источнику (без пакетов - HTTP/1.1)
+        "http2": ["httpx>=0.24", "h2>=4"],
+    },
     entry_points={
         "console_scripts": [
             "erknm=erknm.cli:cli",